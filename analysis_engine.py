@@ -0,0 +1,896 @@
+import os
+import time
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from database import EcommerceDatabase, funnel_drop_offs, rows_through
+from sketches import TDigest
+from cohorts import NO_TIME, cohort_activity, hours_to_days, to_days, to_hours
+
+# Bump when the layout of the persisted aggregates changes
+STATE_VERSION = 7
+
+# Watermark of a table nothing has been folded from (below any SQLite rowid;
+# time-ordered integer ids can be 0)
+NO_ROWS = -(1 << 63)
+
+# Columns folded from each base table, in fold order (parents before children)
+TABLE_COLUMNS = {
+    'users': ['user_id', 'first_visit_date', 'device_type', 'browser', 'country', 'referrer'],
+    'products': ['product_id', 'name', 'category', 'price'],
+    'sessions': ['session_id', 'user_id', 'start_time', 'conversion_status'],
+    'page_views': ['session_id', 'page_type', 'time_spent_seconds', 'exit_page', 'timestamp'],
+    'clicks': ['session_id'],
+    'product_views': ['product_id'],
+    'cart_events': ['session_id', 'product_id', 'event_type', 'quantity'],
+    'search_events': ['session_id', 'query', 'results_count'],
+    'checkout_events': ['session_id', 'step', 'timestamp'],
+}
+
+PRIMARY_KEYS = {
+    'users': 'user_id',
+    'products': 'product_id',
+    'sessions': 'session_id',
+}
+
+# Reference columns resolved against a parent table while scanning
+TABLE_REFERENCES = {
+    'sessions': {'user_id': 'users'},
+    'page_views': {'session_id': 'sessions'},
+    'clicks': {'session_id': 'sessions'},
+    'product_views': {'product_id': 'products'},
+    'cart_events': {'session_id': 'sessions', 'product_id': 'products'},
+    'search_events': {'session_id': 'sessions'},
+    'checkout_events': {'session_id': 'sessions'},
+}
+
+# Low-cardinality text columns, read as pandas categoricals
+CATEGORICAL_COLUMNS = {
+    'users': ['device_type', 'browser', 'country', 'referrer'],
+    'products': ['category'],
+    'sessions': ['conversion_status'],
+    'page_views': ['page_type'],
+    'cart_events': ['event_type'],
+    'search_events': ['query'],
+    'checkout_events': ['step'],
+}
+
+# Base tables each analysis reads
+ANALYSIS_TABLES = {
+    'conversion_funnel': ['sessions', 'page_views', 'cart_events', 'checkout_events'],
+    'cart_abandonment': ['sessions', 'products', 'cart_events'],
+    'search_behavior': ['sessions', 'search_events'],
+    'page_effectiveness': ['page_views'],
+    'product_performance': ['sessions', 'products', 'product_views', 'cart_events'],
+    'user_segments': ['users', 'sessions', 'page_views', 'clicks', 'cart_events', 'search_events'],
+    'cohort_retention': ['users', 'sessions'],
+    'funnel_trends': ['sessions', 'page_views', 'cart_events', 'checkout_events'],
+    'conversion_propensity': ['users', 'sessions', 'page_views', 'clicks', 'cart_events', 'search_events'],
+    'conversion_cube': ['users', 'products', 'sessions', 'page_views', 'cart_events', 'checkout_events'],
+}
+
+FUNNEL_STEPS = [
+    'homepage_views', 'product_listing_views', 'product_detail_views', 'add_to_cart_events',
+    'checkout_starts', 'shipping_info_completed', 'payment_info_completed', 'purchases_completed'
+]
+
+# Additive per-session totals, also rolled up per user
+SESSION_TOTALS = ['page_view_count', 'time_spent_total', 'time_spent_views',
+                  'click_count', 'cart_event_count', 'search_count']
+SESSION_FLAGS = ['homepage_view', 'product_listing_view', 'product_detail_view',
+                 'add_to_cart', 'checkout_start', 'shipping_info', 'payment_info']
+
+# Keyed aggregate arrays: column -> dtype. Row i holds the table's i-th row in rowid order.
+KEYED_COLUMNS = {
+    'users': dict(
+        rowid=np.int64, user_id=object, first_visit_day=np.int32,
+        device_type=np.int16, browser=np.int16, country=np.int16, referrer=np.int16,
+        session_count=np.int32, completed_purchases=np.int32,
+        page_view_count=np.int32, time_spent_total=np.float64, time_spent_views=np.int32,
+        click_count=np.int32, cart_event_count=np.int32, search_count=np.int32),
+    'products': dict(
+        rowid=np.int64, product_id=object, name=object, category=np.int16, price=np.float64,
+        view_count=np.int64, add_to_cart_count=np.int64, purchase_count=np.int64),
+    'sessions': dict(
+        rowid=np.int64, user_code=np.int32, start_day=np.int32, start_hour=np.int32, status=np.int16, completed=bool,
+        page_view_count=np.int32, time_spent_total=np.float64, time_spent_views=np.int32,
+        click_count=np.int32, cart_event_count=np.int32, search_count=np.int32,
+        cart_value=np.float64, priced_adds=np.int32,
+        checkout_first=np.float64, checkout_last=np.float64,
+        landing_page=np.int16, landing_time=np.float64,
+        **{flag: bool for flag in SESSION_FLAGS}),
+}
+
+PAGE_TOTALS = ['view_count', 'time_spent_total', 'time_spent_views', 'exit_count']
+
+# Additive counts per hour of session start: sessions reaching each funnel step, plus page views and exits
+ROLLUP_COLUMNS = ['sessions'] + SESSION_FLAGS + ['completed', 'page_views', 'exits']
+
+# Hours per rollup bucket
+ROLLUP_GRANULARITIES = {'hour': 1, 'day': 24}
+QUERY_TOTALS = ['search_count', 'results_total', 'results_counted', 'zero_count']
+
+
+def code_column(column):
+    """Name of the column holding the resolved code for a reference column."""
+    return column[:-len('_id')] + '_code'
+
+
+def new_state():
+    """Empty aggregate state: nothing folded yet."""
+    return {
+        'version': STATE_VERSION,
+        'marker': None,
+        'watermarks': {table: NO_ROWS for table in TABLE_COLUMNS},
+        'row_counts': {table: 0 for table in TABLE_COLUMNS},
+        'categories': {column: [] for columns in CATEGORICAL_COLUMNS.values() for column in columns},
+        'users': {column: np.empty(0, dtype) for column, dtype in KEYED_COLUMNS['users'].items()},
+        'products': {column: np.empty(0, dtype) for column, dtype in KEYED_COLUMNS['products'].items()},
+        'sessions': {column: np.empty(0, dtype) for column, dtype in KEYED_COLUMNS['sessions'].items()},
+        'purchase_pairs': np.empty(0, np.int64),
+        'cart_samples': {},
+        'page_types': pd.DataFrame(columns=PAGE_TOTALS, dtype=float),
+        'queries': pd.DataFrame(columns=QUERY_TOTALS, dtype=float),
+        'rollups': pd.DataFrame(columns=ROLLUP_COLUMNS, dtype=float),
+        'sketches': {
+            'time_spent': {},
+        },
+        'pending': {},
+        'dropped': {},
+    }
+
+
+def group_sums(codes, values):
+    """Sum per-row values by code (rows with code -1 are skipped); returns (codes, sums)."""
+    codes = np.asarray(codes)
+    keep = codes >= 0
+    keys, inverse = np.unique(codes[keep], return_inverse=True)
+    sums = {}
+    for column, value in values.items():
+        weights = np.broadcast_to(np.asarray(value, dtype=float), codes.shape)[keep]
+        sums[column] = np.bincount(inverse, weights=weights, minlength=len(keys))
+    return keys, sums
+
+
+def scatter_add(arrays, codes, values):
+    """Add per-row values into keyed aggregate arrays."""
+    keys, sums = group_sums(codes, values)
+    for column, total in sums.items():
+        arrays[column][keys] += total.astype(arrays[column].dtype)
+    return keys, sums
+
+
+def add_table_totals(existing, update):
+    """Merge a small keyed aggregate frame (page types, queries) into the running totals."""
+    update.index = update.index.astype(object)
+    if existing.empty:
+        return update.astype(float)
+    return existing.add(update, fill_value=0)
+
+
+class SharedFrameEngine:
+    """Computes the analysis inputs from mergeable aggregates over the base tables.
+
+    Exposes the same getters as `EcommerceDatabase` (`get_funnel_analysis`,
+    `get_product_performance`, ...), so the analyzer can use either. Each
+    base table is streamed out of SQLite once, in chunks of compact
+    categorical frames, and folded into additive aggregates: per-session,
+    per-user and per-product counts, plus totals by page type and query.
+    Every analysis derives its result from those shared aggregates. Counts,
+    distinct counts and top lists come out of them exactly; quantiles, which
+    sums cannot give, come from t-digests folded alongside them (see
+    `get_sketches`).
+
+    Each table has a watermark (the highest rowid folded). A refresh only
+    reads rows above it, up to a snapshot taken when the refresh starts, so
+    with `incremental=True` the aggregates are kept between runs (and
+    persisted to `state_path`) and each run folds in just the new rows. The
+    rows read from each table are counted too: a row written below a
+    watermark (an explicit, older id under the integer id strategies, whose
+    id is the rowid) leaves more rows there than were read, and the
+    aggregates are rebuilt. Rows
+    that reference a session, user or product that has not been written yet
+    are held back and retried on later refreshes for up to `lateness`
+    seconds, after which they are folded as orphans and counted as dropped.
+    Rows are never updated or deleted.
+    """
+
+    def __init__(self, db=None, chunksize=100000, incremental=False, state_path=None, lateness=3600):
+        """Initialize the engine over an `EcommerceDatabase`."""
+        self.db = db if db else EcommerceDatabase()
+        self.chunksize = chunksize
+        self.incremental = incremental
+        self.state_path = state_path or (f"{self.db.db_path}.analysis-state" if incremental else None)
+        self.lateness = lateness
+        self.lock = threading.Lock()
+        self.state = None
+        self.state_loaded = False
+        self.planned_tables = list(TABLE_COLUMNS)
+        self.last_refresh = None
+        self.reset()
+
+    def reset(self):
+        """Start a new run: the next getter call refreshes the aggregates."""
+        with self.lock:
+            self.cache = {}
+            self.cache_locks = {}
+            if not self.incremental:
+                self.state = None
+
+    def plan(self, analysis_names):
+        """Return the base tables (with the parents they reference) a set of analyses needs, in fold order."""
+        tables = set()
+        for name in analysis_names:
+            tables.update(ANALYSIS_TABLES.get(name, []))
+        pending = list(tables)
+        while pending:
+            for parent in TABLE_REFERENCES.get(pending.pop(), {}).values():
+                if parent not in tables:
+                    tables.add(parent)
+                    pending.append(parent)
+        return [table for table in TABLE_COLUMNS if table in tables]
+
+    def prepare(self, analysis_names):
+        """Start a new run for the given analyses and return the tables it will refresh."""
+        self.reset()
+        self.planned_tables = self.plan(analysis_names)
+        return self.planned_tables
+
+    def _cached(self, key, build):
+        """Build a value once per run; concurrent callers wait for the first build."""
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            key_lock = self.cache_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                if key in self.cache:
+                    return self.cache[key]
+            value = build()
+            with self.lock:
+                self.cache[key] = value
+            return value
+
+    def current(self):
+        """Aggregate state, refreshed once per run before any analysis reads it."""
+        def build():
+            self.refresh(self.planned_tables)
+            return self.state
+        return self._cached('refresh', build)
+
+    # Persistence
+
+    def load_state(self):
+        """Load persisted aggregates, or None if there are none (or they are from another version)."""
+        if not self.state_path:
+            return None
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return state if state.get('version') == STATE_VERSION else None
+
+    def save_state(self):
+        """Persist the aggregates atomically."""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.state_path)
+
+    def database_marker(self, conn):
+        """Ids of the first user and session, used to notice when the database was rebuilt."""
+        marker = []
+        for table in ['users', 'sessions']:
+            row = conn.execute(f"SELECT {PRIMARY_KEYS[table]} FROM {table} ORDER BY rowid LIMIT 1").fetchone()
+            marker.append(repr(row[0]) if row else None)
+        return tuple(marker)
+
+    # Refresh
+
+    def refresh(self, tables=None):
+        """Fold rows above each table's watermark into the aggregates; returns per-table stats."""
+        started = time.perf_counter()
+        tables = tables or list(TABLE_COLUMNS)
+        if self.incremental and not self.state_loaded:
+            self.state = self.load_state()
+            self.state_loaded = True
+        if self.state is None:
+            self.state = new_state()
+
+        conn = self.db.connect()
+        try:
+            snapshot = {
+                table: conn.execute(f"SELECT COALESCE(MAX(rowid), {NO_ROWS}) FROM {table}").fetchone()[0]
+                for table in TABLE_COLUMNS
+            }
+            marker = self.database_marker(conn)
+            watermarks = self.state['watermarks']
+            if self.state['marker'] not in (None, marker) or \
+                    any(watermarks[table] > snapshot[table] for table in TABLE_COLUMNS):
+                # The database was rebuilt underneath us: start over
+                self.state = new_state()
+            elif any(rows_through(conn, table, watermarks[table]) != self.state['row_counts'][table]
+                     for table in TABLE_COLUMNS if watermarks[table] != NO_ROWS):
+                # Rows were written below a watermark, where no refresh will read them: start over
+                self.state = new_state()
+            self.state['marker'] = marker
+
+            stats = {}
+            for table in TABLE_COLUMNS:
+                if table in tables:
+                    stats[table] = self._refresh_table(conn, table, snapshot)
+        finally:
+            self.db.close()
+        # Compress buffered digests now, so concurrent readers never modify them
+        for digest in self.state['sketches']['time_spent'].values():
+            digest.compress()
+
+        if self.incremental and self.state_path:
+            self.save_state()
+        self.last_refresh = {'tables': stats, 'seconds': time.perf_counter() - started}
+        return self.last_refresh
+
+    def _scan_query(self, table, snapshot):
+        """Select rows in a rowid range, resolving references to parent rowids within the snapshot."""
+        select = ['t.rowid AS row_code'] + [f't.{column}' for column in TABLE_COLUMNS[table]]
+        joins = []
+        for number, (column, parent) in enumerate(TABLE_REFERENCES.get(table, {}).items()):
+            alias = f'p{number}'
+            select.append(f'COALESCE({alias}.rowid, -1) AS {code_column(column)}')
+            joins.append(f"LEFT JOIN {parent} {alias} ON {alias}.{PRIMARY_KEYS[parent]} = t.{column} "
+                         f"AND {alias}.rowid <= {int(snapshot[parent])}")
+        return f"""
+        SELECT {', '.join(select)}
+        FROM {table} t {' '.join(joins)}
+        WHERE t.rowid > ? AND t.rowid <= ?
+        ORDER BY t.rowid
+        """
+
+    def _refresh_table(self, conn, table, snapshot):
+        """Retry held-back rows, then fold the new rows of one table."""
+        stats = {'rows': 0, 'held': 0, 'dropped': 0}
+        self.appended = []
+
+        if table == 'sessions':
+            self._retry_session_links(conn, snapshot, stats)
+        held = self.state['pending'].pop(table, None)
+        if held is not None and len(held):
+            self._fold(table, self._resolve_held(conn, table, held, snapshot), stats)
+
+        query = self._scan_query(table, snapshot)
+        params = (self.state['watermarks'][table], snapshot[table])
+        for chunk in pd.read_sql_query(query, conn, params=params, chunksize=self.chunksize):
+            self.state['row_counts'][table] += len(chunk)
+            for column in CATEGORICAL_COLUMNS.get(table, []):
+                chunk[column] = chunk[column].astype('category')
+            self._fold(table, chunk, stats)
+        self.state['watermarks'][table] = snapshot[table]
+
+        if self.appended:
+            arrays = self.state[table]
+            for column in arrays:
+                arrays[column] = np.concatenate([arrays[column]] + [piece[column] for piece in self.appended])
+            self.appended = []
+        self.state['dropped'][table] = self.state['dropped'].get(table, 0) + stats['dropped']
+        return stats
+
+    def _lookup_rowids(self, conn, parent, values, snapshot):
+        """Parent rowids for raw id values (-1 where the parent is not in the snapshot)."""
+        key = PRIMARY_KEYS[parent]
+        unique = list(pd.unique(values.dropna()))
+        found = {}
+        for offset in range(0, len(unique), 500):
+            batch = unique[offset:offset + 500]
+            rows = conn.execute(
+                f"SELECT {key}, rowid FROM {parent} WHERE rowid <= ? AND {key} IN ({', '.join('?' for _ in batch)})",
+                [int(snapshot[parent])] + batch
+            ).fetchall()
+            found.update(rows)
+        return pd.Series([found.get(value, -1) for value in values], index=values.index, dtype=np.int64)
+
+    def _resolve_held(self, conn, table, held, snapshot):
+        """Look up the parents of held-back rows again."""
+        for column, parent in TABLE_REFERENCES[table].items():
+            held[code_column(column)] = self._lookup_rowids(conn, parent, held[column], snapshot)
+        return held
+
+    def dense_codes(self, parent, rowids):
+        """Map parent rowids (-1 for none) to positions in the parent's aggregate arrays (-1 if not folded)."""
+        known = self.state[parent]['rowid']
+        values = np.asarray(rowids, dtype=np.int64)
+        codes = np.full(len(values), -1, dtype=np.int64)
+        valid = values >= 0
+        if valid.any() and len(known):
+            wanted = values[valid]
+            positions = np.minimum(np.searchsorted(known, wanted), len(known) - 1)
+            codes[valid] = np.where(known[positions] == wanted, positions, -1)
+        return codes
+
+    def _fold(self, table, chunk, stats):
+        """Resolve a chunk's references and fold it; rows with missing parents are held back."""
+        now = time.time()
+        references = TABLE_REFERENCES.get(table, {})
+        for column, parent in references.items():
+            chunk[code_column(column)] = self.dense_codes(parent, chunk[code_column(column)])
+
+        if references and table != 'sessions':
+            unresolved = np.zeros(len(chunk), dtype=bool)
+            for column in references:
+                unresolved |= (chunk[code_column(column)].to_numpy() < 0) & chunk[column].notna().to_numpy()
+            if unresolved.any():
+                first_seen = chunk['first_seen'].to_numpy() if 'first_seen' in chunk else np.full(len(chunk), now)
+                expired = np.full(len(chunk), not self.incremental) | (now - first_seen > self.lateness)
+                hold = unresolved & ~expired
+                if hold.any():
+                    held = chunk[hold][list(TABLE_COLUMNS[table])].copy()
+                    held['first_seen'] = first_seen[hold]
+                    self._hold(table, held)
+                    stats['held'] += int(hold.sum())
+                stats['dropped'] += int((unresolved & expired).sum())
+                chunk = chunk[~hold]
+
+        stats['rows'] += len(chunk)
+        if len(chunk):
+            getattr(self, f'_fold_{table}')(chunk, now)
+
+    def _hold(self, key, rows):
+        """Keep rows whose parents have not arrived yet for a later refresh."""
+        existing = self.state['pending'].get(key)
+        self.state['pending'][key] = rows if existing is None else pd.concat([existing, rows], ignore_index=True)
+
+    def encode(self, column, values):
+        """Integer codes for text values in a column's growing category list (-1 for null)."""
+        categories = self.state['categories'][column]
+        values = pd.Categorical(values)
+        positions = {value: number for number, value in enumerate(categories)}
+        for value in values.categories:
+            if value not in positions:
+                positions[value] = len(categories)
+                categories.append(value)
+        lookup = np.array([positions[value] for value in values.categories] + [-1], dtype=np.int16)
+        return lookup[values.codes]
+
+    def decode(self, column, codes):
+        """Text values for category codes."""
+        return np.array(self.state['categories'][column] + [None], dtype=object)[codes]
+
+    def next_code(self, table):
+        """Position the next appended row of a keyed table will take."""
+        return len(self.state[table]['rowid']) + sum(len(piece['rowid']) for piece in self.appended)
+
+    def _append(self, table, values, count):
+        """Queue new keyed rows; they are added to the arrays when the table's scan completes."""
+        piece = {}
+        for column, dtype in KEYED_COLUMNS[table].items():
+            value = values.get(column, 0)
+            piece[column] = np.asarray(value, dtype=dtype) if np.ndim(value) else np.full(count, value, dtype=dtype)
+        self.appended.append(piece)
+
+    def add_session_values(self, session_codes, totals=None, flags=None):
+        """Add per-row values to their sessions, rolling additive totals up to linked users."""
+        sessions = self.state['sessions']
+        if totals:
+            keys, sums = scatter_add(sessions, session_codes, totals)
+            user_totals = {column: total for column, total in sums.items() if column in SESSION_TOTALS}
+            if user_totals:
+                scatter_add(self.state['users'], sessions['user_code'][keys], user_totals)
+        for flag, mask in (flags or {}).items():
+            keys, sums = group_sums(session_codes, {flag: mask})
+            reached = sums[flag] > 0
+            # A session counts towards its hour's rollup once, when the flag is first set
+            newly = keys[reached & ~sessions[flag][keys]]
+            sessions[flag][keys] |= reached
+            self.add_rollup(sessions['start_hour'][newly], {flag: 1})
+
+    def add_rollup(self, hours, values):
+        """Add per-row values to the hourly rollups (rows with a negative hour are skipped)."""
+        keys, sums = group_sums(hours, values)
+        if not len(keys):
+            return
+        update = pd.DataFrame(sums, index=keys).reindex(columns=ROLLUP_COLUMNS, fill_value=0)
+        rollups = self.state['rollups']
+        self.state['rollups'] = update if rollups.empty else rollups.add(update, fill_value=0)
+
+    # Fold functions, one per base table
+
+    def _fold_users(self, chunk, now):
+        values = {
+            'rowid': chunk['row_code'].to_numpy(),
+            'user_id': chunk['user_id'].to_numpy(dtype=object),
+            'first_visit_day': to_days(chunk['first_visit_date']),
+        }
+        for column in CATEGORICAL_COLUMNS['users']:
+            values[column] = self.encode(column, chunk[column])
+        self._append('users', values, len(chunk))
+
+    def _fold_products(self, chunk, now):
+        self._append('products', {
+            'rowid': chunk['row_code'].to_numpy(),
+            'product_id': chunk['product_id'].to_numpy(dtype=object),
+            'name': chunk['name'].to_numpy(dtype=object),
+            'category': self.encode('category', chunk['category']),
+            'price': chunk['price'].fillna(0).to_numpy(dtype=float),
+        }, len(chunk))
+
+    def _fold_sessions(self, chunk, now):
+        start = self.next_code('sessions')
+        user_codes = chunk['user_code'].to_numpy()
+        completed = (chunk['conversion_status'] == 'completed').to_numpy()
+        hours = to_hours(chunk['start_time'])
+        self._append('sessions', {
+            'rowid': chunk['row_code'].to_numpy(),
+            'user_code': user_codes,
+            'start_day': hours_to_days(hours),
+            'start_hour': hours,
+            'status': self.encode('conversion_status', chunk['conversion_status']),
+            'completed': completed,
+            'checkout_first': np.inf,
+            'checkout_last': -np.inf,
+            'landing_page': -1,
+            'landing_time': np.inf,
+        }, len(chunk))
+        scatter_add(self.state['users'], user_codes, {'session_count': 1, 'completed_purchases': completed})
+        self.add_rollup(hours, {'sessions': 1, 'completed': completed})
+
+        # Sessions whose user has not been written yet are linked once it is
+        missing = (user_codes < 0) & chunk['user_id'].notna().to_numpy()
+        if missing.any():
+            self._hold('session_users', pd.DataFrame({
+                'session_code': np.arange(start, start + len(chunk))[missing],
+                'user_id': chunk['user_id'].to_numpy(dtype=object)[missing],
+                'first_seen': now,
+            }))
+
+    def _retry_session_links(self, conn, snapshot, stats):
+        """Link sessions to users that arrived after them, carrying their totals over."""
+        links = self.state['pending'].pop('session_users', None)
+        if links is None or not len(links):
+            return
+        user_codes = self.dense_codes('users', self._lookup_rowids(conn, 'users', links['user_id'], snapshot))
+        resolved = user_codes >= 0
+        expired = ~resolved & ((time.time() - links['first_seen'].to_numpy()) > self.lateness)
+        if (~resolved & ~expired).any():
+            self._hold('session_users', links[~resolved & ~expired])
+        stats['dropped'] += int(expired.sum())
+
+        sessions = self.state['sessions']
+        session_codes = links['session_code'].to_numpy()[resolved]
+        user_codes = user_codes[resolved]
+        sessions['user_code'][session_codes] = user_codes
+        totals = {column: sessions[column][session_codes] for column in SESSION_TOTALS}
+        totals.update(session_count=1, completed_purchases=sessions['completed'][session_codes])
+        scatter_add(self.state['users'], user_codes, totals)
+
+    def _fold_page_views(self, chunk, now):
+        page_totals = chunk.groupby('page_type', observed=True).agg(
+            view_count=('page_type', 'size'),
+            time_spent_total=('time_spent_seconds', 'sum'),
+            time_spent_views=('time_spent_seconds', 'count'),
+            exit_count=('exit_page', 'sum'),
+        )
+        self.state['page_types'] = add_table_totals(self.state['page_types'], page_totals)
+        digests = self.state['sketches']['time_spent']
+        for page_type, time_spent in chunk.groupby('page_type', observed=True)['time_spent_seconds']:
+            digests.setdefault(page_type, TDigest()).add(time_spent.to_numpy(dtype=float))
+
+        session_codes = chunk['session_code'].to_numpy()
+        known = session_codes >= 0
+        self.add_rollup(self.state['sessions']['start_hour'][session_codes[known]], {
+            'page_views': 1,
+            'exits': chunk['exit_page'].fillna(0).to_numpy(dtype=float)[known],
+        })
+
+        time_spent = chunk['time_spent_seconds']
+        self.add_session_values(session_codes, totals={
+            'page_view_count': 1,
+            'time_spent_total': time_spent.fillna(0).to_numpy(dtype=float),
+            'time_spent_views': time_spent.notna().to_numpy(),
+        }, flags={
+            'homepage_view': (chunk['page_type'] == 'homepage').to_numpy(),
+            'product_listing_view': (chunk['page_type'] == 'product_listing').to_numpy(),
+            'product_detail_view': (chunk['page_type'] == 'product_detail').to_numpy(),
+        })
+
+        # Landing page: the type of each session's earliest page view (the earlier row on ties)
+        sessions = self.state['sessions']
+        seconds = pd.to_datetime(chunk['timestamp'], format='ISO8601', errors='coerce')
+        seconds = (seconds - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+        timed = np.flatnonzero(known & ~np.isnan(seconds))
+        timed = timed[np.lexsort((seconds[timed], session_codes[timed]))]
+        first = timed[np.diff(session_codes[timed], prepend=-1) != 0]
+        earlier = first[seconds[first] < sessions['landing_time'][session_codes[first]]]
+        sessions['landing_time'][session_codes[earlier]] = seconds[earlier]
+        sessions['landing_page'][session_codes[earlier]] = self.encode('page_type', chunk['page_type'])[earlier]
+
+    def _fold_clicks(self, chunk, now):
+        self.add_session_values(chunk['session_code'].to_numpy(), totals={'click_count': 1})
+
+    def _fold_product_views(self, chunk, now):
+        scatter_add(self.state['products'], chunk['product_code'].to_numpy(), {'view_count': 1})
+
+    def _fold_cart_events(self, chunk, now):
+        sessions = self.state['sessions']
+        products = self.state['products']
+        session_codes = chunk['session_code'].to_numpy()
+        product_codes = chunk['product_code'].to_numpy()
+        adds = (chunk['event_type'] == 'add_to_cart').to_numpy()
+        self.add_session_values(session_codes, totals={'cart_event_count': 1}, flags={'add_to_cart': adds})
+        scatter_add(products, product_codes[adds], {'add_to_cart_count': 1})
+
+        # Cart value only counts adds of known products in known sessions (an inner join)
+        priced = adds & (session_codes >= 0) & (product_codes >= 0)
+        if not priced.any():
+            return
+        session_codes = session_codes[priced]
+        product_codes = product_codes[priced]
+        quantity = chunk['quantity'].fillna(0).to_numpy(dtype=float)[priced]
+        self.add_session_values(session_codes, totals={
+            'cart_value': products['price'][product_codes] * quantity,
+            'priced_adds': 1,
+        })
+
+        # Purchases count distinct (product, completed session) pairs across refreshes
+        completed = sessions['completed'][session_codes]
+        pairs = np.unique((product_codes[completed] << 32) | session_codes[completed])
+        new_pairs = np.setdiff1d(pairs, self.state['purchase_pairs'], assume_unique=True)
+        scatter_add(products, new_pairs >> 32, {'purchase_count': 1})
+        self.state['purchase_pairs'] = np.union1d(self.state['purchase_pairs'], new_pairs)
+
+        # Keep one example cart per conversion status
+        samples = self.state['cart_samples']
+        statuses = sessions['status'][session_codes]
+        for status in np.unique(statuses):
+            if status not in samples:
+                samples[status] = {'session': session_codes[statuses == status][0], 'products': []}
+        for sample in samples.values():
+            in_sample = session_codes == sample['session']
+            sample['products'].extend(products['name'][product_codes[in_sample]])
+
+    def _fold_search_events(self, chunk, now):
+        results = chunk['results_count']
+        query_totals = pd.DataFrame({
+            'query': chunk['query'],
+            'search_count': 1,
+            'results_total': results.fillna(0),
+            'results_counted': results.notna(),
+            'zero_count': results == 0,
+        }).groupby('query', observed=True).sum()
+        self.state['queries'] = add_table_totals(self.state['queries'], query_totals)
+        self.add_session_values(chunk['session_code'].to_numpy(), totals={'search_count': 1})
+
+    def _fold_checkout_events(self, chunk, now):
+        self.add_session_values(chunk['session_code'].to_numpy(), flags={
+            'checkout_start': (chunk['step'] == 'checkout_start').to_numpy(),
+            'shipping_info': (chunk['step'] == 'shipping_info').to_numpy(),
+            'payment_info': (chunk['step'] == 'payment_info').to_numpy(),
+        })
+
+        # First and last checkout event per session, for checkout durations
+        sessions = self.state['sessions']
+        session_codes = chunk['session_code'].to_numpy()
+        seconds = pd.to_datetime(chunk['timestamp'], format='ISO8601', errors='coerce')
+        seconds = (seconds - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+        known = (session_codes >= 0) & ~np.isnan(seconds)
+        np.minimum.at(sessions['checkout_first'], session_codes[known], seconds[known])
+        np.maximum.at(sessions['checkout_last'], session_codes[known], seconds[known])
+
+    # Getters (same shapes as EcommerceDatabase)
+
+    def get_funnel_analysis(self):
+        """Conversion funnel drop-offs."""
+        sessions = self.current()['sessions']
+        steps = [int(sessions[flag].sum()) for flag in SESSION_FLAGS] + [int(sessions['completed'].sum())]
+        return funnel_drop_offs(FUNNEL_STEPS, steps)
+
+    def get_cart_abandonment_data(self):
+        """Cart value and session counts by conversion status."""
+        state = self.current()
+        sessions = state['sessions']
+        with_cart = sessions['priced_adds'] > 0
+        grouped = pd.DataFrame({
+            'status': sessions['status'][with_cart],
+            'cart_value': sessions['cart_value'][with_cart],
+        }).groupby('status')['cart_value'].agg(['size', 'mean'])
+
+        samples = state['cart_samples']
+        cart_data = pd.DataFrame({
+            'conversion_status': self.decode('conversion_status', grouped.index.to_numpy()),
+            'session_count': grouped['size'].to_numpy(),
+            'avg_cart_value': grouped['mean'].to_numpy(),
+            'products_in_cart': [', '.join(samples[status]['products']) if status in samples else None
+                                 for status in grouped.index],
+        })
+        return cart_data.sort_values('conversion_status', kind='stable').reset_index(drop=True)
+
+    def get_search_behavior(self):
+        """Top searches, zero-result searches and search-to-conversion rate."""
+        state = self.current()
+        queries = state['queries']
+
+        top_searches = pd.DataFrame({
+            'query': queries.index.astype(object),
+            'search_count': queries['search_count'].astype(int).to_numpy(),
+            'avg_results': (queries['results_total'] / queries['results_counted'].replace(0, np.nan)).to_numpy(),
+        }).sort_values('search_count', ascending=False, kind='stable').head(20).reset_index(drop=True)
+
+        zero = queries[queries['zero_count'] > 0]
+        zero_results = pd.DataFrame({
+            'query': zero.index.astype(object),
+            'search_count': zero['zero_count'].astype(int).to_numpy(),
+        }).sort_values('search_count', ascending=False, kind='stable').head(20).reset_index(drop=True)
+
+        sessions = state['sessions']
+        with_search = sessions['search_count'] > 0
+        sessions_with_search = int(with_search.sum())
+        converted = int((with_search & sessions['completed']).sum())
+        search_conversion = pd.DataFrame([{
+            'sessions_with_search': sessions_with_search,
+            'converted_search_sessions': converted,
+            'search_conversion_rate': converted / sessions_with_search if sessions_with_search else None,
+        }])
+        return {
+            'top_searches': top_searches,
+            'zero_results': zero_results,
+            'search_conversion': search_conversion
+        }
+
+    def get_page_effectiveness(self):
+        """View count, time spent and exit rate by page type."""
+        page_types = self.current()['page_types']
+        page_data = pd.DataFrame({
+            'page_type': page_types.index.astype(object),
+            'view_count': page_types['view_count'].astype(int).to_numpy(),
+            'avg_time_spent': (page_types['time_spent_total']
+                               / page_types['time_spent_views'].replace(0, np.nan)).to_numpy(),
+            'exit_count': page_types['exit_count'].astype(int).to_numpy(),
+        })
+        page_data['exit_rate'] = page_data['exit_count'] / page_data['view_count']
+        return page_data.sort_values('view_count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_product_performance(self):
+        """Per-product views, add-to-cart and purchase rates."""
+        products = self.current()['products']
+        product_data = pd.DataFrame({
+            'product_id': products['product_id'],
+            'name': products['name'],
+            'category': self.decode('category', products['category']),
+            'view_count': products['view_count'],
+            'add_to_cart_count': products['add_to_cart_count'],
+        })
+        product_data['view_to_cart_rate'] = (
+            product_data['add_to_cart_count'] / product_data['view_count'].replace(0, np.nan))
+        product_data['purchase_count'] = products['purchase_count']
+        product_data['cart_to_purchase_rate'] = (
+            product_data['purchase_count'] / product_data['add_to_cart_count'].replace(0, np.nan))
+        return product_data.sort_values('view_count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_user_segment_features(self):
+        """Per-user behavioural features for users with at least one session.
+
+        Counts are rolled up from per-session totals, so unlike the joined
+        SQL query they are not inflated by row fan-out across event tables.
+        """
+        users = self.current()['users']
+        active = users['session_count'] > 0
+        user_data = pd.DataFrame({'user_id': users['user_id'][active]})
+        for column in CATEGORICAL_COLUMNS['users']:
+            user_data[column] = self.decode(column, users[column][active])
+        user_data['session_count'] = users['session_count'][active]
+        time_spent_views = users['time_spent_views'][active]
+        user_data['avg_time_spent'] = np.where(
+            time_spent_views > 0, users['time_spent_total'][active] / np.maximum(time_spent_views, 1), np.nan)
+        for column in ['page_view_count', 'click_count', 'cart_event_count', 'search_count']:
+            user_data[column] = users[column][active]
+        user_data['completed_purchases'] = users['completed_purchases'][active]
+        user_data['total_sessions'] = user_data['session_count']
+        user_data['conversion_rate'] = user_data['completed_purchases'] / user_data['session_count']
+        return user_data
+
+    def get_session_features(self, since_hour=None):
+        """Per-session behavioural features, device, referrer, start hour and outcome, for sessions starting after `since_hour`.
+
+        Sessions without a parseable start time are left out.
+        """
+        state = self.current()
+        sessions, users = state['sessions'], state['users']
+        start_hour = sessions['start_hour']
+        keep = start_hour != NO_TIME
+        if since_hour is not None:
+            keep &= start_hour > since_hour
+        user_codes = sessions['user_code'][keep]
+        known = user_codes >= 0
+        session_data = pd.DataFrame({'start_hour': start_hour[keep]})
+        for column in ['device_type', 'referrer']:
+            codes = np.full(len(user_codes), -1, dtype=np.int64)
+            codes[known] = users[column][user_codes[known]]
+            session_data[column] = self.decode(column, codes)
+        for column in ['page_view_count', 'click_count', 'cart_event_count', 'search_count']:
+            session_data[column] = sessions[column][keep]
+        time_spent_views = sessions['time_spent_views'][keep]
+        session_data['avg_time_spent'] = np.where(
+            time_spent_views > 0, sessions['time_spent_total'][keep] / np.maximum(time_spent_views, 1), np.nan)
+        session_data['completed'] = sessions['completed'][keep]
+        return session_data
+
+    def get_cube_facts(self):
+        """Per-session cube dimensions (user attributes, landing page type, start day number) and measures."""
+        state = self.current()
+        sessions, users = state['sessions'], state['users']
+        user_codes = sessions['user_code']
+        known = user_codes >= 0
+        facts = pd.DataFrame(index=pd.RangeIndex(len(user_codes)))
+        for column in CATEGORICAL_COLUMNS['users']:
+            codes = np.full(len(user_codes), -1, dtype=np.int64)
+            codes[known] = users[column][user_codes[known]]
+            facts[column] = self.decode(column, codes)
+        facts['landing_page'] = self.decode('page_type', sessions['landing_page'])
+        facts['day'] = sessions['start_day']
+        facts['completed'] = sessions['completed']
+        facts['cart_value'] = sessions['cart_value']
+        for flag in SESSION_FLAGS:
+            facts[flag] = sessions[flag]
+        return facts
+
+    def get_cohort_activity(self, period='week'):
+        """Active, converting and repeat-buying users per acquisition cohort and period since acquisition.
+
+        Cohorts are bucketed from the integer day columns kept with the
+        user and session aggregates, so they follow each refresh.
+        """
+        state = self.current()
+        sessions = state['sessions']
+        return cohort_activity(state['users']['first_visit_day'], sessions['user_code'],
+                               sessions['start_day'], sessions['completed'], period)
+
+    def get_metric_rollups(self, granularity='hour', since=None):
+        """Funnel, conversion and exit counts per hour or day of session start, for buckets after `since`.
+
+        Indexed by bucket number (hours or days since 1970-01-01); buckets
+        with no sessions are absent. Late events keep updating the bucket of
+        their session's start.
+        """
+        rollups = self.current()['rollups']
+        hours = ROLLUP_GRANULARITIES[granularity]
+        if since is not None:
+            rollups = rollups[rollups.index >= (since + 1) * hours]
+        rollups = rollups.groupby(rollups.index // hours).sum().astype(np.int64)
+        rollups.index.name = 'bucket'
+        return rollups
+
+    def get_sketches(self):
+        """Sketches kept with the aggregates, plus a digest of checkout durations.
+
+        Returns t-digests of time spent per page type and of the seconds
+        between each session's first and last checkout event.
+        """
+        state = self.current()
+        sessions = state['sessions']
+        durations = sessions['checkout_last'] - sessions['checkout_first']
+        sketches = dict(state['sketches'])
+        sketches['checkout_duration'] = TDigest().add(durations[np.isfinite(durations)]).compress()
+        return sketches
+
+
+def print_refresh_stats(refresh):
+    """Print rows folded, held back and dropped per table for one refresh."""
+    rows = [[table, f"{stats['rows']:,}", f"{stats['held']:,}", f"{stats['dropped']:,}"]
+            for table, stats in refresh['tables'].items()]
+    print(tabulate(rows, headers=['Table', 'Folded', 'Held back', 'Dropped'], tablefmt='pipe'))
+    print(f"Refreshed in {refresh['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Incrementally refresh the persisted analysis aggregates")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--state', default=None, help="State file (default: <db>.analysis-state)")
+    parser.add_argument('--lateness', type=float, default=3600,
+                        help="Seconds to wait for late parent rows before dropping a row")
+    args = parser.parse_args()
+
+    engine = SharedFrameEngine(EcommerceDatabase(args.db), incremental=True,
+                               state_path=args.state, lateness=args.lateness)
+    print_refresh_stats(engine.refresh())
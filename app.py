@@ -1,13 +1,20 @@
 import os
 import json
+import threading
 import plotly
 import plotly.express as px
+import plotly.graph_objects as go
 from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
 from werkzeug.utils import secure_filename
 from database import EcommerceDatabase
 from data_analyzer import EcommerceDataAnalyzer
 from generate_data import EcommerceDataGenerator
 from ecommerce_agent import EcommerceAgent
+from recommender import RecommenderBuilder, load_recommender
+from propensity import NUMERIC_FEATURES, PropensityTrainer, PropensityScorer, propensity_paths
+from olap_cube import load_cube
+from data_import import FileImporter, IMPORT_TABLES, file_format
+from event_ingest import EventIngestor, MAX_BATCH_BYTES
 
 app = Flask(__name__)
 app.secret_key = 'ecommerce-journey-optimization-agent'
@@ -21,12 +28,23 @@ os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 # Global variables to store analysis results
 analysis_results = None
 enhanced_results = None
+recommender = None
+propensity_scorer = None
+cube = None
+# Held while the propensity model retrains; a retrain requested meanwhile is skipped
+propensity_training = threading.Lock()
+# Uploaded files being imported in the background; a file is never imported twice at once
+active_imports = set()
+imports_lock = threading.Lock()
+# Buffers /events batches for group commits; created with the first request so each worker process has its own
+event_ingestor = None
+ingestor_lock = threading.Lock()
 
 @app.route('/')
 def index():
     # Check if database exists
     db_exists = os.path.exists('ecommerce_data.db')
-    return render_template('index.html', db_exists=db_exists)
+    return render_template('index.html', db_exists=db_exists, import_tables=IMPORT_TABLES)
 
 @app.route('/generate-data', methods=['POST'])
 def generate_data():
@@ -34,12 +52,14 @@ def generate_data():
         num_users = int(request.form.get('num_users', 200))
         num_sessions = int(request.form.get('num_sessions', 500))
         num_products = int(request.form.get('num_products', 50))
+        id_strategy = request.form.get('id_strategy') or None
         
         # Generate data
         generator = EcommerceDataGenerator(
             num_users=num_users,
             num_sessions=num_sessions,
-            num_products=num_products
+            num_products=num_products,
+            id_strategy=id_strategy
         )
         generator.generate_all_data()
         
@@ -61,6 +81,12 @@ def analyze():
         # Run analysis
         analysis_results = analyzer.run_comprehensive_analysis()
         
+        # Fold new events into the recommendation index
+        RecommenderBuilder(db).update()
+        
+        # Retrain the propensity model in the background; scoring keeps using the last export
+        threading.Thread(target=retrain_propensity, daemon=True).start()
+        
         # Save results as JSON for the UI
         with open(os.path.join(app.config['OUTPUT_FOLDER'], 'analysis_results.json'), 'w') as f:
             # Convert any non-serializable objects to strings
@@ -181,6 +207,170 @@ def generate_report():
         flash(f'Error generating report: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
+def id_text(value):
+    """An id as JSON text: hex for binary ids (as /events and the importer take them), str otherwise."""
+    return value.hex() if isinstance(value, bytes) else str(value)
+
+@app.route('/api/recommendations/product/<product_id>')
+def product_recommendations(product_id):
+    global recommender
+    recommender = load_recommender(current=recommender)
+    if recommender is None:
+        return jsonify({'error': 'Recommendation index not built yet. Run the analysis first.'}), 404
+    n = request.args.get('n', 10, type=int)
+    items = recommender.similar(product_id, n)
+    return jsonify({'product_id': product_id,
+                    'recommendations': [{'product_id': id_text(item), 'score': score} for item, score in items]})
+
+@app.route('/api/recommendations/user/<user_id>')
+def user_recommendations(user_id):
+    global recommender
+    recommender = load_recommender(current=recommender)
+    if recommender is None:
+        return jsonify({'error': 'Recommendation index not built yet. Run the analysis first.'}), 404
+    n = request.args.get('n', 10, type=int)
+    items = recommender.recommend_for_user(user_id, n)
+    return jsonify({'user_id': user_id,
+                    'recommendations': [{'product_id': id_text(item), 'score': score} for item, score in items]})
+
+def retrain_propensity():
+    """Fold sessions since the last update into the propensity model, unless a retrain is already running."""
+    if not propensity_training.acquire(blocking=False):
+        return
+    try:
+        db = EcommerceDatabase()
+        PropensityTrainer(db, *propensity_paths(db.db_path)).update()
+    except Exception as e:
+        app.logger.error(f'Propensity retraining failed: {str(e)}')
+    finally:
+        propensity_training.release()
+
+@app.route('/api/propensity', methods=['POST'])
+def propensity_scores():
+    global propensity_scorer
+    if propensity_scorer is None:
+        propensity_scorer = PropensityScorer(propensity_paths('ecommerce_data.db')[1])
+    if not propensity_scorer.reload():
+        return jsonify({'error': 'Propensity model not trained yet. Run the analysis first.'}), 404
+    payload = request.get_json(silent=True)
+    try:
+        if isinstance(payload, dict):
+            return jsonify({'score': propensity_scorer.score_session(payload)})
+        if not isinstance(payload, list) or not all(isinstance(record, dict) for record in payload):
+            return jsonify({'error': 'Expected a JSON session object or a list of them.'}), 400
+        return jsonify({'scores': propensity_scorer.score_records(payload).tolist() if payload else []})
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid session features ({e}); {', '.join(NUMERIC_FEATURES)} must be numbers."}), 400
+
+@app.route('/api/cube')
+def cube_group_by():
+    global cube
+    cube = load_cube(current=cube)
+    if cube is None:
+        return jsonify({'error': 'Conversion cube not built yet. Run the analysis first.'}), 404
+    dimensions = [d for d in request.args.get('group_by', '').split(',') if d]
+    filters = {d: request.args.getlist(d) for d in request.args if d not in ('group_by', 'limit')}
+    try:
+        groups = cube.group_by(*dimensions, **filters)
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 400
+    limit = request.args.get('limit', type=int)
+    if limit:
+        groups = groups.head(limit)
+    return jsonify({'group_by': dimensions, 'filters': filters, 'groups': groups.to_dict(orient='records')})
+
+def start_import(path, table):
+    """Import a file in the background unless it is already being imported; returns whether it started."""
+    with imports_lock:
+        if path in active_imports:
+            return False
+        active_imports.add(path)
+    threading.Thread(target=run_import, args=(path, table), daemon=True).start()
+    return True
+
+def run_import(path, table):
+    """Import (or resume importing) a file; a failure leaves its checkpoint for a later resume."""
+    try:
+        FileImporter(EcommerceDatabase()).import_file(path, table)
+    except Exception as e:
+        app.logger.error(f'Import of {path} failed: {str(e)}')
+    finally:
+        with imports_lock:
+            active_imports.discard(path)
+
+@app.route('/import', methods=['POST'])
+def import_upload():
+    upload = request.files.get('file')
+    table = request.form.get('table')
+    if not upload or not upload.filename:
+        flash('Please choose a file to import.', 'error')
+        return redirect(url_for('index'))
+    filename = secure_filename(upload.filename)
+    if table not in IMPORT_TABLES or not file_format(filename):
+        flash('Please choose a table and a .csv, .ndjson or .jsonl file (optionally .gz).', 'error')
+        return redirect(url_for('index'))
+    path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    with imports_lock:
+        busy = path in active_imports
+    if busy:
+        flash(f'{filename} is still being imported.', 'error')
+        return redirect(url_for('index'))
+    
+    # Werkzeug streams the upload to disk in chunks
+    upload.save(path)
+    start_import(path, table)
+    flash(f'Importing {filename} into {table} in the background.', 'success')
+    return redirect(url_for('index'))
+
+@app.route('/api/imports')
+def import_progress():
+    imports = FileImporter(EcommerceDatabase()).progress()
+    with imports_lock:
+        for entry in imports:
+            entry['active'] = entry['path'] in active_imports
+    return jsonify({'imports': imports})
+
+@app.route('/api/imports/resume', methods=['POST'])
+def resume_imports():
+    """Restart every interrupted import whose file is still in place."""
+    resumed = [entry['path'] for entry in FileImporter(EcommerceDatabase()).progress()
+               if entry['status'] != 'completed' and os.path.exists(entry['path'])
+               and start_import(entry['path'], entry['table_name'])]
+    return jsonify({'resumed': resumed}), 202
+
+def get_event_ingestor():
+    global event_ingestor
+    with ingestor_lock:
+        if event_ingestor is None:
+            event_ingestor = EventIngestor(EcommerceDatabase())
+        return event_ingestor
+
+@app.route('/events', methods=['POST'])
+def ingest_events():
+    ingestor = get_event_ingestor()
+    refusal = ingestor.backpressure()
+    if refusal:
+        status, retry_after = refusal
+        message = 'Ingest buffer is full' if status == 429 else 'Event writer is unavailable'
+        response = jsonify({'error': f'{message}; retry later.', 'pending': ingestor.pending})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, status
+    body = None
+    if (request.content_length or 0) <= MAX_BATCH_BYTES:
+        # Chunked requests have no Content-Length, so the body is read only up to one byte past the limit
+        body = request.stream.read(MAX_BATCH_BYTES + 1)
+    if body is None or len(body) > MAX_BATCH_BYTES:
+        return jsonify({'error': f'Batches are limited to {MAX_BATCH_BYTES // (1024 * 1024)} MB.'}), 413
+    try:
+        accepted = ingestor.submit(body)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'accepted': accepted, 'pending': ingestor.pending}), 202
+
+@app.route('/api/ingest')
+def ingest_stats():
+    return jsonify(get_event_ingestor().stats())
+
 def generate_dashboard_graphs(analysis_results):
     graphs = {}
     
@@ -325,6 +515,29 @@ def generate_dashboard_graphs(analysis_results):
             )
             graphs['referrers'] = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
     
+    # 5. Journey Path Flows
+    if 'journey_paths' in analysis_results and 'flows' in analysis_results['journey_paths']:
+        flow_data = analysis_results['journey_paths']['flows']
+        if flow_data:
+            labels = []
+            positions = {}
+            for flow in flow_data:
+                for label in (flow['source'], flow['target']):
+                    if label not in positions:
+                        positions[label] = len(labels)
+                        labels.append(label)
+            
+            fig = go.Figure(go.Sankey(
+                node=dict(label=labels, pad=15, thickness=15),
+                link=dict(
+                    source=[positions[flow['source']] for flow in flow_data],
+                    target=[positions[flow['target']] for flow in flow_data],
+                    value=[flow['sessions'] for flow in flow_data],
+                ),
+            ))
+            fig.update_layout(title="Frequent Journey Paths")
+            graphs['journey_paths'] = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    
     return graphs
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from datetime import datetime
+from tabulate import tabulate
+from database import EcommerceDatabase
+from generate_data import EcommerceDataGenerator
+from id_generators import DEFAULT_ID_STRATEGY
+
+# Bump when the generator changes in a way that alters its output, so
+# cached datasets built by older code are rebuilt instead of reused.
+GENERATOR_VERSION = 2
+
+# Named scale tiers. Every tier has a fixed seed and the same skewed
+# traffic model: Zipfian product popularity and user activity, and
+# heavy-tailed session lengths.
+DATASET_TIERS = {
+    'small': {
+        'seed': 1001,
+        'num_users': 4000,
+        'num_sessions': 10000,
+        'num_products': 500,
+    },
+    'medium': {
+        'seed': 2002,
+        'num_users': 300000,
+        'num_sessions': 1000000,
+        'num_products': 5000,
+    },
+    'large': {
+        'seed': 3003,
+        'num_users': 2000000,
+        'num_sessions': 20000000,
+        'num_products': 50000,
+    },
+}
+
+TIER_DEFAULTS = {
+    'start_date': '2024-01-01',
+    'end_date': '2025-05-25',
+    'product_popularity': 'zipf',
+    'user_activity': 'zipf',
+    'session_length': 'heavy_tail',
+    'zipf_exponent': 1.07,
+}
+
+CHECKSUM_TABLES = [
+    'users', 'products', 'sessions', 'page_views', 'clicks',
+    'product_views', 'cart_events', 'search_events', 'checkout_events'
+]
+
+
+def database_checksum(db_path, tables=None):
+    """Compute per-table and overall SHA-256 checksums of a database's rows.
+
+    Rows are hashed in rowid order, which is the insertion order of the
+    seeded generator, so identical data always gives identical checksums.
+    """
+    tables = tables or CHECKSUM_TABLES
+    conn = sqlite3.connect(db_path)
+    overall = hashlib.sha256()
+    table_checksums = {}
+    row_counts = {}
+
+    for table in tables:
+        digest = hashlib.sha256()
+        count = 0
+        cursor = conn.execute(f"SELECT * FROM {table} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                digest.update(repr(row).encode('utf-8'))
+            count += len(rows)
+        table_checksums[table] = digest.hexdigest()
+        row_counts[table] = count
+        overall.update(f"{table}:{table_checksums[table]}".encode('utf-8'))
+
+    conn.close()
+    return {
+        'checksum': overall.hexdigest(),
+        'table_checksums': table_checksums,
+        'row_counts': row_counts
+    }
+
+
+class DatasetCatalog:
+    def __init__(self, cache_dir='datasets', id_strategy=None):
+        """Initialize the catalog; built datasets are cached under `cache_dir`."""
+        self.cache_dir = cache_dir
+        self.id_strategy = id_strategy or DEFAULT_ID_STRATEGY
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def tier_params(self, tier):
+        """Return the full generator parameters for a tier."""
+        if tier not in DATASET_TIERS:
+            raise ValueError(f"Unknown dataset tier '{tier}'. Choose one of: {', '.join(DATASET_TIERS)}")
+        params = dict(TIER_DEFAULTS)
+        params.update(DATASET_TIERS[tier])
+        return params
+
+    def db_path(self, tier):
+        """Path of the cached database file for a tier."""
+        return os.path.join(self.cache_dir, f"{tier}-{self.id_strategy}.db")
+
+    def manifest_path(self, tier):
+        """Path of the manifest describing a cached tier."""
+        return os.path.join(self.cache_dir, f"{tier}-{self.id_strategy}.json")
+
+    def load_manifest(self, tier):
+        """Load the manifest for a tier, or None if it has not been built."""
+        try:
+            with open(self.manifest_path(tier), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_cached(self, tier):
+        """Whether a tier is built with the current parameters and generator version."""
+        manifest = self.load_manifest(tier)
+        return (
+            manifest is not None
+            and os.path.exists(self.db_path(tier))
+            and manifest.get('generator_version') == GENERATOR_VERSION
+            and manifest.get('params') == self.tier_params(tier)
+        )
+
+    def build(self, tier, force=False):
+        """Build a tier (unless a valid cached copy exists) and return its manifest."""
+        if not force and self.is_cached(tier):
+            return self.load_manifest(tier)
+
+        params = self.tier_params(tier)
+        final_path = self.db_path(tier)
+        tmp_path = final_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        print(f"Building '{tier}' dataset ({params['num_sessions']:,} sessions)...")
+        started = time.perf_counter()
+        db = EcommerceDatabase(tmp_path, id_strategy=self.id_strategy)
+        generator = EcommerceDataGenerator(db=db, batch_size=50000, **params)
+        generator.generate_all_data()
+        build_seconds = time.perf_counter() - started
+
+        manifest = {
+            'tier': tier,
+            'id_strategy': self.id_strategy,
+            'generator_version': GENERATOR_VERSION,
+            'params': params,
+            'built_at': datetime.now().isoformat(),
+            'build_seconds': round(build_seconds, 1),
+        }
+        manifest.update(database_checksum(tmp_path))
+
+        # Publish atomically so a crashed build never looks cached
+        os.replace(tmp_path, final_path)
+        with open(self.manifest_path(tier), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        print(f"Built '{tier}' in {build_seconds:.1f}s, checksum {manifest['checksum'][:16]}")
+        return manifest
+
+    def get(self, tier):
+        """Return an EcommerceDatabase for a tier, building it on first use."""
+        self.build(tier)
+        return EcommerceDatabase(self.db_path(tier), id_strategy=self.id_strategy)
+
+    def verify(self, tier):
+        """Recompute a cached tier's checksum and compare it with its manifest."""
+        manifest = self.load_manifest(tier)
+        if manifest is None or not os.path.exists(self.db_path(tier)):
+            return False
+        return database_checksum(self.db_path(tier))['checksum'] == manifest['checksum']
+
+    def report(self):
+        """Print the catalog with cache status and checksums."""
+        rows = []
+        for tier in DATASET_TIERS:
+            params = self.tier_params(tier)
+            manifest = self.load_manifest(tier) if self.is_cached(tier) else None
+            rows.append([
+                tier,
+                params['seed'],
+                f"{params['num_sessions']:,}",
+                'yes' if manifest else 'no',
+                f"{sum(manifest['row_counts'].values()):,}" if manifest else '-',
+                manifest['checksum'][:16] if manifest else '-'
+            ])
+        headers = ['Tier', 'Seed', 'Sessions', 'Cached', 'Rows', 'Checksum']
+        print(tabulate(rows, headers=headers, tablefmt='pipe'))
+        return rows
+
+
+def get_dataset(tier='small', cache_dir='datasets', id_strategy=None):
+    """Fixture helper: the EcommerceDatabase for a tier, built and cached on demand."""
+    return DatasetCatalog(cache_dir, id_strategy).get(tier)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Reproducible benchmark dataset catalog")
+    parser.add_argument('command', choices=['list', 'build', 'verify'])
+    parser.add_argument('tier', nargs='?', choices=list(DATASET_TIERS), default='small')
+    parser.add_argument('--cache-dir', default='datasets')
+    parser.add_argument('--id-strategy', default=None)
+    parser.add_argument('--force', action='store_true', help="Rebuild even if a cached copy exists")
+    args = parser.parse_args()
+
+    catalog = DatasetCatalog(args.cache_dir, args.id_strategy)
+    if args.command == 'list':
+        catalog.report()
+    elif args.command == 'build':
+        catalog.build(args.tier, force=args.force)
+    else:
+        print(f"{args.tier}: {'OK' if catalog.verify(args.tier) else 'CHECKSUM MISMATCH'}")
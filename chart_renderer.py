@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import seaborn as sns
+
+# Figures are built with the object-oriented API (never pyplot), so they hold
+# no global state, can be rendered from worker threads and are freed as soon
+# as they go out of scope.
+
+
+def draw_conversion_funnel(ax, data):
+    """Bar chart of users reaching each funnel stage."""
+    ax.bar(data['stages'], data['counts'])
+    ax.set_title('Conversion Funnel')
+    ax.set_xlabel('Funnel Stage')
+    ax.set_ylabel('Number of Users')
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def draw_cart_abandonment(ax, data):
+    """Average cart value for completed vs abandoned sessions."""
+    sns.barplot(x='conversion_status', y='avg_cart_value', data=data, ax=ax)
+    ax.set_title('Average Cart Value by Conversion Status')
+    ax.set_xlabel('Conversion Status')
+    ax.set_ylabel('Average Cart Value ($)')
+
+
+def draw_top_searches(ax, data):
+    """Most frequent search queries."""
+    sns.barplot(x='query', y='search_count', data=data, ax=ax)
+    ax.set_title('Top 5 Search Queries')
+    ax.set_xlabel('Query')
+    ax.set_ylabel('Search Count')
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def draw_exit_rates(ax, data):
+    """Exit rate for each page type."""
+    sns.barplot(x='page_type', y='exit_rate', data=data, ax=ax)
+    ax.set_title('Exit Rate by Page Type')
+    ax.set_xlabel('Page Type')
+    ax.set_ylabel('Exit Rate')
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def draw_product_performance(ax, data):
+    """Most viewed products, annotated with view-to-cart rate."""
+    bars = ax.bar(data['name'], data['view_count'])
+    ax.set_title('Top 10 Viewed Products')
+    ax.set_xlabel('Product')
+    ax.set_ylabel('View Count')
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_ha('right')
+
+    # Add conversion rate as text on top of bars
+    for bar, view_to_cart in zip(bars, data['view_to_cart_rate']):
+        if pd.notna(view_to_cart):
+            ax.text(bar.get_x() + bar.get_width() / 2., bar.get_height() + 5,
+                    f'{view_to_cart*100:.1f}%', ha='center', va='bottom', rotation=0)
+
+
+def draw_user_segments(ax, data):
+    """Conversion rate for each user segment."""
+    sns.barplot(x='segment_name', y='conversion_rate_num', data=data, ax=ax)
+    ax.set_title('Conversion Rate by User Segment')
+    ax.set_xlabel('Segment')
+    ax.set_ylabel('Conversion Rate (%)')
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+# Chart name -> (draw function, figure size)
+CHARTS = {
+    'conversion_funnel': (draw_conversion_funnel, (12, 6)),
+    'cart_abandonment': (draw_cart_abandonment, (10, 6)),
+    'top_searches': (draw_top_searches, (10, 6)),
+    'exit_rates': (draw_exit_rates, (12, 6)),
+    'product_performance': (draw_product_performance, (14, 7)),
+    'user_segments': (draw_user_segments, (10, 6)),
+}
+
+
+def charts_enabled_by_default():
+    """Charts render unless ECOMMERCE_RENDER_CHARTS is set to 0/false (headless runs)."""
+    return os.environ.get('ECOMMERCE_RENDER_CHARTS', '1').lower() not in ('0', 'false', 'no')
+
+
+def data_fingerprint(name, data):
+    """Stable hash of a chart's name and input data."""
+    if isinstance(data, pd.DataFrame):
+        payload = data.to_json(orient='split', date_format='iso')
+    else:
+        payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{name}:{payload}".encode('utf-8')).hexdigest()
+
+
+class ChartRenderer:
+    def __init__(self, output_dir='output', enabled=None, max_workers=2):
+        """Initialize the renderer.
+
+        Charts are written to `<output_dir>/charts/<name>-<data hash>.png`,
+        so identical data is never re-rendered and concurrent runs never
+        overwrite each other's files. With `enabled=False` nothing is rendered.
+        """
+        self.output_dir = output_dir
+        self.chart_dir = os.path.join(output_dir, 'charts')
+        self.enabled = charts_enabled_by_default() if enabled is None else enabled
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def chart_path(self, name, data):
+        """Content-addressed path the chart for this data is (or will be) stored at."""
+        return os.path.join(self.chart_dir, f"{name}-{data_fingerprint(name, data)[:16]}.png")
+
+    def render(self, name, data):
+        """Render a chart now (or reuse the cached file) and return its path."""
+        if not self.enabled or data is None:
+            return None
+        path = self.chart_path(name, data)
+        if os.path.exists(path):
+            return path
+
+        draw, figsize = CHARTS[name]
+        figure = Figure(figsize=figsize)
+        FigureCanvasAgg(figure)
+        try:
+            draw(figure.add_subplot(), data)
+            figure.tight_layout()
+            os.makedirs(self.chart_dir, exist_ok=True)
+            # Write to a private temp file and rename, so readers never see a partial PNG
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            figure.savefig(tmp_path, format='png')
+            os.replace(tmp_path, path)
+        finally:
+            figure.clear()
+        return path
+
+    def submit(self, name, data):
+        """Queue a chart on the background render pool; returns a Future for its path."""
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='chart-render')
+        return self.executor.submit(self.render, name, data)
+
+    def render_all(self, chart_data, background=True):
+        """Render every chart in `chart_data` and return {name: path}.
+
+        Paths are content-addressed, so in background mode they are returned
+        straight away while the files are produced by the render pool.
+        """
+        if not self.enabled:
+            return {}
+        paths = {}
+        for name, data in chart_data.items():
+            if data is None:
+                continue
+            if background:
+                self.submit(name, data)
+                paths[name] = self.chart_path(name, data)
+            else:
+                paths[name] = self.render(name, data)
+        return paths
+
+    def shutdown(self, wait=True):
+        """Stop the background render pool."""
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
@@ -0,0 +1,127 @@
+import time
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from database import EcommerceDatabase
+from sketches import TDigest, merge_sketches
+
+# Quantiles reported per checkout step
+LATENCY_QUANTILES = [0.5, 0.9, 0.99]
+
+# Every checkout event with the time since the session's previous checkout event (LAG) and whether
+# another one follows (LEAD), in one ordered pass over the (session_id, timestamp) index
+STEP_QUERY = """
+WITH ordered AS (
+    SELECT session_id, step, timestamp,
+           LAG(timestamp) OVER session_events AS previous_time,
+           LEAD(step) OVER session_events AS next_step
+    FROM checkout_events
+    WHERE session_id IS NOT NULL AND step IS NOT NULL AND timestamp IS NOT NULL
+    WINDOW session_events AS (PARTITION BY session_id ORDER BY timestamp, rowid)
+)
+SELECT o.step, s.device_type,
+       (julianday(o.timestamp) - julianday(o.previous_time)) * 86400.0 AS dwell_seconds,
+       o.next_step IS NULL AS last_step,
+       COALESCE(s.conversion_status = 'completed', 0) AS converted
+FROM ordered o
+LEFT JOIN sessions s ON s.session_id = o.session_id
+"""
+
+
+class CheckoutLatency:
+    """Per-step checkout dwell times and abandonment hazard.
+
+    A step's dwell time is the time from the session's previous checkout
+    event to this one, so the first step of a checkout has none. A session
+    abandons at a step when that step is its last checkout event and the
+    session did not convert; the step's hazard is the share of sessions
+    reaching it that abandon there.
+
+    Events are read in one ordered query using LAG and LEAD over
+    `(session_id, timestamp)`, streamed in chunks into one t-digest per step
+    and device type, so quantiles need neither self-joins nor the events in
+    memory. Per-step quantiles over all devices merge those digests.
+    """
+
+    def __init__(self, db=None, chunksize=200000, compression=100):
+        """Initialize an empty analysis over an `EcommerceDatabase`."""
+        self.db = db if db else EcommerceDatabase()
+        self.chunksize = chunksize
+        self.compression = compression
+        self.digests = {}
+        self.counts = None
+        self.events = 0
+        self.fit_seconds = None
+
+    def fit(self):
+        """Stream every checkout event into the per-step digests and counts; returns the analysis."""
+        started = time.perf_counter()
+        self.digests = {}
+        self.events = 0
+        counts = []
+        conn = self.db.connect()
+        try:
+            for chunk in pd.read_sql_query(STEP_QUERY, conn, chunksize=self.chunksize):
+                self.events += len(chunk)
+                chunk['device_type'] = chunk['device_type'].fillna('Unknown')
+                chunk['abandoned'] = (chunk['last_step'] == 1) & (chunk['converted'] == 0)
+                groups = chunk.groupby(['step', 'device_type'], sort=False)
+                counts.append(groups.agg(reached=('abandoned', 'size'), abandoned=('abandoned', 'sum')))
+                for key, dwell in groups['dwell_seconds']:
+                    self.digests.setdefault(key, TDigest(self.compression)).add(dwell.to_numpy(dtype=float))
+        finally:
+            self.db.close()
+
+        if counts:
+            self.counts = pd.concat(counts).groupby(level=['step', 'device_type']).sum()
+        else:
+            self.counts = pd.DataFrame(columns=['reached', 'abandoned'],
+                                       index=pd.MultiIndex.from_tuples([], names=['step', 'device_type']))
+        self.fit_seconds = time.perf_counter() - started
+        return self
+
+    def step_latency(self, by_device=False):
+        """One row per checkout step (and device type), in funnel order: reach, hazard and dwell quantiles."""
+        counts = self.counts.reset_index()
+        if not by_device:
+            counts = counts.groupby('step', as_index=False, sort=False)[['reached', 'abandoned']].sum()
+        rows = []
+        for _, row in counts.iterrows():
+            if by_device:
+                digest = self.digests[(row['step'], row['device_type'])]
+            else:
+                digest = merge_sketches([digest for (step, _), digest in self.digests.items() if step == row['step']])
+            quantiles = digest.quantile(LATENCY_QUANTILES)
+            entry = {'step': row['step']}
+            if by_device:
+                entry['device_type'] = row['device_type']
+            entry.update({
+                'reached': int(row['reached']),
+                'abandoned': int(row['abandoned']),
+                'hazard': row['abandoned'] / row['reached'] if row['reached'] else np.nan,
+                'timed': int(digest.count),
+                'mean_seconds': digest.mean,
+            })
+            for q, value in zip(LATENCY_QUANTILES, quantiles):
+                entry[f'p{int(q * 100)}_seconds'] = value
+            rows.append(entry)
+        frame = pd.DataFrame(rows)
+        if frame.empty:
+            return frame
+        # More sessions reach earlier steps
+        frame['order'] = frame.groupby('step')['reached'].transform('sum')
+        sort = ['order', 'reached'] if by_device else ['order']
+        return frame.sort_values(sort, ascending=False, kind='stable').drop(columns='order').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Checkout step dwell-time quantiles and abandonment hazard")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--by-device', action='store_true', help="Break each step down by device type")
+    args = parser.parse_args()
+
+    latency = CheckoutLatency(EcommerceDatabase(args.db)).fit()
+    print(f"Read {latency.events:,} checkout events in {latency.fit_seconds:.2f}s")
+    print(tabulate(latency.step_latency(by_device=args.by_device), headers='keys', tablefmt='pipe',
+                   showindex=False, floatfmt='.3f'))
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+# Acquisition cohort granularities
+COHORT_PERIODS = ('week', 'month')
+
+# Day or hour number of a missing or unparseable timestamp
+NO_TIME = np.iinfo(np.int32).min
+
+# Day 0 (1970-01-01) is a Thursday; shifting by 3 makes weeks start on Monday
+WEEK_OFFSET = 3
+
+
+def to_hours(values):
+    """Whole hours since 1970-01-01 (int32, NO_TIME for missing values) for ISO timestamp strings."""
+    timestamps = pd.to_datetime(pd.Series(values, dtype=object), format='ISO8601', errors='coerce')
+    hours = timestamps.to_numpy(dtype='datetime64[ns]').astype('datetime64[h]')
+    return np.where(np.isnat(hours), NO_TIME, hours.astype(np.int64)).astype(np.int32)
+
+
+def hours_to_days(hours):
+    """Day numbers for hour numbers, keeping NO_TIME."""
+    hours = np.asarray(hours, dtype=np.int32)
+    return np.where(hours == NO_TIME, NO_TIME, hours // 24).astype(np.int32)
+
+
+def to_days(values):
+    """Whole days since 1970-01-01 (int32, NO_TIME for missing values) for ISO timestamp strings."""
+    return hours_to_days(to_hours(values))
+
+
+def period_numbers(days, period='week'):
+    """Week or month number of each day number (weeks start on Monday)."""
+    days = np.asarray(days, dtype=np.int64)
+    if period == 'week':
+        return (days + WEEK_OFFSET) // 7
+    if period == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f"period must be one of {COHORT_PERIODS}, got {period!r}")
+
+
+def period_labels(numbers, period='week'):
+    """Labels for period numbers: the Monday of each week, or the year and month."""
+    numbers = np.asarray(numbers, dtype=np.int64)
+    if period == 'week':
+        return (numbers * 7 - WEEK_OFFSET).astype('datetime64[D]').astype(str)
+    return numbers.astype('datetime64[M]').astype(str)
+
+
+def cohort_activity(first_visit_days, session_users, session_days, completed, period='week'):
+    """Per acquisition cohort and period since acquisition: cohort size, active, converting and repeat users.
+
+    `first_visit_days` holds a day number per user; `session_users` the
+    user position (-1 for none), `session_days` the start day and
+    `completed` the conversion flag of each session. A user is acquired on
+    their first visit, or on their first session when that came earlier.
+    A repeat buyer in a period converted in a session there after already
+    converting in an earlier one. Periods after the last session day (or
+    the latest acquisition, if later) are left out, so recent cohorts have
+    fewer rows rather than zeros.
+    """
+    session_users = np.asarray(session_users, dtype=np.int64)
+    session_days = np.asarray(session_days, dtype=np.int64)
+    completed = np.asarray(completed, dtype=bool)
+    known = (session_users >= 0) & (session_days != NO_TIME)
+    session_users, session_days, completed = session_users[known], session_days[known], completed[known]
+
+    acquired = np.asarray(first_visit_days, dtype=np.int64).copy()
+    acquired[acquired == NO_TIME] = np.iinfo(np.int64).max
+    np.minimum.at(acquired, session_users, session_days)
+    has_cohort = acquired != np.iinfo(np.int64).max
+    columns = ['cohort', 'period_number', 'cohort_users', 'active_users', 'converting_users', 'repeat_buyers']
+    if not has_cohort.any() or not len(session_days):
+        return pd.DataFrame(columns=columns)
+
+    user_cohorts = np.full(len(acquired), -1, dtype=np.int64)
+    user_cohorts[has_cohort] = period_numbers(acquired[has_cohort], period)
+    cohorts, cohort_users = np.unique(user_cohorts[has_cohort], return_counts=True)
+    # Users acquired after the latest session (no sessions yet) still get their cohort's first period
+    last_period = max(int(period_numbers(session_days.max(), period)), int(cohorts.max()))
+
+    # Every observed (cohort, period number) cell, zero until counted; a cohort's cells are contiguous
+    spans = last_period - cohorts + 1
+    starts = np.cumsum(spans) - spans
+    cells = pd.DataFrame({
+        'cohort_number': np.repeat(cohorts, spans),
+        'period_number': np.arange(spans.sum()) - np.repeat(starts, spans),
+        'cohort_users': np.repeat(cohort_users, spans),
+    })
+    width = int(spans.max())
+    user_starts = np.zeros(len(acquired), dtype=np.int64)
+    user_starts[has_cohort] = starts[np.searchsorted(cohorts, user_cohorts[has_cohort])]
+    numbers = period_numbers(session_days, period) - user_cohorts[session_users]
+
+    def distinct_users(mask):
+        """Distinct users per cell among the masked sessions."""
+        pairs = np.unique(session_users[mask] * width + numbers[mask])
+        users = pairs // width
+        return np.bincount(user_starts[users] + pairs % width, minlength=len(cells))
+
+    # Purchases in (user, day) order; all but each user's first are repeats
+    order = np.lexsort((session_days[completed], session_users[completed]))
+    buyers = session_users[completed][order]
+    repeat = np.zeros(len(completed), dtype=bool)
+    repeat_rows = np.flatnonzero(completed)[order]
+    repeat[repeat_rows[1:][buyers[1:] == buyers[:-1]]] = True
+
+    cells['active_users'] = distinct_users(np.ones(len(session_users), dtype=bool))
+    cells['converting_users'] = distinct_users(completed)
+    cells['repeat_buyers'] = distinct_users(repeat)
+    cells['cohort'] = period_labels(cells['cohort_number'], period)
+    return cells[columns]
+
+
+def frame_cohort_activity(users, sessions, period='week'):
+    """`cohort_activity` for raw users (user_id, first_visit_date) and sessions (user_id, start_time, conversion_status)."""
+    return cohort_activity(
+        to_days(users['first_visit_date']),
+        pd.Index(users['user_id']).get_indexer(sessions['user_id']),
+        to_days(sessions['start_time']),
+        (sessions['conversion_status'] == 'completed').to_numpy(),
+        period
+    )
+
+
+def source_cohort_activity(source, db, period='week'):
+    """Cohort activity from an analysis source; the database itself only hands over its raw frames."""
+    if source is db:
+        return frame_cohort_activity(*db.get_cohort_activity(), period)
+    return source.get_cohort_activity(period)
+
+
+def cohort_matrices(activity, max_periods=12):
+    """Retention, conversion and repeat-purchase rate matrices (cohorts x periods since acquisition)."""
+    activity = activity[activity['period_number'] < max_periods]
+    sizes = activity.groupby('cohort')['cohort_users'].first()
+    matrices = {'cohort_users': sizes}
+    for name, column in [('retention', 'active_users'), ('conversion', 'converting_users'),
+                         ('repeat_purchase', 'repeat_buyers')]:
+        rates = activity.assign(rate=activity[column] / activity['cohort_users'])
+        matrices[name] = rates.pivot(index='cohort', columns='period_number', values='rate')
+    return matrices
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Print cohort retention and repeat-purchase matrices")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--period', choices=COHORT_PERIODS, default='month')
+    parser.add_argument('--periods', type=int, default=12, help="Periods since acquisition to show")
+    args = parser.parse_args()
+
+    engine = SharedFrameEngine(EcommerceDatabase(args.db))
+    engine.prepare(['cohort_retention'])
+    matrices = cohort_matrices(engine.get_cohort_activity(args.period), args.periods)
+    for name in ['retention', 'conversion', 'repeat_purchase']:
+        matrix = matrices[name]
+        rows = [[cohort, int(matrices['cohort_users'][cohort])] +
+                [f"{rate*100:.1f}%" if pd.notna(rate) else "" for rate in rates]
+                for cohort, rates in matrix.iterrows()]
+        print(f"\n{name.replace('_', ' ').capitalize()} by {args.period} since acquisition")
+        print(tabulate(rows, headers=['Cohort', 'Users'] + list(matrix.columns), tablefmt='pipe'))
@@ -1,27 +1,133 @@
 import pandas as pd
 import numpy as np
-# Set non-interactive backend for matplotlib to avoid thread issues
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import seaborn as sns
 import plotly.express as px
-from sklearn.cluster import KMeans
 from database import EcommerceDatabase
+from analysis_engine import SharedFrameEngine
+from sampling import SampledEngine
+from page_transitions import EXIT_STATE, PageTransitionModel
+from path_mining import PATH_SEPARATOR, JourneyPathMiner
+from market_basket import ProductAffinity
+from search_index import ProductSearchIndex
+from cohorts import cohort_matrices, source_cohort_activity
+from funnel_monitor import FunnelMonitor, bucket_label
+from significance import compare_cells
+from olap_cube import OlapCube, cube_path
+from checkout_latency import CheckoutLatency
+from user_segmentation import SEGMENT_FEATURES, UserSegmentModel, fit_segment_model, segment_model_path
+from chart_renderer import ChartRenderer
 from tabulate import tabulate
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import time
 import os
 
+# The analyses run by run_comprehensive_analysis, in report order
+ANALYSES = [
+    ('conversion_funnel', 'analyze_conversion_funnel'),
+    ('cart_abandonment', 'analyze_cart_abandonment'),
+    ('search_behavior', 'analyze_search_behavior'),
+    ('page_effectiveness', 'analyze_page_effectiveness'),
+    ('product_performance', 'analyze_product_performance'),
+    ('user_segments', 'analyze_user_segments'),
+    ('page_transitions', 'analyze_page_transitions'),
+    ('journey_paths', 'analyze_journey_paths'),
+    ('cohort_retention', 'analyze_cohort_retention'),
+    ('funnel_trends', 'analyze_funnel_trends'),
+    ('product_affinity', 'analyze_product_affinity'),
+    ('conversion_cube', 'analyze_conversion_cube'),
+    ('checkout_latency', 'analyze_checkout_latency'),
+    ('revenue', 'analyze_revenue'),
+]
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Shared process pool for CPU-heavy work, created on first use.
+
+    Uses the forkserver start method where available: forking a process
+    that already has analysis threads running can deadlock.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _process_pool = ProcessPoolExecutor(max_workers=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                                                mp_context=context)
+        return _process_pool
+
+
+def format_interval(row, column):
+    """A rate's confidence interval as 'low–high%', or None when the rate was not sampled."""
+    low, high = row.get(f'{column}_ci_low'), row.get(f'{column}_ci_high')
+    if low is None or high is None or pd.isna(low) or pd.isna(high):
+        return None
+    return f"{low*100:.1f}–{high*100:.1f}%"
+
+
+def add_interval(entry, key, row, column):
+    """Add `<key>_ci` to an insight entry when `row` carries an interval for `column`."""
+    interval = format_interval(row, column)
+    if interval:
+        entry[f'{key}_ci'] = interval
+    return entry
+
+
+def reset_process_pool():
+    """Discard the shared process pool (e.g. after a worker crashed) so the next use recreates it."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
 class EcommerceDataAnalyzer:
-    def __init__(self, db=None):
-        """Initialize the analyzer with a database connection."""
+    def __init__(self, db=None, cpu_executor=None, chart_renderer=None, render_charts=None, shared_scan=True,
+                 incremental=False, state_path=None, segment_model=None, refit_segments=False, sample_rate=None):
+        """Initialize the analyzer with a database connection.
+
+        `cpu_executor` is an optional executor (such as a process pool) used
+        for CPU-heavy steps like clustering; by default they run inline.
+        Analyses only compute data; charts are drawn afterwards by
+        `chart_renderer`. Pass `render_charts=False` to skip them entirely.
+        With `shared_scan` (the default) analysis inputs come from a
+        `SharedFrameEngine` that scans each table once per run; otherwise
+        each analysis sends its own query to the database. With
+        `incremental=True` the engine's aggregates persist to `state_path`
+        and each run only folds in rows added since the previous one.
+        User segments come from a saved `UserSegmentModel` (by default
+        `<db>.segment-model`), fitted on first use; pass `refit_segments=True`
+        to fit a new one. With `sample_rate` (e.g. 0.05) the analyses run on a
+        stratified sample of sessions through `SampledEngine` and rates are
+        reported with 95% confidence intervals; the default is full precision.
+        """
         self.db = db if db else EcommerceDatabase()
+        if shared_scan or incremental:
+            self.engine = SharedFrameEngine(self.db, incremental=incremental, state_path=state_path)
+        else:
+            self.engine = None
+        if sample_rate:
+            self.sampler = SampledEngine(self.db, sample_rate=sample_rate, full_source=self.engine)
+        else:
+            self.sampler = None
+        self.source = self.sampler or self.engine or self.db
+        self.segment_model_path = segment_model if segment_model else segment_model_path(self.db.db_path)
+        self.refit_segments = refit_segments
+        self.segment_model = None
+        self.cpu_executor = cpu_executor
+        self.chart_renderer = chart_renderer if chart_renderer else ChartRenderer(enabled=render_charts)
         
-        # Create output directory for visualizations
-        os.makedirs('output', exist_ok=True)
+        # Chart inputs captured by the latest run of each analysis
+        self.chart_data = {}
     
     def analyze_conversion_funnel(self):
         """Analyze the conversion funnel to identify drop-off points."""
-        funnel_data = self.db.get_funnel_analysis()
+        funnel_data = self.source.get_funnel_analysis()
         
         insights = {
             'funnel_stages': [],
@@ -43,23 +149,23 @@ class EcommerceDataAnalyzer:
             count = stage.get('current_count', stage.get('count', 0))
             counts.append(count)
         
-        # Create visualization
-        plt.figure(figsize=(12, 6))
-        plt.bar(stages, counts)
-        plt.title('Conversion Funnel')
-        plt.xlabel('Funnel Stage')
-        plt.ylabel('Number of Users')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('output/conversion_funnel.png')
+        # Chart input
+        self.chart_data['conversion_funnel'] = {'stages': stages, 'counts': counts}
+        
+        # Checkout duration quantiles, when the source keeps sketches
+        if hasattr(self.source, 'get_sketches'):
+            checkout_duration = self.source.get_sketches()['checkout_duration']
+            if checkout_duration.count:
+                median, p90 = checkout_duration.quantile([0.5, 0.9])
+                insights['checkout_duration'] = {'median': f"{median:.0f} seconds", 'p90': f"{p90:.0f} seconds"}
         
         # Add insights
         for stage in funnel_data:
-            insights['funnel_stages'].append({
+            insights['funnel_stages'].append(add_interval({
                 'stage': f"{stage.get('current_step', stage.get('stage', 'Unknown'))} → {stage.get('next_step', 'Next Stage')}",
                 'drop_off_rate': f"{stage.get('drop_off_rate', 0)*100:.1f}%" if not isinstance(stage.get('drop_off_rate'), str) else stage.get('drop_off_rate'),
                 'users_lost': stage.get('drop_off', 0)
-            })
+            }, 'drop_off_rate', stage, 'drop_off_rate'))
             
             # Identify critical drop-offs (more than 50%)
             # Safely check drop_off_rate with a default of 0
@@ -72,11 +178,11 @@ class EcommerceDataAnalyzer:
                     drop_rate = 0
                     
             if drop_rate > 0.5:
-                insights['critical_dropoffs'].append({
+                insights['critical_dropoffs'].append(add_interval({
                     'stage': f"{stage.get('current_step', stage.get('stage', 'Unknown'))} → {stage.get('next_step', 'Next Stage')}",
                     'drop_off_rate': f"{drop_rate*100:.1f}%" if not isinstance(stage.get('drop_off_rate'), str) else stage.get('drop_off_rate'),
                     'users_lost': stage.get('drop_off', 0)
-                })
+                }, 'drop_off_rate', stage, 'drop_off_rate'))
                 
                 # Generate specific recommendations based on the stage
                 current_step = stage.get('current_step', stage.get('stage', ''))
@@ -102,7 +208,7 @@ class EcommerceDataAnalyzer:
     
     def analyze_cart_abandonment(self):
         """Analyze cart abandonment patterns."""
-        cart_data = self.db.get_cart_abandonment_data()
+        cart_data = self.source.get_cart_abandonment_data()
         
         insights = {
             'abandonment_rate': 0,
@@ -119,6 +225,10 @@ class EcommerceDataAnalyzer:
         if total > 0:
             abandonment_rate = abandoned / total
             insights['abandonment_rate'] = f"{abandonment_rate*100:.1f}%"
+            # Sampled runs report each status's share of cart sessions with an interval
+            abandoned_rows = cart_data[cart_data['conversion_status'] == 'abandoned']
+            if not abandoned_rows.empty:
+                add_interval(insights, 'abandonment_rate', abandoned_rows.iloc[0], 'share')
         
         # Average cart values
         for status, group in cart_data.groupby('conversion_status'):
@@ -148,24 +258,22 @@ class EcommerceDataAnalyzer:
                 'suggestion': "Add trust signals such as secure payment icons, money-back guarantees, and customer reviews on the checkout page"
             })
         
-        # Create visualization
+        # Chart input
         if not cart_data.empty and 'avg_cart_value' in cart_data.columns and 'conversion_status' in cart_data.columns:
-            plt.figure(figsize=(10, 6))
-            sns.barplot(x='conversion_status', y='avg_cart_value', data=cart_data)
-            plt.title('Average Cart Value by Conversion Status')
-            plt.xlabel('Conversion Status')
-            plt.ylabel('Average Cart Value ($)')
-            plt.savefig('output/cart_abandonment.png')
+            self.chart_data['cart_abandonment'] = cart_data[['conversion_status', 'avg_cart_value']]
         
         return insights
     
     def analyze_search_behavior(self):
         """Analyze search behavior patterns."""
-        search_data = self.db.get_search_behavior()
+        search_data = self.source.get_search_behavior()
         
         insights = {
             'top_searches': [],
             'zero_results': [],
+            'zero_result_matches': [],
+            'zero_result_groups': [],
+            'synonym_candidates': [],
             'search_conversion_rate': 0,
             'recommendations': []
         }
@@ -189,18 +297,66 @@ class EcommerceDataAnalyzer:
                     'count': row['search_count']
                 })
         
+        # What the catalog has for every zero-result query, read from the database itself
+        diagnosis = ProductSearchIndex(self.db).fit().diagnose()
+        failing = diagnosis['queries']
+        matched_searches = int(failing.loc[failing['matched'], 'searches'].sum())
+        if diagnosis['zero_result_searches']:
+            insights['zero_result_searches'] = diagnosis['zero_result_searches']
+            insights['zero_results_with_catalog_match'] = f"{matched_searches / diagnosis['zero_result_searches'] * 100:.1f}%"
+        for _, row in failing.head(10).iterrows():
+            insights['zero_result_matches'].append({
+                'query': row['query'],
+                'searches': int(row['searches']),
+                'closest_product': row['closest_product'] if row['matched'] else None,
+                'match_score': f"{row['score']:.2f}" if row['matched'] else None
+            })
+        for _, row in diagnosis['groups'][diagnosis['groups']['queries'] > 1].head(5).iterrows():
+            insights['zero_result_groups'].append({
+                'group': row['group'],
+                'queries': int(row['queries']),
+                'searches': int(row['searches'])
+            })
+        synonyms = diagnosis['synonyms'][diagnosis['synonyms']['fixable_searches'] > 0]
+        for _, row in synonyms.head(5).iterrows():
+            insights['synonym_candidates'].append({
+                'term': row['term'],
+                'fixable_searches': int(row['fixable_searches']),
+                'closest_term': row['closest_term']
+            })
+        
         # Search conversion rate
         if not search_data['search_conversion'].empty:
             search_conversion_rate = search_data['search_conversion']['search_conversion_rate'].iloc[0]
             insights['search_conversion_rate'] = f"{search_conversion_rate*100:.1f}%"
+            add_interval(insights, 'search_conversion_rate', search_data['search_conversion'].iloc[0],
+                         'search_conversion_rate')
         
         # Recommendations based on search behavior
-        if insights['zero_results']:
+        if matched_searches:
+            example = failing[failing['matched']].iloc[0]
+            insights['recommendations'].append({
+                'area': "Zero-result searches",
+                'suggestion': f"{insights['zero_results_with_catalog_match']} of zero-result searches were for queries the "
+                              f"catalog matches (e.g. '{example['query']}' -> {example['closest_product']}); "
+                              f"check search indexing and query parsing before adding products"
+            })
+        elif insights['zero_results']:
             insights['recommendations'].append({
                 'area': "Zero-result searches",
                 'suggestion': "Add synonyms, correct misspellings, and suggest related products for common zero-result searches"
             })
         
+        if insights['synonym_candidates']:
+            top = insights['synonym_candidates'][0]
+            target = f" (perhaps '{top['closest_term']}')" if top['closest_term'] else ""
+            insights['recommendations'].append({
+                'area': "Search synonyms",
+                'suggestion': f"Mapping '{top['term']}' to a catalog term{target} would fix {top['fixable_searches']} "
+                              f"zero-result searches; the top {len(insights['synonym_candidates'])} missing terms would fix "
+                              f"{sum(c['fixable_searches'] for c in insights['synonym_candidates'])}"
+            })
+        
         insights['recommendations'].append({
             'area': "Search functionality",
             'suggestion': "Implement autocomplete, search suggestions, and filters to improve the search experience"
@@ -211,23 +367,15 @@ class EcommerceDataAnalyzer:
             'suggestion': "Optimize search results page with better sorting, filtering, and product information"
         })
         
-        # Create visualization for top searches
+        # Chart input for top searches
         if not search_data['top_searches'].empty:
-            top_5_searches = search_data['top_searches'].head(5)
-            plt.figure(figsize=(10, 6))
-            sns.barplot(x='query', y='search_count', data=top_5_searches)
-            plt.title('Top 5 Search Queries')
-            plt.xlabel('Query')
-            plt.ylabel('Search Count')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig('output/top_searches.png')
+            self.chart_data['top_searches'] = search_data['top_searches'].head(5)[['query', 'search_count']]
         
         return insights
     
     def analyze_page_effectiveness(self):
         """Analyze page effectiveness metrics."""
-        page_data = self.db.get_page_effectiveness()
+        page_data = self.source.get_page_effectiveness()
         
         insights = {
             'page_metrics': [],
@@ -235,24 +383,33 @@ class EcommerceDataAnalyzer:
             'recommendations': []
         }
         
+        # Time spent quantiles per page type, when the source keeps sketches
+        digests = self.source.get_sketches()['time_spent'] if hasattr(self.source, 'get_sketches') else {}
+        
         # Page metrics
         if not page_data.empty:
             for _, row in page_data.iterrows():
-                insights['page_metrics'].append({
+                metric = add_interval({
                     'page_type': row['page_type'],
                     'views': row['view_count'],
                     'avg_time_spent': f"{row['avg_time_spent']:.1f} seconds",
                     'exit_rate': f"{row['exit_rate']*100:.1f}%"
-                })
+                }, 'exit_rate', row, 'exit_rate')
+                digest = digests.get(row['page_type'])
+                if digest is not None and digest.count:
+                    median, p90 = digest.quantile([0.5, 0.9])
+                    metric['median_time_spent'] = f"{median:.1f} seconds"
+                    metric['p90_time_spent'] = f"{p90:.1f} seconds"
+                insights['page_metrics'].append(metric)
         
         # High exit pages (exit rate > 40%)
         high_exit_pages = page_data[page_data['exit_rate'] > 0.4]
         for _, row in high_exit_pages.iterrows():
-            insights['high_exit_pages'].append({
+            insights['high_exit_pages'].append(add_interval({
                 'page_type': row['page_type'],
                 'exit_rate': f"{row['exit_rate']*100:.1f}%",
                 'views': row['view_count']
-            })
+            }, 'exit_rate', row, 'exit_rate'))
         
         # Recommendations based on page effectiveness
         for page in insights['high_exit_pages']:
@@ -278,22 +435,15 @@ class EcommerceDataAnalyzer:
                     'suggestion': "Improve relevance ranking, add filtering options, and enhance product cards"
                 })
         
-        # Create visualization
+        # Chart input
         if not page_data.empty:
-            plt.figure(figsize=(12, 6))
-            sns.barplot(x='page_type', y='exit_rate', data=page_data)
-            plt.title('Exit Rate by Page Type')
-            plt.xlabel('Page Type')
-            plt.ylabel('Exit Rate')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig('output/exit_rates.png')
+            self.chart_data['exit_rates'] = page_data[['page_type', 'exit_rate']]
         
         return insights
     
     def analyze_product_performance(self):
         """Analyze product performance metrics."""
-        product_data = self.db.get_product_performance()
+        product_data = self.source.get_product_performance()
         
         insights = {
             'top_viewed_products': [],
@@ -306,23 +456,23 @@ class EcommerceDataAnalyzer:
             # Top viewed products
             top_viewed = product_data.sort_values('view_count', ascending=False).head(5)
             for _, row in top_viewed.iterrows():
-                insights['top_viewed_products'].append({
+                insights['top_viewed_products'].append(add_interval({
                     'product': row['name'],
                     'category': row['category'],
                     'views': row['view_count'],
                     'view_to_cart_rate': f"{row['view_to_cart_rate']*100:.1f}%" if pd.notna(row['view_to_cart_rate']) else "0.0%"
-                })
+                }, 'view_to_cart_rate', row, 'view_to_cart_rate'))
             
             # Top converting products (view to cart)
             top_converting = product_data.sort_values('view_to_cart_rate', ascending=False).head(5)
             for _, row in top_converting.iterrows():
                 if pd.notna(row['view_to_cart_rate']) and row['view_count'] > 10:  # Only include products with sufficient views
-                    insights['top_converting_products'].append({
+                    insights['top_converting_products'].append(add_interval({
                         'product': row['name'],
                         'category': row['category'],
                         'view_to_cart_rate': f"{row['view_to_cart_rate']*100:.1f}%" if pd.notna(row['view_to_cart_rate']) else "0.0%",
                         'views': row['view_count']
-                    })
+                    }, 'view_to_cart_rate', row, 'view_to_cart_rate'))
             
             # Underperforming products (high views, low conversion)
             underperforming = product_data[
@@ -331,12 +481,12 @@ class EcommerceDataAnalyzer:
             ].head(5)
             
             for _, row in underperforming.iterrows():
-                insights['underperforming_products'].append({
+                insights['underperforming_products'].append(add_interval({
                     'product': row['name'],
                     'category': row['category'],
                     'views': row['view_count'],
                     'view_to_cart_rate': f"{row['view_to_cart_rate']*100:.1f}%" if pd.notna(row['view_to_cart_rate']) else "0.0%"
-                })
+                }, 'view_to_cart_rate', row, 'view_to_cart_rate'))
             
             # Recommendations based on product performance
             if insights['underperforming_products']:
@@ -350,74 +500,37 @@ class EcommerceDataAnalyzer:
                 'suggestion': "Apply successful elements from high-converting product pages to other products"
             })
             
-            # Create visualization
+            # Chart input
             top_products = product_data.sort_values('view_count', ascending=False).head(10)
-            plt.figure(figsize=(14, 7))
-            bars = plt.bar(top_products['name'], top_products['view_count'])
-            plt.title('Top 10 Viewed Products')
-            plt.xlabel('Product')
-            plt.ylabel('View Count')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            
-            # Add conversion rate as text on top of bars
-            for i, bar in enumerate(bars):
-                height = bar.get_height()
-                view_to_cart = top_products.iloc[i]['view_to_cart_rate']
-                if pd.notna(view_to_cart):
-                    plt.text(bar.get_x() + bar.get_width()/2., height + 5,
-                            f'{view_to_cart*100:.1f}%',
-                            ha='center', va='bottom', rotation=0)
-            
-            plt.savefig('output/product_performance.png')
+            self.chart_data['product_performance'] = top_products[['name', 'view_count', 'view_to_cart_rate']]
         
         return insights
     
     def analyze_user_segments(self):
         """Analyze user segments and behavior patterns."""
         # Get user journey data for clustering
-        user_data = self.db.execute_query("""
-        SELECT 
-            u.user_id, 
-            u.device_type, 
-            u.browser, 
-            u.country, 
-            u.referrer,
-            COUNT(DISTINCT s.session_id) as session_count,
-            AVG(pv.time_spent_seconds) as avg_time_spent,
-            COUNT(DISTINCT pv.view_id) as page_view_count,
-            COUNT(DISTINCT c.click_id) as click_count,
-            COUNT(DISTINCT ce.event_id) as cart_event_count,
-            COUNT(DISTINCT se.search_id) as search_count,
-            SUM(CASE WHEN s.conversion_status = 'completed' THEN 1 ELSE 0 END) as completed_purchases,
-            COUNT(DISTINCT s.session_id) as total_sessions,
-            CAST(SUM(CASE WHEN s.conversion_status = 'completed' THEN 1 ELSE 0 END) AS FLOAT) / 
-                COUNT(DISTINCT s.session_id) as conversion_rate
-        FROM 
-            users u
-        LEFT JOIN 
-            sessions s ON u.user_id = s.user_id
-        LEFT JOIN 
-            page_views pv ON s.session_id = pv.session_id
-        LEFT JOIN 
-            clicks c ON s.session_id = c.session_id
-        LEFT JOIN 
-            cart_events ce ON s.session_id = ce.session_id
-        LEFT JOIN 
-            search_events se ON s.session_id = se.session_id
-        GROUP BY 
-            u.user_id
-        HAVING
-            session_count > 0
-        """)
+        user_data = self.source.get_user_segment_features()
         
         insights = {
             'user_segments': [],
             'device_type_analysis': [],
             'referrer_analysis': [],
+            'significant_segments': [],
             'recommendations': []
         }
         
+        # Session conversion of every device x browser x referrer x country cell against the rest, FDR-controlled
+        cells = compare_cells(user_data)
+        significant = cells[cells['significant']]
+        
+        def cell_test(dimension, value):
+            row = cells[(cells['dimensions'] == dimension) & (cells[dimension] == value)]
+            if row.empty or pd.isna(row['q_value'].iloc[0]):
+                return {'vs_rest': "n/a", 'q_value': "n/a", 'significant': False}
+            row = row.iloc[0]
+            return {'vs_rest': f"{row['lift']*100:+.1f} pts", 'q_value': f"{row['q_value']:.3f}",
+                    'significant': bool(row['significant'])}
+        
         # Device type analysis
         device_analysis = user_data.groupby('device_type').agg({
             'user_id': 'count',
@@ -430,7 +543,8 @@ class EcommerceDataAnalyzer:
             insights['device_type_analysis'].append({
                 'device_type': row['device_type'],
                 'user_count': row['user_count'],
-                'avg_conversion_rate': f"{row['conversion_rate']*100:.1f}%" if pd.notna(row['conversion_rate']) else "0.0%"
+                'avg_conversion_rate': f"{row['conversion_rate']*100:.1f}%" if pd.notna(row['conversion_rate']) else "0.0%",
+                **cell_test('device_type', row['device_type'])
             })
         
         # Referrer analysis
@@ -445,29 +559,24 @@ class EcommerceDataAnalyzer:
             insights['referrer_analysis'].append({
                 'referrer': row['referrer'],
                 'user_count': row['user_count'],
-                'avg_conversion_rate': f"{row['conversion_rate']*100:.1f}%" if pd.notna(row['conversion_rate']) else "0.0%"
+                'avg_conversion_rate': f"{row['conversion_rate']*100:.1f}%" if pd.notna(row['conversion_rate']) else "0.0%",
+                **cell_test('referrer', row['referrer'])
+            })
+        
+        # Significant cells, strongest evidence first
+        for _, row in significant.sort_values(['q_value', 'trials'], ascending=[True, False]).head(10).iterrows():
+            insights['significant_segments'].append({
+                'segment': row['cell'],
+                'sessions': int(row['trials']),
+                'conversion_rate': f"{row['rate']*100:.1f}%",
+                'rest_conversion_rate': f"{row['other_rate']*100:.1f}%",
+                'q_value': f"{row['q_value']:.4f}"
             })
         
         # Clustering for user segments
         if len(user_data) > 10:  # Only perform clustering with sufficient data
-            # Select features for clustering
-            features = ['session_count', 'avg_time_spent', 'page_view_count', 'click_count', 
-                       'cart_event_count', 'search_count', 'conversion_rate']
-            
-            # Handle missing values
-            X = user_data[features].fillna(0)
-            
-            # Normalize data
-            from sklearn.preprocessing import StandardScaler
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            # Determine optimal number of clusters (simplified)
-            n_clusters = min(3, len(X) // 20 + 1)  # Simple heuristic, at least 20 users per cluster
-            
-            # Apply K-means clustering
-            kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-            user_data['cluster'] = kmeans.fit_predict(X_scaled)
+            # Assign users with the saved segment model, fitting one if needed
+            user_data['cluster'] = self.get_segment_model(user_data).assign(user_data)
             
             # Analyze clusters
             cluster_analysis = user_data.groupby('cluster').agg({
@@ -480,6 +589,7 @@ class EcommerceDataAnalyzer:
                 'conversion_rate': 'mean'
             }).reset_index()
             
+            name_counts = {}
             for _, row in cluster_analysis.iterrows():
                 cluster_id = int(row['cluster'])
                 
@@ -495,8 +605,12 @@ class EcommerceDataAnalyzer:
                 else:
                     segment_name = f"Segment {cluster_id + 1}"
                 
+                # Number repeated names (with automatic k several clusters can share one)
+                name_counts[segment_name] = name_counts.get(segment_name, 0) + 1
+                display_name = segment_name if name_counts[segment_name] == 1 else f"{segment_name} {name_counts[segment_name]}"
+                
                 insights['user_segments'].append({
-                    'segment_name': segment_name,
+                    'segment_name': display_name,
                     'user_count': int(row['user_id']),
                     'avg_sessions': f"{row['session_count']:.1f}",
                     'avg_page_views': f"{row['page_view_count']:.1f}",
@@ -528,71 +642,623 @@ class EcommerceDataAnalyzer:
                         'suggestion': "Implement cart abandonment emails with incentives and simplify the checkout process"
                     })
         
-        # Device-specific recommendations
-        if insights['device_type_analysis']:
-            lowest_device = min(insights['device_type_analysis'], key=lambda x: float(x['avg_conversion_rate'].strip('%')))
+        # Device-specific recommendations, only for a device converting significantly worse than the others
+        underperforming = significant[significant['lift'] < 0]
+        worst_devices = underperforming[underperforming['dimensions'] == 'device_type'].sort_values('lift')
+        if not worst_devices.empty:
+            lowest_device = worst_devices.iloc[0]['device_type']
             
-            if lowest_device['device_type'] == 'mobile':
+            if lowest_device == 'mobile':
                 insights['recommendations'].append({
                     'area': "Mobile optimization",
                     'suggestion': "Improve mobile user experience with faster page loads, simplified navigation, and mobile-friendly checkout"
                 })
-            elif lowest_device['device_type'] == 'tablet':
+            elif lowest_device == 'tablet':
                 insights['recommendations'].append({
                     'area': "Tablet optimization",
                     'suggestion': "Optimize layouts and interaction elements for tablet users"
                 })
         
-        # Referrer-specific recommendations
-        if insights['referrer_analysis']:
-            # Find top referrer by user count
-            top_referrer = max(insights['referrer_analysis'], key=lambda x: x['user_count'])
+        # Referrer-specific recommendations, for the largest traffic source converting significantly worse than the rest
+        worst_referrers = underperforming[underperforming['dimensions'] == 'referrer'].sort_values('trials', ascending=False)
+        if not worst_referrers.empty:
+            top_referrer = worst_referrers.iloc[0]['referrer']
             
-            if top_referrer['referrer'] in ['google', 'bing']:
+            if top_referrer in ['google', 'bing']:
                 insights['recommendations'].append({
                     'area': "Search engine optimization",
                     'suggestion': "Enhance SEO strategy to improve organic search traffic quality and conversion rate"
                 })
-            elif top_referrer['referrer'] in ['facebook', 'instagram', 'twitter']:
+            elif top_referrer in ['facebook', 'instagram', 'twitter']:
                 insights['recommendations'].append({
                     'area': "Social media integration",
                     'suggestion': "Strengthen social proof elements and integrate social sharing to improve conversion from social media traffic"
                 })
-            elif top_referrer['referrer'] == 'email':
+            elif top_referrer == 'email':
                 insights['recommendations'].append({
                     'area': "Email marketing optimization",
                     'suggestion': "Segment email campaigns and personalize landing pages for email traffic"
                 })
         
-        # Create visualization for user segments
+        # The combined segment losing the most conversions, when it converts significantly worse
+        combined = underperforming[underperforming['dimensions'].str.contains(' x ')]
+        if not combined.empty:
+            lost = (combined['other_rate'] - combined['rate']) * combined['trials']
+            worst = combined.loc[lost.idxmax()]
+            insights['recommendations'].append({
+                'area': "Underperforming segment",
+                'suggestion': f"Investigate the experience for {worst['cell']}: {worst['rate']*100:.1f}% session conversion "
+                              f"against {worst['other_rate']*100:.1f}% for everyone else over {int(worst['trials'])} sessions"
+            })
+        
+        # Chart input for user segments
         if 'cluster' in user_data.columns and len(insights['user_segments']) > 0:
-            # Plot conversion rate by segment
+            # Conversion rate by segment
             segment_df = pd.DataFrame(insights['user_segments'])
             segment_df['conversion_rate_num'] = segment_df['conversion_rate'].str.rstrip('%').astype(float)
-            
-            plt.figure(figsize=(10, 6))
-            sns.barplot(x='segment_name', y='conversion_rate_num', data=segment_df)
-            plt.title('Conversion Rate by User Segment')
-            plt.xlabel('Segment')
-            plt.ylabel('Conversion Rate (%)')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig('output/user_segments.png')
+            self.chart_data['user_segments'] = segment_df[['segment_name', 'conversion_rate_num']]
         
         return insights
     
-    def run_comprehensive_analysis(self):
-        """Run all analyses and compile a comprehensive report."""
-        print("Running comprehensive e-commerce journey analysis...")
+    def analyze_page_transitions(self):
+        """Analyze how users move between page types with an absorbing Markov chain."""
+        model = PageTransitionModel(self.db).fit()
+        summary, conversion_probability = model.page_type_summary()
+        
+        insights = {
+            'conversion_probability': f"{conversion_probability*100:.2f}%",
+            'page_types': [],
+            'top_transitions': [],
+            'recommendations': []
+        }
+        
+        for _, row in summary.iterrows():
+            insights['page_types'].append({
+                'page_type': row['page_type'],
+                'visits': int(row['visits']),
+                'conversion_probability': f"{row['conversion_probability']*100:.1f}%",
+                'expected_steps': f"{row['expected_steps']:.1f}",
+                'steps_to_conversion': f"{row['steps_to_conversion']:.1f}" if pd.notna(row['steps_to_conversion']) else "-",
+                'removal_effect': f"{row['removal_effect']*100:.1f}%" if pd.notna(row['removal_effect']) else "-"
+            })
+        
+        for _, row in model.top_transitions(10).iterrows():
+            insights['top_transitions'].append({
+                'transition': f"{row['from_page']} → {row['to_page']}",
+                'count': int(row['count']),
+                'probability': f"{row['probability']*100:.1f}%"
+            })
+        
+        # Pages most journeys to a purchase depend on, and pages that mostly lead out
+        critical = summary[summary['removal_effect'] >= 0.5]
+        if not critical.empty:
+            insights['recommendations'].append({
+                'area': "Critical journey pages",
+                'suggestion': f"Prioritise speed and reliability of the {', '.join(critical['page_type'])} pages; "
+                              "removing any of them from journeys would cut conversions by half or more"
+            })
+        transitions = model.top_transitions(limit=None)
+        exits = transitions[(transitions['to_page'] == EXIT_STATE) & (transitions['probability'] > 0.5)]
+        for _, row in exits.iterrows():
+            insights['recommendations'].append({
+                'area': f"{row['from_page']} exits",
+                'suggestion': f"{row['probability']*100:.0f}% of {row['from_page']} views end the session; "
+                              "add clear next steps (related products, progress cues) to keep users moving"
+            })
+        
+        return insights
+    
+    def analyze_journey_paths(self):
+        """Mine the most frequent journey paths and where they convert or end."""
+        miner = JourneyPathMiner(self.db).fit()
+        overall = miner.conversion_rate
+        
+        insights = {
+            'sessions': miner.sessions,
+            'min_support': miner.min_count,
+            'conversion_rate': f"{overall*100:.2f}%",
+            'top_paths': [],
+            'converting_paths': [],
+            'dead_ends': [],
+            'flows': miner.flows().to_dict('records'),
+            'recommendations': []
+        }
+        
+        def path_entry(row):
+            return {
+                'path': row['path'],
+                'sessions': int(row['support']),
+                'share': f"{row['share']*100:.1f}%",
+                'conversion_rate': f"{row['conversion_rate']*100:.1f}%"
+            }
+        
+        for _, row in miner.top_paths(10).iterrows():
+            insights['top_paths'].append(path_entry(row))
+        converting = miner.top_paths(5, by='conversion_rate')
+        for _, row in converting.iterrows():
+            insights['converting_paths'].append(path_entry(row))
+        dead_ends = miner.dead_ends(5)
+        for _, row in dead_ends.iterrows():
+            insights['dead_ends'].append({
+                'path': row['path'],
+                'exits': int(row['exits']),
+                'exit_share': f"{row['exit_share']*100:.1f}%"
+            })
+        
+        # Paths that convert well above average are worth steering users into
+        promoted = converting[converting['conversion_rate'] >= 1.5 * overall]
+        if overall and not promoted.empty:
+            best = promoted.iloc[0]
+            insights['recommendations'].append({
+                'area': "High-converting journey",
+                'suggestion': f"Sessions following {best['path']} convert at {best['conversion_rate']*100:.1f}% "
+                              f"(vs {overall*100:.1f}% overall); shorten the way into this path from entry pages"
+            })
+        for _, row in dead_ends[dead_ends['exit_share'] >= 0.1].head(2).iterrows():
+            insights['recommendations'].append({
+                'area': f"{PATH_SEPARATOR.join(row['path'].split(PATH_SEPARATOR)[-2:])} dead end",
+                'suggestion': f"{row['exit_share']*100:.0f}% of sessions end without converting after "
+                              f"{row['path']}; add a next step at this point of the journey"
+            })
+        
+        return insights
+    
+    def analyze_product_affinity(self, min_count=5):
+        """Analyze which products are viewed or added to cart together (market basket)."""
+        model = ProductAffinity(self.db, min_count=min_count).fit()
+        pairs = model.top_pairs(10)
+        
+        insights = {
+            'baskets': model.sessions,
+            'min_count': min_count,
+            'top_pairs': [],
+            'product_neighbors': [],
+            'recommendations': []
+        }
+        
+        for _, row in pairs.iterrows():
+            insights['top_pairs'].append({
+                'product': row['product'],
+                'neighbor': row['neighbor'],
+                'sessions': int(row['count']),
+                'confidence': f"{row['confidence']*100:.1f}%",
+                'lift': f"{row['lift']:.2f}"
+            })
+        
+        # Strongest associations of the products in the most baskets
+        for position in np.argsort(-model.product_sessions, kind='stable')[:5]:
+            neighbors = model.neighbors(model.products['product_id'].iloc[position], 3)
+            if neighbors.empty:
+                continue
+            insights['product_neighbors'].append({
+                'product': model.products['name'].iloc[position],
+                'baskets': int(model.product_sessions[position]),
+                'neighbors': ", ".join(f"{row['neighbor']} ({row['lift']:.1f}x)" for _, row in neighbors.iterrows())
+            })
+        
+        # Pairs seen together at least twice as often as chance
+        associated = pairs[pairs['lift'] >= 2]
+        if not associated.empty:
+            best = associated.iloc[0]
+            insights['recommendations'].append({
+                'area': "Product bundles",
+                'suggestion': f"{best['product']} and {best['neighbor']} share {int(best['count'])} sessions, "
+                              f"{best['lift']:.1f}x more than chance; offer them as a bundle or cross-link their pages"
+            })
+            insights['recommendations'].append({
+                'area': "Frequently viewed together",
+                'suggestion': "Show each product's highest-lift neighbors on its page and in the cart to lift average order value"
+            })
+        
+        return insights
+    
+    def analyze_cohort_retention(self, period='month', periods=6):
+        """Analyze how monthly acquisition cohorts return, convert and buy again."""
+        activity = source_cohort_activity(self.source, self.db, period)
+        
+        insights = {
+            'period': period,
+            'retention_curve': [],
+            'cohorts': [],
+            'recommendations': []
+        }
+        if activity.empty:
+            return insights
+        
+        # Average curve: each period number pools the cohorts observed that long
+        curve = activity[activity['period_number'] < periods].groupby('period_number')[
+            ['cohort_users', 'active_users', 'converting_users', 'repeat_buyers']].sum()
+        for number, row in curve.iterrows():
+            insights['retention_curve'].append({
+                'period_number': int(number),
+                'retention': f"{row['active_users'] / row['cohort_users']*100:.1f}%",
+                'conversion': f"{row['converting_users'] / row['cohort_users']*100:.1f}%",
+                'repeat_purchase': f"{row['repeat_buyers'] / row['cohort_users']*100:.1f}%"
+            })
+        
+        # Most recent cohorts first
+        matrices = cohort_matrices(activity, periods)
+        for cohort in matrices['retention'].index[::-1][:12]:
+            insights['cohorts'].append({
+                'cohort': cohort,
+                'users': int(matrices['cohort_users'][cohort]),
+                'retention': [f"{rate*100:.1f}%" if pd.notna(rate) else "-"
+                              for rate in matrices['retention'].loc[cohort]]
+            })
+        
+        # Returning in the period after acquisition, and buying again
+        if 1 in curve.index:
+            returning = curve.loc[1, 'active_users'] / curve.loc[1, 'cohort_users']
+            if returning < 0.2:
+                insights['recommendations'].append({
+                    'area': "Early retention",
+                    'suggestion': f"Only {returning*100:.1f}% of users come back in the {period} after their first visit; "
+                                  "add re-engagement (welcome emails, saved carts, back-in-stock alerts)"
+                })
+        buyers = activity['converting_users'].sum()
+        if buyers:
+            repeat_share = activity['repeat_buyers'].sum() / buyers
+            if repeat_share < 0.3:
+                insights['recommendations'].append({
+                    'area': "Repeat purchases",
+                    'suggestion': f"Only {repeat_share*100:.0f}% of buyers in a {period} had bought before; "
+                                  "introduce loyalty rewards or replenishment reminders"
+                })
+        
+        return insights
+    
+    def analyze_funnel_trends(self, granularity='day', recent=7):
+        """Replay daily funnel, conversion and exit rates through the anomaly detectors."""
+        monitor = FunnelMonitor(self.source, granularity=granularity)
+        alerts = monitor.process()
+        
+        insights = {
+            'granularity': granularity,
+            'metrics': [],
+            'recent_alerts': [],
+            'recommendations': []
+        }
+        last = monitor.state['last_bucket']
+        if last is None:
+            return insights
+        insights['through'] = bucket_label(last, granularity)
+        
+        for _, row in monitor.baselines().iterrows():
+            insights['metrics'].append({
+                'metric': row['metric'],
+                'latest_rate': f"{row['latest_rate']*100:.1f}%",
+                'baseline': f"{row['baseline']*100:.1f}%",
+                'alerts': sum(1 for alert in alerts if alert['metric'] == row['metric'])
+            })
+        
+        for alert in alerts[-10:]:
+            insights['recent_alerts'].append({
+                'bucket': alert['start'],
+                'metric': alert['metric'],
+                'rate': f"{alert['rate']*100:.1f}%",
+                'expected': f"{alert['expected']*100:.1f}%",
+                'direction': alert['direction'],
+                'rule': alert['rule']
+            })
+        
+        # Metrics that moved the wrong way in the most recent buckets
+        flagged = {}
+        for alert in alerts:
+            if alert['worse'] and alert['bucket'] > last - recent:
+                flagged[alert['metric']] = alert
+        for metric, alert in flagged.items():
+            insights['recommendations'].append({
+                'area': f"{metric.replace('_', ' ')} anomaly",
+                'suggestion': f"{metric.replace('_', ' ').capitalize()} was {alert['rate']*100:.1f}% on {alert['start']} "
+                              f"against an expected {alert['expected']*100:.1f}%; check releases, campaigns and "
+                              "payment or site incidents around that time"
+            })
+        
+        return insights
+    
+    def analyze_conversion_cube(self, min_sessions=100):
+        """Build the session cube and drill into conversion by landing page, country and their combinations."""
+        cube = OlapCube.from_facts(self.source.get_cube_facts())
+        cube.save(cube_path(self.db.db_path))
+        
+        insights = {
+            'cells': cube.cells,
+            'by_landing_page': [],
+            'by_country': [],
+            'best_segments': [],
+            'worst_segments': [],
+            'recommendations': []
+        }
+        overall = cube.group_by().iloc[0] if cube.cells else None
+        if overall is None or not overall['sessions']:
+            return insights
+        insights['sessions'] = int(overall['sessions'])
+        insights['conversion_rate'] = f"{overall['conversion_rate']*100:.1f}%"
+        
+        def entry(row, dimensions):
+            return dict({dimension: row[dimension] if row[dimension] is not None else 'Unknown'
+                         for dimension in dimensions},
+                        sessions=int(row['sessions']),
+                        conversion_rate=f"{row['conversion_rate']*100:.1f}%",
+                        add_to_cart_rate=f"{row['add_to_cart'] / row['sessions']*100:.1f}%",
+                        cart_value_per_session=f"${row['cart_value_per_session']:.2f}")
+        
+        for dimensions, key in [(['landing_page'], 'by_landing_page'), (['country'], 'by_country')]:
+            for _, row in cube.group_by(*dimensions).head(10).iterrows():
+                insights[key].append(entry(row, dimensions))
+        
+        # Device, traffic source and landing page combinations with enough sessions to compare
+        segment_dimensions = ['device_type', 'referrer', 'landing_page']
+        
+        def label(row):
+            return ' / '.join(entry(row, segment_dimensions)[dimension] for dimension in segment_dimensions)
+        
+        segments = cube.group_by(*segment_dimensions)
+        segments = segments[segments['sessions'] >= min_sessions].sort_values('conversion_rate', ascending=False)
+        for _, row in segments.head(5).iterrows():
+            insights['best_segments'].append(entry(row, segment_dimensions))
+        for _, row in segments.tail(5).iloc[::-1].iterrows():
+            insights['worst_segments'].append(entry(row, segment_dimensions))
+        
+        if len(segments) > 1:
+            best, worst = segments.iloc[0], segments.iloc[-1]
+            if worst['conversion_rate'] < overall['conversion_rate'] * 0.5:
+                insights['recommendations'].append({
+                    'area': "Worst-converting segment",
+                    'suggestion': f"{label(worst)} converts at {worst['conversion_rate']*100:.1f}% over {int(worst['sessions']):,} "
+                                  f"sessions against {overall['conversion_rate']*100:.1f}% overall; review that landing "
+                                  "page on that device and what the traffic source promises"
+                })
+            if best['conversion_rate'] > overall['conversion_rate'] * 1.5:
+                insights['recommendations'].append({
+                    'area': "Best-converting segment",
+                    'suggestion': f"{label(best)} converts at {best['conversion_rate']*100:.1f}% over {int(best['sessions']):,} "
+                                  "sessions; shift acquisition spend and landing traffic towards it"
+                })
+        
+        return insights
+    
+    def analyze_checkout_latency(self, slow_ratio=1.25):
+        """Measure how long each checkout step takes, per device, and where checkouts are abandoned."""
+        latency = CheckoutLatency(self.db).fit()
+        
+        insights = {
+            'events': latency.events,
+            'steps': [],
+            'device_steps': [],
+            'recommendations': []
+        }
+        steps = latency.step_latency()
+        if steps.empty:
+            return insights
         
-        analysis_results = {
-            'conversion_funnel': self.analyze_conversion_funnel(),
-            'cart_abandonment': self.analyze_cart_abandonment(),
-            'search_behavior': self.analyze_search_behavior(),
-            'page_effectiveness': self.analyze_page_effectiveness(),
-            'product_performance': self.analyze_product_performance(),
-            'user_segments': self.analyze_user_segments()
+        def entry(row):
+            result = {'step': row['step']}
+            if 'device_type' in row:
+                result['device_type'] = row['device_type']
+            result.update({
+                'reached': int(row['reached']),
+                'abandonment_hazard': f"{row['hazard']*100:.1f}%",
+                'p50': f"{row['p50_seconds']:.0f}s" if pd.notna(row['p50_seconds']) else "-",
+                'p90': f"{row['p90_seconds']:.0f}s" if pd.notna(row['p90_seconds']) else "-",
+                'p99': f"{row['p99_seconds']:.0f}s" if pd.notna(row['p99_seconds']) else "-"
+            })
+            return result
+        
+        for _, row in steps.iterrows():
+            insights['steps'].append(entry(row))
+        devices = latency.step_latency(by_device=True)
+        for _, row in devices.iterrows():
+            insights['device_steps'].append(entry(row))
+        
+        # The step where the largest share of the sessions reaching it give up
+        riskiest = steps.loc[steps['hazard'].idxmax()]
+        timing = (f"; its p90 time to complete is {riskiest['p90_seconds']:.0f}s"
+                  if pd.notna(riskiest['p90_seconds']) else "")
+        insights['recommendations'].append({
+            'area': "Checkout step abandonment",
+            'suggestion': f"{riskiest['hazard']*100:.1f}% of sessions reaching {riskiest['step']} abandon there, "
+                          f"more than at any other step{timing}; simplify that step's form and show progress"
+        })
+        
+        # A device whose tail latency on a step is well above that step's overall
+        devices = devices.merge(steps[['step', 'p90_seconds']], on='step', suffixes=('', '_all'))
+        devices['ratio'] = devices['p90_seconds'] / devices['p90_seconds_all']
+        slow = devices[devices['ratio'] >= slow_ratio]
+        if not slow.empty:
+            slowest = slow.loc[slow['ratio'].idxmax()]
+            insights['recommendations'].append({
+                'area': f"Slow checkout on {slowest['device_type']}",
+                'suggestion': f"On {slowest['device_type']}, p90 time for {slowest['step']} is "
+                              f"{slowest['p90_seconds']:.0f}s against {slowest['p90_seconds_all']:.0f}s on all devices; "
+                              "check that step's form layout and load time on that device"
+            })
+        
+        return insights
+    
+    def analyze_revenue(self, days=14):
+        """Revenue, average order value, revenue per session and abandoned cart value by device, referrer and day."""
+        revenue_data = self.db.get_revenue_metrics()
+        
+        insights = {
+            'by_device': [],
+            'by_referrer': [],
+            'daily': [],
+            'recommendations': []
         }
+        if revenue_data.empty:
+            return insights
+        
+        measures = ['sessions', 'orders', 'revenue', 'cart_sessions', 'abandoned_carts', 'value_at_risk']
+        
+        def entry(totals):
+            return {
+                'sessions': int(totals['sessions']),
+                'orders': int(totals['orders']),
+                'revenue': f"${totals['revenue']:,.2f}",
+                'average_order_value': f"${totals['revenue'] / totals['orders']:,.2f}" if totals['orders'] else "-",
+                'revenue_per_session': f"${totals['revenue'] / totals['sessions']:,.2f}" if totals['sessions'] else "-",
+                'abandoned_carts': int(totals['abandoned_carts']),
+                'value_at_risk': f"${totals['value_at_risk']:,.2f}"
+            }
+        
+        overall = revenue_data[measures].sum()
+        insights.update(entry(overall))
+        
+        for dimension, key in [('device_type', 'by_device'), ('referrer', 'by_referrer')]:
+            grouped = revenue_data.groupby(revenue_data[dimension].fillna('Unknown'))[measures].sum()
+            for value, totals in grouped.sort_values('revenue', ascending=False).iterrows():
+                insights[key].append(dict({dimension: value}, **entry(totals)))
+        
+        daily = revenue_data.dropna(subset=['day']).groupby('day')[measures].sum().sort_index()
+        for day, totals in daily.tail(days).iterrows():
+            insights['daily'].append(dict({'day': day}, **entry(totals)))
+        
+        # Value left in carts, and where it is concentrated
+        if overall['value_at_risk'] > 0:
+            by_device = revenue_data.groupby(revenue_data['device_type'].fillna('Unknown'))['value_at_risk'].sum()
+            insights['recommendations'].append({
+                'area': "Revenue at risk",
+                'suggestion': f"${overall['value_at_risk']:,.0f} was left in {int(overall['abandoned_carts'])} abandoned carts "
+                              f"({by_device.max() / overall['value_at_risk']*100:.0f}% of it on {by_device.idxmax()}); "
+                              "send cart reminders and keep carts saved across sessions"
+            })
+        
+        # A device earning much less per session than the rest
+        devices = revenue_data.groupby(revenue_data['device_type'].fillna('Unknown'))[['sessions', 'revenue']].sum()
+        devices = devices[devices['sessions'] > 0]
+        if overall['sessions'] and overall['revenue'] and len(devices) > 1:
+            per_session = devices['revenue'] / devices['sessions']
+            average = overall['revenue'] / overall['sessions']
+            if per_session.min() < average * 0.75:
+                insights['recommendations'].append({
+                    'area': f"{per_session.idxmin()} revenue per session",
+                    'suggestion': f"{per_session.idxmin()} sessions earn ${per_session.min():.2f} each against "
+                                  f"${average:.2f} overall; compare its cart and checkout experience with the best device"
+                })
+        
+        return insights
+    
+    def get_segment_model(self, user_data):
+        """The user segment model: loaded from disk, or fitted on `user_data` and saved."""
+        if self.segment_model is None and not self.refit_segments:
+            self.segment_model = UserSegmentModel.load(self.segment_model_path)
+        if self.segment_model is not None:
+            return self.segment_model
+        
+        # Fit in a worker process when one is available
+        features = user_data[SEGMENT_FEATURES]
+        model = None
+        if self.cpu_executor is not None:
+            try:
+                model = self.cpu_executor.submit(fit_segment_model, features).result()
+            except BrokenProcessPool:
+                reset_process_pool()
+        if model is None:
+            model = fit_segment_model(features)
+        model.save(self.segment_model_path)
+        self.segment_model = model
+        self.refit_segments = False
+        return model
+    
+    def _run_timed(self, method_name):
+        """Run one analysis method and return (result, elapsed seconds)."""
+        started = time.perf_counter()
+        result = getattr(self, method_name)()
+        return result, time.perf_counter() - started
+    
+    def run_analyses(self, parallel=True, timeout=None, use_process_pool=True):
+        """Run the individual analyses, concurrently by default.
+        
+        Analyses are independent and mostly wait on SQLite, so they run on a
+        thread pool; clustering is sent to a process pool. `timeout` is the
+        per-analysis limit in seconds (a number, or a dict keyed by analysis
+        name). An analysis that fails or times out is reported in
+        `errors` and replaced by an empty result, so the rest still return.
+        
+        Returns (results, timings, errors).
+        """
+        results = {}
+        timings = {}
+        errors = {}
+        
+        def timeout_for(name):
+            if isinstance(timeout, dict):
+                return timeout.get(name)
+            return timeout
+        
+        def record_failure(name, message):
+            errors[name] = message
+            results[name] = {'error': message, 'recommendations': []}
+            print(f"Analysis '{name}' failed: {message}")
+        
+        if not parallel:
+            for name, method_name in ANALYSES:
+                try:
+                    results[name], timings[name] = self._run_timed(method_name)
+                except Exception as e:
+                    timings[name] = None
+                    record_failure(name, str(e))
+            return results, timings, errors
+        
+        previous_executor = self.cpu_executor
+        if use_process_pool and self.cpu_executor is None:
+            self.cpu_executor = get_process_pool()
+        
+        executor = ThreadPoolExecutor(max_workers=len(ANALYSES), thread_name_prefix='analysis')
+        try:
+            started = time.perf_counter()
+            futures = {name: executor.submit(self._run_timed, method_name) for name, method_name in ANALYSES}
+            
+            for name, _ in ANALYSES:
+                limit = timeout_for(name)
+                remaining = None if limit is None else max(0.0, started + limit - time.perf_counter())
+                try:
+                    results[name], timings[name] = futures[name].result(timeout=remaining)
+                except FutureTimeoutError:
+                    timings[name] = None
+                    record_failure(name, f"timed out after {limit}s")
+                except Exception as e:
+                    timings[name] = None
+                    record_failure(name, str(e))
+        finally:
+            # Don't wait for analyses that timed out; they finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.cpu_executor = previous_executor
+        
+        return results, timings, errors
+    
+    def render_chart(self, name):
+        """Render one chart from the latest analysis data on demand; returns its path."""
+        return self.chart_renderer.render(name, self.chart_data.get(name))
+    
+    def run_comprehensive_analysis(self, parallel=True, timeout=None, background_charts=True):
+        """Run all analyses and compile a comprehensive report.
+        
+        Charts are queued on the renderer's background pool after the
+        analyses finish (or drawn before returning with
+        `background_charts=False`); their paths are listed under 'charts'.
+        """
+        print("Running comprehensive e-commerce journey analysis...")
+        started = time.perf_counter()
+        
+        self.chart_data = {}
+        if self.sampler:
+            self.sampler.prepare([name for name, _ in ANALYSES])
+        if self.engine:
+            # A sampled run only reads full-precision aggregates for user segments, cohorts, trends and the cube
+            self.engine.prepare(['user_segments', 'cohort_retention', 'funnel_trends', 'conversion_cube'] if self.sampler
+                                else [name for name, _ in ANALYSES])
+        analysis_results, timings, errors = self.run_analyses(parallel=parallel, timeout=timeout)
+        if self.sampler and self.sampler.last_sample:
+            sample = self.sampler.last_sample
+            analysis_results['sampling'] = dict(sample, rate=self.sampler.sample_rate)
+            print(f"Estimated from a sample of {sample['sessions']:,} of {sample['population']:,} sessions "
+                  f"across {sample['strata']} strata")
+        if self.engine and self.engine.last_refresh:
+            refreshed = self.engine.last_refresh
+            folded = sum(stats['rows'] for stats in refreshed['tables'].values())
+            print(f"Folded {folded:,} new rows into the analysis aggregates in {refreshed['seconds']:.2f}s")
         
         # Compile all recommendations
         all_recommendations = []
@@ -613,5 +1279,16 @@ class EcommerceDataAnalyzer:
         
         analysis_results['consolidated_recommendations'] = unique_recommendations
         
+        timings['total'] = time.perf_counter() - started
+        analysis_results['charts'] = self.chart_renderer.render_all(self.chart_data, background=background_charts)
+        analysis_results['timings'] = {
+            name: round(seconds, 3) if seconds is not None else None for name, seconds in timings.items()
+        }
+        if errors:
+            analysis_results['analysis_errors'] = errors
+        
+        timing_rows = [[name, f"{seconds:.2f}s" if seconds is not None else "failed"]
+                       for name, seconds in timings.items()]
+        print(tabulate(timing_rows, headers=['Analysis', 'Time'], tablefmt='pipe'))
         print("Analysis complete. Results and visualizations available in the 'output' directory.")
         return analysis_results
@@ -0,0 +1,410 @@
+import os
+import csv
+import gzip
+import json
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from database import EcommerceDatabase
+from generate_data import EVENT_BUFFERS
+
+# Tables a file can be imported into
+IMPORT_TABLES = ['users', 'products'] + [table for _, table in EVENT_BUFFERS]
+
+# File formats by extension (before an optional .gz)
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson'}
+
+# Text columns holding timestamps; they are validated and normalized to naive ISO 8601 (UTC if zoned)
+TIME_COLUMNS = {'timestamp', 'start_time', 'end_time', 'first_visit_date'}
+
+# Range of an SQLite INTEGER (a signed 64-bit value); larger integers cannot be bound
+MIN_INTEGER, MAX_INTEGER = -(1 << 63), (1 << 63) - 1
+
+# Rejected-record messages kept per import
+MAX_ERRORS = 20
+
+# Imports are checkpointed in the database itself, in the transaction of each batch
+PROGRESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_progress (
+    path TEXT PRIMARY KEY,
+    table_name TEXT,
+    format TEXT,
+    file_size INTEGER,
+    file_mtime REAL,
+    byte_offset INTEGER,
+    bytes_read INTEGER,
+    records INTEGER,
+    imported INTEGER,
+    duplicates INTEGER,
+    rejected INTEGER,
+    errors TEXT,
+    status TEXT,
+    started_at TEXT,
+    updated_at TEXT
+)
+"""
+
+PROGRESS_COLUMNS = ['path', 'table_name', 'format', 'file_size', 'file_mtime', 'byte_offset', 'bytes_read',
+                    'records', 'imported', 'duplicates', 'rejected', 'errors', 'status', 'started_at', 'updated_at']
+
+
+def file_format(path):
+    """'csv' or 'ndjson' from a file name (ignoring a trailing .gz), or None if unrecognized."""
+    name = path[:-3] if path.lower().endswith('.gz') else path
+    return FORMATS.get(os.path.splitext(name)[1].lower())
+
+
+def open_binary(path):
+    """The file as a binary stream, decompressed on the fly if gzipped."""
+    with open(path, 'rb') as probe:
+        gzipped = probe.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if gzipped else open(path, 'rb')
+
+
+def raw_position(handle):
+    """Bytes of the file on disk consumed so far (compressed bytes for gzip), for progress."""
+    return (handle.fileobj if isinstance(handle, gzip.GzipFile) else handle).tell()
+
+
+def to_integer(value):
+    """An integer from an int, an integral float or their text, exactly (ids can exceed a float's precision).
+
+    Raises ValueError outside SQLite's 64-bit range, which cannot be stored.
+    """
+    if isinstance(value, int):
+        number = int(value)
+    elif isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        number = int(value)
+    else:
+        text = str(value).strip()
+        try:
+            number = int(text)
+        except ValueError:
+            return to_integer(float(text))
+    if not MIN_INTEGER <= number <= MAX_INTEGER:
+        raise ValueError(f"{value!r} is outside the 64-bit integer range")
+    return number
+
+
+def to_bytes(value):
+    """Bytes from bytes or their hex text."""
+    return value if isinstance(value, bytes) else bytes.fromhex(value)
+
+
+# Per-value conversions for declared column types pandas cannot coerce exactly
+CONVERTERS = {'INTEGER': to_integer, 'BLOB': to_bytes}
+
+
+def python_values(series):
+    """A column as a list of Python values, with None for missing ones."""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def whole_numbers(raw, empty):
+    """A column's values as exact integers (None where empty), or None unless all of them are whole numbers.
+
+    This is the vectorized path for the usual case; anything else goes
+    through `to_integer` value by value.
+    """
+    numbers = pd.to_numeric(raw[~empty], errors='coerce')
+    if numbers.dtype.kind not in 'iu' or (numbers.dtype.kind == 'u' and len(numbers) and numbers.max() > MAX_INTEGER):
+        return None
+    return python_values(numbers.astype(object).reindex(raw.index))
+
+
+class FileImporter:
+    """Streams CSV or NDJSON exports (optionally gzipped) into a table through bulk transactions.
+
+    Files are read line by line and parsed into records one at a time, so
+    memory stays bounded by the batch size whatever the file size. CSV files
+    need a header row naming the columns; NDJSON files hold one object per
+    line. Columns the table lacks are ignored and missing ones are NULL.
+
+    Each batch of records is validated and coerced as a whole, by the
+    table's declared column types: integers, reals, text, ids as the
+    database's id strategy stores them (hex strings for binary ids, as
+    `HttpSink` sends them) and timestamps normalized to ISO 8601. Records
+    with a value that does not fit, or without their primary key, are
+    rejected and counted rather than stopping the import; rows whose
+    primary key already exists are skipped as duplicates.
+
+    A batch's rows and the import's checkpoint (the input offset after its
+    last record, with the running counts) are committed in one transaction,
+    so an interrupted import picks up exactly where it stopped when the same
+    unchanged file is imported again.
+    """
+
+    def __init__(self, db=None, batch_size=10000):
+        """Initialize an importer writing to an `EcommerceDatabase` in batches of `batch_size` records."""
+        self.db = db if db else EcommerceDatabase()
+        self.batch_size = batch_size
+        self.columns, self.types, self.keys = {}, {}, {}
+        conn = self.db.connect()
+        try:
+            conn.execute(PROGRESS_SCHEMA)
+            conn.commit()
+            for table in IMPORT_TABLES:
+                info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                self.columns[table] = [row[1] for row in info]
+                self.types[table] = {row[1]: row[2].upper() for row in info}
+                self.keys[table] = next(row[1] for row in info if row[5])
+        finally:
+            self.db.close()
+
+    def progress(self, path=None):
+        """Checkpoint rows of every import (or of one file), most recently updated first."""
+        query = f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM import_progress"
+        params = ()
+        if path:
+            query += " WHERE path = ?"
+            params = (os.path.abspath(path),)
+        conn = self.db.connect()
+        try:
+            rows = conn.execute(query + " ORDER BY updated_at DESC", params).fetchall()
+        finally:
+            self.db.close()
+        imports = []
+        for row in rows:
+            entry = dict(zip(PROGRESS_COLUMNS, row))
+            entry['errors'] = json.loads(entry['errors'] or '[]')
+            imports.append(entry)
+        return imports
+
+    def import_file(self, path, table, file_type=None, restart=False, on_progress=None):
+        """Import a file into a table, resuming an interrupted import of the same file; returns its checkpoint.
+
+        `file_type` ('csv' or 'ndjson') defaults to the one the extension
+        names. A completed import of an unchanged file is not repeated unless
+        `restart`. `on_progress` is called with the checkpoint after every
+        committed batch.
+        """
+        if table not in self.columns:
+            raise ValueError(f"Cannot import into {table!r}; expected one of {IMPORT_TABLES}")
+        file_type = file_type or file_format(path)
+        if file_type not in ('csv', 'ndjson'):
+            raise ValueError(f"Cannot tell the format of {path}; expected .csv or .ndjson, optionally .gz")
+        path = os.path.abspath(path)
+        size, mtime = os.path.getsize(path), os.path.getmtime(path)
+
+        previous = self.progress(path)
+        state = previous[0] if previous else None
+        if (restart or state is None or state['table_name'] != table or state['format'] != file_type
+                or (state['file_size'], state['file_mtime']) != (size, mtime)):
+            state = {'path': path, 'table_name': table, 'format': file_type, 'file_size': size, 'file_mtime': mtime,
+                     'byte_offset': 0, 'bytes_read': 0, 'records': 0, 'imported': 0, 'duplicates': 0,
+                     'rejected': 0, 'errors': [], 'status': 'running',
+                     'started_at': datetime.now().isoformat(), 'updated_at': None}
+        elif state['status'] == 'completed':
+            return state
+        state['status'] = 'running'
+
+        try:
+            with open_binary(path) as handle:
+                header = self._read_header(handle) if file_type == 'csv' else None
+                start = max(state['byte_offset'], handle.tell())
+                if start != handle.tell():
+                    handle.seek(start)
+                batch = []
+                for record, offset in self._records(handle, file_type, header, start):
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        self._commit(table, batch, offset, raw_position(handle), state)
+                        batch = []
+                        if on_progress:
+                            on_progress(dict(state))
+                state['status'] = 'completed'
+                self._commit(table, batch, handle.tell(), size, state)
+        except Exception:
+            # The checkpoint of the last committed batch stands; importing the file again resumes from it
+            conn = self.db.connect()
+            try:
+                with conn:
+                    conn.execute("UPDATE import_progress SET status = 'failed', updated_at = ? WHERE path = ?",
+                                 (datetime.now().isoformat(), path))
+            finally:
+                self.db.close()
+            raise
+        if on_progress:
+            on_progress(dict(state))
+        return state
+
+    def _read_header(self, handle):
+        """Column names from a CSV file's first row, leaving the handle just after it."""
+        handle.seek(0)
+        line = handle.readline().decode('utf-8-sig')
+        names = next(csv.reader([line]), [])
+        if not names:
+            raise ValueError("CSV file has no header row")
+        return [name.strip() for name in names]
+
+    def _records(self, handle, file_type, header, offset):
+        """Yield (record dict or a message saying why it is unreadable, input offset after it) from `offset` on."""
+        position = [offset]
+
+        def lines():
+            for line in handle:
+                position[0] += len(line)
+                yield line.decode('utf-8', errors='replace')
+
+        if file_type == 'csv':
+            # The reader pulls only the lines of the record it returns, so the offset stays on a record boundary
+            for values in csv.reader(lines()):
+                if not values:
+                    continue
+                if len(values) != len(header):
+                    yield f"expected {len(header)} fields, found {len(values)}", position[0]
+                    continue
+                yield dict(zip(header, values)), position[0]
+        else:
+            for line in lines():
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield f"invalid JSON ({e})", position[0]
+                    continue
+                yield (record if isinstance(record, dict) else "not a JSON object"), position[0]
+
+    def _coerce(self, table, records):
+        """Rows (tuples in column order) for the valid records of a batch, and a message per rejected one."""
+        columns = self.columns[table]
+        problems = {number: record for number, record in enumerate(records) if isinstance(record, str)}
+        frame = pd.DataFrame.from_records([{} if isinstance(record, str) else record for record in records],
+                                          columns=columns)
+        values = {}
+        for column in columns:
+            raw = frame[column].astype(object)
+            empty = raw.isna() | (raw == '')
+            raw = raw.where(~empty, None)
+            declared = self.types[table][column]
+            kind = pd.api.types.infer_dtype(raw, skipna=True)
+            exact = whole_numbers(raw, empty) if declared == 'INTEGER' and kind in ('integer', 'string') else None
+            if exact is not None:
+                bad = pd.Series(False, index=raw.index)
+                values[column] = exact
+            elif declared in CONVERTERS:
+                converted, flags = [], []
+                for value in raw.tolist():
+                    try:
+                        converted.append(None if value is None else CONVERTERS[declared](value))
+                        flags.append(False)
+                    except (TypeError, ValueError):
+                        converted.append(None)
+                        flags.append(True)
+                bad = pd.Series(flags, index=raw.index, dtype=bool)
+                values[column] = converted
+            elif declared == 'REAL':
+                numbers = pd.to_numeric(raw, errors='coerce')
+                bad = ~empty & numbers.isna()
+                values[column] = python_values(numbers.where(~bad))
+            elif column in TIME_COLUMNS:
+                parsed = pd.to_datetime(raw, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+                bad = ~empty & parsed.isna()
+                # isoformat() text, with microseconds only when there are any
+                moments = parsed.to_numpy(dtype='datetime64[us]')
+                text = np.datetime_as_string(moments, unit='s').astype(object)
+                fractional = ~np.isnat(moments) & (moments.astype(np.int64) % 1000000 != 0)
+                text[fractional] = np.datetime_as_string(moments[fractional], unit='us')
+                text = pd.Series(text, index=raw.index)
+                values[column] = python_values(text.where(~bad & ~empty))
+            else:
+                bad = pd.Series(False, index=raw.index)
+                if kind == 'string':
+                    values[column] = raw.tolist()
+                else:
+                    values[column] = python_values(raw.map(lambda value: value if value is None or isinstance(value, str)
+                                                           else json.dumps(value) if isinstance(value, (dict, list))
+                                                           else str(value)))
+            if column == self.keys[table]:
+                bad = bad | empty
+            for number in bad[bad].index:
+                if number not in problems:
+                    value = records[number].get(column) if isinstance(records[number], dict) else None
+                    expected = 'timestamp' if column in TIME_COLUMNS and declared == 'TEXT' else declared
+                    problems[number] = (f"missing {column}" if empty[number]
+                                        else f"{column}={value!r} is not a valid {expected}")
+        rows = [row for number, row in enumerate(zip(*(values[column] for column in columns)))
+                if number not in problems]
+        return rows, problems
+
+    def _commit(self, table, batch, offset, bytes_read, state):
+        """Insert a batch and advance the checkpoint past it, in one transaction."""
+        rows, problems = self._coerce(table, batch) if batch else ([], {})
+        first = state['records']
+        for number, message in sorted(problems.items()):
+            if len(state['errors']) < MAX_ERRORS:
+                state['errors'].append(f"record {first + number + 1}: {message}")
+        state.update(records=first + len(batch), rejected=state['rejected'] + len(problems),
+                     byte_offset=offset, bytes_read=bytes_read, updated_at=datetime.now().isoformat())
+
+        columns = self.columns[table]
+        conn = self.db.connect()
+        try:
+            with conn:
+                inserted = 0
+                if rows:
+                    inserted = conn.executemany(
+                        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+                        f"VALUES ({', '.join('?' for _ in columns)})", rows).rowcount
+                state['imported'] += inserted
+                state['duplicates'] += len(rows) - inserted
+                conn.execute(
+                    f"INSERT OR REPLACE INTO import_progress ({', '.join(PROGRESS_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in PROGRESS_COLUMNS)})",
+                    [json.dumps(state[column]) if column == 'errors' else state[column]
+                     for column in PROGRESS_COLUMNS])
+        finally:
+            self.db.close()
+
+
+def check_oversized_integers(batch_size=2):
+    """Check that integers beyond 64 bits are rejected and counted while the import still completes."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = EcommerceDatabase(os.path.join(tmp_dir, 'check.db'))
+        path = os.path.join(tmp_dir, 'page_views.ndjson')
+        records = [{'view_id': db.new_id(), 'timestamp': '2024-01-01T00:00:00', 'time_spent_seconds': seconds}
+                   for seconds in [30, 10 ** 20, str(1 << 63), 45, -(1 << 63)]]
+        with open(path, 'w', encoding='utf-8') as lines:
+            lines.writelines(json.dumps(record) + '\n' for record in records)
+        state = FileImporter(db, batch_size=batch_size).import_file(path, 'page_views')
+    print(tabulate([[name, state[name]] for name in ['status', 'records', 'imported', 'rejected']],
+                   headers=['Statistic', 'Value'], tablefmt='pipe'))
+    return state['status'] == 'completed' and state['imported'] == 3 and state['rejected'] == 2
+
+
+if __name__ == "__main__":
+    import argparse
+    from tqdm import tqdm
+    parser = argparse.ArgumentParser(description="Import a CSV or NDJSON export (optionally gzipped) into a table")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--table', choices=IMPORT_TABLES)
+    parser.add_argument('--input', help="File to import; .csv, .ndjson or .jsonl, optionally .gz")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="Override the format the extension implies")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--restart', action='store_true', help="Start over instead of resuming")
+    parser.add_argument('--check', action='store_true',
+                        help="check that out-of-range integers are rejected without stopping an import, then exit")
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(0 if check_oversized_integers() else 1)
+    if not (args.table and args.input):
+        parser.error("--table and --input are required")
+
+    importer = FileImporter(EcommerceDatabase(args.db), batch_size=args.batch_size)
+    started = time.perf_counter()
+    with tqdm(total=os.path.getsize(args.input), unit='B', unit_scale=True, desc=args.table) as bar:
+        def show(state):
+            bar.update(state['bytes_read'] - bar.n)
+            bar.set_postfix(imported=state['imported'], rejected=state['rejected'])
+        state = importer.import_file(args.input, args.table, args.format, restart=args.restart, on_progress=show)
+    print(tabulate([[name, f"{state[name]:,}"] for name in ['records', 'imported', 'duplicates', 'rejected']] +
+                   [['seconds', f"{time.perf_counter() - started:,.2f}"]], headers=['Statistic', 'Value'],
+                   tablefmt='pipe'))
+    for message in state['errors']:
+        print(f"  {message}")
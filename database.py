@@ -1,15 +1,118 @@
 import sqlite3
 import os
+import threading
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from id_generators import DEFAULT_ID_STRATEGY, get_id_generator
+
+# Signed quantity of a cart event (formatted with the event's table alias): additions count up, removals down
+NET_QUANTITY = "CASE {event}.event_type WHEN 'add_to_cart' THEN COALESCE({event}.quantity, 0) ELSE -COALESCE({event}.quantity, 0) END"
+
+def session_chunks(query, conn, chunksize, column='session_id'):
+    """Stream a query ordered by session in chunks that each hold whole sessions.
+
+    The rows of the last session in a chunk may continue in the next one,
+    so they are carried over; empty chunks (an empty table) yield nothing.
+    """
+    carry = None
+    for chunk in pd.read_sql_query(query, conn, chunksize=chunksize):
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        sessions = chunk[column].to_numpy(dtype=object)
+        earlier = np.flatnonzero(sessions != sessions[-1])
+        tail = earlier[-1] + 1 if len(earlier) else 0
+        carry = chunk.iloc[tail:]
+        if tail:
+            yield chunk.iloc[:tail]
+    if carry is not None:
+        yield carry
+
+
+def group_ranks(groups):
+    """Position of each row within its run of equal `groups` values (0 for the run's first row)."""
+    groups = np.asarray(groups)
+    if not len(groups):
+        return np.empty(0, np.int64)
+    first = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+    return np.arange(len(groups)) - np.repeat(first, np.diff(np.append(first, len(groups))))
+
+
+def top_k_rows(groups, k, *keys):
+    """Row order keeping each group's first `k` rows by `keys` (most significant first, ascending).
+
+    Returns the kept row numbers, sorted by group and then by the keys, and
+    each one's rank within its group.
+    """
+    order = np.lexsort(tuple(reversed(keys)) + (groups,))
+    rank = group_ranks(np.asarray(groups)[order])
+    kept = rank < k
+    return order[kept], rank[kept]
+
+
+def rows_through(conn, table, watermark):
+    """Rows of a table with a rowid at or below `watermark`.
+
+    Incremental readers fold rows above a rowid watermark, which assumes new
+    rows get higher rowids. Under the integer id strategies the id is the
+    rowid, so a row written with an explicit, older id lands below it;
+    comparing this count with the rows read so far catches that.
+    """
+    return conn.execute(f"SELECT (SELECT COUNT(*) FROM {table}) - (SELECT COUNT(*) FROM {table} WHERE rowid > ?)",
+                        (watermark,)).fetchone()[0]
+
+
+def funnel_drop_offs(step_names, steps):
+    """Convert per-stage funnel counts into step-by-step drop-off records."""
+    funnel_analysis = []
+    for i in range(len(steps) - 1):
+        current_step = steps[i]
+        next_step = steps[i+1]
+        drop_off = current_step - next_step
+        if current_step > 0:
+            drop_off_rate = drop_off / current_step
+        else:
+            drop_off_rate = 0
+            
+        funnel_analysis.append({
+            'current_step': step_names[i],
+            'next_step': step_names[i+1],
+            'current_count': int(current_step),
+            'next_count': int(next_step),
+            'drop_off': int(drop_off),
+            'drop_off_rate': float(drop_off_rate)
+        })
+        
+    return funnel_analysis
+
 
 class EcommerceDatabase:
-    def __init__(self, db_path='ecommerce_data.db'):
-        """Initialize the database connection."""
+    def __init__(self, db_path='ecommerce_data.db', id_strategy=None):
+        """Initialize the database connection.
+
+        `id_strategy` selects how primary keys are generated and stored
+        ('uuid', 'snowflake' or 'ulid'). It is recorded in the database on
+        creation; reopening an existing database reuses the stored strategy.
+        """
         self.db_path = db_path
+        # Connections are per thread so concurrent callers never close each other's connection
+        self._local = threading.local()
         self.connection = None
+        self.id_strategy = self._resolve_id_strategy(id_strategy)
+        self.id_generator = get_id_generator(self.id_strategy)
         self.create_tables()
     
+    @property
+    def connection(self):
+        """The current thread's open connection, if any."""
+        return getattr(self._local, 'connection', None)
+    
+    @connection.setter
+    def connection(self, value):
+        self._local.connection = value
+    
     def connect(self):
         """Create a connection to the SQLite database."""
         self.connection = sqlite3.connect(self.db_path)
@@ -19,16 +122,57 @@ class EcommerceDatabase:
         """Close the database connection."""
         if self.connection:
             self.connection.close()
+            self.connection = None
+    
+    def _resolve_id_strategy(self, id_strategy):
+        """Determine the id strategy, preferring the one stored in an existing database."""
+        stored_strategy = None
+        if os.path.exists(self.db_path):
+            conn = sqlite3.connect(self.db_path)
+            has_meta = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_meta'"
+            ).fetchone()
+            if has_meta:
+                row = conn.execute("SELECT value FROM schema_meta WHERE key = 'id_strategy'").fetchone()
+                stored_strategy = row[0] if row else None
+            elif conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+                # Databases created before id strategies existed use UUID text
+                stored_strategy = DEFAULT_ID_STRATEGY
+            conn.close()
+        
+        if stored_strategy and id_strategy and stored_strategy != id_strategy:
+            raise ValueError(
+                f"Database {self.db_path} uses the '{stored_strategy}' id strategy; "
+                f"cannot open it with '{id_strategy}'"
+            )
+        return stored_strategy or id_strategy or DEFAULT_ID_STRATEGY
+    
+    def new_id(self):
+        """Generate a new primary key using the database's id strategy."""
+        return self.id_generator.new_id()
     
     def create_tables(self):
         """Create the necessary tables if they don't exist."""
         conn = self.connect()
         cursor = conn.cursor()
+        id_type = self.id_generator.sql_type
         
-        # Users table
+        # Schema metadata (records the id strategy the tables were created with)
         cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        cursor.execute(
+            "INSERT OR IGNORE INTO schema_meta (key, value) VALUES ('id_strategy', ?)",
+            (self.id_strategy,)
+        )
+        
+        # Users table
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
+            user_id {id_type} PRIMARY KEY,
             first_visit_date TEXT,
             device_type TEXT,
             browser TEXT,
@@ -38,10 +182,10 @@ class EcommerceDatabase:
         ''')
         
         # Sessions table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS sessions (
-            session_id TEXT PRIMARY KEY,
-            user_id TEXT,
+            session_id {id_type} PRIMARY KEY,
+            user_id {id_type},
             start_time TEXT,
             end_time TEXT,
             device_type TEXT,
@@ -52,11 +196,11 @@ class EcommerceDatabase:
         ''')
         
         # Page views table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS page_views (
-            view_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
+            view_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
             timestamp TEXT,
             page_type TEXT,
             page_url TEXT,
@@ -68,11 +212,11 @@ class EcommerceDatabase:
         ''')
         
         # Clicks table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS clicks (
-            click_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
+            click_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
             page_url TEXT,
             element_type TEXT,
             element_id TEXT,
@@ -83,9 +227,9 @@ class EcommerceDatabase:
         ''')
         
         # Products table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS products (
-            product_id TEXT PRIMARY KEY,
+            product_id {id_type} PRIMARY KEY,
             name TEXT,
             category TEXT,
             price REAL,
@@ -94,12 +238,12 @@ class EcommerceDatabase:
         ''')
         
         # Product views table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS product_views (
-            view_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
-            product_id TEXT,
+            view_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
+            product_id {id_type},
             timestamp TEXT,
             time_spent_seconds INTEGER,
             FOREIGN KEY (session_id) REFERENCES sessions(session_id),
@@ -109,12 +253,12 @@ class EcommerceDatabase:
         ''')
         
         # Cart events table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS cart_events (
-            event_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
-            product_id TEXT,
+            event_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
+            product_id {id_type},
             event_type TEXT,
             quantity INTEGER,
             timestamp TEXT,
@@ -125,11 +269,11 @@ class EcommerceDatabase:
         ''')
         
         # Search events table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS search_events (
-            search_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
+            search_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
             query TEXT,
             results_count INTEGER,
             timestamp TEXT,
@@ -139,11 +283,11 @@ class EcommerceDatabase:
         ''')
         
         # Checkout events table
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS checkout_events (
-            checkout_id TEXT PRIMARY KEY,
-            session_id TEXT,
-            user_id TEXT,
+            checkout_id {id_type} PRIMARY KEY,
+            session_id {id_type},
+            user_id {id_type},
             step TEXT,
             status TEXT,
             timestamp TEXT,
@@ -151,7 +295,52 @@ class EcommerceDatabase:
             FOREIGN KEY (user_id) REFERENCES users(user_id)
         )
         ''')
-        
+
+        # Order lines: net cart quantity per session and product, priced when first added.
+        # A trigger keeps them current as cart events are inserted, whatever the ingest path.
+        has_order_lines = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_lines'"
+        ).fetchone()
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS order_lines (
+            session_id {id_type},
+            product_id {id_type},
+            quantity INTEGER NOT NULL,
+            unit_price REAL,
+            PRIMARY KEY (session_id, product_id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS cart_events_order_lines
+        AFTER INSERT ON cart_events
+        WHEN NEW.session_id IS NOT NULL AND NEW.product_id IS NOT NULL
+             AND NEW.event_type IN ('add_to_cart', 'remove_from_cart')
+        BEGIN
+            INSERT INTO order_lines (session_id, product_id, quantity, unit_price)
+            VALUES (NEW.session_id, NEW.product_id, {NET_QUANTITY.format(event='NEW')},
+                    (SELECT price FROM products WHERE product_id = NEW.product_id))
+            ON CONFLICT (session_id, product_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                unit_price = COALESCE(unit_price, excluded.unit_price);
+        END
+        ''')
+        # Indexes for per-session scans in time order and per-user session lookups,
+        # declared here so analyses never build them (and hold the write lock) on their read path
+        for table in ('page_views', 'product_views', 'cart_events', 'checkout_events'):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_session_time ON {table} (session_id, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_start ON sessions (user_id, start_time)")
+        if not has_order_lines:
+            # Databases created before order lines existed: derive them from the cart events once
+            cursor.execute(f'''
+            INSERT INTO order_lines (session_id, product_id, quantity, unit_price)
+            SELECT c.session_id, c.product_id, SUM({NET_QUANTITY.format(event='c')}), MAX(p.price)
+            FROM cart_events c
+            LEFT JOIN products p ON p.product_id = c.product_id
+            WHERE c.session_id IS NOT NULL AND c.product_id IS NOT NULL
+              AND c.event_type IN ('add_to_cart', 'remove_from_cart')
+            GROUP BY c.session_id, c.product_id
+            ''')
+
         conn.commit()
         self.close()
     
@@ -162,6 +351,37 @@ class EcommerceDatabase:
         conn.commit()
         self.close()
     
+    def insert_records(self, table_name, rows, columns=None, ignore_duplicates=False):
+        """Bulk insert rows (tuples in column order, or dicts) in a single transaction.
+
+        This is the fast ingest path: it skips DataFrame construction and
+        commits once per call, so callers should pass rows in batches. With
+        `ignore_duplicates`, rows whose primary key already exists are skipped.
+        Returns the number of rows inserted.
+        """
+        if not rows:
+            return 0
+        
+        if isinstance(rows[0], dict):
+            columns = columns or list(rows[0].keys())
+            rows = [tuple(row.get(column) for column in columns) for row in rows]
+        
+        if columns:
+            column_list = f" ({', '.join(columns)})"
+            placeholders = ', '.join('?' for _ in columns)
+        else:
+            column_list = ''
+            placeholders = ', '.join('?' for _ in rows[0])
+        
+        conn = self.connect()
+        with conn:
+            cursor = conn.executemany(
+                f"INSERT {'OR IGNORE ' if ignore_duplicates else ''}INTO {table_name}{column_list} VALUES ({placeholders})",
+                rows
+            )
+        self.close()
+        return cursor.rowcount
+    
     def execute_query(self, query, params=()):
         """Execute a query and return the results."""
         conn = self.connect()
@@ -326,29 +546,9 @@ class EcommerceDatabase:
         self.close()
         
         # Convert to step-by-step drop-off rates
-        steps = funnel_data.iloc[0].tolist()
+        steps = funnel_data.iloc[0].fillna(0).tolist()
         step_names = funnel_data.columns.tolist()
-        
-        funnel_analysis = []
-        for i in range(len(steps) - 1):
-            current_step = steps[i]
-            next_step = steps[i+1]
-            drop_off = current_step - next_step
-            if current_step > 0:
-                drop_off_rate = drop_off / current_step
-            else:
-                drop_off_rate = 0
-                
-            funnel_analysis.append({
-                'current_step': step_names[i],
-                'next_step': step_names[i+1],
-                'current_count': int(current_step),
-                'next_count': int(next_step),
-                'drop_off': int(drop_off),
-                'drop_off_rate': float(drop_off_rate)
-            })
-            
-        return funnel_analysis
+        return funnel_drop_offs(step_names, steps)
     
     def get_cart_abandonment_data(self):
         """Analyze cart abandonment patterns."""
@@ -389,6 +589,48 @@ class EcommerceDatabase:
         
         return cart_data
     
+    def get_revenue_metrics(self):
+        """Additive revenue totals per device type, referrer and day of session start, from the order lines.
+
+        A session's cart value is its order lines' net quantity (floored at
+        zero) times unit price. It is revenue when the session converted (an
+        order, if non-empty) and value at risk when the session left with a
+        non-empty cart.
+        """
+        conn = self.connect()
+        
+        query = """
+        WITH carts AS (
+            SELECT session_id, SUM(MAX(quantity, 0) * COALESCE(unit_price, 0)) AS cart_value
+            FROM order_lines
+            GROUP BY session_id
+        )
+        SELECT
+            s.device_type,
+            u.referrer,
+            DATE(s.start_time) AS day,
+            COUNT(*) AS sessions,
+            SUM(s.conversion_status = 'completed' AND COALESCE(c.cart_value, 0) > 0) AS orders,
+            SUM(CASE WHEN s.conversion_status = 'completed' THEN COALESCE(c.cart_value, 0) ELSE 0 END) AS revenue,
+            SUM(COALESCE(c.cart_value, 0) > 0) AS cart_sessions,
+            SUM(COALESCE(c.cart_value, 0) > 0 AND COALESCE(s.conversion_status, '') != 'completed') AS abandoned_carts,
+            SUM(CASE WHEN COALESCE(s.conversion_status, '') != 'completed' THEN COALESCE(c.cart_value, 0) ELSE 0 END)
+                AS value_at_risk
+        FROM
+            sessions s
+        LEFT JOIN
+            users u ON s.user_id = u.user_id
+        LEFT JOIN
+            carts c ON s.session_id = c.session_id
+        GROUP BY
+            s.device_type, u.referrer, DATE(s.start_time)
+        """
+        
+        revenue_data = pd.read_sql_query(query, conn)
+        self.close()
+        
+        return revenue_data
+    
     def get_search_behavior(self):
         """Analyze search behavior patterns."""
         conn = self.connect()
@@ -508,3 +750,242 @@ class EcommerceDatabase:
         self.close()
         
         return product_data
+    
+    def get_user_segment_features(self):
+        """Per-user behavioural features used for segmentation.
+
+        Event tables are aggregated per session first and then summed per
+        user, so no count is inflated by joining several event tables at once.
+        """
+        return self.execute_query("""
+        WITH page_stats AS (
+            SELECT session_id, COUNT(*) as page_view_count,
+                   SUM(time_spent_seconds) as time_spent_total,
+                   COUNT(time_spent_seconds) as time_spent_views
+            FROM page_views GROUP BY session_id
+        ),
+        click_stats AS (
+            SELECT session_id, COUNT(*) as click_count FROM clicks GROUP BY session_id
+        ),
+        cart_stats AS (
+            SELECT session_id, COUNT(*) as cart_event_count FROM cart_events GROUP BY session_id
+        ),
+        search_stats AS (
+            SELECT session_id, COUNT(*) as search_count FROM search_events GROUP BY session_id
+        ),
+        session_stats AS (
+            SELECT
+                s.session_id,
+                s.user_id,
+                CASE WHEN s.conversion_status = 'completed' THEN 1 ELSE 0 END as completed,
+                COALESCE(ps.page_view_count, 0) as page_view_count,
+                COALESCE(ps.time_spent_total, 0) as time_spent_total,
+                COALESCE(ps.time_spent_views, 0) as time_spent_views,
+                COALESCE(cs.click_count, 0) as click_count,
+                COALESCE(cas.cart_event_count, 0) as cart_event_count,
+                COALESCE(ss.search_count, 0) as search_count
+            FROM
+                sessions s
+            LEFT JOIN page_stats ps ON ps.session_id = s.session_id
+            LEFT JOIN click_stats cs ON cs.session_id = s.session_id
+            LEFT JOIN cart_stats cas ON cas.session_id = s.session_id
+            LEFT JOIN search_stats ss ON ss.session_id = s.session_id
+        )
+        SELECT 
+            u.user_id, 
+            u.device_type, 
+            u.browser, 
+            u.country, 
+            u.referrer,
+            COUNT(*) as session_count,
+            CAST(SUM(st.time_spent_total) AS FLOAT) / NULLIF(SUM(st.time_spent_views), 0) as avg_time_spent,
+            SUM(st.page_view_count) as page_view_count,
+            SUM(st.click_count) as click_count,
+            SUM(st.cart_event_count) as cart_event_count,
+            SUM(st.search_count) as search_count,
+            SUM(st.completed) as completed_purchases,
+            COUNT(*) as total_sessions,
+            CAST(SUM(st.completed) AS FLOAT) / COUNT(*) as conversion_rate
+        FROM 
+            users u
+        JOIN 
+            session_stats st ON st.user_id = u.user_id
+        GROUP BY 
+            u.user_id
+        """)
+    
+    def get_session_features(self, since_hour=None):
+        """Per-session behavioural features, device, referrer, start hour and outcome, for sessions starting after `since_hour`."""
+        session_data = self.execute_query("""
+        WITH page_stats AS (
+            SELECT session_id, COUNT(*) as page_view_count,
+                   SUM(time_spent_seconds) as time_spent_total,
+                   COUNT(time_spent_seconds) as time_spent_views
+            FROM page_views GROUP BY session_id
+        ),
+        click_stats AS (
+            SELECT session_id, COUNT(*) as click_count FROM clicks GROUP BY session_id
+        ),
+        cart_stats AS (
+            SELECT session_id, COUNT(*) as cart_event_count FROM cart_events GROUP BY session_id
+        ),
+        search_stats AS (
+            SELECT session_id, COUNT(*) as search_count FROM search_events GROUP BY session_id
+        ),
+        session_hours AS (
+            SELECT session_id, user_id, conversion_status,
+                   CAST(strftime('%s', start_time) AS INTEGER) / 3600 as start_hour
+            FROM sessions
+        )
+        SELECT
+            sh.start_hour,
+            u.device_type,
+            u.referrer,
+            COALESCE(ps.page_view_count, 0) as page_view_count,
+            COALESCE(cs.click_count, 0) as click_count,
+            COALESCE(cas.cart_event_count, 0) as cart_event_count,
+            COALESCE(ss.search_count, 0) as search_count,
+            ps.time_spent_total * 1.0 / NULLIF(ps.time_spent_views, 0) as avg_time_spent,
+            CASE WHEN sh.conversion_status = 'completed' THEN 1 ELSE 0 END as completed
+        FROM
+            session_hours sh
+        LEFT JOIN users u ON u.user_id = sh.user_id
+        LEFT JOIN page_stats ps ON ps.session_id = sh.session_id
+        LEFT JOIN click_stats cs ON cs.session_id = sh.session_id
+        LEFT JOIN cart_stats cas ON cas.session_id = sh.session_id
+        LEFT JOIN search_stats ss ON ss.session_id = sh.session_id
+        WHERE sh.start_hour IS NOT NULL AND sh.start_hour > ?
+        ORDER BY sh.start_hour
+        """, params=(-(1 << 62) if since_hour is None else since_hour,))
+        session_data['completed'] = session_data['completed'].astype(bool)
+        return session_data
+    
+    def get_cube_facts(self):
+        """Per-session cube dimensions (user attributes, landing page type, start day number) and measures."""
+        facts = self.execute_query("""
+        WITH page_stats AS (
+            SELECT session_id,
+                   MAX(CASE WHEN page_type = 'homepage' THEN 1 ELSE 0 END) as homepage_view,
+                   MAX(CASE WHEN page_type = 'product_listing' THEN 1 ELSE 0 END) as product_listing_view,
+                   MAX(CASE WHEN page_type = 'product_detail' THEN 1 ELSE 0 END) as product_detail_view
+            FROM page_views GROUP BY session_id
+        ),
+        landing_pages AS (
+            SELECT session_id, page_type as landing_page
+            FROM (
+                SELECT session_id, page_type,
+                       ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY timestamp, rowid) as position
+                FROM page_views
+                WHERE timestamp IS NOT NULL
+            )
+            WHERE position = 1
+        ),
+        cart_stats AS (
+            SELECT c.session_id,
+                   MAX(CASE WHEN c.event_type = 'add_to_cart' THEN 1 ELSE 0 END) as add_to_cart,
+                   SUM(CASE WHEN c.event_type = 'add_to_cart' AND p.product_id IS NOT NULL
+                            THEN COALESCE(p.price, 0) * COALESCE(c.quantity, 0) ELSE 0 END) as cart_value
+            FROM cart_events c
+            LEFT JOIN products p ON p.product_id = c.product_id
+            GROUP BY c.session_id
+        ),
+        checkout_stats AS (
+            SELECT session_id,
+                   MAX(CASE WHEN step = 'checkout_start' THEN 1 ELSE 0 END) as checkout_start,
+                   MAX(CASE WHEN step = 'shipping_info' THEN 1 ELSE 0 END) as shipping_info,
+                   MAX(CASE WHEN step = 'payment_info' THEN 1 ELSE 0 END) as payment_info
+            FROM checkout_events GROUP BY session_id
+        )
+        SELECT
+            u.device_type,
+            u.browser,
+            u.country,
+            u.referrer,
+            lp.landing_page,
+            s.start_time,
+            CASE WHEN s.conversion_status = 'completed' THEN 1 ELSE 0 END as completed,
+            COALESCE(cs.cart_value, 0) as cart_value,
+            COALESCE(ps.homepage_view, 0) as homepage_view,
+            COALESCE(ps.product_listing_view, 0) as product_listing_view,
+            COALESCE(ps.product_detail_view, 0) as product_detail_view,
+            COALESCE(cs.add_to_cart, 0) as add_to_cart,
+            COALESCE(chs.checkout_start, 0) as checkout_start,
+            COALESCE(chs.shipping_info, 0) as shipping_info,
+            COALESCE(chs.payment_info, 0) as payment_info
+        FROM
+            sessions s
+        LEFT JOIN users u ON u.user_id = s.user_id
+        LEFT JOIN landing_pages lp ON lp.session_id = s.session_id
+        LEFT JOIN page_stats ps ON ps.session_id = s.session_id
+        LEFT JOIN cart_stats cs ON cs.session_id = s.session_id
+        LEFT JOIN checkout_stats chs ON chs.session_id = s.session_id
+        ORDER BY s.rowid
+        """)
+        facts.insert(5, 'day', to_days(facts.pop('start_time')))
+        for column in ['completed', 'homepage_view', 'product_listing_view', 'product_detail_view', 'add_to_cart',
+                       'checkout_start', 'shipping_info', 'payment_info']:
+            facts[column] = facts[column].astype(bool)
+        return facts
+    
+    def get_cohort_activity(self):
+        """Users (id, first visit) and sessions (user, start, status) that cohort activity is counted from.
+
+        The raw frames; `cohorts.frame_cohort_activity` buckets them.
+        """
+        users = self.execute_query("SELECT user_id, first_visit_date FROM users")
+        sessions = self.execute_query("SELECT user_id, start_time, conversion_status FROM sessions")
+        return users, sessions
+    
+    def get_metric_rollups(self, granularity='hour', since=None):
+        """Funnel, conversion and exit counts per hour or day of session start, for buckets after `since`."""
+        hours = {'hour': 1, 'day': 24}[granularity]
+        rollups = self.execute_query("""
+        WITH page_stats AS (
+            SELECT session_id,
+                   COUNT(*) as page_views,
+                   SUM(COALESCE(exit_page, 0)) as exits,
+                   MAX(CASE WHEN page_type = 'homepage' THEN 1 ELSE 0 END) as homepage_view,
+                   MAX(CASE WHEN page_type = 'product_listing' THEN 1 ELSE 0 END) as product_listing_view,
+                   MAX(CASE WHEN page_type = 'product_detail' THEN 1 ELSE 0 END) as product_detail_view
+            FROM page_views GROUP BY session_id
+        ),
+        cart_stats AS (
+            SELECT session_id, MAX(CASE WHEN event_type = 'add_to_cart' THEN 1 ELSE 0 END) as add_to_cart
+            FROM cart_events GROUP BY session_id
+        ),
+        checkout_stats AS (
+            SELECT session_id,
+                   MAX(CASE WHEN step = 'checkout_start' THEN 1 ELSE 0 END) as checkout_start,
+                   MAX(CASE WHEN step = 'shipping_info' THEN 1 ELSE 0 END) as shipping_info,
+                   MAX(CASE WHEN step = 'payment_info' THEN 1 ELSE 0 END) as payment_info
+            FROM checkout_events GROUP BY session_id
+        ),
+        session_buckets AS (
+            SELECT session_id, conversion_status,
+                   CAST(strftime('%s', start_time) AS INTEGER) / 3600 / ? as bucket
+            FROM sessions
+            WHERE start_time IS NOT NULL
+        )
+        SELECT
+            sb.bucket,
+            COUNT(*) as sessions,
+            SUM(COALESCE(ps.homepage_view, 0)) as homepage_view,
+            SUM(COALESCE(ps.product_listing_view, 0)) as product_listing_view,
+            SUM(COALESCE(ps.product_detail_view, 0)) as product_detail_view,
+            SUM(COALESCE(cs.add_to_cart, 0)) as add_to_cart,
+            SUM(COALESCE(chs.checkout_start, 0)) as checkout_start,
+            SUM(COALESCE(chs.shipping_info, 0)) as shipping_info,
+            SUM(COALESCE(chs.payment_info, 0)) as payment_info,
+            SUM(CASE WHEN sb.conversion_status = 'completed' THEN 1 ELSE 0 END) as completed,
+            SUM(COALESCE(ps.page_views, 0)) as page_views,
+            SUM(COALESCE(ps.exits, 0)) as exits
+        FROM
+            session_buckets sb
+        LEFT JOIN page_stats ps ON ps.session_id = sb.session_id
+        LEFT JOIN cart_stats cs ON cs.session_id = sb.session_id
+        LEFT JOIN checkout_stats chs ON chs.session_id = sb.session_id
+        WHERE sb.bucket IS NOT NULL AND sb.bucket > ?
+        GROUP BY sb.bucket
+        ORDER BY sb.bucket
+        """, params=(hours, -1 if since is None else since))
+        return rollups.set_index('bucket')
@@ -146,6 +146,18 @@ Focus on actionable insights that directly address the friction points in the us
                 for query in search['zero_results'][:5]:  # Top 5
                     summary.append(f"- {query['query']}: {query['count']} searches")
             
+            if 'zero_result_matches' in search and search['zero_result_matches']:
+                summary.append(f"\nZero-result searches whose query the catalog matches: {search.get('zero_results_with_catalog_match', 'n/a')}")
+                for m in search['zero_result_matches'][:5]:  # Top 5
+                    match = f"closest product {m['closest_product']} (score {m['match_score']})" if m['closest_product'] else "no catalog match"
+                    summary.append(f"- {m['query']}: {m['searches']} searches, {match}")
+            
+            if 'synonym_candidates' in search and search['synonym_candidates']:
+                summary.append("\nQuery terms missing from the catalog (zero-result searches a synonym would fix):")
+                for c in search['synonym_candidates'][:5]:  # Top 5
+                    closest = f", closest catalog term '{c['closest_term']}'" if c['closest_term'] else ""
+                    summary.append(f"- {c['term']}: {c['fixable_searches']} searches{closest}")
+            
             if 'search_conversion_rate' in search:
                 summary.append(f"\nSearch to purchase conversion rate: {search['search_conversion_rate']}")
             summary.append("")
@@ -191,6 +203,162 @@ Focus on actionable insights that directly address the friction points in the us
                 summary.append("\nDevice type analysis:")
                 for d in segments['device_type_analysis']:
                     summary.append(f"- {d['device_type']}: {d['user_count']} users, {d['avg_conversion_rate']} avg conversion rate")
+            
+            if 'significant_segments' in segments and segments['significant_segments']:
+                summary.append("\nSegments converting significantly differently from the rest (5% false discovery rate):")
+                for c in segments['significant_segments'][:5]:  # Top 5
+                    summary.append(f"- {c['segment']}: {c['conversion_rate']} vs {c['rest_conversion_rate']} over {c['sessions']} sessions (q={c['q_value']})")
+            summary.append("")
+        
+        # Page Transitions
+        if 'page_transitions' in analysis_results:
+            transitions = analysis_results['page_transitions']
+            summary.append("## Page Transition Analysis")
+            
+            if 'conversion_probability' in transitions:
+                summary.append(f"Conversion probability from entry: {transitions['conversion_probability']}")
+            
+            if 'page_types' in transitions and transitions['page_types']:
+                summary.append("\nPage types (removal effect = share of conversions lost without the page):")
+                for p in transitions['page_types']:
+                    summary.append(f"- {p['page_type']}: {p['conversion_probability']} conversion probability, "
+                                   f"{p['steps_to_conversion']} steps to conversion, {p['removal_effect']} removal effect")
+            
+            if 'top_transitions' in transitions and transitions['top_transitions']:
+                summary.append("\nMost frequent transitions:")
+                for t in transitions['top_transitions'][:5]:  # Top 5
+                    summary.append(f"- {t['transition']}: {t['count']} ({t['probability']})")
+            summary.append("")
+        
+        # Journey Paths
+        if 'journey_paths' in analysis_results:
+            paths = analysis_results['journey_paths']
+            summary.append("## Journey Path Analysis")
+            
+            if 'conversion_rate' in paths:
+                summary.append(f"Sessions: {paths.get('sessions')}, overall conversion rate: {paths['conversion_rate']}")
+            
+            if 'top_paths' in paths and paths['top_paths']:
+                summary.append("\nMost frequent journey paths (from entry):")
+                for p in paths['top_paths'][:5]:  # Top 5
+                    summary.append(f"- {p['path']}: {p['sessions']} sessions ({p['share']}), {p['conversion_rate']} conversion rate")
+            
+            if 'converting_paths' in paths and paths['converting_paths']:
+                summary.append("\nHighest-converting frequent paths:")
+                for p in paths['converting_paths'][:3]:  # Top 3
+                    summary.append(f"- {p['path']}: {p['conversion_rate']} conversion rate over {p['sessions']} sessions")
+            
+            if 'dead_ends' in paths and paths['dead_ends']:
+                summary.append("\nPaths where most journeys end without converting:")
+                for p in paths['dead_ends'][:3]:  # Top 3
+                    summary.append(f"- {p['path']}: {p['exits']} sessions ({p['exit_share']})")
+            summary.append("")
+        
+        # Cohort Retention
+        if 'cohort_retention' in analysis_results:
+            cohorts = analysis_results['cohort_retention']
+            period = cohorts.get('period', 'month')
+            summary.append("## Cohort Retention Analysis")
+            
+            if 'retention_curve' in cohorts and cohorts['retention_curve']:
+                summary.append(f"Average curve by {period} since acquisition:")
+                for c in cohorts['retention_curve']:
+                    summary.append(f"- {period.capitalize()} {c['period_number']}: {c['retention']} active, "
+                                   f"{c['conversion']} converting, {c['repeat_purchase']} repeat buyers")
+            
+            if 'cohorts' in cohorts and cohorts['cohorts']:
+                summary.append("\nRecent cohorts (retention by period):")
+                for c in cohorts['cohorts'][:6]:  # Latest 6
+                    summary.append(f"- {c['cohort']} ({c['users']} users): {', '.join(c['retention'])}")
+            summary.append("")
+        
+        # Funnel Trends
+        if 'funnel_trends' in analysis_results:
+            trends = analysis_results['funnel_trends']
+            summary.append("## Funnel Trend Monitoring")
+            
+            if 'metrics' in trends and trends['metrics']:
+                summary.append(f"Per-{trends.get('granularity', 'day')} rates through {trends.get('through', '-')} "
+                               "(latest vs baseline, alerts):")
+                for m in trends['metrics']:
+                    summary.append(f"- {m['metric']}: {m['latest_rate']} vs {m['baseline']}, {m['alerts']} alerts")
+            
+            if 'recent_alerts' in trends and trends['recent_alerts']:
+                summary.append("\nMost recent anomaly alerts:")
+                for a in trends['recent_alerts'][-5:]:  # Last 5
+                    summary.append(f"- {a['bucket']} {a['metric']}: {a['rate']} (expected {a['expected']}, {a['direction']})")
+            summary.append("")
+        
+        # Product Affinity
+        if 'product_affinity' in analysis_results:
+            affinity = analysis_results['product_affinity']
+            summary.append("## Product Affinity Analysis")
+            
+            if 'top_pairs' in affinity and affinity['top_pairs']:
+                summary.append(f"Strongest product pairs ({affinity.get('baskets', 0)} session baskets, lift = times more often together than chance):")
+                for p in affinity['top_pairs'][:5]:  # Top 5
+                    summary.append(f"- {p['product']} + {p['neighbor']}: {p['sessions']} sessions, {p['confidence']} confidence, {p['lift']} lift")
+            
+            if 'product_neighbors' in affinity and affinity['product_neighbors']:
+                summary.append("\nMost associated products for the most frequent products:")
+                for p in affinity['product_neighbors']:
+                    summary.append(f"- {p['product']}: {p['neighbors']}")
+            summary.append("")
+        
+        # Conversion Cube
+        if 'conversion_cube' in analysis_results:
+            cube = analysis_results['conversion_cube']
+            summary.append("## Conversion Drill-Down")
+            
+            if 'by_landing_page' in cube and cube['by_landing_page']:
+                summary.append(f"Conversion by landing page ({cube.get('sessions', 0)} sessions, {cube.get('conversion_rate', '-')} overall):")
+                for l in cube['by_landing_page'][:5]:  # Top 5
+                    summary.append(f"- {l['landing_page']}: {l['sessions']} sessions, {l['conversion_rate']} conversion, {l['cart_value_per_session']} cart value per session")
+            
+            if 'by_country' in cube and cube['by_country']:
+                summary.append("\nConversion by country:")
+                for c in cube['by_country'][:5]:  # Top 5
+                    summary.append(f"- {c['country']}: {c['sessions']} sessions, {c['conversion_rate']} conversion")
+            
+            for key, title in [('best_segments', "Best-converting"), ('worst_segments', "Worst-converting")]:
+                if key in cube and cube[key]:
+                    summary.append(f"\n{title} device / referrer / landing page segments:")
+                    for s in cube[key][:3]:
+                        summary.append(f"- {s['device_type']} / {s['referrer']} / {s['landing_page']}: {s['sessions']} sessions, {s['conversion_rate']} conversion")
+            summary.append("")
+        
+        # Checkout Latency
+        if 'checkout_latency' in analysis_results:
+            latency = analysis_results['checkout_latency']
+            summary.append("## Checkout Step Latency")
+            
+            if 'steps' in latency and latency['steps']:
+                summary.append(f"Time to complete each checkout step and abandonment hazard ({latency.get('events', 0)} checkout events):")
+                for st in latency['steps']:
+                    summary.append(f"- {st['step']}: {st['reached']} sessions, {st['abandonment_hazard']} abandon here, p50 {st['p50']}, p90 {st['p90']}, p99 {st['p99']}")
+            
+            if 'device_steps' in latency and latency['device_steps']:
+                summary.append("\nBy device (p50 / p90):")
+                for st in latency['device_steps']:
+                    if st['p90'] != '-':
+                        summary.append(f"- {st['step']} on {st['device_type']}: {st['p50']} / {st['p90']}, {st['abandonment_hazard']} abandon")
+            summary.append("")
+        
+        # Revenue
+        if 'revenue' in analysis_results:
+            revenue = analysis_results['revenue']
+            summary.append("## Revenue and Order Value")
+            
+            if 'revenue' in revenue:
+                summary.append(f"Revenue: {revenue['revenue']} from {revenue['orders']} orders over {revenue['sessions']} sessions")
+                summary.append(f"Average order value: {revenue['average_order_value']}, revenue per session: {revenue['revenue_per_session']}")
+                summary.append(f"Value left in {revenue['abandoned_carts']} abandoned carts: {revenue['value_at_risk']}")
+            
+            for key, dimension, title in [('by_device', 'device_type', "device"), ('by_referrer', 'referrer', "referrer")]:
+                if key in revenue and revenue[key]:
+                    summary.append(f"\nBy {title} (revenue, AOV, revenue per session, value at risk):")
+                    for r in revenue[key][:5]:  # Top 5
+                        summary.append(f"- {r[dimension]}: {r['revenue']}, {r['average_order_value']}, {r['revenue_per_session']}, {r['value_at_risk']}")
             summary.append("")
         
         return "\n".join(summary)
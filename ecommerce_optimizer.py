@@ -1,13 +1,15 @@
 import os
 import json
 import sqlite3
-import uuid
 import random
 from datetime import datetime, timedelta
+from id_generators import get_id_generator
 
 # Create a simple database and generate demo data
-def setup_database():
+def setup_database(id_strategy='uuid'):
     print("Setting up database...")
+    id_generator = get_id_generator(id_strategy)
+    id_type = id_generator.sql_type
     # Remove existing database if it exists
     if os.path.exists('ecommerce_data.db'):
         os.remove('ecommerce_data.db')
@@ -18,28 +20,28 @@ def setup_database():
     cursor = conn.cursor()
     
     # Create tables
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE users (
-        user_id TEXT PRIMARY KEY,
+        user_id {id_type} PRIMARY KEY,
         device_type TEXT,
         referrer TEXT
     )
     ''')
     
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE sessions (
-        session_id TEXT PRIMARY KEY,
-        user_id TEXT,
+        session_id {id_type} PRIMARY KEY,
+        user_id {id_type},
         start_time TEXT,
         conversion_status TEXT,
         FOREIGN KEY (user_id) REFERENCES users(user_id)
     )
     ''')
     
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE page_views (
-        view_id TEXT PRIMARY KEY,
-        session_id TEXT,
+        view_id {id_type} PRIMARY KEY,
+        session_id {id_type},
         page_type TEXT,
         time_spent_seconds INTEGER,
         exit_page INTEGER,
@@ -47,30 +49,30 @@ def setup_database():
     )
     ''')
     
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE product_views (
-        view_id TEXT PRIMARY KEY,
-        session_id TEXT,
-        product_id TEXT,
+        view_id {id_type} PRIMARY KEY,
+        session_id {id_type},
+        product_id {id_type},
         time_spent_seconds INTEGER,
         FOREIGN KEY (session_id) REFERENCES sessions(session_id)
     )
     ''')
     
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE cart_events (
-        event_id TEXT PRIMARY KEY,
-        session_id TEXT,
-        product_id TEXT,
+        event_id {id_type} PRIMARY KEY,
+        session_id {id_type},
+        product_id {id_type},
         event_type TEXT,
         FOREIGN KEY (session_id) REFERENCES sessions(session_id)
     )
     ''')
     
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE TABLE checkout_events (
-        checkout_id TEXT PRIMARY KEY,
-        session_id TEXT,
+        checkout_id {id_type} PRIMARY KEY,
+        session_id {id_type},
         step TEXT,
         status TEXT,
         FOREIGN KEY (session_id) REFERENCES sessions(session_id)
@@ -92,10 +94,13 @@ def setup_database():
     
     page_types = ['homepage', 'product_listing', 'product_detail', 'cart', 'checkout']
     
+    # Product catalogue ids
+    product_ids = [id_generator.new_id() for _ in range(50)]
+    
     # Generate users
     users = []
     for i in range(100):
-        user_id = str(uuid.uuid4())
+        user_id = id_generator.new_id()
         device_type = random.choices(device_types, weights=device_weights)[0]
         referrer = random.choices(referrers, weights=referrer_weights)[0]
         
@@ -114,7 +119,7 @@ def setup_database():
     for user_id, _, _ in users:
         # Each user has 1-3 sessions
         for _ in range(random.randint(1, 3)):
-            session_id = str(uuid.uuid4())
+            session_id = id_generator.new_id()
             
             # 20% conversion rate
             conversion_status = 'completed' if random.random() < 0.2 else 'abandoned'
@@ -124,7 +129,7 @@ def setup_database():
             
             # Generate page views for this session
             for page_type in page_types[:random.randint(1, len(page_types))]:
-                view_id = str(uuid.uuid4())
+                view_id = id_generator.new_id()
                 time_spent = random.randint(5, 300)  # 5-300 seconds
                 exit_page = 1 if random.random() < 0.2 else 0  # 20% chance to be an exit page
                 
@@ -133,16 +138,16 @@ def setup_database():
             # Some sessions have product views
             if random.random() < 0.7:  # 70% chance
                 for _ in range(random.randint(1, 3)):
-                    view_id = str(uuid.uuid4())
-                    product_id = f"product_{random.randint(1, 50)}"
+                    view_id = id_generator.new_id()
+                    product_id = random.choice(product_ids)
                     time_spent = random.randint(10, 180)  # 10-180 seconds
                     
                     product_views.append((view_id, session_id, product_id, time_spent))
                 
                 # Some sessions have cart events
                 if random.random() < 0.5:  # 50% chance
-                    event_id = str(uuid.uuid4())
-                    product_id = f"product_{random.randint(1, 50)}"
+                    event_id = id_generator.new_id()
+                    product_id = random.choice(product_ids)
                     event_type = 'add_to_cart'
                     
                     cart_events.append((event_id, session_id, product_id, event_type))
@@ -152,7 +157,7 @@ def setup_database():
                         checkout_steps = ['checkout_start', 'shipping_info', 'payment_info', 'review_order']
                         
                         for step in checkout_steps[:random.randint(1, len(checkout_steps))]:
-                            checkout_id = str(uuid.uuid4())
+                            checkout_id = id_generator.new_id()
                             status = 'completed' if conversion_status == 'completed' or random.random() < 0.7 else 'abandoned'
                             
                             checkout_events.append((checkout_id, session_id, step, status))
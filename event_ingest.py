@@ -0,0 +1,353 @@
+import json
+import math
+import time
+import atexit
+import sqlite3
+import threading
+from itertools import chain
+from datetime import datetime, timezone
+from database import EcommerceDatabase
+from generate_data import EVENT_BUFFERS
+from data_import import TIME_COLUMNS, MIN_INTEGER, MAX_INTEGER, to_integer, to_bytes
+
+# Tables the endpoint accepts, in the order a commit writes them (users and sessions before their events)
+INGEST_TABLES = ['users'] + [table for _, table in EVENT_BUFFERS]
+
+# Invalid-record messages returned with a rejected batch
+MAX_ERRORS = 20
+
+# Largest request body the endpoint accepts
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# Bound parameters allowed in one statement (SQLite raised its default limit in 3.32)
+MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+
+def iso_datetime(value):
+    """A datetime from ISO 8601 text, accepting a trailing Z for UTC (fromisoformat only does from Python 3.11)."""
+    return datetime.fromisoformat(value[:-1] + '+00:00' if value[-1:] in ('Z', 'z') else value)
+
+
+def to_utc(moment):
+    """A naive UTC datetime: zoned times are converted, naive ones are taken to be UTC already."""
+    return moment if moment.tzinfo is None else moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp(value):
+    """ISO 8601 text for a timestamp, as written by the data generator; zoned times are converted to UTC."""
+    moment = iso_datetime(value)
+    if moment.tzinfo is None and value[10:11] == 'T':
+        return value
+    return to_utc(moment).isoformat()
+
+
+def to_text(value):
+    """Text for a non-string value (JSON for objects and lists)."""
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def to_real(value):
+    """A float from a number or its text."""
+    return float(value)
+
+
+# Per-value conversions by declared column type; strings pass through text columns unchanged
+CONVERTERS = {'INTEGER': to_integer, 'REAL': to_real, 'BLOB': to_bytes}
+
+# Python types a column may already hold as-is (besides None)
+NATIVE_TYPES = {to_text: {str}, to_integer: {int}, to_real: {int, float}}
+
+
+def column_converters(info):
+    """(column, converter) pairs from a table's PRAGMA table_info rows; timestamp text is normalized to UTC."""
+    return [(row[1], to_timestamp if row[1] in TIME_COLUMNS and row[2].upper() == 'TEXT'
+             else CONVERTERS.get(row[2].upper(), to_text)) for row in info]
+
+
+def transient(error):
+    """Whether a failed write may succeed if retried (the database was busy or locked)."""
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+
+def convert_column(values, convert):
+    """A column's values converted in one pass ('' becomes None), or None if some value needs checking alone."""
+    kinds = set(map(type, values))
+    kinds.discard(type(None))
+    if kinds <= NATIVE_TYPES.get(convert, set()):
+        if convert is to_integer and not all(MIN_INTEGER <= value <= MAX_INTEGER for value in values if value is not None):
+            return None
+        return [value if value != '' else None for value in values] if str in kinds else values
+    if kinds == {str}:
+        try:
+            return [convert(value) if value else None for value in values]
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class EventIngestor:
+    """Validates batches of events and writes them in group commits from a background thread.
+
+    A batch is newline-delimited JSON. Each line is a row of one of
+    `INGEST_TABLES` with a "table" key naming it, the format `HttpSink`
+    posts. Each record is checked against its table's declared column types
+    by a per-column conversion, so a batch is validated in one pass without
+    touching the database. A batch with any invalid record is rejected
+    whole, so a client never has to work out which part was taken. Missing
+    primary keys get a new id; columns the table lacks are ignored.
+
+    Valid rows are appended to per-table buffers. The writer thread drains
+    every buffer and commits it in one transaction once `batch_size` rows
+    are waiting or the oldest has waited `flush_interval` seconds, so many
+    requests share one commit. Rows whose primary key exists are skipped, so
+    a client can resend a batch it is unsure about. A write that failed
+    because the database was busy or locked is retried with backoff while
+    new rows keep buffering; any other failure drops the drained rows and
+    counts them, so one bad commit cannot stall the writer.
+
+    Accepted rows are not durable until their commit. `backpressure()` says
+    when to refuse new batches: once `max_pending` rows are buffered or
+    being written (429), or while writes are failing (503), with a
+    Retry-After estimated from the write rate so far.
+    """
+
+    def __init__(self, db=None, batch_size=20000, flush_interval=0.05, max_pending=100000):
+        """Initialize an ingestor for an `EcommerceDatabase`; the writer starts with the first batch."""
+        self.db = db if db else EcommerceDatabase()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.schemas, self.keys = {}, {}
+        conn = self.db.connect()
+        try:
+            for table in INGEST_TABLES:
+                info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                self.schemas[table] = column_converters(info)
+                self.keys[table] = next(number for number, row in enumerate(info) if row[5])
+        finally:
+            self.db.close()
+        self.statements = {
+            table: f"INSERT OR IGNORE INTO {table} ({', '.join(column for column, _ in schema)}) VALUES "
+            for table, schema in self.schemas.items()
+        }
+        self.placeholders = {table: f"({', '.join('?' for _ in schema)})" for table, schema in self.schemas.items()}
+
+        self.condition = threading.Condition()
+        self.buffers = {table: [] for table in INGEST_TABLES}
+        self.buffered = 0
+        self.writing = 0
+        self.oldest = None
+        self.writer = None
+        self.stopping = False
+        self.error = None
+        self.write_rate = None
+        self.write_seconds = 0.0
+        self.counters = {'batches': 0, 'accepted': 0, 'rejected_batches': 0, 'refused_batches': 0,
+                         'written': 0, 'duplicates': 0, 'commits': 0, 'largest_commit': 0, 'failed_commits': 0,
+                         'dropped_commits': 0, 'dropped': 0}
+        self.drop_error = None
+        self.last_commit_ms = None
+
+    @property
+    def pending(self):
+        """Rows accepted but not yet committed."""
+        return self.buffered + self.writing
+
+    # Request side
+
+    def backpressure(self):
+        """(HTTP status, Retry-After seconds) when new batches should be refused, else None."""
+        with self.condition:
+            if self.error is not None or self.stopping:
+                status = 503
+            elif self.pending >= self.max_pending:
+                status = 429
+            else:
+                return None
+            self.counters['refused_batches'] += 1
+            rate = self.write_rate or self.batch_size / max(self.flush_interval, 0.01)
+            return status, min(30, max(1, math.ceil(self.pending / rate)))
+
+    def parse(self, body):
+        """Rows per table from an NDJSON batch; raises ValueError describing its invalid records."""
+        lines = [line for line in body.decode('utf-8', errors='replace').split('\n') if line.strip()]
+        try:
+            # One parse of the whole batch; only a malformed batch is parsed line by line to locate errors
+            records = json.loads('[' + ','.join(lines) + ']')
+        except ValueError:
+            records = None
+        if records is None or len(records) != len(lines):
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError as e:
+                    records.append(f"invalid JSON ({e})")
+
+        # Records grouped by table, then validated a column at a time
+        groups = {}
+        errors = []
+        for number, record in enumerate(records, 1):
+            if isinstance(record, str):
+                errors.append((number, record))
+            elif not isinstance(record, dict):
+                errors.append((number, "not a JSON object"))
+            elif record.get('table') not in self.schemas:
+                errors.append((number, f"unknown table {record.get('table')!r}; expected one of {INGEST_TABLES}"))
+            else:
+                numbers, group = groups.setdefault(record['table'], ([], []))
+                numbers.append(number)
+                group.append(record)
+
+        rows = {}
+        for table, (numbers, group) in groups.items():
+            columns = []
+            for column, convert in self.schemas[table]:
+                values = [record.get(column) for record in group]
+                converted = convert_column(values, convert)
+                if converted is None:
+                    converted = []
+                    for number, value in zip(numbers, values):
+                        try:
+                            converted.append(convert(value) if value is not None and value != '' else None)
+                        except (TypeError, ValueError):
+                            converted.append(None)
+                            errors.append((number, f"{column}={value!r} is not valid for {table}"))
+                columns.append(converted)
+            key = columns[self.keys[table]]
+            for position, value in enumerate(key):
+                if value is None:
+                    key[position] = self.db.new_id()
+            rows[table] = list(zip(*columns))
+
+        if errors:
+            with self.condition:
+                self.counters['rejected_batches'] += 1
+            messages = [f"line {number}: {message}" for number, message in sorted(errors)[:MAX_ERRORS]]
+            if len(errors) > MAX_ERRORS:
+                messages.append(f"{len(errors) - MAX_ERRORS} more")
+            raise ValueError(f"Batch rejected: {'; '.join(messages)}")
+        return rows
+
+    def submit(self, body):
+        """Validate an NDJSON batch and buffer its rows for the next group commit; returns how many were accepted."""
+        rows = self.parse(body)
+        accepted = sum(len(table_rows) for table_rows in rows.values())
+        with self.condition:
+            if self.writer is None:
+                self.start()
+            for table, table_rows in rows.items():
+                self.buffers[table].extend(table_rows)
+            if not self.buffered:
+                self.oldest = time.perf_counter()
+            self.buffered += accepted
+            self.counters['batches'] += 1
+            self.counters['accepted'] += accepted
+            # Wake the writer to start the flush timer, or when a full commit is waiting
+            if self.buffered == accepted or self.buffered >= self.batch_size:
+                self.condition.notify()
+        return accepted
+
+    # Writer side
+
+    def start(self):
+        """Start the writer thread (called with the condition held); it drains the buffers at exit."""
+        self.writer = threading.Thread(target=self._write_loop, name='event-ingest-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def close(self, timeout=30):
+        """Stop accepting batches and wait for the writer to commit what is buffered."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+            writer = self.writer
+        if writer is not None:
+            writer.join(timeout)
+
+    def _write_loop(self):
+        """Drain the buffers into one transaction at a time until stopped and empty."""
+        conn = self.db.connect()
+        try:
+            while True:
+                with self.condition:
+                    while not self.stopping:
+                        if self.buffered >= self.batch_size:
+                            break
+                        if self.buffered:
+                            wait = self.oldest + self.flush_interval - time.perf_counter()
+                            if wait <= 0:
+                                break
+                        else:
+                            wait = None
+                        self.condition.wait(wait)
+                    if not self.buffered:
+                        return
+                    buffers = self.buffers
+                    self.buffers = {table: [] for table in INGEST_TABLES}
+                    self.writing, self.buffered = self.buffered, 0
+                self._commit(conn, buffers)
+        finally:
+            self.db.close()
+
+    def _commit(self, conn, buffers):
+        """Write drained buffers in one transaction, retrying transient failures with backoff; others drop them."""
+        rows = self.writing
+        delay = 0.05
+        while True:
+            started = time.perf_counter()
+            try:
+                inserted = 0
+                with conn:
+                    for table in INGEST_TABLES:
+                        inserted += self._insert(conn, table, buffers[table])
+                break
+            except Exception as e:
+                # A failed COMMIT can leave the transaction open; retry from a clean slate
+                if conn.in_transaction:
+                    conn.rollback()
+                with self.condition:
+                    self.counters['failed_commits'] += 1
+                    if not transient(e):
+                        self.error = None
+                        self.writing = 0
+                        self.drop_error = f"{type(e).__name__}: {e}"
+                        self.counters['dropped_commits'] += 1
+                        self.counters['dropped'] += rows
+                        return
+                    self.error = f"{type(e).__name__}: {e}"
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        seconds = time.perf_counter() - started
+        with self.condition:
+            self.error = None
+            self.writing = 0
+            self.counters['written'] += inserted
+            self.counters['duplicates'] += rows - inserted
+            self.counters['commits'] += 1
+            self.counters['largest_commit'] = max(self.counters['largest_commit'], rows)
+            self.last_commit_ms = seconds * 1000
+            self.write_seconds += seconds
+            self.write_rate = (self.counters['written'] + self.counters['duplicates']) / max(self.write_seconds, 1e-6)
+
+    def _insert(self, conn, table, rows):
+        """Insert rows with as few multi-row statements as the variable limit allows; returns rows inserted.
+
+        The sqlite3 module releases the GIL around each statement step, so
+        `executemany` would hand it back and wait for it once per row while
+        request threads parse; one step per few thousand rows avoids that.
+        """
+        inserted = 0
+        per_statement = max(1, MAX_VARIABLES // len(self.schemas[table]))
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            statement = self.statements[table] + ','.join([self.placeholders[table]] * len(chunk))
+            inserted += conn.execute(statement, list(chain.from_iterable(chunk))).rowcount
+        return inserted
+
+    def stats(self):
+        """Counters since start, plus the current buffer and writer state."""
+        with self.condition:
+            return dict(self.counters, pending=self.pending, writer_error=self.error,
+                        last_commit_ms=self.last_commit_ms, write_rate=self.write_rate, drop_error=self.drop_error)
+
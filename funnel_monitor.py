@@ -0,0 +1,262 @@
+import os
+import math
+import time
+import pickle
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from analysis_engine import FUNNEL_STEPS, ROLLUP_GRANULARITIES, SESSION_FLAGS
+
+# Bump when the layout of the persisted detector state changes
+MONITOR_VERSION = 1
+
+# Seasonal slots per granularity: hour of day for hourly buckets, day of week for daily ones
+SEASONS = {'hour': 24, 'day': 7}
+
+# Rollup columns holding the session count at each funnel step, in FUNNEL_STEPS order
+STEP_COLUMNS = SESSION_FLAGS + ['completed']
+
+# Monitored rates, in report order
+METRICS = [f"{step}_drop_off" for step in FUNNEL_STEPS[:-1]] + ['conversion_rate', 'exit_rate']
+
+# Buckets whose rate is out of fewer than this many sessions (or page views) only update the baselines
+MIN_COUNT = 10
+
+# Direction in which each kind of metric gets worse
+WORSE_DIRECTIONS = {'drop_off': 'increase', 'conversion_rate': 'decrease', 'exit_rate': 'increase'}
+
+
+def rollup_rates(rollups):
+    """Per-bucket funnel drop-off, conversion and exit rates, and the counts each rate is out of.
+
+    Returns (rates, denominators): frames indexed by bucket with one column
+    per metric. A rate is NaN in buckets where its denominator is zero. A
+    step that sessions can skip (so more of them reach the next step) reads
+    as no drop-off rather than a negative one.
+    """
+    rates, denominators = {}, {}
+    for step, current, following in zip(FUNNEL_STEPS, STEP_COLUMNS, STEP_COLUMNS[1:]):
+        name = f"{step}_drop_off"
+        denominators[name] = rollups[current]
+        rates[name] = (1 - rollups[following] / rollups[current].replace(0, np.nan)).clip(lower=0)
+    denominators['conversion_rate'] = rollups['sessions']
+    rates['conversion_rate'] = rollups['completed'] / rollups['sessions'].replace(0, np.nan)
+    denominators['exit_rate'] = rollups['page_views']
+    rates['exit_rate'] = rollups['exits'] / rollups['page_views'].replace(0, np.nan)
+    return pd.DataFrame(rates), pd.DataFrame(denominators)
+
+
+def metric_kind(metric):
+    """'drop_off', 'conversion_rate' or 'exit_rate'."""
+    return 'drop_off' if metric.endswith('_drop_off') else metric
+
+
+def bucket_label(bucket, granularity):
+    """ISO label for a bucket number: 'YYYY-MM-DDTHH' for hours, 'YYYY-MM-DD' for days."""
+    return str(np.datetime64(int(bucket), 'h' if granularity == 'hour' else 'D'))
+
+
+def season_slot(bucket, granularity):
+    """Seasonal slot of a bucket: hour of day (UTC), or day of week with Monday as 0."""
+    return int(bucket % 24) if granularity == 'hour' else int((bucket + 3) % 7)
+
+
+class RateDetector:
+    """EWMA baselines and two-sided CUSUM for one rate, updated one bucket at a time.
+
+    The expected rate is an exponentially weighted average kept per seasonal
+    slot (once that slot has `min_periods` buckets) and overall; nothing is
+    scored during the first `min_periods` seasonal cycles. Each
+    bucket's deviation is standardized with the binomial variance of the
+    expected rate over the bucket's denominator, then scaled by a running
+    estimate of over-dispersion, so metrics with noisier buckets are not
+    flagged more often; buckets out of fewer than `min_count` only update
+    the baselines. A bucket alerts as a 'spike' when its standardized
+    deviation alone reaches `spike`, and as 'cusum' when the accumulated
+    drift (beyond `k` per bucket) reaches `h`; the sums restart after an
+    alert. Each update is constant work.
+    """
+
+    def __init__(self, seasons=1, alpha=0.1, k=0.5, h=5.0, spike=4.0, min_periods=3, min_count=MIN_COUNT):
+        self.alpha = alpha
+        self.k = k
+        self.h = h
+        self.spike = spike
+        self.min_periods = min_periods
+        self.min_count = min_count
+        self.baselines = np.full(seasons, np.nan)
+        self.seen = np.zeros(seasons, dtype=np.int64)
+        self.level = math.nan
+        self.dispersion = 1.0
+        self.upper = 0.0
+        self.lower = 0.0
+        self.updates = 0
+
+    def expected(self, slot):
+        """Baseline rate for a seasonal slot (the overall baseline until the slot has warmed up)."""
+        return self.baselines[slot] if self.seen[slot] >= self.min_periods else self.level
+
+    def update(self, slot, rate, count):
+        """Fold one bucket's rate; returns (expected rate, standardized deviation, alert rule or None)."""
+        expected = self.expected(slot)
+        result = None
+        # Scoring starts once every seasonal slot could have warmed up
+        warmed_up = self.updates >= self.min_periods * len(self.baselines)
+        if warmed_up and count >= self.min_count and not math.isnan(expected):
+            p = min(max(expected, 0.01), 0.99)
+            deviation = (rate - expected) / math.sqrt(p * (1 - p) / count)
+            z = deviation / math.sqrt(self.dispersion)
+            self.upper = max(0.0, self.upper + z - self.k)
+            self.lower = max(0.0, self.lower - z - self.k)
+            rule = None
+            if abs(z) >= self.spike:
+                rule = 'spike'
+            elif max(self.upper, self.lower) >= self.h:
+                rule = 'cusum'
+            if rule:
+                self.upper = self.lower = 0.0
+            # Capped, so one outlier does not mask the next
+            self.dispersion += self.alpha * (min(deviation * deviation, self.spike * self.spike) - self.dispersion)
+            self.dispersion = max(self.dispersion, 1.0)
+            result = (expected, z, rule)
+
+        self.level = rate if math.isnan(self.level) else self.level + self.alpha * (rate - self.level)
+        baseline = self.baselines[slot]
+        self.baselines[slot] = rate if math.isnan(baseline) else baseline + self.alpha * (rate - baseline)
+        self.seen[slot] += 1
+        self.updates += 1
+        return result
+
+
+class FunnelMonitor:
+    """Streaming anomaly alerts over hourly or daily funnel, conversion and exit rates.
+
+    Reads metric rollups from a source with `get_metric_rollups` (the
+    shared engine, or `EcommerceDatabase`) and feeds each closed bucket
+    after the last one processed to a `RateDetector` per metric. A bucket is
+    closed once `settle` newer buckets have begun (by the data or the
+    clock), since events for recent sessions are still arriving; later
+    changes to a processed bucket are not revisited. With `state_path` the
+    detectors and the last bucket persist, so running `process` every
+    minute only does work for buckets that closed since the previous run.
+    """
+
+    def __init__(self, source, granularity='hour', state_path=None, settle=1, **detector_options):
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"granularity must be one of {list(ROLLUP_GRANULARITIES)}, got {granularity!r}")
+        self.source = source
+        self.granularity = granularity
+        self.state_path = state_path
+        self.settle = settle
+        self.detector_options = detector_options
+        self.state = self.load_state() or self.new_state()
+
+    def new_state(self):
+        return {'version': MONITOR_VERSION, 'granularity': self.granularity, 'last_bucket': None,
+                'detectors': {}, 'latest': {}}
+
+    def load_state(self):
+        """Load persisted detectors, or None if there are none for this granularity and version."""
+        if not self.state_path:
+            return None
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if state.get('version') != MONITOR_VERSION or state.get('granularity') != self.granularity:
+            return None
+        return state
+
+    def save_state(self):
+        """Persist the detectors atomically."""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.state_path)
+
+    def detector(self, metric):
+        detectors = self.state['detectors']
+        if metric not in detectors:
+            detectors[metric] = RateDetector(seasons=SEASONS[self.granularity], **self.detector_options)
+        return detectors[metric]
+
+    def process(self):
+        """Feed buckets closed since the last run to the detectors; returns the alerts they raised."""
+        rollups = self.source.get_metric_rollups(self.granularity, since=self.state['last_bucket'])
+        if rollups.empty:
+            return []
+        now = int(time.time() // 3600 // ROLLUP_GRANULARITIES[self.granularity])
+        closed = rollups[rollups.index <= max(int(rollups.index.max()), now) - self.settle]
+        if closed.empty:
+            return []
+
+        rates, denominators = rollup_rates(closed)
+        alerts = []
+        for bucket, bucket_rates, counts in zip(rates.index, rates.to_numpy(), denominators.to_numpy()):
+            slot = season_slot(bucket, self.granularity)
+            for metric, rate, count in zip(rates.columns, bucket_rates, counts):
+                if count <= 0 or math.isnan(rate):
+                    continue
+                result = self.detector(metric).update(slot, float(rate), float(count))
+                self.state['latest'][metric] = (int(bucket), float(rate))
+                if result and result[2]:
+                    expected, z, rule = result
+                    alerts.append({
+                        'bucket': int(bucket),
+                        'start': bucket_label(bucket, self.granularity),
+                        'metric': metric,
+                        'rate': float(rate),
+                        'expected': float(expected),
+                        'z': float(z),
+                        'direction': 'increase' if z > 0 else 'decrease',
+                        'worse': (z > 0) == (WORSE_DIRECTIONS[metric_kind(metric)] == 'increase'),
+                        'rule': rule,
+                    })
+        self.state['last_bucket'] = int(closed.index.max())
+        if self.state_path:
+            self.save_state()
+        return alerts
+
+    def baselines(self):
+        """Per metric: latest bucket, its rate, and the overall baseline rate."""
+        rows = []
+        detectors = self.state['detectors']
+        for metric in METRICS:
+            if metric not in detectors:
+                continue
+            detector = detectors[metric]
+            bucket, rate = self.state['latest'].get(metric, (None, math.nan))
+            rows.append({'metric': metric, 'latest_bucket': bucket, 'latest_rate': rate, 'baseline': detector.level,
+                         'dispersion': detector.dispersion})
+        return pd.DataFrame(rows, columns=['metric', 'latest_bucket', 'latest_rate', 'baseline', 'dispersion'])
+
+
+def monitor_state_path(db_path, granularity):
+    """Default location of the persisted detectors for a database and granularity."""
+    return f"{db_path}.monitor-{granularity}"
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Check new funnel metric buckets for anomalies (run e.g. every minute)")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--granularity', choices=list(ROLLUP_GRANULARITIES), default='hour')
+    parser.add_argument('--state', default=None, help="Detector state file (default: <db>.monitor-<granularity>)")
+    args = parser.parse_args()
+
+    # The engine folds only rows added since its last refresh, and the monitor only buckets closed since its last run
+    engine = SharedFrameEngine(EcommerceDatabase(args.db), incremental=True)
+    engine.prepare(['funnel_trends'])
+    monitor = FunnelMonitor(engine, granularity=args.granularity,
+                            state_path=args.state or monitor_state_path(args.db, args.granularity))
+    alerts = monitor.process()
+    rows = [[alert['start'], alert['metric'], f"{alert['rate']*100:.1f}%", f"{alert['expected']*100:.1f}%",
+             f"{alert['z']:+.1f}", alert['rule']] for alert in alerts]
+    if rows:
+        print(tabulate(rows, headers=['Bucket', 'Metric', 'Rate', 'Expected', 'z', 'Rule'], tablefmt='pipe'))
+    last = monitor.state['last_bucket']
+    print(f"{len(alerts)} alerts; processed up to {bucket_label(last, args.granularity) if last is not None else '-'}")
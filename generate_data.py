@@ -1,25 +1,62 @@
 import pandas as pd
 import numpy as np
 import sqlite3
-import uuid
 import random
 from datetime import datetime, timedelta
+from itertools import accumulate
 import os
 from tqdm import tqdm
 from database import EcommerceDatabase
+from id_generators import ID_STRATEGIES, seeded_id_generator
+
+# Generator buffers and the tables they are flushed into
+EVENT_BUFFERS = [
+    ('sessions', 'sessions'),
+    ('page_views', 'page_views'),
+    ('clicks', 'clicks'),
+    ('product_views', 'product_views'),
+    ('cart_events', 'cart_events'),
+    ('search_events', 'search_events'),
+    ('checkout_events', 'checkout_events'),
+]
 
 class EcommerceDataGenerator:
-    def __init__(self, num_users=500, num_sessions=1000, num_products=100, start_date='2024-01-01', end_date='2025-05-25'):
+    def __init__(self, num_users=500, num_sessions=1000, num_products=100, start_date='2024-01-01', end_date='2025-05-25',
+                 db=None, id_strategy=None, seed=None, product_popularity='uniform', user_activity='uniform',
+                 session_length='uniform', zipf_exponent=1.07, batch_size=None, show_progress=True):
+        """Configure the generator.
+
+        `seed` makes the output (ids included) fully reproducible.
+        `product_popularity` and `user_activity` accept 'uniform' or 'zipf';
+        `session_length` accepts 'uniform' or 'heavy_tail' (Pareto number of
+        product views, log-normal duration). With `batch_size` set, rows are
+        flushed to the database every `batch_size` sessions so memory stays
+        flat regardless of `num_sessions`.
+        """
         self.num_users = num_users
         self.num_sessions = num_sessions
         self.num_products = num_products
         self.start_date = datetime.fromisoformat(start_date)
         self.end_date = datetime.fromisoformat(end_date)
+        self.product_popularity = product_popularity
+        self.user_activity = user_activity
+        self.session_length = session_length
+        self.zipf_exponent = zipf_exponent
+        self.batch_size = batch_size
+        self.show_progress = show_progress
+        
+        self.db = db if db else EcommerceDatabase(id_strategy=id_strategy)
         
-        self.db = EcommerceDatabase()
+        # A private random source so seeded runs are independent of global state
+        self.rng = random.Random(seed)
+        if seed is not None:
+            self.db.id_generator = seeded_id_generator(self.db.id_strategy, seed)
         
-        # Initialize data containers
+        # Initialize data containers (pending rows, flushed into the database)
         self.users = []
+        self.user_profiles = []  # (user_id, device_type, browser) for every generated user
+        self.user_cum_weights = None
+        self.product_cum_weights = None
         self.sessions = []
         self.page_views = []
         self.clicks = []
@@ -70,12 +107,12 @@ class EcommerceDataGenerator:
         """Generate user data."""
         print("Generating users...")
         for _ in range(self.num_users):
-            user_id = str(uuid.uuid4())
+            user_id = self.db.new_id()
             first_visit_date = self.random_date()
-            device_type = random.choices(self.device_types, weights=self.device_weights)[0]
-            browser = random.choices(self.browsers, weights=self.browser_weights)[0]
-            country = random.choices(self.countries, weights=self.country_weights)[0]
-            referrer = random.choices(self.referrers, weights=self.referrer_weights)[0]
+            device_type = self.rng.choices(self.device_types, weights=self.device_weights)[0]
+            browser = self.rng.choices(self.browsers, weights=self.browser_weights)[0]
+            country = self.rng.choices(self.countries, weights=self.country_weights)[0]
+            referrer = self.rng.choices(self.referrers, weights=self.referrer_weights)[0]
             
             self.users.append({
                 'user_id': user_id,
@@ -85,11 +122,20 @@ class EcommerceDataGenerator:
                 'country': country,
                 'referrer': referrer
             })
-        
-        # Convert to DataFrame and insert into database
-        users_df = pd.DataFrame(self.users)
-        self.db.insert_data('users', users_df)
-        print(f"Generated {len(self.users)} users")
+            self.user_profiles.append((user_id, device_type, browser))
+            
+            if self.batch_size and len(self.users) >= self.batch_size:
+                self.db.insert_records('users', self.users)
+                self.users = []
+        
+        # Insert remaining users into the database
+        if self.users:
+            self.db.insert_records('users', self.users)
+            self.users = []
+        
+        if self.user_activity == 'zipf':
+            self.user_cum_weights = self.zipf_cum_weights(len(self.user_profiles))
+        print(f"Generated {len(self.user_profiles)} users")
     
     def generate_products(self):
         """Generate product data."""
@@ -107,32 +153,32 @@ class EcommerceDataGenerator:
         }
         
         for _ in range(self.num_products):
-            product_id = str(uuid.uuid4())
-            category = random.choice(self.product_categories)
-            adjective = random.choice(product_adjectives)
-            noun = random.choice(product_nouns[category])
+            product_id = self.db.new_id()
+            category = self.rng.choice(self.product_categories)
+            adjective = self.rng.choice(product_adjectives)
+            noun = self.rng.choice(product_nouns[category])
             name = f"{adjective} {noun}"
             
             # Price based on category
             if category == 'electronics':
-                price = round(random.uniform(50, 2000), 2)
+                price = round(self.rng.uniform(50, 2000), 2)
             elif category in ['clothing', 'sports']:
-                price = round(random.uniform(15, 200), 2)
+                price = round(self.rng.uniform(15, 200), 2)
             elif category == 'home':
-                price = round(random.uniform(20, 500), 2)
+                price = round(self.rng.uniform(20, 500), 2)
             elif category == 'beauty':
-                price = round(random.uniform(5, 100), 2)
+                price = round(self.rng.uniform(5, 100), 2)
             elif category == 'toys':
-                price = round(random.uniform(10, 150), 2)
+                price = round(self.rng.uniform(10, 150), 2)
             elif category == 'books':
-                price = round(random.uniform(8, 50), 2)
+                price = round(self.rng.uniform(8, 50), 2)
             elif category == 'food':
-                price = round(random.uniform(3, 30), 2)
+                price = round(self.rng.uniform(3, 30), 2)
             else:
-                price = round(random.uniform(10, 100), 2)
+                price = round(self.rng.uniform(10, 100), 2)
             
             # Generate a description
-            description_length = random.randint(1, 3)
+            description_length = self.rng.randint(1, 3)
             description_parts = [
                 f"High-quality {category} product",
                 f"Perfect for everyday use",
@@ -145,7 +191,7 @@ class EcommerceDataGenerator:
                 f"Innovative features",
                 f"Easy to use and maintain"
             ]
-            description = " ".join(random.sample(description_parts, description_length))
+            description = " ".join(self.rng.sample(description_parts, description_length))
             
             self.products.append({
                 'product_id': product_id,
@@ -158,88 +204,115 @@ class EcommerceDataGenerator:
         # Convert to DataFrame and insert into database
         products_df = pd.DataFrame(self.products)
         self.db.insert_data('products', products_df)
+        
+        if self.product_popularity == 'zipf':
+            self.product_cum_weights = self.zipf_cum_weights(len(self.products))
         print(f"Generated {len(self.products)} products")
     
+    def zipf_cum_weights(self, size):
+        """Cumulative Zipf weights over `size` items, with popularity ranks shuffled across items."""
+        ranks = list(range(1, size + 1))
+        self.rng.shuffle(ranks)
+        return list(accumulate(1.0 / rank ** self.zipf_exponent for rank in ranks))
+    
+    def choose_user(self):
+        """Pick the user for a new session, honouring the user activity skew."""
+        if self.user_cum_weights:
+            return self.rng.choices(self.user_profiles, cum_weights=self.user_cum_weights)[0]
+        return self.rng.choice(self.user_profiles)
+    
+    def choose_product(self):
+        """Pick a product to view, honouring the product popularity skew."""
+        if self.product_cum_weights:
+            return self.rng.choices(self.products, cum_weights=self.product_cum_weights)[0]
+        return self.rng.choice(self.products)
+    
+    def flush(self):
+        """Insert all buffered session and event rows into the database."""
+        for attribute, table_name in EVENT_BUFFERS:
+            rows = getattr(self, attribute)
+            if rows:
+                self.db.insert_records(table_name, rows)
+                setattr(self, attribute, [])
+    
     def generate_sessions_and_events(self):
         """Generate session data and related events."""
         print("Generating sessions and events...")
-        for i in tqdm(range(self.num_sessions)):
-            # Select a random user
-            user = random.choice(self.users)
-            user_id = user['user_id']
-            session_id = str(uuid.uuid4())
-            
-            # Session start and end times
-            start_time = self.random_date()
-            session_duration = timedelta(minutes=random.randint(1, 120))
-            end_time = start_time + session_duration
-            
-            # Device and browser might change from the user's first visit
-            if random.random() < 0.8:  # 80% chance to use the same device
-                device_type = user['device_type']
-                browser = user['browser']
-            else:
-                device_type = random.choices(self.device_types, weights=self.device_weights)[0]
-                browser = random.choices(self.browsers, weights=self.browser_weights)[0]
-            
-            # Determine if this session will convert (purchase)
-            # Base conversion rate adjusted by device and browser factors
-            conversion_prob = self.base_conversion_rate
-            if device_type == 'desktop':
-                conversion_prob *= 1.2
-            elif device_type == 'mobile':
-                conversion_prob *= 0.9
-            
-            if browser == 'Chrome':
-                conversion_prob *= 1.1
-            elif browser == 'Safari':
-                conversion_prob *= 1.05
-            
-            conversion_status = 'completed' if random.random() < conversion_prob else 'abandoned'
+        for i in tqdm(range(self.num_sessions), disable=not self.show_progress):
+            self.generate_session()
             
-            self.sessions.append({
-                'session_id': session_id,
-                'user_id': user_id,
-                'start_time': start_time.isoformat(),
-                'end_time': end_time.isoformat(),
-                'device_type': device_type,
-                'browser': browser,
-                'conversion_status': conversion_status
-            })
-            
-            # Now generate the user journey for this session
-            self.generate_user_journey(session_id, user_id, start_time, end_time, conversion_status)
+            if self.batch_size and len(self.sessions) >= self.batch_size:
+                self.flush()
         
-        # Convert to DataFrame and insert into database
-        sessions_df = pd.DataFrame(self.sessions)
-        self.db.insert_data('sessions', sessions_df)
+        # Insert all remaining session and event data
+        self.flush()
         
-        # Insert all event data
-        if self.page_views:
-            page_views_df = pd.DataFrame(self.page_views)
-            self.db.insert_data('page_views', page_views_df)
+        print(f"Generated {self.num_sessions} sessions with corresponding events")
+    
+    def generate_session(self, start_time=None):
+        """Generate one session and its journey into the buffers; returns the session row."""
+        # Select a random user
+        user_id, user_device_type, user_browser = self.choose_user()
+        session_id = self.db.new_id()
+        
+        # Session start and end times
+        if start_time is None:
+            start_time = self.random_date()
+        if self.session_length == 'heavy_tail':
+            session_minutes = min(int(self.rng.lognormvariate(2.5, 1.0)) + 1, 360)
+        else:
+            session_minutes = self.rng.randint(1, 120)
+        end_time = start_time + timedelta(minutes=session_minutes)
         
-        if self.clicks:
-            clicks_df = pd.DataFrame(self.clicks)
-            self.db.insert_data('clicks', clicks_df)
+        # Device and browser might change from the user's first visit
+        if self.rng.random() < 0.8:  # 80% chance to use the same device
+            device_type = user_device_type
+            browser = user_browser
+        else:
+            device_type = self.rng.choices(self.device_types, weights=self.device_weights)[0]
+            browser = self.rng.choices(self.browsers, weights=self.browser_weights)[0]
         
-        if self.product_views:
-            product_views_df = pd.DataFrame(self.product_views)
-            self.db.insert_data('product_views', product_views_df)
+        # Determine if this session will convert (purchase)
+        # Base conversion rate adjusted by device and browser factors
+        conversion_prob = self.base_conversion_rate
+        if device_type == 'desktop':
+            conversion_prob *= 1.2
+        elif device_type == 'mobile':
+            conversion_prob *= 0.9
         
-        if self.cart_events:
-            cart_events_df = pd.DataFrame(self.cart_events)
-            self.db.insert_data('cart_events', cart_events_df)
+        if browser == 'Chrome':
+            conversion_prob *= 1.1
+        elif browser == 'Safari':
+            conversion_prob *= 1.05
         
-        if self.search_events:
-            search_events_df = pd.DataFrame(self.search_events)
-            self.db.insert_data('search_events', search_events_df)
+        conversion_status = 'completed' if self.rng.random() < conversion_prob else 'abandoned'
         
-        if self.checkout_events:
-            checkout_events_df = pd.DataFrame(self.checkout_events)
-            self.db.insert_data('checkout_events', checkout_events_df)
+        session = {
+            'session_id': session_id,
+            'user_id': user_id,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'device_type': device_type,
+            'browser': browser,
+            'conversion_status': conversion_status
+        }
+        self.sessions.append(session)
         
-        print(f"Generated {len(self.sessions)} sessions with corresponding events")
+        # Now generate the user journey for this session
+        self.generate_user_journey(session_id, user_id, start_time, end_time, conversion_status)
+        return session
+    
+    def load_existing_catalog(self):
+        """Use the users and products already stored in the database instead of generating new ones."""
+        users = self.db.execute_query("SELECT user_id, device_type, browser FROM users")
+        products = self.db.execute_query("SELECT product_id, name, category, price, description FROM products")
+        self.user_profiles = list(users.itertuples(index=False, name=None))
+        self.products = products.to_dict('records')
+        if self.user_activity == 'zipf' and self.user_profiles:
+            self.user_cum_weights = self.zipf_cum_weights(len(self.user_profiles))
+        if self.product_popularity == 'zipf' and self.products:
+            self.product_cum_weights = self.zipf_cum_weights(len(self.products))
+        return len(self.user_profiles), len(self.products)
     
     def generate_user_journey(self, session_id, user_id, start_time, end_time, conversion_status):
         """Generate a realistic user journey for a session."""
@@ -247,81 +320,87 @@ class EcommerceDataGenerator:
         
         # Start with homepage
         self.add_page_view(session_id, user_id, current_time, 'homepage', '/index.html')
-        current_time += timedelta(seconds=random.randint(5, 30))
+        current_time += timedelta(seconds=self.rng.randint(5, 30))
         
         # User might perform a search
-        if random.random() < 0.6:  # 60% chance to search
-            search_query = random.choice(self.common_search_queries)
-            results_count = random.randint(0, 50)
+        if self.rng.random() < 0.6:  # 60% chance to search
+            search_query = self.rng.choice(self.common_search_queries)
+            results_count = self.rng.randint(0, 50)
             self.add_search_event(session_id, user_id, current_time, search_query, results_count)
-            current_time += timedelta(seconds=random.randint(2, 10))
+            current_time += timedelta(seconds=self.rng.randint(2, 10))
             
             # View search results page
             self.add_page_view(session_id, user_id, current_time, 'search_results', f'/search?q={search_query}')
-            current_time += timedelta(seconds=random.randint(5, 30))
+            current_time += timedelta(seconds=self.rng.randint(5, 30))
             
             # Click on a search result
             self.add_click(session_id, user_id, current_time, f'/search?q={search_query}', 'product_card', 'search_result_item')
-            current_time += timedelta(seconds=random.randint(1, 3))
+            current_time += timedelta(seconds=self.rng.randint(1, 3))
         else:
             # Browse product categories instead
-            category = random.choice(self.product_categories)
+            category = self.rng.choice(self.product_categories)
             self.add_page_view(session_id, user_id, current_time, 'product_listing', f'/categories/{category}')
-            current_time += timedelta(seconds=random.randint(10, 60))
+            current_time += timedelta(seconds=self.rng.randint(10, 60))
             
             # Click on a product in the listing
             self.add_click(session_id, user_id, current_time, f'/categories/{category}', 'product_card', 'product_item')
-            current_time += timedelta(seconds=random.randint(1, 3))
+            current_time += timedelta(seconds=self.rng.randint(1, 3))
         
         # View product details
         viewed_products = []
-        products_to_view = random.randint(1, 5)  # View 1-5 products
+        session_cart_events = []
+        if self.session_length == 'heavy_tail':
+            products_to_view = min(int(self.rng.paretovariate(1.3)), 40)  # Mostly 1-3, occasionally dozens
+        else:
+            products_to_view = self.rng.randint(1, 5)  # View 1-5 products
         
         for _ in range(products_to_view):
             if current_time >= end_time:
                 break
                 
-            product = random.choice(self.products)
+            product = self.choose_product()
             product_id = product['product_id']
             viewed_products.append(product)
             
             # Product detail page view
-            self.add_page_view(session_id, user_id, current_time, 'product_detail', f'/products/{product_id}')
-            current_time += timedelta(seconds=random.randint(10, 120))
+            self.add_page_view(session_id, user_id, current_time, 'product_detail', f'/products/{self.db.id_generator.to_text(product_id)}')
+            current_time += timedelta(seconds=self.rng.randint(10, 120))
             
             # Product view event
-            time_spent = random.randint(10, 120)
+            time_spent = self.rng.randint(10, 120)
             self.add_product_view(session_id, user_id, product_id, current_time, time_spent)
             
             # User might add to cart
-            if random.random() < 0.3:  # 30% chance to add to cart
-                self.add_click(session_id, user_id, current_time, f'/products/{product_id}', 'button', 'add_to_cart_btn')
-                current_time += timedelta(seconds=random.randint(1, 3))
+            if self.rng.random() < 0.3:  # 30% chance to add to cart
+                self.add_click(session_id, user_id, current_time, f'/products/{self.db.id_generator.to_text(product_id)}', 'button', 'add_to_cart_btn')
+                current_time += timedelta(seconds=self.rng.randint(1, 3))
                 
-                quantity = random.randint(1, 3)
-                self.add_cart_event(session_id, user_id, product_id, current_time, 'add_to_cart', quantity)
-                current_time += timedelta(seconds=random.randint(1, 5))
+                quantity = self.rng.randint(1, 3)
+                session_cart_events.append(
+                    self.add_cart_event(session_id, user_id, product_id, current_time, 'add_to_cart', quantity)
+                )
+                current_time += timedelta(seconds=self.rng.randint(1, 5))
         
-        # Check if any products were added to cart by looking for add_to_cart events
-        cart_events = [e for e in self.cart_events if e['session_id'] == session_id and e['event_type'] == 'add_to_cart']
+        # Check if any products were added to cart during this session
+        cart_events = session_cart_events
         
         if cart_events:  # If there are items in the cart
             # View cart page
             self.add_page_view(session_id, user_id, current_time, 'cart', '/cart')
-            current_time += timedelta(seconds=random.randint(10, 60))
+            current_time += timedelta(seconds=self.rng.randint(10, 60))
             
             # Randomly remove some items from cart
-            if random.random() < 0.2:  # 20% chance to remove items
-                event_to_remove = random.choice(cart_events)
+            if self.rng.random() < 0.2:  # 20% chance to remove items
+                event_to_remove = self.rng.choice(cart_events)
                 self.add_cart_event(session_id, user_id, event_to_remove['product_id'], current_time, 'remove_from_cart', 1)
-                current_time += timedelta(seconds=random.randint(1, 5))
+                current_time += timedelta(seconds=self.rng.randint(1, 5))
             
             # Proceed to checkout or abandon
             checkout_probability = 0.6 if conversion_status == 'completed' else 0.3
             
-            if random.random() < checkout_probability:  # Start checkout process
+            if self.rng.random() < checkout_probability:  # Start checkout process
                 self.add_click(session_id, user_id, current_time, '/cart', 'button', 'checkout_btn')
-                current_time += timedelta(seconds=random.randint(1, 3))
+                current_time += timedelta(seconds=self.rng.randint(1, 3))
                 
                 # Start checkout process
                 checkout_step_index = 0
@@ -333,7 +412,7 @@ class EcommerceDataGenerator:
                     
                     # Add page view for this checkout step
                     self.add_page_view(session_id, user_id, current_time, 'checkout', f'/checkout/{step}')
-                    current_time += timedelta(seconds=random.randint(30, 120))
+                    current_time += timedelta(seconds=self.rng.randint(30, 120))
                     
                     # Add checkout event
                     status = 'completed' if checkout_successful or checkout_step_index < len(self.checkout_steps) - 1 else 'abandoned'
@@ -342,22 +421,22 @@ class EcommerceDataGenerator:
                     # If this is the last step and successful, we're done
                     if checkout_step_index == len(self.checkout_steps) - 1 and checkout_successful:
                         # Add a final thank you / confirmation page
-                        current_time += timedelta(seconds=random.randint(1, 3))
+                        current_time += timedelta(seconds=self.rng.randint(1, 3))
                         self.add_page_view(session_id, user_id, current_time, 'confirmation', '/checkout/confirmation')
                         break
                     
                     # If the user is going to abandon, they might do so at any step
-                    if not checkout_successful and random.random() < 0.3:  # 30% chance to abandon at each step
+                    if not checkout_successful and self.rng.random() < 0.3:  # 30% chance to abandon at each step
                         break
                     
                     checkout_step_index += 1
-                    current_time += timedelta(seconds=random.randint(5, 15))
+                    current_time += timedelta(seconds=self.rng.randint(5, 15))
     
     def add_page_view(self, session_id, user_id, timestamp, page_type, page_url):
         """Add a page view event."""
-        view_id = str(uuid.uuid4())
-        time_spent = random.randint(5, 300)  # 5-300 seconds
-        exit_page = 1 if random.random() < 0.2 else 0  # 20% chance to be an exit page
+        view_id = self.db.new_id()
+        time_spent = self.rng.randint(5, 300)  # 5-300 seconds
+        exit_page = 1 if self.rng.random() < 0.2 else 0  # 20% chance to be an exit page
         
         self.page_views.append({
             'view_id': view_id,
@@ -372,7 +451,7 @@ class EcommerceDataGenerator:
     
     def add_click(self, session_id, user_id, timestamp, page_url, element_type, element_id):
         """Add a click event."""
-        click_id = str(uuid.uuid4())
+        click_id = self.db.new_id()
         
         self.clicks.append({
             'click_id': click_id,
@@ -386,7 +465,7 @@ class EcommerceDataGenerator:
     
     def add_product_view(self, session_id, user_id, product_id, timestamp, time_spent):
         """Add a product view event."""
-        view_id = str(uuid.uuid4())
+        view_id = self.db.new_id()
         
         self.product_views.append({
             'view_id': view_id,
@@ -399,9 +478,9 @@ class EcommerceDataGenerator:
     
     def add_cart_event(self, session_id, user_id, product_id, timestamp, event_type, quantity):
         """Add a cart event (add or remove from cart)."""
-        event_id = str(uuid.uuid4())
+        event_id = self.db.new_id()
         
-        self.cart_events.append({
+        event = {
             'event_id': event_id,
             'session_id': session_id,
             'user_id': user_id,
@@ -409,11 +488,13 @@ class EcommerceDataGenerator:
             'event_type': event_type,
             'quantity': quantity,
             'timestamp': timestamp.isoformat()
-        })
+        }
+        self.cart_events.append(event)
+        return event
     
     def add_search_event(self, session_id, user_id, timestamp, query, results_count):
         """Add a search event."""
-        search_id = str(uuid.uuid4())
+        search_id = self.db.new_id()
         
         self.search_events.append({
             'search_id': search_id,
@@ -426,7 +507,7 @@ class EcommerceDataGenerator:
     
     def add_checkout_event(self, session_id, user_id, timestamp, step, status):
         """Add a checkout event."""
-        checkout_id = str(uuid.uuid4())
+        checkout_id = self.db.new_id()
         
         self.checkout_events.append({
             'checkout_id': checkout_id,
@@ -441,14 +522,14 @@ class EcommerceDataGenerator:
         """Generate a random date between start_date and end_date."""
         time_between_dates = self.end_date - self.start_date
         days_between_dates = time_between_dates.days
-        random_number_of_days = random.randrange(days_between_dates)
+        random_number_of_days = self.rng.randrange(days_between_dates)
         random_date = self.start_date + timedelta(days=random_number_of_days)
         
         # Add random hours, minutes, seconds
         random_date = random_date.replace(
-            hour=random.randint(0, 23),
-            minute=random.randint(0, 59),
-            second=random.randint(0, 59)
+            hour=self.rng.randint(0, 23),
+            minute=self.rng.randint(0, 59),
+            second=self.rng.randint(0, 59)
         )
         
         return random_date
@@ -463,11 +544,17 @@ class EcommerceDataGenerator:
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate demo e-commerce journey data")
+    parser.add_argument('--id-strategy', default=None, choices=list(ID_STRATEGIES),
+                        help="Primary key format (default: uuid)")
+    args = parser.parse_args()
+    
     # Check if database file exists and remove if it does
     if os.path.exists('ecommerce_data.db'):
         os.remove('ecommerce_data.db')
         print("Removed existing database file.")
     
     # Generate data
-    generator = EcommerceDataGenerator(num_users=200, num_sessions=500, num_products=50)
+    generator = EcommerceDataGenerator(num_users=200, num_sessions=500, num_products=50, id_strategy=args.id_strategy)
     generator.generate_all_data()
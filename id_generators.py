@@ -0,0 +1,264 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from tabulate import tabulate
+
+# Custom epoch for time-ordered ids (2024-01-01T00:00:00Z), in milliseconds
+ID_EPOCH_MS = 1704067200000
+
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def _wall_clock_ms():
+    """Current wall-clock time in milliseconds since the Unix epoch."""
+    return int(time.time() * 1000)
+
+
+class UUIDTextIdGenerator:
+    """Random UUID4 ids stored as 36-character text (the original id format)."""
+
+    name = 'uuid'
+    sql_type = 'TEXT'
+
+    def __init__(self, rng=None, clock=None):
+        """Initialize the generator; pass a seeded `random.Random` for reproducible ids."""
+        self.rng = rng
+
+    def new_id(self):
+        """Return a new UUID4 string."""
+        if self.rng is None:
+            return str(uuid.uuid4())
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def to_text(self, value):
+        """Render an id for use in URLs and log output."""
+        return str(value)
+
+
+class SnowflakeIdGenerator:
+    """Time-ordered 64-bit integer ids.
+
+    Layout (63 usable bits so values fit a signed SQLite INTEGER):
+    41 bits of milliseconds since ID_EPOCH_MS, 10 bits of worker id and
+    12 bits of per-millisecond sequence. Ids increase with creation time,
+    so inserts land at the right-hand edge of the primary key B-tree, and
+    an INTEGER PRIMARY KEY column becomes an alias for the rowid.
+    """
+
+    name = 'snowflake'
+    sql_type = 'INTEGER'
+
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+    def __init__(self, rng=None, clock=None, worker_id=None):
+        """Initialize the generator with an optional clock (ms) and worker id."""
+        self.clock = clock if clock else _wall_clock_ms
+        if worker_id is None:
+            worker_id = os.getpid()
+        self.worker_id = worker_id & ((1 << self.WORKER_BITS) - 1)
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        """Return a new time-ordered integer id."""
+        with self.lock:
+            now_ms = self.clock() - ID_EPOCH_MS
+            if now_ms <= self.last_ms:
+                # Same millisecond (or the clock went backwards): keep ids
+                # monotonic by bumping the sequence, borrowing the next
+                # millisecond when the sequence space is exhausted.
+                self.sequence += 1
+                if self.sequence > self.MAX_SEQUENCE:
+                    self.last_ms += 1
+                    self.sequence = 0
+                now_ms = self.last_ms
+            else:
+                self.last_ms = now_ms
+                self.sequence = 0
+            return (now_ms << (self.WORKER_BITS + self.SEQUENCE_BITS)) | \
+                   (self.worker_id << self.SEQUENCE_BITS) | self.sequence
+
+    def to_text(self, value):
+        """Render an id for use in URLs and log output."""
+        return str(value)
+
+    def timestamp_ms(self, value):
+        """Recover the creation time (ms since the Unix epoch) from an id."""
+        return (value >> (self.WORKER_BITS + self.SEQUENCE_BITS)) + ID_EPOCH_MS
+
+
+class ULIDIdGenerator:
+    """ULIDs stored as 16-byte blobs.
+
+    48 bits of millisecond timestamp followed by 80 random bits. Ids
+    generated within the same millisecond increment the random part so the
+    byte order always matches creation order.
+    """
+
+    name = 'ulid'
+    sql_type = 'BLOB'
+
+    RANDOM_BITS = 80
+    MAX_RANDOM = (1 << RANDOM_BITS) - 1
+
+    def __init__(self, rng=None, clock=None):
+        """Initialize the generator with an optional random source and clock (ms)."""
+        # random.Random seeded from os.urandom is much cheaper per call than os.urandom(10)
+        self.rng = rng if rng else random.Random(os.urandom(16))
+        self.clock = clock if clock else _wall_clock_ms
+        self.last_ms = -1
+        self.last_random = 0
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        """Return a new ULID as 16 bytes."""
+        with self.lock:
+            now_ms = self.clock()
+            if now_ms <= self.last_ms:
+                now_ms = self.last_ms
+                self.last_random += 1
+                if self.last_random > self.MAX_RANDOM:
+                    self.last_ms += 1
+                    now_ms = self.last_ms
+                    self.last_random = self.rng.getrandbits(self.RANDOM_BITS - 1)
+            else:
+                self.last_ms = now_ms
+                # Leave headroom so the monotonic increment rarely overflows
+                self.last_random = self.rng.getrandbits(self.RANDOM_BITS - 1)
+            value = (now_ms << self.RANDOM_BITS) | self.last_random
+        return value.to_bytes(16, 'big')
+
+    def to_text(self, value):
+        """Render an id in the canonical 26-character Crockford base32 form."""
+        number = int.from_bytes(value, 'big')
+        chars = []
+        for _ in range(26):
+            chars.append(CROCKFORD_BASE32[number & 31])
+            number >>= 5
+        return ''.join(reversed(chars))
+
+    def timestamp_ms(self, value):
+        """Recover the creation time (ms since the Unix epoch) from an id."""
+        return int.from_bytes(value[:6], 'big')
+
+
+ID_STRATEGIES = {
+    'uuid': UUIDTextIdGenerator,
+    'snowflake': SnowflakeIdGenerator,
+    'ulid': ULIDIdGenerator,
+}
+
+DEFAULT_ID_STRATEGY = 'uuid'
+
+
+def get_id_generator(strategy=None, rng=None, clock=None):
+    """Create an id generator for the named strategy."""
+    strategy = strategy or DEFAULT_ID_STRATEGY
+    if strategy not in ID_STRATEGIES:
+        raise ValueError(f"Unknown id strategy '{strategy}'. Choose one of: {', '.join(ID_STRATEGIES)}")
+    return ID_STRATEGIES[strategy](rng=rng, clock=clock)
+
+
+def seeded_id_generator(strategy, seed):
+    """Create a fully deterministic id generator for reproducible datasets.
+
+    Random bits come from a seeded `random.Random` and time-ordered
+    strategies read a logical clock that advances one millisecond per id,
+    so the same seed always yields the same sequence of ids. The clock's
+    starting point and the snowflake worker id are drawn from the seed too,
+    so runs with different seeds can share a database without colliding.
+    """
+    rng = random.Random(f'ids-{seed}')
+    # Start somewhere in the first ~50 days after the epoch so different seeds use different millisecond ranges
+    start_ms = ID_EPOCH_MS + rng.getrandbits(32)
+    worker_id = rng.getrandbits(SnowflakeIdGenerator.WORKER_BITS)
+    logical_ms = iter(range(start_ms, 1 << 62))
+    generator = get_id_generator(strategy, rng=rng, clock=lambda: next(logical_ms))
+    if isinstance(generator, SnowflakeIdGenerator):
+        generator.worker_id = worker_id
+    return generator
+
+
+def check_seeded_ids(seeds=(1, 2), count=100000, strategies=None):
+    """Check that each seed reproduces its ids and that different seeds share none."""
+    strategies = strategies or list(ID_STRATEGIES)
+    results = []
+    for strategy in strategies:
+        generators = [seeded_id_generator(strategy, seed) for seed in seeds + seeds[:1]]
+        *runs, repeat = [[generator.new_id() for _ in range(count)] for generator in generators]
+        distinct = len(set().union(*runs))
+        results.append([strategy, repeat == runs[0], len(seeds) * count - distinct])
+    print(tabulate(results, headers=['Strategy', 'Reproducible', 'Shared Ids'], tablefmt='pipe'))
+    return all(reproducible and not shared for _, reproducible, shared in results)
+
+
+def compare_insert_throughput(num_rows=200000, batch_size=10000, strategies=None):
+    """Compare id generation and insert throughput for each id strategy.
+
+    Each strategy gets a fresh database with a page_views-shaped table. Rows
+    are inserted in batches through `EcommerceDatabase.insert_records`, the
+    same path used by the data generator and ingest code.
+    """
+    from database import EcommerceDatabase
+
+    strategies = strategies or list(ID_STRATEGIES)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for strategy in strategies:
+            db_path = os.path.join(tmp_dir, f'ids_{strategy}.db')
+            db = EcommerceDatabase(db_path, id_strategy=strategy)
+            session_id = db.new_id()
+            user_id = db.new_id()
+
+            # Id generation on its own
+            start = time.perf_counter()
+            ids = [db.new_id() for _ in range(num_rows)]
+            generate_seconds = time.perf_counter() - start
+
+            # Insert throughput, batched into transactions
+            start = time.perf_counter()
+            for offset in range(0, num_rows, batch_size):
+                rows = [
+                    (view_id, session_id, user_id, '2024-01-01T00:00:00', 'homepage', '/index.html', 30, 0)
+                    for view_id in ids[offset:offset + batch_size]
+                ]
+                db.insert_records('page_views', rows)
+            insert_seconds = time.perf_counter() - start
+
+            # Index size
+            conn = sqlite3.connect(db_path)
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            conn.close()
+
+            results.append([
+                strategy,
+                db.id_generator.sql_type,
+                f"{num_rows / generate_seconds:,.0f}",
+                f"{num_rows / insert_seconds:,.0f}",
+                f"{page_count * page_size / (1024 * 1024):.1f} MB"
+            ])
+
+    headers = ['Strategy', 'Column Type', 'Ids/sec', 'Inserts/sec', 'Database Size']
+    print(tabulate(results, headers=headers, tablefmt='pipe'))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare id strategies')
+    parser.add_argument('--check-seeds', action='store_true',
+                        help='check that seeded runs are reproducible and disjoint instead of benchmarking')
+    args = parser.parse_args()
+    if args.check_seeds:
+        raise SystemExit(0 if check_seeded_ids() else 1)
+    compare_insert_throughput()
@@ -0,0 +1,195 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from tabulate import tabulate
+from database import EcommerceDatabase, top_k_rows
+
+# Product interactions that put a product in a session's basket
+BASKET_QUERIES = {
+    'product_views': "SELECT session_id, product_id FROM product_views "
+                     "WHERE session_id IS NOT NULL AND product_id IS NOT NULL",
+    'cart_events': "SELECT session_id, product_id FROM cart_events "
+                   "WHERE event_type = 'add_to_cart' AND session_id IS NOT NULL AND product_id IS NOT NULL",
+}
+
+# Pair metrics neighbors can be ranked by
+RANKINGS = ('lift', 'confidence', 'count')
+
+# Products whose co-occurrence rows are computed together; bounds the memory of one sparse product
+BLOCK_SIZE = 2048
+
+
+def binary_matrix(rows, columns, shape, dtype=np.float32):
+    """Sparse CSR matrix with a 1 for every (row, column) pair present; repeated pairs count once."""
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, columns)), shape=shape)
+    matrix.data[:] = 1
+    return matrix
+
+
+class ProductAffinity:
+    """Item-item co-occurrence, confidence and lift from a sparse session x product matrix.
+
+    A session's basket is every product it viewed or added to its cart
+    (`sources` picks which). Baskets are streamed out of SQLite in chunks
+    into a binary CSR matrix X, and co-occurrence counts come from the
+    sparse product X[:, block].T @ X, one block of products at a time; each
+    block is cut to its `top_k` neighbors before the next is computed, so
+    neither a dense matrix nor the full product x product matrix is ever
+    held. Pairs seen together in fewer than `min_count` sessions are
+    dropped, since their lift is mostly noise.
+    """
+
+    def __init__(self, db=None, sources=tuple(BASKET_QUERIES), top_k=20, min_count=2, rank_by='lift',
+                 chunksize=500000):
+        """Initialize an unfitted model over an `EcommerceDatabase`."""
+        unknown = set(sources) - set(BASKET_QUERIES)
+        if unknown:
+            raise ValueError(f"sources must be among {list(BASKET_QUERIES)}, got {sorted(unknown)}")
+        if rank_by not in RANKINGS:
+            raise ValueError(f"rank_by must be one of {RANKINGS}, got {rank_by!r}")
+        self.db = db if db else EcommerceDatabase()
+        self.sources = tuple(sources)
+        self.top_k = top_k
+        self.min_count = min_count
+        self.rank_by = rank_by
+        self.chunksize = chunksize
+        self.products = pd.DataFrame(columns=['product_id', 'name', 'category'])
+        self.product_sessions = np.zeros(0)
+        self.sessions = 0
+        self.neighbor_table = None
+        self.fit_seconds = None
+
+    # Counting
+
+    def fit(self):
+        """Build the basket matrix and each product's top-K neighbors; returns the model."""
+        started = time.perf_counter()
+        baskets = self.basket_matrix()
+        self.sessions = baskets.shape[0]
+        self.product_sessions = np.asarray(baskets.sum(axis=0)).ravel()
+        self.neighbor_table = self._neighbors(baskets)
+        self.fit_seconds = time.perf_counter() - started
+        return self
+
+    def basket_matrix(self):
+        """Binary CSR matrix of sessions x products; also sets `products` (row order of the columns)."""
+        session_positions, product_positions = {}, {}
+        rows, columns = [], []
+        conn = self.db.connect()
+        try:
+            catalog = pd.read_sql_query("SELECT product_id, name, category FROM products", conn)
+            for product_id in catalog['product_id']:
+                product_positions.setdefault(product_id, len(product_positions))
+            for source in self.sources:
+                for chunk in pd.read_sql_query(BASKET_QUERIES[source], conn, chunksize=self.chunksize):
+                    rows.append(self._encode(chunk['session_id'], session_positions))
+                    columns.append(self._encode(chunk['product_id'], product_positions))
+        finally:
+            self.db.close()
+
+        # Products with events but no catalog row keep their id as the name
+        extra = list(product_positions)[len(catalog):]
+        self.products = pd.concat([catalog, pd.DataFrame({'product_id': extra, 'name': extra, 'category': None})],
+                                  ignore_index=True)
+        rows = np.concatenate(rows) if rows else np.empty(0, np.int64)
+        columns = np.concatenate(columns) if columns else np.empty(0, np.int64)
+        # Repeat views of a product in a session count once
+        return binary_matrix(rows, columns, (len(session_positions), len(product_positions)))
+
+    @staticmethod
+    def _encode(values, positions):
+        """Global codes for a chunk's ids, adding ids seen for the first time."""
+        codes, uniques = pd.factorize(values)
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for number, value in enumerate(uniques):
+            lookup[number] = positions.setdefault(value, len(positions))
+        return lookup[codes]
+
+    def _neighbors(self, baskets):
+        """Top-K neighbors of every product, as a frame of (product, neighbor) code pairs with their metrics."""
+        by_product = baskets.T.tocsr()
+        pieces = []
+        for start in range(0, baskets.shape[1], BLOCK_SIZE):
+            # Co-occurrence rows of one block of products: sparse, (block x products)
+            block = (by_product[start:start + BLOCK_SIZE] @ baskets).tocoo()
+            keep = (block.row + start != block.col) & (block.data >= self.min_count)
+            product = block.row[keep].astype(np.int64) + start
+            neighbor = block.col[keep].astype(np.int64)
+            count = block.data[keep].astype(np.int64)
+            pieces.append(self._top_k(product, neighbor, count))
+        columns = ['product', 'neighbor', 'count', 'confidence', 'lift']
+        if not pieces:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(pieces, ignore_index=True)[columns]
+
+    def _top_k(self, product, neighbor, count):
+        """Confidence and lift of candidate pairs, cut to each product's best `top_k` neighbors."""
+        support = self.product_sessions
+        confidence = count / support[product]
+        lift = count * self.sessions / (support[product] * support[neighbor])
+        score = {'lift': lift, 'confidence': confidence, 'count': count}[self.rank_by]
+        # Best score first within each product, ties to the larger count
+        kept, _ = top_k_rows(product, self.top_k, -score, -count)
+        return pd.DataFrame({'product': product[kept], 'neighbor': neighbor[kept], 'count': count[kept],
+                             'confidence': confidence[kept], 'lift': lift[kept]})
+
+    # Results
+
+    def _label(self, table):
+        """Attach product ids, names and categories to a frame of product and neighbor codes."""
+        products = self.products.reset_index(drop=True)
+        return pd.DataFrame({
+            'product_id': products['product_id'].to_numpy(dtype=object)[table['product']],
+            'product': products['name'].to_numpy(dtype=object)[table['product']],
+            'category': products['category'].to_numpy(dtype=object)[table['product']],
+            'neighbor_id': products['product_id'].to_numpy(dtype=object)[table['neighbor']],
+            'neighbor': products['name'].to_numpy(dtype=object)[table['neighbor']],
+            'neighbor_category': products['category'].to_numpy(dtype=object)[table['neighbor']],
+            'count': table['count'].to_numpy(),
+            'confidence': table['confidence'].to_numpy(),
+            'lift': table['lift'].to_numpy(),
+        })
+
+    def neighbors(self, product_id, k=None):
+        """The products most associated with one product, best first."""
+        position = np.flatnonzero(self.products['product_id'].to_numpy(dtype=object) == product_id)
+        if not len(position):
+            raise KeyError(product_id)
+        table = self.neighbor_table[self.neighbor_table['product'] == position[0]]
+        return self._label(table.head(k) if k else table).reset_index(drop=True)
+
+    def top_pairs(self, k=10, min_count=None):
+        """The strongest product pairs by the ranking metric, each unordered pair once.
+
+        Confidence is given in the direction of the pair's first product.
+        """
+        table = self.neighbor_table
+        if min_count:
+            table = table[table['count'] >= min_count]
+        score = table[self.rank_by]
+        # A pair kept from both ends appears twice; keep the direction with the higher confidence
+        table = table.assign(first=np.minimum(table['product'], table['neighbor']),
+                             second=np.maximum(table['product'], table['neighbor']), score=score)
+        table = table.sort_values(['score', 'confidence'], ascending=False, kind='stable')
+        table = table.drop_duplicates(['first', 'second']).head(k)
+        return self._label(table).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Product co-occurrence, confidence and lift")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--top-k', type=int, default=20, help="Neighbors kept per product")
+    parser.add_argument('--min-count', type=int, default=2, help="Sessions a pair must share")
+    parser.add_argument('--rank-by', choices=RANKINGS, default='lift')
+    parser.add_argument('--product', default=None, help="Show the neighbors of one product id")
+    args = parser.parse_args()
+
+    model = ProductAffinity(EcommerceDatabase(args.db), top_k=args.top_k, min_count=args.min_count,
+                            rank_by=args.rank_by).fit()
+    print(f"{model.sessions:,} baskets, {len(model.products):,} products, {len(model.neighbor_table):,} neighbor pairs "
+          f"kept, in {model.fit_seconds:.2f}s")
+    results = model.neighbors(args.product) if args.product else model.top_pairs(20)
+    columns = ['product', 'category', 'neighbor', 'neighbor_category', 'count', 'confidence', 'lift']
+    print(tabulate(results[columns], headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
@@ -0,0 +1,248 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from analysis_engine import SESSION_FLAGS
+from cohorts import NO_TIME
+
+# Bump when the layout of a saved cube changes
+CUBE_VERSION = 1
+
+# Session attributes the cube is keyed by; day is the session's start date
+CUBE_DIMENSIONS = ['device_type', 'browser', 'country', 'referrer', 'landing_page', 'day']
+
+# Additive totals kept per cell: sessions, conversions, cart value and sessions reaching each funnel stage
+CUBE_MEASURES = ['sessions', 'conversions', 'cart_value'] + SESSION_FLAGS
+
+# Roll-ups materialized with the cube: most drill-downs do not split by day, and leaving it out shrinks the cube
+# most; trends by day are mostly read for one other dimension at a time
+MATERIALIZED_ROLLUPS = ([[dimension for dimension in CUBE_DIMENSIONS if dimension != 'day']] +
+                        [[dimension, 'day'] for dimension in CUBE_DIMENSIONS if dimension != 'day'])
+
+
+def cube_path(db_path):
+    """Default location of the saved cube for a database."""
+    return f"{db_path}.cube.npz"
+
+
+def combine_cells(codes, sizes, measures):
+    """Sum measures over rows sharing the same combination of dimension codes.
+
+    `codes` holds each dimension's code per row and `sizes` the number of
+    labels per dimension. Returns the codes and measure totals of each
+    combination present. With a small code space the totals are counted
+    densely with bincount; otherwise the combined codes are sorted.
+    """
+    rows = len(next(iter(measures.values())))
+    cell = np.zeros(rows, dtype=np.int64)
+    space = 1
+    for dimension, dimension_codes in codes.items():
+        cell = cell * sizes[dimension] + dimension_codes
+        space *= sizes[dimension]
+    if space <= max(rows, 1 << 16):
+        present = np.flatnonzero(np.bincount(cell, minlength=space))
+        lookup = np.zeros(space, dtype=np.int64)
+        lookup[present] = np.arange(len(present))
+        inverse = lookup[cell]
+    else:
+        present, inverse = np.unique(cell, return_inverse=True)
+    totals = {name: np.bincount(inverse, weights=values, minlength=len(present))
+              for name, values in measures.items()}
+    cell_codes = {}
+    remainder = present
+    for dimension in reversed(list(codes)):
+        cell_codes[dimension] = (remainder % sizes[dimension]).astype(np.int32)
+        remainder = remainder // sizes[dimension]
+    return {dimension: cell_codes[dimension] for dimension in codes}, totals
+
+
+class OlapCube:
+    """Precomputed session measures over every combination of the cube dimensions.
+
+    The cube keeps only the cells that occur, as parallel arrays: one
+    integer code array per dimension (into that dimension's labels) and one
+    total array per measure. `slice` keeps the cells matching some
+    dimension values, `roll_up` sums away dimensions, and `group_by` answers
+    any group-by over the dimensions from the cells. It is served from the
+    smallest materialized roll-up that covers the query, so no session is
+    read again.
+    """
+
+    def __init__(self, labels, codes, measures, materialize=True):
+        """A cube from each dimension's labels, the per-cell codes and the per-cell measure totals."""
+        self.dimensions = list(labels)
+        self.labels = labels
+        self.codes = codes
+        self.measures = measures
+        self.rollups = []
+        if materialize:
+            for dimensions in MATERIALIZED_ROLLUPS:
+                kept = [dimension for dimension in dimensions if dimension in self.dimensions]
+                if len(kept) < len(self.dimensions):
+                    self.rollups.append(self.roll_up(kept))
+
+    @classmethod
+    def from_facts(cls, facts, dimensions=CUBE_DIMENSIONS):
+        """Build the cube from per-session facts (as returned by `get_cube_facts`)."""
+        labels, codes = {}, {}
+        for dimension in dimensions:
+            values = facts[dimension]
+            if dimension == 'day':
+                # Day numbers become ISO dates, and a missing start time a missing day
+                values = pd.Series(np.where(values.to_numpy() == NO_TIME, np.nan, values.to_numpy(dtype=float)))
+                codes[dimension], uniques = pd.factorize(values, use_na_sentinel=False)
+                labels[dimension] = np.array([None if np.isnan(day) else
+                                              str(np.datetime64(int(day), 'D')) for day in uniques], dtype=object)
+            else:
+                codes[dimension], uniques = pd.factorize(values.astype(object), use_na_sentinel=False)
+                labels[dimension] = np.array([None if pd.isna(value) else value for value in uniques], dtype=object)
+        measures = {
+            'sessions': np.ones(len(facts)),
+            'conversions': facts['completed'].to_numpy(dtype=float),
+            'cart_value': facts['cart_value'].fillna(0).to_numpy(dtype=float),
+        }
+        for flag in SESSION_FLAGS:
+            measures[flag] = facts[flag].to_numpy(dtype=float)
+        sizes = {dimension: len(labels[dimension]) for dimension in dimensions}
+        codes, measures = combine_cells(codes, sizes, measures)
+        return cls(labels, codes, measures)
+
+    @property
+    def cells(self):
+        return len(self.measures['sessions'])
+
+    # Operations
+
+    def slice(self, **filters):
+        """The cells whose dimensions take the given values (one label or a list each); all dimensions are kept."""
+        keep = np.ones(self.cells, dtype=bool)
+        for dimension, values in filters.items():
+            if dimension not in self.labels:
+                raise KeyError(f"unknown dimension {dimension!r}; expected one of {self.dimensions}")
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            allowed = np.array([label in values for label in self.labels[dimension]], dtype=bool)
+            keep &= allowed[self.codes[dimension]]
+        return OlapCube(self.labels, {dimension: codes[keep] for dimension, codes in self.codes.items()},
+                        {name: totals[keep] for name, totals in self.measures.items()}, materialize=False)
+
+    def roll_up(self, dimensions):
+        """The cube over a subset of its dimensions, summing the measures of the others away."""
+        unknown = set(dimensions) - set(self.dimensions)
+        if unknown:
+            raise KeyError(f"unknown dimensions {sorted(unknown)}; expected among {self.dimensions}")
+        dimensions = [dimension for dimension in self.dimensions if dimension in dimensions]
+        codes, measures = combine_cells({dimension: self.codes[dimension] for dimension in dimensions},
+                                        {dimension: len(self.labels[dimension]) for dimension in dimensions},
+                                        self.measures)
+        return OlapCube({dimension: self.labels[dimension] for dimension in dimensions}, codes, measures,
+                        materialize=False)
+
+    def covering(self, dimensions):
+        """The smallest of this cube and its materialized roll-ups that has all the given dimensions."""
+        candidates = [self] + [rollup for rollup in self.rollups if set(dimensions) <= set(rollup.dimensions)]
+        return min(candidates, key=lambda cube: cube.cells)
+
+    def group_by(self, *dimensions, **filters):
+        """Measure totals, conversion rate and cart value per session for each combination of the given dimensions.
+
+        Keyword arguments filter dimensions first, as in `slice`. Groups are
+        ordered by sessions, most first.
+        """
+        cube = self.covering(set(dimensions) | set(filters))
+        if filters:
+            cube = cube.slice(**filters)
+        cube = cube.roll_up(dimensions)
+        return cube.to_frame().sort_values('sessions', ascending=False, kind='stable').reset_index(drop=True)
+
+    def to_frame(self):
+        """One row per cell: dimension labels, measure totals and derived rates."""
+        frame = pd.DataFrame({dimension: self.labels[dimension][self.codes[dimension]] for dimension in self.dimensions})
+        for name, totals in self.measures.items():
+            frame[name] = totals if name == 'cart_value' else totals.astype(np.int64)
+        sessions = np.maximum(self.measures['sessions'], 1)
+        frame['conversion_rate'] = self.measures['conversions'] / sessions
+        frame['cart_value_per_session'] = self.measures['cart_value'] / sessions
+        return frame
+
+    # Persistence
+
+    def save(self, path):
+        """Write the cube's arrays atomically (the materialized roll-ups are rebuilt on load)."""
+        arrays = {'version': np.array(CUBE_VERSION), 'dimensions': np.array(self.dimensions, dtype=str)}
+        for dimension in self.dimensions:
+            labels = self.labels[dimension]
+            arrays[f"labels_{dimension}"] = np.array(['' if label is None else str(label) for label in labels], dtype=str)
+            arrays[f"missing_{dimension}"] = np.array([label is None for label in labels], dtype=bool)
+            arrays[f"codes_{dimension}"] = self.codes[dimension]
+        for name, totals in self.measures.items():
+            arrays[f"measure_{name}"] = totals
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a saved cube, or None if there is none for this version."""
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if int(saved['version']) != CUBE_VERSION:
+                    return None
+                dimensions = saved['dimensions'].tolist()
+                labels = {dimension: np.where(saved[f"missing_{dimension}"], None,
+                                              saved[f"labels_{dimension}"].astype(object)) for dimension in dimensions}
+                codes = {dimension: saved[f"codes_{dimension}"] for dimension in dimensions}
+                measures = {name: saved[f"measure_{name}"] for name in CUBE_MEASURES}
+        except OSError:
+            return None
+        return cls(labels, codes, measures)
+
+
+def build_cube(source, path=None):
+    """Build the cube from a source with `get_cube_facts` (the shared engine, or `EcommerceDatabase`), saving it to `path`."""
+    cube = OlapCube.from_facts(source.get_cube_facts())
+    if path:
+        cube.save(path)
+    return cube
+
+
+def load_cube(db_path='ecommerce_data.db', current=None):
+    """The saved cube for a database, reusing `current` unless the file changed (None if not built)."""
+    path = cube_path(db_path)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+    if current is not None and getattr(current, 'loaded', None) == (path, modified):
+        return current
+    cube = OlapCube.load(path)
+    if cube is not None:
+        cube.loaded = (path, modified)
+    return cube
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Build the session cube and answer a group-by from it")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--group-by', default='device_type,landing_page', help="Comma-separated dimensions")
+    parser.add_argument('--where', action='append', default=[], help="dimension=value filter (repeatable)")
+    args = parser.parse_args()
+
+    engine = SharedFrameEngine(EcommerceDatabase(args.db), incremental=True)
+    engine.prepare(['conversion_cube'])
+    started = time.perf_counter()
+    cube = build_cube(engine, cube_path(args.db))
+    print(f"Built {cube.cells:,} cells over {', '.join(cube.dimensions)} in {time.perf_counter() - started:.2f}s "
+          f"({os.path.getsize(cube_path(args.db)) / 1e6:.1f} MB saved)")
+
+    dimensions = [dimension for dimension in args.group_by.split(',') if dimension]
+    filters = dict(condition.split('=', 1) for condition in args.where)
+    started = time.perf_counter()
+    result = cube.group_by(*dimensions, **filters)
+    print(f"Group-by answered in {(time.perf_counter() - started) * 1000:.1f} ms")
+    columns = dimensions + ['sessions', 'conversions', 'conversion_rate', 'add_to_cart', 'cart_value_per_session']
+    print(tabulate(result[columns].head(20), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
@@ -0,0 +1,244 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from tabulate import tabulate
+from database import EcommerceDatabase, session_chunks
+
+# Page type whose pages end a journey in a purchase
+CONVERSION_PAGE_TYPE = 'confirmation'
+
+# Virtual state a session moves to after its last page (when it did not convert)
+EXIT_STATE = 'exit'
+
+# Transition (from, to) codes are packed into one int64 as from * PAIR_BASE + to
+PAIR_BASE = 1 << 32
+
+
+class PageTransitionModel:
+    """Absorbing Markov chain over page-to-page transitions.
+
+    Page views are streamed out of SQLite in (session, timestamp) order, in
+    chunks, and each chunk's transitions are counted with vectorized
+    comparisons of adjacent rows; a session that spans two chunks is
+    carried over. States are page types, or individual page URLs with
+    `level='page_url'`. Confirmation pages absorb (a conversion); a
+    session's last page otherwise moves to the absorbing exit state.
+
+    The transition matrix is kept sparse, and conversion probabilities,
+    expected steps and removal effects come from sparse LU solves of
+    (I - Q), where Q holds the transient-to-transient probabilities.
+    """
+
+    def __init__(self, db=None, level='page_type', chunksize=500000):
+        """Initialize an unfitted model over an `EcommerceDatabase`."""
+        if level not in ('page_type', 'page_url'):
+            raise ValueError(f"level must be 'page_type' or 'page_url', got {level!r}")
+        self.db = db if db else EcommerceDatabase()
+        self.level = level
+        self.chunksize = chunksize
+        self.states = []
+        self.state_types = []
+        self.counts = None
+        self.exits = None
+        self.starts = None
+        self.page_views = 0
+        self.sessions = 0
+        self.fit_seconds = None
+
+    # Counting
+
+    def fit(self):
+        """Count transitions over all page views and return the model."""
+        started = time.perf_counter()
+        self.states, self.state_types = [], []
+        positions = {}
+        pair_counts, exit_codes, start_codes = [], [], []
+        self.page_views = 0
+        self.sessions = 0
+
+        conn = self.db.connect()
+        try:
+            # Rows come out in index order (idx_page_views_session_time), so the ordered scan needs no sort
+            query = f"""
+            SELECT session_id, page_type, {self.level} AS state
+            FROM page_views
+            WHERE session_id IS NOT NULL AND {self.level} IS NOT NULL
+            ORDER BY session_id, timestamp
+            """
+            for chunk in session_chunks(query, conn, self.chunksize):
+                self.page_views += len(chunk)
+                self._count(chunk, positions, pair_counts, exit_codes, start_codes)
+        finally:
+            self.db.close()
+
+        size = len(self.states)
+        pairs, weights = self._collect(pair_counts)
+        # Duplicate (from, to) entries across chunks are summed when converting to CSR
+        self.counts = sparse.coo_matrix((weights, (pairs // PAIR_BASE, pairs % PAIR_BASE)), shape=(size, size)).tocsr()
+        exit_states, exit_counts = self._collect(exit_codes)
+        self.exits = np.bincount(exit_states, weights=exit_counts, minlength=size)
+        start_states, start_counts = self._collect(start_codes)
+        self.starts = np.bincount(start_states, weights=start_counts, minlength=size)
+        self.fit_seconds = time.perf_counter() - started
+        return self
+
+    def _count(self, chunk, positions, pair_counts, exit_codes, start_codes):
+        """Add the transitions of complete sessions in one chunk."""
+        if chunk.empty:
+            return
+        codes = self._encode(chunk, positions)
+        sessions = chunk['session_id'].to_numpy(dtype=object)
+        same_session = sessions[1:] == sessions[:-1]
+        first = np.concatenate([[True], ~same_session])
+        last = np.concatenate([~same_session, [True]])
+        # Each chunk is reduced to distinct codes with counts, so memory tracks distinct transitions
+        pair_counts.append(np.unique(codes[:-1][same_session] * PAIR_BASE + codes[1:][same_session], return_counts=True))
+        exit_codes.append(np.unique(codes[last], return_counts=True))
+        start_codes.append(np.unique(codes[first], return_counts=True))
+        self.sessions += int(first.sum())
+
+    @staticmethod
+    def _collect(pieces):
+        """Concatenate per-chunk (codes, counts) pairs."""
+        if not pieces:
+            return np.empty(0, np.int64), np.empty(0)
+        return (np.concatenate([codes for codes, _ in pieces]),
+                np.concatenate([counts for _, counts in pieces]).astype(float))
+
+    def _encode(self, chunk, positions):
+        """Global state codes for a chunk's states, adding states seen for the first time."""
+        codes, uniques = pd.factorize(chunk['state'])
+        page_types = chunk['page_type'].to_numpy(dtype=object)
+        first_rows = np.unique(codes, return_index=True)[1]
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for number, state in enumerate(uniques):
+            if state not in positions:
+                positions[state] = len(self.states)
+                self.states.append(state)
+                self.state_types.append(page_types[first_rows[number]])
+            lookup[number] = positions[state]
+        return lookup[codes]
+
+    # Absorbing chain
+
+    @property
+    def converting(self):
+        """Mask of absorbing conversion states."""
+        return np.array(self.state_types, dtype=object) == CONVERSION_PAGE_TYPE
+
+    def chain(self, removed=None):
+        """Transient-to-transient probabilities Q and one-step conversion probabilities r.
+
+        States in the `removed` mask are cut out: transitions into them
+        leave the journey (as exits) and sessions starting on them are lost.
+        """
+        transient = ~self.converting
+        if removed is not None:
+            transient &= ~removed
+        outgoing = np.asarray(self.counts.sum(axis=1)).ravel() + self.exits
+        scale = sparse.diags(np.divide(1.0, outgoing, out=np.zeros_like(outgoing), where=outgoing > 0))
+        probabilities = (scale @ self.counts).tocsr()
+        kept = np.flatnonzero(transient)
+        q = probabilities[kept][:, kept]
+        r = np.asarray(probabilities[kept][:, np.flatnonzero(self.converting)].sum(axis=1)).ravel()
+        return kept, q.tocsc(), r
+
+    def solve(self, removed=None):
+        """Conversion probability, expected steps and expected steps to conversion from each transient state.
+
+        Returns (kept state codes, frame of per-state results, overall conversion probability).
+        """
+        kept, q, r = self.chain(removed)
+        if not len(kept):
+            return kept, pd.DataFrame(columns=['conversion_probability', 'expected_steps', 'steps_to_conversion']), 0.0
+        lu = splu((sparse.identity(len(kept), format='csc') - q).tocsc())
+        # (I - Q) p = r gives absorption into conversion; (I - Q) t = 1 gives expected steps to absorption
+        conversion = lu.solve(r)
+        steps = lu.solve(np.ones(len(kept)))
+        # Steps conditional on converting: (I - Q) x = p, then x / p
+        weighted_steps = lu.solve(conversion)
+        to_conversion = np.divide(weighted_steps, conversion, out=np.full(len(kept), np.nan), where=conversion > 0)
+
+        total_starts = self.starts.sum()
+        overall = 0.0
+        if total_starts:
+            overall = (self.starts[kept] @ conversion + self.starts[self.converting].sum()) / total_starts
+        results = pd.DataFrame({
+            'conversion_probability': conversion,
+            'expected_steps': steps,
+            'steps_to_conversion': to_conversion,
+        }, index=kept)
+        return kept, results, float(overall)
+
+    def removal_effects(self, baseline=None):
+        """Relative drop in overall conversion probability when each (non-conversion) page type is removed."""
+        if baseline is None:
+            baseline = self.solve()[2]
+        state_types = np.array(self.state_types, dtype=object)
+        effects = {}
+        for page_type in pd.unique(state_types[~self.converting]):
+            removed_probability = self.solve(removed=state_types == page_type)[2]
+            effects[page_type] = 1 - removed_probability / baseline if baseline else 0.0
+        return pd.Series(effects, name='removal_effect')
+
+    def page_type_summary(self):
+        """Per page type: visits, conversion probability, expected steps (to conversion) and removal effect.
+
+        With `level='page_url'` per-page results are averaged over a type's
+        pages, weighted by visits (and, for steps to conversion, by
+        conversion probability too).
+        """
+        kept, results, overall = self.solve()
+        outgoing = np.asarray(self.counts.sum(axis=1)).ravel() + self.exits
+        frame = results.assign(page_type=np.array(self.state_types, dtype=object)[kept], visits=outgoing[kept])
+        frame['converting_visits'] = frame['visits'] * frame['conversion_probability']
+        frame['weighted_probability'] = frame['converting_visits']
+        frame['weighted_steps'] = frame['visits'] * frame['expected_steps']
+        frame['weighted_conversion_steps'] = frame['converting_visits'] * frame['steps_to_conversion'].fillna(0)
+        grouped = frame.groupby('page_type')[
+            ['visits', 'converting_visits', 'weighted_steps', 'weighted_conversion_steps']].sum()
+        summary = pd.DataFrame({
+            'visits': grouped['visits'].astype(int),
+            'conversion_probability': grouped['converting_visits'] / grouped['visits'],
+            'expected_steps': grouped['weighted_steps'] / grouped['visits'],
+            'steps_to_conversion': grouped['weighted_conversion_steps'] / grouped['converting_visits'].replace(0, np.nan),
+        })
+        summary['removal_effect'] = self.removal_effects(overall)
+        summary.index.name = 'page_type'
+        summary = summary.reset_index().sort_values(['removal_effect', 'visits'], ascending=False, kind='stable')
+        return summary.reset_index(drop=True), overall
+
+    def top_transitions(self, limit=15):
+        """The most frequent page type transitions (including exits) with their probabilities; all with `limit=None`."""
+        state_types = np.array(self.state_types, dtype=object)
+        counts = self.counts.tocoo()
+        frame = pd.DataFrame({
+            'from_page': np.concatenate([state_types[counts.row], state_types]),
+            'to_page': np.concatenate([state_types[counts.col], np.full(len(state_types), EXIT_STATE, dtype=object)]),
+            'count': np.concatenate([counts.data, self.exits]),
+        })
+        frame = frame[frame['from_page'] != CONVERSION_PAGE_TYPE]
+        frame = frame.groupby(['from_page', 'to_page'], as_index=False)['count'].sum()
+        frame = frame[frame['count'] > 0]
+        frame['probability'] = frame['count'] / frame.groupby('from_page')['count'].transform('sum')
+        frame['count'] = frame['count'].astype(int)
+        frame = frame.sort_values('count', ascending=False, kind='stable')
+        return (frame if limit is None else frame.head(limit)).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fit the page-transition Markov model")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--level', choices=['page_type', 'page_url'], default='page_type')
+    args = parser.parse_args()
+
+    model = PageTransitionModel(EcommerceDatabase(args.db), level=args.level).fit()
+    summary, overall = model.page_type_summary()
+    print(f"{model.page_views:,} page views in {model.sessions:,} sessions, {len(model.states):,} states, "
+          f"counted in {model.fit_seconds:.2f}s")
+    print(f"Conversion probability from entry: {overall*100:.2f}%")
+    print(tabulate(summary, headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
+    print(tabulate(model.top_transitions(), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
@@ -0,0 +1,266 @@
+import time
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from database import EcommerceDatabase, group_ranks, session_chunks
+
+# Longest journey prefix kept per session
+MAX_PATH_LENGTH = 8
+
+# Paths followed by fewer sessions than this share (or count, when >= 1) are pruned
+MIN_SUPPORT = 0.01
+
+# Trie nodes are keyed by (parent node + 1) * STEP_BASE + step code
+STEP_BASE = 1 << 20
+
+# Running counts kept per journey prefix
+PREFIX_COUNTS = ['support', 'conversions', 'ends', 'ended_conversions']
+
+# Separator between steps when a path is shown as text
+PATH_SEPARATOR = ' → '
+
+# Every journey event as (session, time, step); page views come first on timestamp ties
+EVENTS_QUERY = """
+SELECT session_id, timestamp, page_type AS step, 0 AS source FROM page_views
+WHERE session_id IS NOT NULL AND page_type IS NOT NULL
+UNION ALL
+SELECT session_id, timestamp, event_type, 1 FROM cart_events
+WHERE session_id IS NOT NULL AND event_type IS NOT NULL
+UNION ALL
+SELECT session_id, timestamp, step, 2 FROM checkout_events
+WHERE session_id IS NOT NULL AND step IS NOT NULL
+ORDER BY session_id, timestamp, source
+"""
+
+
+class JourneyPathMiner:
+    """Frequent journey paths from a prefix trie over per-session event sequences.
+
+    A session's journey is its page types, cart events and checkout steps
+    in time order, with immediate repeats collapsed (five product pages in
+    a row are one `product_detail` step) and cut at `max_length` steps.
+    Events are streamed out of SQLite in chunks of whole sessions.
+
+    Each chunk's journeys are folded into running counts per prefix (trie
+    node): sessions reaching it, conversions among them, and journeys that
+    end there. Nothing is kept per session, so memory grows with the number
+    of distinct prefixes rather than with the number of sessions. Once every
+    session is counted, nodes followed by fewer than `min_support` sessions
+    are pruned; a node is never more frequent than its parent, so the pruned
+    nodes form a trie. Since the nodes at one depth split the sessions
+    between them, each depth of it holds at most sessions / min_support
+    nodes, whatever the number of distinct journeys.
+    """
+
+    def __init__(self, db=None, min_support=MIN_SUPPORT, max_length=MAX_PATH_LENGTH,
+                 collapse_repeats=True, chunksize=500000):
+        """Initialize an unfitted miner over an `EcommerceDatabase`."""
+        self.db = db if db else EcommerceDatabase()
+        self.min_support = min_support
+        self.max_length = max_length
+        self.collapse_repeats = collapse_repeats
+        self.chunksize = chunksize
+        self.steps = []
+        self.nodes = None
+        self.sessions = 0
+        self.conversions = 0
+        self.events = 0
+        self.min_count = None
+        self.fit_seconds = None
+
+    @property
+    def conversion_rate(self):
+        """Share of sessions with journey events that converted."""
+        return self.conversions / self.sessions if self.sessions else 0.0
+
+    # Sequences
+
+    def fit(self):
+        """Count every session's journey prefixes, prune them into the frequent trie and return the miner."""
+        started = time.perf_counter()
+        prefixes = self._count_prefixes()
+        if self.min_support < 1:
+            self.min_count = max(1, int(np.ceil(self.min_support * self.sessions)))
+        else:
+            self.min_count = int(self.min_support)
+        self.nodes = self._build(prefixes)
+        self.fit_seconds = time.perf_counter() - started
+        return self
+
+    def _count_prefixes(self):
+        """Running counts of every journey prefix, folded a chunk of sessions at a time."""
+        self.steps = []
+        self.events = 0
+        self.sessions = 0
+        self.conversions = 0
+        positions = {}
+        prefixes = {'keys': pd.Index(np.empty(0, np.int64)), 'parent': [], 'step': [], 'length': [],
+                    'counts': np.zeros((0, len(PREFIX_COUNTS)))}
+
+        conn = self.db.connect()
+        try:
+            completed = pd.read_sql_query(
+                "SELECT session_id FROM sessions WHERE conversion_status = 'completed'", conn)['session_id']
+            completed = pd.Index(completed.dropna().unique())
+
+            for chunk in session_chunks(EVENTS_QUERY, conn, self.chunksize):
+                self.events += len(chunk)
+                self._fold(chunk, positions, completed, prefixes)
+        finally:
+            self.db.close()
+        return prefixes
+
+    def _fold(self, chunk, positions, completed, prefixes):
+        """Add the journeys of the whole sessions in one chunk to the prefix counts."""
+        codes = self._encode(chunk['step'], positions)
+        session_codes, session_ids = pd.factorize(chunk['session_id'])
+        same_session = session_codes[1:] == session_codes[:-1]
+        keep = np.ones(len(codes), dtype=bool)
+        if self.collapse_repeats:
+            keep[1:] = ~(same_session & (codes[1:] == codes[:-1]))
+        codes, session_codes = codes[keep], session_codes[keep]
+
+        # Step number within the session
+        depths = group_ranks(session_codes)
+        lengths = np.bincount(session_codes, minlength=len(session_ids))
+        converted = np.asarray(session_ids.isin(completed))
+        self.sessions += len(session_ids)
+        self.conversions += int(converted.sum())
+
+        node = np.full(len(session_ids), -1, dtype=np.int64)   # Each session's prefix node so far
+        for depth in range(min(self.max_length, int(lengths.max(initial=0)))):
+            at = depths == depth
+            sessions = session_codes[at]
+            node[sessions] = self._node_ids((node[sessions] + 1) * STEP_BASE + codes[at], depth, prefixes)
+            # Journeys cut at max_length have not ended
+            finished = (lengths[sessions] == depth + 1) & (depth + 1 < self.max_length)
+            outcome = converted[sessions]
+            np.add.at(prefixes['counts'], node[sessions],
+                      np.column_stack([np.ones(len(sessions)), outcome, finished, finished & outcome]))
+
+    def _node_ids(self, keys, depth, prefixes):
+        """Node numbers of (parent, step) keys, adding nodes seen for the first time."""
+        nodes = prefixes['keys'].get_indexer(keys)
+        new = nodes < 0
+        if new.any():
+            added = np.unique(keys[new])
+            nodes[new] = len(prefixes['keys']) + np.searchsorted(added, keys[new])
+            prefixes['keys'] = prefixes['keys'].append(pd.Index(added))
+            prefixes['parent'].append(added // STEP_BASE - 1)
+            prefixes['step'].append(added % STEP_BASE)
+            prefixes['length'].append(np.full(len(added), depth + 1))
+            prefixes['counts'] = np.vstack([prefixes['counts'], np.zeros((len(added), len(PREFIX_COUNTS)))])
+        return nodes
+
+    def _encode(self, steps, positions):
+        """Global step codes for a chunk's steps, adding steps seen for the first time."""
+        codes, uniques = pd.factorize(steps)
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        for number, step in enumerate(uniques):
+            if step not in positions:
+                positions[step] = len(self.steps)
+                self.steps.append(step)
+            lookup[number] = positions[step]
+        return lookup[codes]
+
+    # Trie
+
+    def _build(self, prefixes):
+        """Frequent trie nodes, one row per node, numbered depth by depth in (parent, step) order."""
+        counts = prefixes['counts']
+        frequent = counts[:, 0] >= self.min_count
+        parent = np.concatenate(prefixes['parent']) if prefixes['parent'] else np.empty(0, np.int64)
+        step = np.concatenate(prefixes['step']) if prefixes['step'] else np.empty(0, np.int64)
+        length = np.concatenate(prefixes['length']) if prefixes['length'] else np.empty(0, np.int64)
+
+        # Frequent nodes are renumbered a depth at a time, so parents always come before their children
+        numbers = np.full(len(parent), -1, dtype=np.int64)
+        order = []
+        for depth in range(1, self.max_length + 1):
+            level = np.flatnonzero(frequent & (length == depth))
+            if not len(level):
+                break
+            parents = np.where(parent[level] >= 0, numbers[np.maximum(parent[level], 0)], -1)
+            level = level[np.lexsort((step[level], parents))]
+            numbers[level] = sum(map(len, order)) + np.arange(len(level))
+            order.append(level)
+
+        columns = ['parent', 'step', 'length', 'support', 'conversions', 'ends', 'ended_conversions']
+        if not order:
+            return pd.DataFrame(columns=columns + ['path', 'share', 'conversion_rate'])
+        order = np.concatenate(order)
+        nodes = pd.DataFrame({
+            'parent': np.where(parent[order] >= 0, numbers[np.maximum(parent[order], 0)], -1),
+            'step': np.array(self.steps, dtype=object)[step[order]],
+            'length': length[order],
+        })
+        for column, values in zip(PREFIX_COUNTS, counts[order].T):
+            nodes[column] = values.astype(int)
+        # Parents always come before their children, so paths are built in one pass
+        labels = []
+        for parent, step in zip(nodes['parent'].to_numpy(), nodes['step'].to_numpy()):
+            labels.append(step if parent < 0 else labels[parent] + PATH_SEPARATOR + step)
+        nodes['path'] = labels
+        nodes['share'] = nodes['support'] / self.sessions
+        nodes['conversion_rate'] = nodes['conversions'] / nodes['support']
+        return nodes
+
+    # Results
+
+    def top_paths(self, k=10, min_length=2, by='support'):
+        """The k frequent paths of at least `min_length` steps with the highest `by` (support first on ties)."""
+        paths = self.nodes[self.nodes['length'] >= min_length]
+        order = [by, 'support'] if by != 'support' else ['support', 'length']
+        paths = paths.sort_values(order, ascending=False, kind='stable')
+        return paths[['path', 'length', 'support', 'share', 'conversions', 'conversion_rate', 'ends']].head(k).reset_index(drop=True)
+
+    def dead_ends(self, k=10):
+        """The k frequent paths where the most journeys end without converting."""
+        paths = self.nodes.assign(exits=self.nodes['ends'] - self.nodes['ended_conversions'])
+        paths['exit_share'] = paths['exits'] / self.sessions
+        paths = paths[paths['exits'] > 0].sort_values(['exits', 'length'], ascending=False, kind='stable')
+        return paths[['path', 'length', 'support', 'exits', 'exit_share', 'conversion_rate']].head(k).reset_index(drop=True)
+
+    def flows(self, max_length=5):
+        """Session flows between consecutive steps of the frequent paths, for a Sankey diagram.
+
+        Steps are labelled with their position ("2. product_detail"), so the
+        diagram reads left to right. Sessions whose journey ends at a node
+        flow to "converted" or "exit"; flows into pruned paths are left out.
+        """
+        nodes = self.nodes[self.nodes['length'] <= max_length]
+        labels = nodes['length'].astype(str) + '. ' + nodes['step']
+        frame = pd.DataFrame({'target': labels, 'parent': nodes['parent'], 'sessions': nodes['support']})
+        frame['source'] = frame['parent'].map(labels)
+        links = frame.dropna(subset=['source']).groupby(['source', 'target'], as_index=False)['sessions'].sum()
+
+        # Journeys that stop here, by outcome
+        terminal = pd.concat([
+            pd.DataFrame({'source': labels, 'target': 'converted', 'sessions': nodes['ended_conversions']}),
+            pd.DataFrame({'source': labels, 'target': 'exit', 'sessions': nodes['ends'] - nodes['ended_conversions']}),
+        ])
+        terminal = terminal[terminal['sessions'] > 0].groupby(['source', 'target'], as_index=False)['sessions'].sum()
+        links = pd.concat([links, terminal], ignore_index=True)
+        links['sessions'] = links['sessions'].astype(int)
+        return links.sort_values('sessions', ascending=False, kind='stable').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Mine frequent journey paths")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--min-support', type=float, default=MIN_SUPPORT,
+                        help="Minimum share of sessions (or session count when >= 1)")
+    parser.add_argument('--max-length', type=int, default=MAX_PATH_LENGTH)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    miner = JourneyPathMiner(EcommerceDatabase(args.db), min_support=args.min_support,
+                             max_length=args.max_length).fit()
+    print(f"{miner.events:,} events in {miner.sessions:,} sessions, {len(miner.nodes):,} frequent paths "
+          f"(support >= {miner.min_count:,} sessions), mined in {miner.fit_seconds:.2f}s")
+    print(f"Overall conversion rate: {miner.conversion_rate*100:.2f}%")
+    print(tabulate(miner.top_paths(args.top), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
+    print(tabulate(miner.top_paths(args.top, by='conversion_rate'), headers='keys', tablefmt='pipe',
+                   showindex=False, floatfmt='.3f'))
+    print(tabulate(miner.dead_ends(args.top), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
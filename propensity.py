@@ -0,0 +1,300 @@
+import os
+import time
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import log_loss, roc_auc_score
+from sklearn.preprocessing import StandardScaler
+from tabulate import tabulate
+
+# Bump when the layout of the trainer state or the exported model changes
+MODEL_VERSION = 1
+
+# Per-session counts the model is trained on (log-scaled, then standardized)
+NUMERIC_FEATURES = ['page_view_count', 'click_count', 'cart_event_count', 'search_count', 'avg_time_spent']
+
+# User attributes, one-hot encoded into a fixed number of slots so the model's width never changes;
+# slot 0 takes missing values and values first seen after the other slots filled up
+CATEGORICAL_FEATURES = ['device_type', 'referrer']
+CATEGORY_SLOTS = 16
+
+# Sessions that started within this many hours of the latest one may still convert, so they wait for the next update
+SETTLE_HOURS = 2
+
+# Passes over the first batch of training data; later updates make one pass over just the new sessions
+INITIAL_EPOCHS = 5
+
+
+def propensity_paths(db_path):
+    """Default locations of the trainer state and the exported scoring model for a database."""
+    return f"{db_path}.propensity-state", f"{db_path}.propensity.npz"
+
+
+def numeric_matrix(columns):
+    """log1p of the numeric features (missing or negative values as 0), one column per feature."""
+    return np.log1p(np.clip(np.nan_to_num(np.column_stack(columns).astype(float)), 0, None))
+
+
+class PropensityTrainer:
+    """Online training of a conversion-propensity model on per-session features.
+
+    The model is a logistic regression (`SGDClassifier` with log loss) over
+    log-scaled, standardized session counts plus one-hot device type and
+    referrer. Each `update` reads the sessions that started after the last
+    trained hour from a source with `get_session_features` (the shared
+    engine, or `EcommerceDatabase`), leaving out the last `settle` hours,
+    and folds them in with `partial_fit`; the scaler is kept as first
+    fitted, so earlier updates stay valid. Before training on a batch the
+    current model scores it, giving an out-of-sample (progressive
+    validation) AUC and log loss.
+
+    The trainer state persists to `state_path`. After each update the
+    model is exported to `model_path` as a few arrays (the scaler folded
+    into the weights), written atomically, so `PropensityScorer` keeps
+    serving the previous model until the new one is in place.
+    """
+
+    def __init__(self, source, state_path=None, model_path=None, settle=SETTLE_HOURS, batch_size=4096,
+                 alpha=1e-4, eta0=0.01, random_state=42):
+        self.source = source
+        self.state_path = state_path
+        self.model_path = model_path
+        self.settle = settle
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.eta0 = eta0
+        self.random_state = random_state
+        self.state = self.load_state() or self.new_state()
+
+    def new_state(self):
+        return {
+            'version': MODEL_VERSION,
+            'scaler': None,
+            # A small constant step with averaged weights keeps the probabilities calibrated between updates
+            'classifier': SGDClassifier(loss='log_loss', alpha=self.alpha, learning_rate='constant', eta0=self.eta0,
+                                        average=True, random_state=self.random_state),
+            'vocab': {column: [] for column in CATEGORICAL_FEATURES},
+            'trained_through': None,
+            'sessions': 0,
+            'updates': 0,
+            'validation': None,
+        }
+
+    def load_state(self):
+        """Load the persisted trainer, or None if there is none for this version."""
+        if not self.state_path:
+            return None
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            return None
+        return state if state.get('version') == MODEL_VERSION else None
+
+    def save_state(self):
+        """Persist the trainer atomically."""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def is_fitted(self):
+        return self.state['scaler'] is not None
+
+    def slots(self, column, values, grow=False):
+        """Vocabulary slot of each category value (0 for missing or unknown), adding new values when `grow`."""
+        vocab = self.state['vocab'][column]
+        if grow:
+            for value in pd.unique(pd.Series(values).dropna()):
+                if value not in vocab and len(vocab) < CATEGORY_SLOTS - 1:
+                    vocab.append(value)
+        return pd.Index(vocab, dtype=object).get_indexer(pd.Series(values, dtype=object)) + 1
+
+    def matrix(self, session_data, grow=False):
+        """Model input: standardized numeric features followed by one block of one-hot slots per categorical."""
+        numeric = numeric_matrix([session_data[column].to_numpy() for column in NUMERIC_FEATURES])
+        if self.state['scaler'] is None:
+            self.state['scaler'] = StandardScaler().fit(numeric)
+        blocks = [self.state['scaler'].transform(numeric)]
+        for column in CATEGORICAL_FEATURES:
+            one_hot = np.zeros((len(session_data), CATEGORY_SLOTS))
+            one_hot[np.arange(len(session_data)), self.slots(column, session_data[column], grow)] = 1
+            blocks.append(one_hot)
+        return np.hstack(blocks)
+
+    def update(self):
+        """Train on sessions that settled since the last update and export the model; returns stats."""
+        started = time.perf_counter()
+        stats = {'sessions': 0, 'trained_through': self.state['trained_through'], 'validation': None}
+        session_data = self.source.get_session_features(since_hour=self.state['trained_through'])
+        if session_data.empty:
+            stats['seconds'] = time.perf_counter() - started
+            return stats
+        now = int(time.time() // 3600)
+        cutoff = max(int(session_data['start_hour'].max()), now) - self.settle
+        session_data = session_data[session_data['start_hour'] <= cutoff]
+        if session_data.empty:
+            stats['seconds'] = time.perf_counter() - started
+            return stats
+
+        first = not self.is_fitted
+        X = self.matrix(session_data, grow=True)
+        y = session_data['completed'].to_numpy(dtype=bool)
+        classifier = self.state['classifier']
+        if not first and len(np.unique(y)) == 2:
+            # Progressive validation: score the batch before learning from it
+            predicted = classifier.predict_proba(X)[:, 1]
+            stats['validation'] = self.state['validation'] = {
+                'sessions': len(y), 'auc': float(roc_auc_score(y, predicted)), 'log_loss': float(log_loss(y, predicted))}
+
+        rng = np.random.default_rng(self.random_state + self.state['updates'])
+        for _ in range(INITIAL_EPOCHS if first else 1):
+            order = rng.permutation(len(y))
+            for start in range(0, len(y), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                classifier.partial_fit(X[batch], y[batch], classes=np.array([False, True]))
+
+        self.state['trained_through'] = cutoff
+        self.state['sessions'] += len(y)
+        self.state['updates'] += 1
+        if self.state_path:
+            self.save_state()
+        if self.model_path:
+            self.export(self.model_path)
+        stats.update(sessions=len(y), trained_through=cutoff)
+        stats['seconds'] = time.perf_counter() - started
+        return stats
+
+    def export(self, path):
+        """Write the scoring model atomically: scaler-folded weights, bias and category vocabularies."""
+        scaler, classifier = self.state['scaler'], self.state['classifier']
+        coef = classifier.coef_[0]
+        width = len(NUMERIC_FEATURES)
+        numeric_weights = coef[:width] / scaler.scale_
+        arrays = {
+            'version': np.array(MODEL_VERSION),
+            'numeric_weights': numeric_weights,
+            'bias': np.array(classifier.intercept_[0] - numeric_weights @ scaler.mean_),
+            'sessions': np.array(self.state['sessions']),
+        }
+        for number, column in enumerate(CATEGORICAL_FEATURES):
+            arrays[f"{column}_weights"] = coef[width + number * CATEGORY_SLOTS:width + (number + 1) * CATEGORY_SLOTS]
+            arrays[f"{column}_vocab"] = np.array([str(value) for value in self.state['vocab'][column]], dtype=str)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+
+class PropensityScorer:
+    """Vectorized conversion-propensity scores from an exported model, with no scikit-learn at scoring time.
+
+    A score is the logistic of the folded weights applied to log-scaled
+    session counts, plus the weights of the session's device type and
+    referrer. `reload` swaps in a newly exported model with a single
+    reference assignment, so scoring never waits on training.
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = None
+        self.loaded = None
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Load the exported model if it changed since the last load; returns whether one is loaded."""
+        try:
+            modified = os.path.getmtime(self.model_path)
+        except OSError:
+            return self.model is not None
+        if modified == self.loaded:
+            return True
+        with self.lock:
+            if modified == self.loaded:
+                return True
+            with np.load(self.model_path, allow_pickle=False) as exported:
+                if int(exported['version']) != MODEL_VERSION:
+                    return self.model is not None
+                model = {name: exported[name] for name in exported.files}
+            for column in CATEGORICAL_FEATURES:
+                vocab = model[f"{column}_vocab"].tolist()
+                model[f"{column}_slots"] = {value: slot + 1 for slot, value in enumerate(vocab)}
+                model[f"{column}_index"] = pd.Index(vocab, dtype=object)
+            self.model = model
+            self.loaded = modified
+        return True
+
+    def score_frame(self, session_data):
+        """Conversion probability for each row of a frame of session features."""
+        model = self.model
+        numeric = numeric_matrix([session_data[column].to_numpy() if column in session_data
+                                  else np.zeros(len(session_data)) for column in NUMERIC_FEATURES])
+        logits = numeric @ model['numeric_weights'] + model['bias']
+        for column in CATEGORICAL_FEATURES:
+            values = session_data[column] if column in session_data else pd.Series([None] * len(session_data))
+            slots = model[f"{column}_index"].get_indexer(values.astype(object).astype(str)) + 1
+            slots[values.isna().to_numpy()] = 0
+            logits += model[f"{column}_weights"][slots]
+        return 1 / (1 + np.exp(-logits))
+
+    def score_records(self, records):
+        """Conversion probability for each of a list of session feature dicts (missing features count as 0).
+
+        Raises ValueError or TypeError for a numeric feature that is not a number.
+        """
+        model = self.model
+        numeric = numeric_matrix([np.fromiter((record.get(column) or 0 for record in records), dtype=float,
+                                              count=len(records)) for column in NUMERIC_FEATURES])
+        logits = numeric @ model['numeric_weights'] + model['bias']
+        for column in CATEGORICAL_FEATURES:
+            slots = model[f"{column}_slots"]
+            logits += model[f"{column}_weights"][[slots.get(str(record.get(column)), 0) for record in records]]
+        return 1 / (1 + np.exp(-logits))
+
+    def score_session(self, features):
+        """Conversion probability for one session's feature dict."""
+        return float(self.score_records([features])[0])
+
+    def weights(self):
+        """Per-feature weights of the loaded model (per log unit for counts, per value for categories)."""
+        model = self.model
+        rows = [{'feature': column, 'weight': float(weight)}
+                for column, weight in zip(NUMERIC_FEATURES, model['numeric_weights'])]
+        for column in CATEGORICAL_FEATURES:
+            weights = model[f"{column}_weights"]
+            for value, slot in model[f"{column}_slots"].items():
+                # Relative to missing or unknown values
+                rows.append({'feature': f"{column}={value}", 'weight': float(weights[slot] - weights[0])})
+        return pd.DataFrame(rows, columns=['feature', 'weight'])
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Train the conversion-propensity model on sessions since the last run")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    args = parser.parse_args()
+
+    # The engine folds only rows added since its last refresh, and the trainer only sessions since its last update
+    engine = SharedFrameEngine(EcommerceDatabase(args.db), incremental=True)
+    engine.prepare(['conversion_propensity'])
+    state_path, model_path = propensity_paths(args.db)
+    stats = PropensityTrainer(engine, state_path, model_path).update()
+    validation = stats['validation']
+    print(f"Trained on {stats['sessions']:,} sessions in {stats['seconds']:.2f}s"
+          + (f"; progressive AUC {validation['auc']:.3f}, log loss {validation['log_loss']:.3f}" if validation else ""))
+
+    if os.path.exists(model_path):
+        scorer = PropensityScorer(model_path)
+        print(tabulate(scorer.weights(), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
+        session_data = engine.get_session_features()
+        started = time.perf_counter()
+        scores = scorer.score_frame(session_data)
+        elapsed = time.perf_counter() - started
+        print(f"Scored {len(scores):,} sessions in {elapsed*1000:.1f} ms; "
+              f"AUC {roc_auc_score(session_data['completed'], scores):.3f} on all sessions (in-sample)")
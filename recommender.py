@@ -0,0 +1,429 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from tabulate import tabulate
+from database import EcommerceDatabase, rows_through, session_chunks, top_k_rows
+from market_basket import binary_matrix
+from data_import import to_bytes
+from analysis_engine import NO_ROWS
+
+# Bump when the layout of the persisted counts or the exported index changes
+INDEX_VERSION = 3
+
+# Co-occurrence signals: the events that put a product in a session's basket, and how much a shared basket counts
+SIGNALS = {
+    'view': ('product_views', ""),
+    'cart': ('cart_events', "AND t.event_type = 'add_to_cart'"),
+}
+SIGNAL_WEIGHTS = {'view': 1.0, 'cart': 3.0}
+
+# Similar items kept per product
+TOP_N = 20
+
+# Products whose similarity rows are ranked together
+BLOCK_SIZE = 2048
+
+# Weight of each earlier item of a session relative to the next, when recommending from several
+RECENCY_DECAY = 0.8
+
+# Items of a session or user history used as seeds
+RECENT_ITEMS = 10
+
+
+def recommender_paths(db_path):
+    """Default locations of the persisted counts and the exported index for a database."""
+    return f"{db_path}.recommender-state", f"{db_path}.recommender.npz"
+
+
+class RecommenderBuilder:
+    """Builds and incrementally updates the item-to-item recommendation index.
+
+    Keeps a sparse product x product matrix of weighted co-occurrence counts:
+    each session adds its signal's weight for every pair of products it
+    viewed (or added to its cart), and for every product on the diagonal.
+    Similarity is cosine, C_ij / sqrt(C_ii C_jj). An update reads only
+    sessions with view or cart rows above the watermarks, rebuilds their
+    baskets with and without the new rows and adds the difference, so the
+    counts match a full rebuild. Neighbor lists are then re-ranked only for
+    products whose similarities could have changed, and the index file is
+    rewritten. Rows are never updated or deleted; a row written below a
+    watermark (an explicit, older integer id) is noticed by counting the
+    rows read and the counts are rebuilt.
+    """
+
+    def __init__(self, db=None, state_path=None, index_path=None, top_n=TOP_N, weights=SIGNAL_WEIGHTS,
+                 chunksize=500000):
+        """Initialize a builder over an `EcommerceDatabase`."""
+        self.db = db if db else EcommerceDatabase()
+        default_state, default_index = recommender_paths(self.db.db_path)
+        self.state_path = state_path or default_state
+        self.index_path = index_path or default_index
+        self.top_n = top_n
+        self.weights = dict(weights)
+        self.chunksize = chunksize
+        self.state = None
+
+    def new_state(self):
+        return {
+            'version': INDEX_VERSION,
+            'settings': (self.top_n, tuple(sorted(self.weights.items()))),
+            'marker': None,
+            'watermarks': {signal: NO_ROWS for signal in SIGNALS},
+            'row_counts': {signal: 0 for signal in SIGNALS},
+            'product_ids': [],
+            'positions': {},
+            'counts': sparse.csr_matrix((0, 0)),
+            'neighbors': np.empty((0, self.top_n), dtype=np.int32),
+            'scores': np.empty((0, self.top_n), dtype=np.float32),
+        }
+
+    def load_state(self):
+        """Load persisted counts, or None if there are none for this version and these settings."""
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if state.get('version') != INDEX_VERSION or \
+                state.get('settings') != (self.top_n, tuple(sorted(self.weights.items()))):
+            return None
+        return state
+
+    def save_state(self):
+        """Persist the counts atomically."""
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.state_path)
+
+    # Counting
+
+    def update(self):
+        """Fold new view and cart rows into the counts, re-rank affected products and export the index.
+
+        Returns stats: new rows per signal, sessions recounted, products re-ranked and seconds.
+        """
+        started = time.perf_counter()
+        if self.state is None:
+            self.state = self.load_state() or self.new_state()
+        stats = {'rows': {}, 'sessions': 0, 'reranked': 0}
+
+        conn = self.db.connect()
+        try:
+            snapshot = {signal: conn.execute(f"SELECT COALESCE(MAX(rowid), {NO_ROWS}) FROM {table}").fetchone()[0]
+                        for signal, (table, _) in SIGNALS.items()}
+            row = conn.execute("SELECT session_id FROM sessions ORDER BY rowid LIMIT 1").fetchone()
+            marker = repr(row[0]) if row else None
+            watermarks = self.state['watermarks']
+            if self.state['marker'] not in (None, marker) or \
+                    any(watermarks[signal] > snapshot[signal] for signal in SIGNALS):
+                # The database was rebuilt underneath us: start over
+                self.state = self.new_state()
+                watermarks = self.state['watermarks']
+            elif any(rows_through(conn, table, watermarks[signal]) != self.state['row_counts'][signal]
+                     for signal, (table, _) in SIGNALS.items() if watermarks[signal] != NO_ROWS):
+                # Rows were written below a watermark, where no update will read them: start over
+                self.state = self.new_state()
+                watermarks = self.state['watermarks']
+            self.state['marker'] = marker
+
+            delta = None
+            for signal in SIGNALS:
+                if watermarks[signal] >= snapshot[signal]:
+                    stats['rows'][signal] = 0
+                    continue
+                stats['rows'][signal] = conn.execute(
+                    f"SELECT COUNT(*) FROM {SIGNALS[signal][0]} WHERE rowid > ? AND rowid <= ?",
+                    (watermarks[signal], snapshot[signal])).fetchone()[0]
+                self.state['row_counts'][signal] += stats['rows'][signal]
+                signal_delta, sessions = self._signal_delta(conn, signal, watermarks[signal], snapshot[signal])
+                stats['sessions'] += sessions
+                delta = signal_delta if delta is None else self._resized(delta) + self._resized(signal_delta)
+        finally:
+            self.db.close()
+
+        if delta is not None:
+            counts = self._resized(self.state['counts']) + self._resized(delta)
+            counts.eliminate_zeros()
+            self.state['counts'] = counts
+            self._grow_neighbors()
+            changed = np.unique(self._resized(delta).tocoo().col)
+            # Similarities involving a changed product move with its count, so its co-occurring products re-rank too
+            affected = np.union1d(changed, np.unique(counts[:, changed].tocoo().row))
+            self._rank(affected)
+            stats['reranked'] = len(affected)
+        self.state['watermarks'].update(snapshot)
+        self.save_state()
+        # Readers reload the index when it changes, so an update that found nothing leaves it alone
+        if delta is not None or not os.path.exists(self.index_path):
+            self.export()
+        stats['seconds'] = time.perf_counter() - started
+        return stats
+
+    def _signal_delta(self, conn, signal, watermark, snapshot):
+        """Weighted co-occurrence added by one signal's new rows, and the number of sessions recounted."""
+        table, condition = SIGNALS[signal]
+        join = ""
+        if watermark != NO_ROWS:
+            # Only sessions with new rows change; their baskets are rebuilt from all their rows
+            conn.execute("DROP TABLE IF EXISTS temp.touched_sessions")
+            conn.execute("CREATE TEMP TABLE touched_sessions (session_id PRIMARY KEY)")
+            conn.execute(f"INSERT OR IGNORE INTO temp.touched_sessions SELECT session_id FROM {table} "
+                         f"WHERE rowid > ? AND rowid <= ? AND session_id IS NOT NULL", (watermark, snapshot))
+            join = "JOIN temp.touched_sessions s ON s.session_id = t.session_id"
+        query = f"""
+        SELECT t.session_id, t.product_id, t.rowid > {int(watermark)} AS new
+        FROM {table} t {join}
+        WHERE t.rowid <= {int(snapshot)} AND t.session_id IS NOT NULL AND t.product_id IS NOT NULL {condition}
+        ORDER BY t.session_id
+        """
+        weight = self.weights[signal]
+        delta, sessions = None, 0
+        for chunk in session_chunks(query, conn, self.chunksize):
+            piece, count = self._basket_delta(chunk, weight)
+            delta = piece if delta is None else self._resized(delta) + self._resized(piece)
+            sessions += count
+        return delta if delta is not None else self._resized(sparse.csr_matrix((0, 0))), sessions
+
+    def _basket_delta(self, chunk, weight):
+        """weight * (A.T A - B.T B) for binary session x product matrices after (A) and before (B) the new rows."""
+        sessions, session_count = pd.factorize(chunk['session_id'])[0], chunk['session_id'].nunique()
+        products = self._encode(chunk['product_id'])
+        shape = (session_count, len(self.state['product_ids']))
+        new = chunk['new'].to_numpy(dtype=bool)
+
+        def baskets(mask):
+            # Repeat events of a product in a session count once
+            return binary_matrix(sessions[mask], products[mask], shape, dtype=float)
+
+        after = baskets(np.ones(len(chunk), dtype=bool))
+        delta = after.T @ after
+        if (~new).any():
+            before = baskets(~new)
+            delta = delta - before.T @ before
+        return (weight * delta).tocsr(), session_count
+
+    def _encode(self, values):
+        """Positions of product ids, adding ids seen for the first time."""
+        positions, product_ids = self.state['positions'], self.state['product_ids']
+        codes, uniques = pd.factorize(values)
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for number, value in enumerate(uniques):
+            if value not in positions:
+                positions[value] = len(product_ids)
+                product_ids.append(value)
+            lookup[number] = positions[value]
+        return lookup[codes]
+
+    def _resized(self, matrix):
+        """A square CSR matrix padded to the current number of products."""
+        size = len(self.state['product_ids'])
+        matrix = matrix.tocsr()
+        if matrix.shape != (size, size):
+            matrix = matrix.copy()
+            matrix.resize((size, size))
+        return matrix
+
+    # Ranking
+
+    def _grow_neighbors(self):
+        """Add empty neighbor rows for products seen for the first time."""
+        missing = len(self.state['product_ids']) - len(self.state['neighbors'])
+        if missing > 0:
+            self.state['neighbors'] = np.vstack([self.state['neighbors'],
+                                                 np.full((missing, self.top_n), -1, dtype=np.int32)])
+            self.state['scores'] = np.vstack([self.state['scores'],
+                                              np.zeros((missing, self.top_n), dtype=np.float32)])
+
+    def _rank(self, products):
+        """Recompute the top-N cosine neighbors of the given products."""
+        counts = self.state['counts']
+        diagonal = counts.diagonal()
+        neighbors, scores = self.state['neighbors'], self.state['scores']
+        for start in range(0, len(products), BLOCK_SIZE):
+            block = products[start:start + BLOCK_SIZE]
+            rows = counts[block].tocoo()
+            product = block[rows.row]
+            keep = (product != rows.col) & (rows.data > 0)
+            product, neighbor, count = product[keep], rows.col[keep], rows.data[keep]
+            similarity = count / np.sqrt(diagonal[product] * diagonal[neighbor])
+            # Best similarity first within each product, ties to the lower neighbor
+            kept, rank = top_k_rows(product, self.top_n, -similarity, neighbor)
+            neighbors[block] = -1
+            scores[block] = 0
+            neighbors[product[kept], rank] = neighbor[kept]
+            scores[product[kept], rank] = similarity[kept]
+
+    def export(self):
+        """Write the neighbor lists and product ids to the index file atomically.
+
+        Binary ids are written as hex text: a fixed-width bytes array would
+        drop their trailing NUL bytes.
+        """
+        product_ids = self.state['product_ids']
+        binary_ids = bool(product_ids) and isinstance(product_ids[0], bytes)
+        product_ids = np.asarray([product_id.hex() for product_id in product_ids] if binary_ids else product_ids)
+        if product_ids.dtype == object:
+            product_ids = product_ids.astype(str)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, version=np.array(INDEX_VERSION), product_ids=product_ids, binary_ids=np.array(binary_ids),
+                 neighbors=self.state['neighbors'], scores=self.state['scores'])
+        os.replace(tmp_path, self.index_path)
+
+
+class Recommender:
+    """Sub-millisecond similar-item and session recommendations from an exported index.
+
+    The index holds, for every product, its top-N neighbors and cosine
+    similarities as fixed-width arrays, so a product lookup is a dictionary
+    hit and a row slice. Recommendations for several products (a session's
+    or a user's recent items) sum their neighbors' similarities, weighting
+    each earlier item by RECENCY_DECAY, and leave out the items themselves.
+    With `db_path`, sessions and users are resolved to their recent items
+    through indexed SQLite lookups on a read-only connection.
+    """
+
+    def __init__(self, index_path, db_path=None):
+        with np.load(index_path, allow_pickle=False) as index:
+            if int(index['version']) != INDEX_VERSION:
+                raise ValueError(f"{index_path} is index version {int(index['version'])}, expected {INDEX_VERSION}")
+            self.product_ids = index['product_ids']
+            self.binary_ids = bool(index['binary_ids'])
+            self.neighbors = index['neighbors']
+            self.scores = index['scores']
+        self.ids = self.product_ids.tolist()
+        if self.binary_ids:
+            self.ids = [to_bytes(product_id) for product_id in self.ids]
+        self.positions = {product_id: position for position, product_id in enumerate(self.ids)}
+        self.db_path = db_path
+        self.loaded = os.path.getmtime(index_path)
+        self.index_path = index_path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def native_id(self, value):
+        """An id as the database stores it, from its text form: hex for binary ids, digits for integer ids.
+
+        Raises ValueError for text that is not a valid binary id.
+        """
+        if isinstance(value, str):
+            if self.binary_ids:
+                return to_bytes(value)
+            if value.lstrip('-').isdigit():
+                return int(value)
+        return value
+
+    def position(self, product_id):
+        """Index position of a product id or its text form (None if unknown)."""
+        position = self.positions.get(product_id)
+        if position is None:
+            try:
+                position = self.positions.get(self.native_id(product_id))
+            except ValueError:
+                return None
+        return position
+
+    def similar(self, product_id, n=10):
+        """The products most similar to one product, as (product_id, similarity) pairs, best first."""
+        position = self.position(product_id)
+        if position is None:
+            return []
+        neighbors = self.neighbors[position, :n]
+        kept = neighbors >= 0
+        return list(zip([self.ids[neighbor] for neighbor in neighbors[kept]],
+                        self.scores[position, :n][kept].tolist()))
+
+    def recommend(self, product_ids, n=10):
+        """Recommendations for a list of products, most recent first, as (product_id, score) pairs."""
+        positions = [position for position in map(self.position, product_ids) if position is not None]
+        if not positions:
+            return []
+        positions = np.array(positions)
+        weights = RECENCY_DECAY ** np.arange(len(positions), dtype=np.float32)
+        candidates = self.neighbors[positions].ravel()
+        scores = (self.scores[positions] * weights[:, None]).ravel()
+        kept = (candidates >= 0) & ~np.isin(candidates, positions)
+        candidates, inverse = np.unique(candidates[kept], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[kept])
+        best = np.argsort(-totals, kind='stable')[:n]
+        return list(zip([self.ids[candidate] for candidate in candidates[best]], totals[best].tolist()))
+
+    def _query(self, sql, params):
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            return self.connection.execute(sql, params).fetchall()
+
+    def session_items(self, session_id, limit=RECENT_ITEMS):
+        """A session's most recently viewed or carted products, most recent first, without repeats."""
+        try:
+            session_id = self.native_id(session_id)
+        except ValueError:
+            return []
+        rows = self._query("""
+            SELECT product_id FROM (
+                SELECT product_id, timestamp FROM product_views WHERE session_id = ?
+                UNION ALL
+                SELECT product_id, timestamp FROM cart_events WHERE session_id = ? AND event_type = 'add_to_cart'
+            ) ORDER BY timestamp DESC LIMIT ?
+            """, (session_id, session_id, limit * 2))
+        return list(dict.fromkeys(row[0] for row in rows if row[0] is not None))[:limit]
+
+    def latest_session(self, user_id):
+        """A user's most recent session id, or None."""
+        try:
+            user_id = self.native_id(user_id)
+        except ValueError:
+            return None
+        rows = self._query("SELECT session_id FROM sessions WHERE user_id = ? ORDER BY start_time DESC LIMIT 1",
+                           (user_id,))
+        return rows[0][0] if rows else None
+
+    def recommend_for_session(self, session_id, n=10):
+        """Recommendations from a session's recent items."""
+        return self.recommend(self.session_items(session_id), n)
+
+    def recommend_for_user(self, user_id, n=10):
+        """Recommendations from the items of a user's most recent session."""
+        session_id = self.latest_session(user_id)
+        return self.recommend_for_session(session_id, n) if session_id is not None else []
+
+
+def load_recommender(db_path='ecommerce_data.db', current=None):
+    """The recommender for a database's exported index, reusing `current` unless the index changed (None if not built)."""
+    index_path = recommender_paths(db_path)[1]
+    if not os.path.exists(index_path):
+        return None
+    if current is not None and current.index_path == index_path and current.loaded == os.path.getmtime(index_path):
+        return current
+    recommender = Recommender(index_path, db_path)
+    return recommender
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or update the item-to-item recommendation index")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--product', default=None, help="Show recommendations for a product id")
+    parser.add_argument('--user', default=None, help="Show recommendations for a user's latest session")
+    args = parser.parse_args()
+
+    db = EcommerceDatabase(args.db)
+    stats = RecommenderBuilder(db).update()
+    print(f"{sum(stats['rows'].values()):,} new rows, {stats['sessions']:,} sessions recounted, "
+          f"{stats['reranked']:,} products re-ranked in {stats['seconds']:.2f}s")
+
+    recommender = load_recommender(args.db)
+    if args.product or args.user:
+        started = time.perf_counter()
+        results = recommender.similar(args.product) if args.product else recommender.recommend_for_user(args.user)
+        elapsed = time.perf_counter() - started
+        names = dict(db.execute_query("SELECT product_id, name FROM products")[['product_id', 'name']].to_numpy())
+        rows = [[product_id, names.get(product_id, ''), f"{score:.3f}"] for product_id, score in results]
+        print(tabulate(rows, headers=['Product', 'Name', 'Score'], tablefmt='pipe'))
+        print(f"Lookup took {elapsed*1000:.3f} ms")
@@ -149,6 +149,29 @@ class ReportGenerator:
                 report.append(tabulate(zero_data, headers=headers, tablefmt="pipe"))
                 report.append("")
             
+            # Zero-result queries against the catalog
+            if 'zero_result_matches' in search and search['zero_result_matches']:
+                report.append(f"Zero-Result Searches With a Catalog Match: {search.get('zero_results_with_catalog_match', 'n/a')}")
+                match_data = []
+                headers = ["Query", "Searches", "Closest Product", "Score"]
+                
+                for m in search['zero_result_matches'][:5]:  # Show top 5
+                    match_data.append([m['query'], m['searches'], m['closest_product'] or "-", m['match_score'] or "-"])
+                
+                report.append(tabulate(match_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            if 'synonym_candidates' in search and search['synonym_candidates']:
+                report.append("Synonym Candidates (query terms missing from the catalog):")
+                synonym_data = []
+                headers = ["Term", "Searches Fixed", "Closest Catalog Term"]
+                
+                for c in search['synonym_candidates'][:5]:  # Show top 5
+                    synonym_data.append([c['term'], c['fixable_searches'], c['closest_term'] or "-"])
+                
+                report.append(tabulate(synonym_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
             # Search Conversion
             if 'search_conversion_rate' in search:
                 report.append(f"Search to Purchase Conversion Rate: {search['search_conversion_rate']}")
@@ -270,10 +293,11 @@ class ReportGenerator:
             if 'device_type_analysis' in segments and segments['device_type_analysis']:
                 report.append("Device Type Analysis:")
                 device_data = []
-                headers = ["Device Type", "User Count", "Avg Conversion Rate"]
+                headers = ["Device Type", "User Count", "Avg Conversion Rate", "Vs Rest", "q-value"]
                 
                 for d in segments['device_type_analysis']:
-                    device_data.append([d['device_type'], d['user_count'], d['avg_conversion_rate']])
+                    device_data.append([d['device_type'], d['user_count'], d['avg_conversion_rate'],
+                                        d.get('vs_rest', "n/a"), d.get('q_value', "n/a")])
                 
                 report.append(tabulate(device_data, headers=headers, tablefmt="pipe"))
                 report.append("")
@@ -282,14 +306,28 @@ class ReportGenerator:
             if 'referrer_analysis' in segments and segments['referrer_analysis']:
                 report.append("Traffic Source Analysis:")
                 referrer_data = []
-                headers = ["Referrer", "User Count", "Avg Conversion Rate"]
+                headers = ["Referrer", "User Count", "Avg Conversion Rate", "Vs Rest", "q-value"]
                 
                 for r in segments['referrer_analysis']:
-                    referrer_data.append([r['referrer'], r['user_count'], r['avg_conversion_rate']])
+                    referrer_data.append([r['referrer'], r['user_count'], r['avg_conversion_rate'],
+                                          r.get('vs_rest', "n/a"), r.get('q_value', "n/a")])
                 
                 report.append(tabulate(referrer_data, headers=headers, tablefmt="pipe"))
                 report.append("")
             
+            # Significant Segments
+            if 'significant_segments' in segments and segments['significant_segments']:
+                report.append("Segments Converting Significantly Differently (5% false discovery rate):")
+                significant_data = []
+                headers = ["Segment", "Sessions", "Conversion Rate", "Rest Conversion Rate", "q-value"]
+                
+                for c in segments['significant_segments']:
+                    significant_data.append([c['segment'], c['sessions'], c['conversion_rate'],
+                                             c['rest_conversion_rate'], c['q_value']])
+                
+                report.append(tabulate(significant_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
             # Recommendations
             if 'recommendations' in segments and segments['recommendations']:
                 report.append("User Segment Optimization Recommendations:")
@@ -297,6 +335,332 @@ class ReportGenerator:
                     report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
         report.append("")
         
+        # 7. Page Transition Analysis
+        report.append("7. PAGE TRANSITION ANALYSIS")
+        report.append("---------------------------")
+        if 'page_transitions' in self.analysis_results:
+            transitions = self.analysis_results['page_transitions']
+            
+            if 'conversion_probability' in transitions:
+                report.append(f"Conversion probability from entry: {transitions['conversion_probability']}\n")
+            
+            # Per page type absorption results
+            if 'page_types' in transitions and transitions['page_types']:
+                report.append("Page Types (Markov chain):")
+                page_data = []
+                headers = ["Page Type", "Visits", "Conversion Probability", "Expected Steps",
+                           "Steps to Conversion", "Removal Effect"]
+                
+                for p in transitions['page_types']:
+                    page_data.append([p['page_type'], p['visits'], p['conversion_probability'], p['expected_steps'],
+                                      p['steps_to_conversion'], p['removal_effect']])
+                
+                report.append(tabulate(page_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Most frequent transitions
+            if 'top_transitions' in transitions and transitions['top_transitions']:
+                report.append("Most Frequent Transitions:")
+                transition_data = []
+                headers = ["Transition", "Count", "Probability"]
+                
+                for t in transitions['top_transitions']:
+                    transition_data.append([t['transition'], t['count'], t['probability']])
+                
+                report.append(tabulate(transition_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in transitions and transitions['recommendations']:
+                report.append("Journey Flow Recommendations:")
+                for i, rec in enumerate(transitions['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 8. Journey Path Analysis
+        report.append("8. JOURNEY PATH ANALYSIS")
+        report.append("------------------------")
+        if 'journey_paths' in self.analysis_results:
+            paths = self.analysis_results['journey_paths']
+            
+            if 'conversion_rate' in paths:
+                report.append(f"Overall conversion rate: {paths['conversion_rate']} "
+                              f"(paths followed by at least {paths.get('min_support')} sessions)\n")
+            
+            # Most frequent paths
+            if 'top_paths' in paths and paths['top_paths']:
+                report.append("Most Frequent Journey Paths:")
+                path_data = []
+                headers = ["Path", "Sessions", "Share", "Conversion Rate"]
+                
+                for p in paths['top_paths']:
+                    path_data.append([p['path'], p['sessions'], p['share'], p['conversion_rate']])
+                
+                report.append(tabulate(path_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Highest-converting paths
+            if 'converting_paths' in paths and paths['converting_paths']:
+                report.append("Highest-Converting Paths:")
+                path_data = []
+                headers = ["Path", "Sessions", "Conversion Rate"]
+                
+                for p in paths['converting_paths']:
+                    path_data.append([p['path'], p['sessions'], p['conversion_rate']])
+                
+                report.append(tabulate(path_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Dead ends
+            if 'dead_ends' in paths and paths['dead_ends']:
+                report.append("Journey Dead Ends:")
+                path_data = []
+                headers = ["Path", "Sessions Ending", "Share of Sessions"]
+                
+                for p in paths['dead_ends']:
+                    path_data.append([p['path'], p['exits'], p['exit_share']])
+                
+                report.append(tabulate(path_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in paths and paths['recommendations']:
+                report.append("Journey Path Recommendations:")
+                for i, rec in enumerate(paths['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 9. Cohort Retention Analysis
+        report.append("9. COHORT RETENTION ANALYSIS")
+        report.append("----------------------------")
+        if 'cohort_retention' in self.analysis_results:
+            cohorts = self.analysis_results['cohort_retention']
+            period = cohorts.get('period', 'month')
+            
+            # Average retention curve
+            if 'retention_curve' in cohorts and cohorts['retention_curve']:
+                report.append(f"Average Curve by {period.capitalize()} Since Acquisition:")
+                curve_data = []
+                headers = [period.capitalize(), "Retention", "Conversion", "Repeat Purchase"]
+                
+                for c in cohorts['retention_curve']:
+                    curve_data.append([c['period_number'], c['retention'], c['conversion'], c['repeat_purchase']])
+                
+                report.append(tabulate(curve_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Retention matrix of recent cohorts
+            if 'cohorts' in cohorts and cohorts['cohorts']:
+                report.append("Retention by Cohort:")
+                cohort_data = []
+                headers = ["Cohort", "Users"] + list(range(len(cohorts['cohorts'][0]['retention'])))
+                
+                for c in cohorts['cohorts']:
+                    cohort_data.append([c['cohort'], c['users']] + c['retention'])
+                
+                report.append(tabulate(cohort_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in cohorts and cohorts['recommendations']:
+                report.append("Retention Recommendations:")
+                for i, rec in enumerate(cohorts['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 10. Funnel Trend Monitoring
+        report.append("10. FUNNEL TREND MONITORING")
+        report.append("---------------------------")
+        if 'funnel_trends' in self.analysis_results:
+            trends = self.analysis_results['funnel_trends']
+            
+            # Latest rate against baseline per metric
+            if 'metrics' in trends and trends['metrics']:
+                report.append(f"Per-{trends.get('granularity', 'day')} Metrics through {trends.get('through', '-')}:")
+                metric_data = []
+                headers = ["Metric", "Latest", "Baseline", "Alerts"]
+                
+                for m in trends['metrics']:
+                    metric_data.append([m['metric'], m['latest_rate'], m['baseline'], m['alerts']])
+                
+                report.append(tabulate(metric_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Alerts
+            if 'recent_alerts' in trends and trends['recent_alerts']:
+                report.append("Recent Anomaly Alerts:")
+                alert_data = []
+                headers = ["Bucket", "Metric", "Rate", "Expected", "Direction", "Rule"]
+                
+                for a in trends['recent_alerts']:
+                    alert_data.append([a['bucket'], a['metric'], a['rate'], a['expected'], a['direction'], a['rule']])
+                
+                report.append(tabulate(alert_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in trends and trends['recommendations']:
+                report.append("Trend Recommendations:")
+                for i, rec in enumerate(trends['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 11. Product Affinity Analysis
+        report.append("11. PRODUCT AFFINITY ANALYSIS")
+        report.append("-----------------------------")
+        if 'product_affinity' in self.analysis_results:
+            affinity = self.analysis_results['product_affinity']
+            
+            # Product pairs
+            if 'top_pairs' in affinity and affinity['top_pairs']:
+                report.append(f"Strongest Product Pairs (in at least {affinity.get('min_count', 0)} of "
+                              f"{affinity.get('baskets', 0)} session baskets):")
+                pair_data = []
+                headers = ["Product", "Paired With", "Sessions", "Confidence", "Lift"]
+                
+                for p in affinity['top_pairs']:
+                    pair_data.append([p['product'], p['neighbor'], p['sessions'], p['confidence'], p['lift']])
+                
+                report.append(tabulate(pair_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Neighbors of the most frequent products
+            if 'product_neighbors' in affinity and affinity['product_neighbors']:
+                report.append("Most Associated Products:")
+                neighbor_data = []
+                headers = ["Product", "Baskets", "Neighbors (lift)"]
+                
+                for p in affinity['product_neighbors']:
+                    neighbor_data.append([p['product'], p['baskets'], p['neighbors']])
+                
+                report.append(tabulate(neighbor_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in affinity and affinity['recommendations']:
+                report.append("Product Affinity Recommendations:")
+                for i, rec in enumerate(affinity['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 12. Conversion Drill-Down
+        report.append("12. CONVERSION DRILL-DOWN")
+        report.append("-------------------------")
+        if 'conversion_cube' in self.analysis_results:
+            cube = self.analysis_results['conversion_cube']
+            if 'sessions' in cube:
+                report.append(f"Session cube: {cube['cells']} cells over {cube['sessions']} sessions, "
+                              f"{cube['conversion_rate']} converting overall")
+                report.append("")
+            
+            # Single-dimension breakdowns
+            for key, dimension, title in [('by_landing_page', 'landing_page', "Landing Page"),
+                                          ('by_country', 'country', "Country")]:
+                if key in cube and cube[key]:
+                    report.append(f"Conversion by {title}:")
+                    rows = []
+                    headers = [title, "Sessions", "Conversion", "Add to Cart", "Cart Value / Session"]
+                    
+                    for r in cube[key]:
+                        rows.append([r[dimension], r['sessions'], r['conversion_rate'], r['add_to_cart_rate'],
+                                     r['cart_value_per_session']])
+                    
+                    report.append(tabulate(rows, headers=headers, tablefmt="pipe"))
+                    report.append("")
+            
+            # Segments
+            for key, title in [('best_segments', "Best-Converting Segments"), ('worst_segments', "Worst-Converting Segments")]:
+                if key in cube and cube[key]:
+                    report.append(f"{title}:")
+                    rows = []
+                    headers = ["Device", "Referrer", "Landing Page", "Sessions", "Conversion", "Cart Value / Session"]
+                    
+                    for r in cube[key]:
+                        rows.append([r['device_type'], r['referrer'], r['landing_page'], r['sessions'],
+                                     r['conversion_rate'], r['cart_value_per_session']])
+                    
+                    report.append(tabulate(rows, headers=headers, tablefmt="pipe"))
+                    report.append("")
+            
+            # Recommendations
+            if 'recommendations' in cube and cube['recommendations']:
+                report.append("Drill-Down Recommendations:")
+                for i, rec in enumerate(cube['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 13. Checkout Step Latency
+        report.append("13. CHECKOUT STEP LATENCY")
+        report.append("-------------------------")
+        if 'checkout_latency' in self.analysis_results:
+            latency = self.analysis_results['checkout_latency']
+            
+            # Per step
+            if 'steps' in latency and latency['steps']:
+                report.append(f"Checkout Steps ({latency.get('events', 0)} events; time since the previous step):")
+                step_data = []
+                headers = ["Step", "Sessions", "Abandonment Hazard", "p50", "p90", "p99"]
+                
+                for st in latency['steps']:
+                    step_data.append([st['step'], st['reached'], st['abandonment_hazard'], st['p50'], st['p90'], st['p99']])
+                
+                report.append(tabulate(step_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Per step and device
+            if 'device_steps' in latency and latency['device_steps']:
+                report.append("Checkout Steps by Device:")
+                device_data = []
+                headers = ["Step", "Device", "Sessions", "Abandonment Hazard", "p50", "p90", "p99"]
+                
+                for st in latency['device_steps']:
+                    device_data.append([st['step'], st['device_type'], st['reached'], st['abandonment_hazard'],
+                                        st['p50'], st['p90'], st['p99']])
+                
+                report.append(tabulate(device_data, headers=headers, tablefmt="pipe"))
+                report.append("")
+            
+            # Recommendations
+            if 'recommendations' in latency and latency['recommendations']:
+                report.append("Checkout Latency Recommendations:")
+                for i, rec in enumerate(latency['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
+        # 14. Revenue and Order Value
+        report.append("14. REVENUE AND ORDER VALUE")
+        report.append("---------------------------")
+        if 'revenue' in self.analysis_results:
+            revenue = self.analysis_results['revenue']
+            if 'revenue' in revenue:
+                report.append(f"Revenue: {revenue['revenue']} from {revenue['orders']} orders over {revenue['sessions']} sessions")
+                report.append(f"Average Order Value: {revenue['average_order_value']}")
+                report.append(f"Revenue per Session: {revenue['revenue_per_session']}")
+                report.append(f"Value at Risk: {revenue['value_at_risk']} in {revenue['abandoned_carts']} abandoned carts")
+                report.append("")
+            
+            # Breakdowns
+            for key, dimension, title in [('by_device', 'device_type', "Device"), ('by_referrer', 'referrer', "Referrer"),
+                                          ('daily', 'day', "Day")]:
+                if key in revenue and revenue[key]:
+                    report.append(f"Revenue by {title}:")
+                    rows = []
+                    headers = [title, "Sessions", "Orders", "Revenue", "AOV", "Revenue / Session", "Value at Risk"]
+                    
+                    for r in revenue[key]:
+                        rows.append([r[dimension], r['sessions'], r['orders'], r['revenue'], r['average_order_value'],
+                                     r['revenue_per_session'], r['value_at_risk']])
+                    
+                    report.append(tabulate(rows, headers=headers, tablefmt="pipe"))
+                    report.append("")
+            
+            # Recommendations
+            if 'recommendations' in revenue and revenue['recommendations']:
+                report.append("Revenue Recommendations:")
+                for i, rec in enumerate(revenue['recommendations'], 1):
+                    report.append(f"{i}. {rec['area']}: {rec['suggestion']}")
+        report.append("")
+        
         # Final Conclusion
         report.append("CONCLUSION AND NEXT STEPS")
         report.append("--------------------------")
@@ -0,0 +1,522 @@
+import hashlib
+import threading
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from database import EcommerceDatabase, funnel_drop_offs, rows_through
+from analysis_engine import NO_ROWS, FUNNEL_STEPS, SESSION_FLAGS
+from cohorts import source_cohort_activity
+
+# Sessions are hashed into this many buckets; a sample at rate r keeps buckets below r * SAMPLE_BUCKETS
+SAMPLE_BUCKETS = 10000
+
+# Strata smaller than this are sampled at a higher rate so every stratum has a usable variance
+MIN_STRATUM_SESSIONS = 30
+
+# Groups observed in fewer sampled rows than this get no interval (the normal approximation breaks down)
+MIN_INTERVAL_SUPPORT = 10
+
+# Event tables read per sampled session (each gets an index on session_id)
+SAMPLED_EVENT_TABLES = ['page_views', 'product_views', 'cart_events', 'search_events', 'checkout_events']
+
+CHECKOUT_STEPS = ['checkout_start', 'shipping_info', 'payment_info']
+PAGE_FLAGS = {'homepage_view': 'homepage', 'product_listing_view': 'product_listing',
+              'product_detail_view': 'product_detail'}
+
+
+def sample_bucket(value):
+    """Deterministic bucket in [0, SAMPLE_BUCKETS) for an id (text, integer or blob)."""
+    key = value if isinstance(value, bytes) else str(value).encode('utf-8')
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % SAMPLE_BUCKETS
+
+
+def estimate(rows, design, y, x=None, by=None, z=1.96):
+    """Post-stratified estimate of the total of `y`, or of the ratio sum(y) / sum(x), with a confidence interval.
+
+    `rows` holds one row per sampled session (per group with `by`) and a
+    `stratum` column; sampled sessions without a row count as zeros.
+    `design` is indexed by stratum and gives its `population` and `sampled`
+    session counts. Each sampled session stands for N_h / n_h sessions, and
+    the variance is the stratified (linearized, for ratios) variance with a
+    finite population correction.
+
+    Returns a frame indexed by group with estimate, ci_low and ci_high;
+    the bounds are NaN for groups seen in fewer than MIN_INTERVAL_SUPPORT
+    sampled rows.
+    """
+    keys = ([by] if by else []) + ['stratum']
+    values = pd.DataFrame({key: rows[key] for key in keys})
+    values['y'] = rows[y].astype(float)
+    values['x'] = rows[x].astype(float) if x else 0.0
+    values['yy'] = values['y'] ** 2
+    values['xx'] = values['x'] ** 2
+    values['xy'] = values['x'] * values['y']
+    values['support'] = (values['x'] if x else values['y']) != 0
+    sums = values.groupby(keys, observed=True, sort=False).sum()
+    population = design['population'].reindex(sums.index.get_level_values('stratum')).to_numpy(dtype=float)
+    sampled = design['sampled'].reindex(sums.index.get_level_values('stratum')).to_numpy(dtype=float)
+    groups = sums.index.get_level_values(by) if by else np.zeros(len(sums), dtype=int)
+
+    weights = population / sampled
+    totals = pd.DataFrame({'y': weights * sums['y'].to_numpy(), 'x': weights * sums['x'].to_numpy(),
+                           'support': sums['support'].to_numpy()})
+    totals = totals.groupby(groups, sort=False).sum()
+    ratio = totals['y'] / totals['x'].replace(0, np.nan) if x else pd.Series(0.0, index=totals.index)
+
+    # Per-stratum sample variance of the residual y - R x, from the accumulated sums
+    r = ratio.reindex(groups).fillna(0).to_numpy()
+    residual_sum = sums['y'].to_numpy() - r * sums['x'].to_numpy()
+    residual_squares = (sums['yy'].to_numpy() - 2 * r * sums['xy'].to_numpy()
+                        + r ** 2 * sums['xx'].to_numpy())
+    spread = np.maximum(residual_squares - residual_sum ** 2 / sampled, 0)
+    s2 = np.where(sampled > 1, spread / np.maximum(sampled - 1, 1), 0.0)
+    variance = population ** 2 * (1 - sampled / population) * s2 / sampled
+    variance = pd.Series(variance).groupby(groups, sort=False).sum().reindex(totals.index)
+
+    if x:
+        point = ratio
+        error = np.sqrt(variance) / totals['x'].replace(0, np.nan)
+    else:
+        point = totals['y']
+        error = np.sqrt(variance)
+    error = error.where(totals['support'] >= MIN_INTERVAL_SUPPORT)
+    return pd.DataFrame({'estimate': point, 'ci_low': point - z * error, 'ci_high': point + z * error})
+
+
+class SampledEngine:
+    """Runs the analyses on a deterministic, stratified sample of sessions.
+
+    Every session gets a fixed hash bucket, kept with its device type and
+    referrer in the `session_samples` table (maintained incrementally from
+    a sessions rowid watermark, and rebuilt if sessions turn up below it).
+    A run at `sample_rate` keeps the sessions
+    of each device/referrer stratum whose bucket falls below the stratum's
+    threshold; the selection is an index range scan in SQL and event rows
+    are fetched only for the sampled sessions, so cost scales with the
+    sample rather than the full history. The same rate always selects the
+    same sessions, so repeated runs are stable.
+
+    Getters return the same shapes as `EcommerceDatabase`, with scaled-up
+    counts and, for every rate, `<rate>_ci_low` / `<rate>_ci_high` columns.
+    Per-user segment features, cohort activity and metric rollups are not
+    sampled: they come from `full_source`.
+    """
+
+    def __init__(self, db=None, sample_rate=0.05, full_source=None, min_stratum_sessions=MIN_STRATUM_SESSIONS,
+                 confidence=0.95):
+        """Initialize the sampler over an `EcommerceDatabase`."""
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in (0, 1], got {sample_rate}")
+        self.db = db if db else EcommerceDatabase()
+        self.sample_rate = sample_rate
+        self.full_source = full_source if full_source else self.db
+        self.min_stratum_sessions = min_stratum_sessions
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.lock = threading.Lock()
+        self.last_sample = None
+        self.reset()
+
+    def reset(self):
+        """Start a new run: the next getter call re-reads the sample."""
+        with self.lock:
+            self.cache = {}
+            self.cache_locks = {}
+
+    def prepare(self, analysis_names):
+        """Start a new run for the given analyses."""
+        self.reset()
+
+    def _cached(self, key, build):
+        """Build a value once per run; concurrent callers wait for the first build."""
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            key_lock = self.cache_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                if key in self.cache:
+                    return self.cache[key]
+            value = build()
+            with self.lock:
+                self.cache[key] = value
+            return value
+
+    # Sample index
+
+    def refresh_index(self):
+        """Bucket sessions added since the last refresh; returns how many were indexed."""
+        conn = self.db.connect()
+        try:
+            with conn:
+                self._create_index_tables(conn)
+                row = conn.execute("SELECT value FROM schema_meta WHERE key = 'session_samples_rowid'").fetchone()
+                watermark = int(row[0]) if row else NO_ROWS
+                latest = conn.execute(f"SELECT COALESCE(MAX(rowid), {NO_ROWS}) FROM sessions").fetchone()[0]
+                sampled = conn.execute("SELECT COUNT(*) FROM session_samples").fetchone()[0]
+                missed = watermark != NO_ROWS and rows_through(conn, 'sessions', watermark) != sampled
+                if watermark > latest or missed:
+                    # The database was rebuilt underneath us, or sessions were written below the watermark
+                    # (explicit, older integer ids) where no refresh would index them: start over
+                    conn.execute("DELETE FROM session_samples")
+                    conn.execute("DELETE FROM sample_strata")
+                    watermark = NO_ROWS
+
+                cursor = conn.execute("""
+                SELECT s.rowid, s.session_id, COALESCE(s.device_type, ''), COALESCE(u.referrer, '')
+                FROM sessions s LEFT JOIN users u ON u.user_id = s.user_id
+                WHERE s.rowid > ? AND s.rowid <= ?
+                ORDER BY s.rowid
+                """, (watermark, latest))
+                strata = {}
+                indexed = 0
+                while True:
+                    rows = cursor.fetchmany(50000)
+                    if not rows:
+                        break
+                    conn.executemany(
+                        "INSERT INTO session_samples (session_id, device_type, referrer, bucket) VALUES (?, ?, ?, ?)",
+                        [(session_id, device, referrer, sample_bucket(session_id))
+                         for _, session_id, device, referrer in rows])
+                    for _, _, device, referrer in rows:
+                        strata[(device, referrer)] = strata.get((device, referrer), 0) + 1
+                    indexed += len(rows)
+
+                conn.executemany("""
+                INSERT INTO sample_strata (device_type, referrer, session_count) VALUES (?, ?, ?)
+                ON CONFLICT (device_type, referrer) DO UPDATE SET session_count = session_count + excluded.session_count
+                """, [(device, referrer, count) for (device, referrer), count in strata.items()])
+                conn.execute("INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('session_samples_rowid', ?)",
+                             (str(latest),))
+        finally:
+            self.db.close()
+        return indexed
+
+    def _create_index_tables(self, conn):
+        """Create the sample index tables and the session_id indexes the sampled reads probe."""
+        id_type = self.db.id_generator.sql_type
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS session_samples (
+            session_id {id_type} PRIMARY KEY,
+            device_type TEXT,
+            referrer TEXT,
+            bucket INTEGER
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_samples_stratum "
+                     "ON session_samples (device_type, referrer, bucket)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sample_strata (
+            device_type TEXT,
+            referrer TEXT,
+            session_count INTEGER,
+            PRIMARY KEY (device_type, referrer)
+        )
+        """)
+        for table in SAMPLED_EVENT_TABLES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_session_id ON {table} (session_id)")
+
+    def design(self):
+        """Strata with their population and the bucket threshold each is sampled below."""
+        def build():
+            self.refresh_index()
+            strata = self.db.execute_query(
+                "SELECT device_type, referrer, session_count AS population FROM sample_strata "
+                "WHERE session_count > 0 ORDER BY device_type, referrer")
+            rate = np.minimum(1.0, np.maximum(self.sample_rate, self.min_stratum_sessions / strata['population']))
+            strata['threshold'] = np.ceil(rate * SAMPLE_BUCKETS).astype(int)
+            strata.index.name = 'stratum'
+            return strata
+        return self._cached('design', build)
+
+    def read_sample(self, body):
+        """Run a query whose FROM clause starts at `sampled s` (stratum, session_id of each sampled session)."""
+        design = self.design()
+        values = ', '.join('(?, ?, ?, ?)' for _ in range(len(design))) or '(NULL, NULL, NULL, -1)'
+        params = []
+        for stratum, row in design.iterrows():
+            params.extend([int(stratum), row['device_type'], row['referrer'], int(row['threshold'])])
+        # CROSS JOIN keeps the sampled sessions as the outer loop, so event tables are probed by index
+        query = f"""
+        WITH thresholds (stratum, device_type, referrer, threshold) AS (VALUES {values}),
+        sampled AS (
+            SELECT t.stratum, ss.session_id
+            FROM thresholds t
+            JOIN session_samples ss
+                ON ss.device_type = t.device_type AND ss.referrer = t.referrer AND ss.bucket < t.threshold
+        )
+        {body}
+        """
+        return self.db.execute_query(query, params)
+
+    # Sampled inputs (read once per run)
+
+    def sample(self):
+        """The design with per-stratum sample sizes, and one row per sampled session."""
+        def build():
+            design = self.design().copy()
+            sessions = self.read_sample("""
+            SELECT s.stratum, s.session_id, se.conversion_status
+            FROM sampled s CROSS JOIN sessions se ON se.session_id = s.session_id
+            """)
+            design['sampled'] = sessions['stratum'].value_counts().reindex(design.index, fill_value=0)
+            design = design[design['sampled'] > 0]
+            self.last_sample = {
+                'sessions': len(sessions),
+                'population': int(design['population'].sum()),
+                'strata': len(design),
+            }
+            return design, sessions
+        return self._cached('sample', build)
+
+    def page_rows(self):
+        """Page view totals per sampled session and page type."""
+        return self._cached('page_rows', lambda: self.read_sample("""
+        SELECT s.stratum, s.session_id, pv.page_type,
+               COUNT(*) AS view_count,
+               SUM(pv.time_spent_seconds) AS time_spent_total,
+               COUNT(pv.time_spent_seconds) AS time_spent_views,
+               SUM(pv.exit_page) AS exit_count
+        FROM sampled s CROSS JOIN page_views pv ON pv.session_id = s.session_id
+        GROUP BY s.session_id, pv.page_type
+        """))
+
+    def cart_rows(self):
+        """Add-to-cart counts and priced cart value per sampled session and product."""
+        return self._cached('cart_rows', lambda: self.read_sample("""
+        SELECT s.stratum, s.session_id, ce.product_id, p.name,
+               SUM(ce.event_type = 'add_to_cart') AS add_count,
+               SUM(ce.event_type = 'add_to_cart' AND p.product_id IS NOT NULL) AS priced_adds,
+               COALESCE(SUM(CASE WHEN ce.event_type = 'add_to_cart' THEN p.price * ce.quantity END), 0) AS cart_value
+        FROM sampled s CROSS JOIN cart_events ce ON ce.session_id = s.session_id
+        LEFT JOIN products p ON p.product_id = ce.product_id
+        GROUP BY s.session_id, ce.product_id
+        """))
+
+    def product_view_rows(self):
+        """Product view counts per sampled session and product."""
+        return self._cached('product_view_rows', lambda: self.read_sample("""
+        SELECT s.stratum, s.session_id, pv.product_id, COUNT(*) AS view_count
+        FROM sampled s CROSS JOIN product_views pv ON pv.session_id = s.session_id
+        GROUP BY s.session_id, pv.product_id
+        """))
+
+    def search_rows(self):
+        """Search totals per sampled session and query."""
+        return self._cached('search_rows', lambda: self.read_sample("""
+        SELECT s.stratum, s.session_id, se.query,
+               COUNT(*) AS search_count,
+               SUM(se.results_count) AS results_total,
+               COUNT(se.results_count) AS results_counted,
+               SUM(se.results_count = 0) AS zero_count
+        FROM sampled s CROSS JOIN search_events se ON se.session_id = s.session_id
+        GROUP BY s.session_id, se.query
+        """))
+
+    def checkout_rows(self):
+        """Distinct checkout steps reached by each sampled session."""
+        return self._cached('checkout_rows', lambda: self.read_sample("""
+        SELECT DISTINCT s.session_id, ch.step
+        FROM sampled s CROSS JOIN checkout_events ch ON ch.session_id = s.session_id
+        """))
+
+    def session_frame(self):
+        """One row per sampled session with its funnel flags, search count and cart value."""
+        def build():
+            design, sessions = self.sample()
+            frame = sessions.copy()
+            frame['completed'] = (frame['conversion_status'] == 'completed').astype(int)
+
+            pages = self.page_rows()
+            for flag, page_type in PAGE_FLAGS.items():
+                frame[flag] = frame['session_id'].isin(pages.loc[pages['page_type'] == page_type, 'session_id'])
+            carts = self.cart_rows()
+            frame['add_to_cart'] = frame['session_id'].isin(carts.loc[carts['add_count'] > 0, 'session_id'])
+            checkouts = self.checkout_rows()
+            for step in CHECKOUT_STEPS:
+                frame[step] = frame['session_id'].isin(checkouts.loc[checkouts['step'] == step, 'session_id'])
+            for flag in SESSION_FLAGS:
+                frame[flag] = frame[flag].astype(int)
+
+            cart_totals = carts.groupby('session_id')[['priced_adds', 'cart_value']].sum()
+            frame['priced_adds'] = frame['session_id'].map(cart_totals['priced_adds']).fillna(0)
+            frame['cart_value'] = frame['session_id'].map(cart_totals['cart_value']).fillna(0)
+            search_totals = self.search_rows().groupby('session_id')['search_count'].sum()
+            frame['search_count'] = frame['session_id'].map(search_totals).fillna(0)
+            return frame
+        return self._cached('session_frame', build)
+
+    def _estimate(self, rows, y, x=None, by=None):
+        design, _ = self.sample()
+        return estimate(rows, design, y, x=x, by=by, z=self.z)
+
+    def _add_rate(self, frame, column, estimates, index):
+        """Set a rate column and its clipped confidence bounds from `estimate` output aligned to `index`."""
+        estimates = estimates.reindex(index)
+        frame[column] = estimates['estimate'].to_numpy()
+        frame[f'{column}_ci_low'] = estimates['ci_low'].clip(0, 1).to_numpy()
+        frame[f'{column}_ci_high'] = estimates['ci_high'].clip(0, 1).to_numpy()
+
+    # Getters (same shapes as EcommerceDatabase)
+
+    def get_funnel_analysis(self):
+        """Estimated conversion funnel drop-offs with confidence intervals on each drop-off rate."""
+        frame = self.session_frame()
+        stages = SESSION_FLAGS + ['completed']
+        steps = [round(self._estimate(frame, flag)['estimate'].iloc[0]) for flag in stages]
+        funnel = funnel_drop_offs(FUNNEL_STEPS, steps)
+        for i, step in enumerate(funnel):
+            reached = self._estimate(frame, stages[i + 1], x=stages[i]).iloc[0]
+            if step['current_count'] > 0 and pd.notna(reached['ci_low']):
+                # Later stages are not subsets of earlier ones, so a drop-off can be negative
+                step['drop_off_rate_ci_low'] = float(1 - reached['ci_high'])
+                step['drop_off_rate_ci_high'] = float(min(1 - reached['ci_low'], 1))
+        return funnel
+
+    def get_cart_abandonment_data(self):
+        """Estimated cart sessions and value by conversion status, with each status's share of carts."""
+        frame = self.session_frame()
+        carts = frame[frame['priced_adds'] > 0].assign(cart=1)
+        statuses = sorted(carts['conversion_status'].dropna().unique())
+        counts = self._estimate(carts, 'cart', by='conversion_status')
+        values = self._estimate(carts, 'cart_value', x='cart', by='conversion_status')
+
+        cart_data = pd.DataFrame({'conversion_status': statuses})
+        cart_data['session_count'] = counts['estimate'].reindex(statuses).round().astype(int).to_numpy()
+        cart_data['avg_cart_value'] = values['estimate'].reindex(statuses).to_numpy()
+        cart_data['avg_cart_value_ci_low'] = values['ci_low'].reindex(statuses).to_numpy()
+        cart_data['avg_cart_value_ci_high'] = values['ci_high'].reindex(statuses).to_numpy()
+        shares = pd.concat([
+            self._estimate(carts.assign(in_status=(carts['conversion_status'] == status).astype(int)),
+                           'in_status', x='cart').set_axis([status])
+            for status in statuses
+        ]) if statuses else pd.DataFrame(columns=['estimate', 'ci_low', 'ci_high'])
+        self._add_rate(cart_data, 'share', shares, statuses)
+
+        names = self.cart_rows().dropna(subset=['name'])
+        names = names[names['priced_adds'] > 0].merge(frame[['session_id', 'conversion_status']], on='session_id')
+        first_cart = names.drop_duplicates('conversion_status').set_index('conversion_status')['session_id']
+        cart_data['products_in_cart'] = [
+            ', '.join(names.loc[names['session_id'] == first_cart[status], 'name']) if status in first_cart else None
+            for status in statuses
+        ]
+        return cart_data
+
+    def get_search_behavior(self):
+        """Estimated top and zero-result searches, and search-to-conversion rate with its interval."""
+        searches = self.search_rows()
+        counts = self._estimate(searches, 'search_count', by='query')
+        results = self._estimate(searches, 'results_total', x='results_counted', by='query')
+        top_searches = pd.DataFrame({
+            'query': counts.index.astype(object),
+            'search_count': counts['estimate'].round().astype(int).to_numpy(),
+            'avg_results': results['estimate'].reindex(counts.index).to_numpy(),
+        }).sort_values('search_count', ascending=False, kind='stable').head(20).reset_index(drop=True)
+
+        zero = self._estimate(searches, 'zero_count', by='query')
+        zero = zero[zero['estimate'] > 0]
+        zero_results = pd.DataFrame({
+            'query': zero.index.astype(object),
+            'search_count': zero['estimate'].round().astype(int).to_numpy(),
+        }).sort_values('search_count', ascending=False, kind='stable').head(20).reset_index(drop=True)
+
+        frame = self.session_frame()
+        frame = frame.assign(searched=(frame['search_count'] > 0).astype(int))
+        frame['converted'] = frame['searched'] * frame['completed']
+        search_conversion = pd.DataFrame([{
+            'sessions_with_search': round(self._estimate(frame, 'searched')['estimate'].iloc[0]),
+            'converted_search_sessions': round(self._estimate(frame, 'converted')['estimate'].iloc[0]),
+        }])
+        self._add_rate(search_conversion, 'search_conversion_rate',
+                       self._estimate(frame, 'converted', x='searched'), [0])
+        return {
+            'top_searches': top_searches,
+            'zero_results': zero_results,
+            'search_conversion': search_conversion
+        }
+
+    def get_page_effectiveness(self):
+        """Estimated views, time spent and exit rate (with interval) by page type."""
+        pages = self.page_rows()
+        views = self._estimate(pages, 'view_count', by='page_type')
+        page_types = views.index
+        page_data = pd.DataFrame({
+            'page_type': page_types.astype(object),
+            'view_count': views['estimate'].round().astype(int).to_numpy(),
+            'avg_time_spent': self._estimate(pages, 'time_spent_total', x='time_spent_views',
+                                             by='page_type')['estimate'].reindex(page_types).to_numpy(),
+            'exit_count': self._estimate(pages, 'exit_count', by='page_type')['estimate']
+                              .reindex(page_types).round().astype(int).to_numpy(),
+        })
+        self._add_rate(page_data, 'exit_rate', self._estimate(pages, 'exit_count', x='view_count', by='page_type'),
+                       page_types)
+        return page_data.sort_values('view_count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_product_performance(self):
+        """Estimated per-product views, add-to-cart and purchase rates with intervals."""
+        frame = self.session_frame()
+        carts = self.cart_rows()
+        pairs = self.product_view_rows()[['stratum', 'session_id', 'product_id', 'view_count']].merge(
+            carts[['stratum', 'session_id', 'product_id', 'add_count']],
+            on=['stratum', 'session_id', 'product_id'], how='outer').fillna({'view_count': 0, 'add_count': 0})
+        pairs = pairs.merge(frame[['session_id', 'completed']], on='session_id', how='left')
+        pairs['purchased'] = ((pairs['add_count'] > 0) & (pairs['completed'] == 1)).astype(int)
+
+        products = self.db.execute_query("SELECT product_id, name, category FROM products")
+        product_ids = products['product_id']
+
+        def total(column):
+            estimates = self._estimate(pairs, column, by='product_id')['estimate']
+            return estimates.reindex(product_ids).fillna(0).round().astype(int).to_numpy()
+
+        product_data = products.copy()
+        product_data['view_count'] = total('view_count')
+        product_data['add_to_cart_count'] = total('add_count')
+        self._add_rate(product_data, 'view_to_cart_rate',
+                       self._estimate(pairs, 'add_count', x='view_count', by='product_id'), product_ids)
+        product_data['purchase_count'] = total('purchased')
+        self._add_rate(product_data, 'cart_to_purchase_rate',
+                       self._estimate(pairs, 'purchased', x='add_count', by='product_id'), product_ids)
+        return product_data.sort_values('view_count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_user_segment_features(self):
+        """Per-user features; segments describe every user, so these are never sampled."""
+        return self.full_source.get_user_segment_features()
+
+    def get_session_features(self, since_hour=None):
+        """Per-session features; the propensity model trains on every session, so these are never sampled."""
+        return self.full_source.get_session_features(since_hour)
+
+    def get_cohort_activity(self, period='week'):
+        """Cohort activity; retention follows each user across sessions, so it is never sampled."""
+        return source_cohort_activity(self.full_source, self.db, period)
+
+    def get_cube_facts(self):
+        """Per-session cube facts; the cube is built once and then sliced many ways, so it uses full data."""
+        return self.full_source.get_cube_facts()
+
+    def get_metric_rollups(self, granularity='hour', since=None):
+        """Hourly or daily metric rollups; per-bucket rates are too sparse to sample, so they use full data."""
+        return self.full_source.get_metric_rollups(granularity, since)
+
+
+def print_design(design):
+    """Print each stratum's population, bucket threshold and sample size."""
+    rows = [[row['device_type'] or '-', row['referrer'] or '-', f"{row['population']:,}",
+             f"{row['threshold'] / SAMPLE_BUCKETS:.2%}", f"{int(row['sampled']):,}"]
+            for _, row in design.iterrows()]
+    print(tabulate(rows, headers=['Device', 'Referrer', 'Sessions', 'Rate', 'Sampled'], tablefmt='pipe'))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the session sample index and show the sampling design")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--rate', type=float, default=0.05, help="Sample rate (fraction of sessions)")
+    args = parser.parse_args()
+
+    sampler = SampledEngine(EcommerceDatabase(args.db), sample_rate=args.rate)
+    design, sessions = sampler.sample()
+    print_design(design)
+    print(f"Sampled {len(sessions):,} of {int(design['population'].sum()):,} sessions")
@@ -0,0 +1,342 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from tabulate import tabulate
+from database import EcommerceDatabase, top_k_rows
+
+# Lower-cased alphanumeric runs are tokens; a trailing plural 's' is dropped so 'shoes' finds 'shoe'
+TOKEN_PATTERN = r"[a-z0-9]+"
+PLURAL_PATTERN = r"(?<=[a-z]{3})(?<!s)s$"
+
+# How much a query token found in each product field counts, relative to the name
+FIELD_WEIGHTS = {'name': 1.0, 'category': 2 / 3, 'description': 1 / 3}
+
+# Share of a match score from whole-token overlap; the rest comes from character trigrams of the product name
+TOKEN_WEIGHT = 0.5
+
+# Lowest score that counts as a catalog match for a query: about half its trigrams, as for a one-letter typo
+MIN_SCORE = 0.25
+
+# Trigram similarity at which two failing queries are grouped
+GROUP_SIMILARITY = 0.5
+
+# Trigram similarity at which an unknown query term is taken as a misspelling of a catalog term
+SPELLING_SIMILARITY = 0.5
+
+# Query rows scored at a time; bounds the memory of one sparse product
+BLOCK_SIZE = 256
+
+
+def token_pairs(texts):
+    """(row, token, word) triples of each text's tokens, repeats included; the word is the token before stemming."""
+    tokens = (pd.Series(texts, dtype=object).reset_index(drop=True).fillna('').astype(str).str.lower()
+              .str.findall(TOKEN_PATTERN).explode().dropna())
+    # Stem each distinct token once
+    codes, distinct = pd.factorize(tokens.to_numpy(dtype=object))
+    stemmed = pd.Series(distinct, dtype=object).str.replace(PLURAL_PATTERN, '', regex=True).to_numpy(dtype=object)
+    return tokens.index.to_numpy(dtype=np.int64), stemmed[codes], tokens.to_numpy(dtype=object)
+
+
+def trigram_matrix(rows, tokens, n_rows):
+    """Binary rows x trigrams matrix of the tokens in each row, padded as '  token ', and its trigram vocabulary.
+
+    Trigrams are listed once per distinct token; each row's set is then a
+    sparse product of its tokens with the token x trigram matrix.
+    """
+    codes, distinct = pd.factorize(np.asarray(tokens, dtype=object))
+    token_numbers, grams = [], []
+    for number, token in enumerate(distinct):
+        padded = f"  {token} "
+        token_numbers.extend([number] * (len(padded) - 2))
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    gram_codes, vocabulary = pd.factorize(np.array(grams, dtype=object))
+    token_grams = sparse.csr_matrix((np.ones(len(gram_codes)), (token_numbers, gram_codes)),
+                                    shape=(len(distinct), len(vocabulary)))
+    row_tokens = sparse.csr_matrix((np.ones(len(codes)), (rows, codes)), shape=(n_rows, len(distinct)))
+    matrix = sparse.csr_matrix(row_tokens @ token_grams)
+    matrix.data[:] = 1
+    return matrix, pd.Index(vocabulary, dtype=object)
+
+
+def reindex_columns(matrix, vocabulary, target):
+    """A matrix's columns moved from `vocabulary` to `target`, and each row's total in columns `target` lacks."""
+    matrix = matrix.tocoo()
+    position = target.get_indexer(vocabulary)[matrix.col]
+    known = position >= 0
+    moved = sparse.csr_matrix((matrix.data[known], (matrix.row[known], position[known])),
+                              shape=(matrix.shape[0], len(target)))
+    return moved, np.bincount(matrix.row[~known], weights=matrix.data[~known], minlength=matrix.shape[0])
+
+
+def term_matrix(rows, terms, vocabulary, n_rows):
+    """Sparse rows x vocabulary counts of (row, term) pairs; terms outside the vocabulary are dropped."""
+    columns = vocabulary.get_indexer(terms)
+    known = columns >= 0
+    return sparse.csr_matrix((np.ones(int(known.sum())), (rows[known], columns[known])), shape=(n_rows, len(vocabulary)))
+
+
+def inverse_document_frequency(counts, n_rows):
+    """Smoothed IDF of each column; a term no row has gets log(1 + n_rows) + 1."""
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    return np.log((1 + n_rows) / (1 + document_frequency)) + 1
+
+
+def query_rows(counts, idf, unknown, unknown_idf):
+    """Binary query rows scaled so a dot product with IDF-weighted postings is the IDF-weighted share of the query found.
+
+    Each row is divided by its squared IDF weight, including `unknown` terms
+    per row that are not in the postings and so are never found.
+    """
+    weighted = sparse.csr_matrix(counts.multiply(idf[np.newaxis, :]))
+    totals = np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel() + unknown * unknown_idf ** 2
+    totals[totals == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1 / totals) @ weighted)
+
+
+def weighted_rows(counts, idf, unknown=None, unknown_idf=0.0):
+    """TF-IDF rows scaled to unit length; `unknown` terms per row add to the length without matching anything."""
+    weighted = sparse.csr_matrix(counts.multiply(idf[np.newaxis, :]))
+    norms = np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel()
+    if unknown is not None:
+        norms = norms + unknown * unknown_idf ** 2
+    norms = np.sqrt(norms)
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ weighted)
+
+
+def top_matches(rows, postings, k, min_score, exclude_self=False, block_size=BLOCK_SIZE):
+    """Best `k` columns per row of `rows @ postings` scoring at least `min_score`, as a (row, column, score) frame.
+
+    `rows` is rows x terms and `postings` terms x items, so the product only
+    visits the posting lists of each row's terms. Rows are scored a block at
+    a time, and each block is cut to its top `k` before the next.
+    """
+    pieces = []
+    for start in range(0, rows.shape[0], block_size):
+        block = (rows[start:start + block_size] @ postings).tocoo()
+        keep = block.data >= min_score
+        if exclude_self:
+            keep &= block.row + start != block.col
+        row, column, score = block.row[keep].astype(np.int64) + start, block.col[keep].astype(np.int64), block.data[keep]
+        # Best score first within each row, ties to the lower column
+        kept, _ = top_k_rows(row, k, -score, column)
+        pieces.append(pd.DataFrame({'row': row[kept], 'column': column[kept], 'score': score[kept]}))
+    if not pieces:
+        return pd.DataFrame({'row': np.empty(0, np.int64), 'column': np.empty(0, np.int64), 'score': np.empty(0)})
+    return pd.concat(pieces, ignore_index=True)
+
+
+class ProductSearchIndex:
+    """In-process inverted index of the product catalog, for diagnosing zero-result searches.
+
+    Token postings cover product names, categories and descriptions;
+    character-trigram postings cover names, so misspelled and partial words
+    still find products. A query's score against a product is the share of
+    the query found in it, 0 to 1: TOKEN_WEIGHT times the IDF-weighted share
+    of its tokens (each counted by FIELD_WEIGHTS for the best field it is
+    in), plus the rest times the share of its trigrams. Rare tokens count
+    for more; trigrams all count the same, so a typo keeps most of its
+    trigram share. Query terms not in the catalog are never found, so they
+    lower every score.
+
+    The postings are one sparse term x product matrix, token rows then
+    trigram rows. Matching many queries is a blocked sparse product of
+    their weighted term rows with it, which visits only the posting lists of
+    the queries' terms, never every query x product pair.
+    """
+
+    def __init__(self, db=None, min_score=MIN_SCORE):
+        """Initialize an unfitted index over an `EcommerceDatabase`."""
+        self.db = db if db else EcommerceDatabase()
+        self.min_score = min_score
+        self.products = pd.DataFrame(columns=['product_id', 'name', 'category'])
+        self.tokens = pd.Index([], dtype=object)
+        self.trigrams = pd.Index([], dtype=object)
+        self.spellings = pd.Series([], dtype=object)
+        self.postings = None
+        self.token_idf = np.zeros(0)
+        self.fit_seconds = None
+
+    # Indexing
+
+    def fit(self):
+        """Read the catalog and build the token and trigram postings; returns the index."""
+        started = time.perf_counter()
+        conn = self.db.connect()
+        try:
+            catalog = pd.read_sql_query("SELECT product_id, name, category, description FROM products", conn)
+        finally:
+            self.db.close()
+        self.products = catalog[['product_id', 'name', 'category']]
+        n_products = len(catalog)
+
+        # Token postings: IDF times the weight of the best field each product has the token in
+        fields = {field: token_pairs(catalog[field]) for field in FIELD_WEIGHTS}
+        tokens = np.concatenate([tokens for _, tokens, _ in fields.values()])
+        self.tokens = pd.Index(pd.unique(tokens), dtype=object)
+        # How each token is written in the catalog, for reporting
+        words = pd.Series(np.concatenate([words for _, _, words in fields.values()]), dtype=object)
+        self.spellings = words.groupby(tokens, sort=False).first().reindex(self.tokens)
+        weights = None
+        for field, (rows, tokens, _) in fields.items():
+            field_weights = term_matrix(rows, tokens, self.tokens, n_products)
+            field_weights.data[:] = FIELD_WEIGHTS[field]
+            weights = field_weights if weights is None else weights.maximum(field_weights)
+        self.token_idf = inverse_document_frequency(weights, n_products)
+        token_postings = weights.multiply(self.token_idf[np.newaxis, :]).T
+
+        # Trigram postings: the set of trigrams of each product name's tokens
+        trigram_postings, self.trigrams = trigram_matrix(*fields['name'][:2], n_products)
+        trigram_postings = trigram_postings.T
+        self.postings = sparse.vstack([token_postings, trigram_postings], format='csr')
+        self.fit_seconds = time.perf_counter() - started
+        return self
+
+    def _vectors(self, queries):
+        """Queries' term rows, whose product with the postings is their scores, and their (row, token) pairs."""
+        n_queries = len(queries)
+        rows, tokens, words = token_pairs(queries)
+        pairs = pd.DataFrame({'row': rows, 'token': tokens, 'word': words}).drop_duplicates(['row', 'token'])
+        rows, tokens = pairs['row'].to_numpy(dtype=np.int64), pairs['token'].to_numpy(dtype=object)
+        unknown_tokens = np.bincount(rows[self.tokens.get_indexer(tokens) < 0], minlength=n_queries)
+        token_rows = query_rows(term_matrix(rows, tokens, self.tokens, n_queries), self.token_idf,
+                                unknown_tokens, np.log(1 + len(self.products)) + 1)
+        counts, unknown_grams = reindex_columns(*trigram_matrix(rows, tokens, n_queries), self.trigrams)
+        trigram_rows = query_rows(counts, np.ones(len(self.trigrams)), unknown_grams, 1.0)
+        return sparse.hstack([TOKEN_WEIGHT * token_rows, (1 - TOKEN_WEIGHT) * trigram_rows], format='csr'), pairs
+
+    # Matching
+
+    def match(self, queries, k=3):
+        """Each query's closest products scoring at least `min_score`, best first."""
+        queries = pd.Series(queries, dtype=object).reset_index(drop=True)
+        matches = top_matches(self._vectors(queries)[0], self.postings, k, self.min_score)
+        products = self.products.reset_index(drop=True)
+        return pd.DataFrame({
+            'query': queries.to_numpy(dtype=object)[matches['row']],
+            'product_id': products['product_id'].to_numpy(dtype=object)[matches['column']],
+            'product': products['name'].to_numpy(dtype=object)[matches['column']],
+            'category': products['category'].to_numpy(dtype=object)[matches['column']],
+            'score': matches['score'].to_numpy(),
+        })
+
+    def zero_result_queries(self):
+        """Every query that returned no results, with how many searches it failed."""
+        conn = self.db.connect()
+        try:
+            return pd.read_sql_query(
+                "SELECT query, COUNT(*) AS searches FROM search_events "
+                "WHERE results_count = 0 AND query IS NOT NULL GROUP BY query ORDER BY searches DESC, query", conn)
+        finally:
+            self.db.close()
+
+    def group_queries(self, queries, searches):
+        """Group label per query: queries linked by trigram similarity share the label of their most searched one."""
+        queries = pd.Series(queries, dtype=object).reset_index(drop=True)
+        searches = np.asarray(searches)
+        n_queries = len(queries)
+        if not n_queries:
+            return np.empty(0, dtype=object)
+        rows, tokens, _ = token_pairs(queries)
+        counts, _ = trigram_matrix(rows, tokens, n_queries)
+        vectors = weighted_rows(counts, inverse_document_frequency(counts, n_queries))
+        links = top_matches(vectors, vectors.T.tocsr(), n_queries, GROUP_SIMILARITY, exclude_self=True)
+        graph = sparse.csr_matrix((np.ones(len(links)), (links['row'], links['column'])), shape=(n_queries, n_queries))
+        _, component = connected_components(graph, directed=False)
+        # Label each component by its most searched query
+        leaders, _ = top_k_rows(component, 1, -searches, np.arange(n_queries))
+        # Components are numbered 0..n-1, so the leaders sorted by component are indexed by it
+        return queries.to_numpy(dtype=object)[leaders[component]]
+
+    def closest_terms(self, terms):
+        """The catalog token closest to each term by trigrams, if at least SPELLING_SIMILARITY (else None)."""
+        terms = pd.Series(terms, dtype=object).reset_index(drop=True)
+        closest = pd.DataFrame({'closest_term': pd.Series([None] * len(terms), dtype=object),
+                                'similarity': np.full(len(terms), np.nan)})
+        if not len(terms) or not len(self.tokens):
+            return closest
+        counts, vocabulary = trigram_matrix(np.arange(len(self.tokens)), self.tokens, len(self.tokens))
+        idf = inverse_document_frequency(counts, len(self.tokens))
+        term_counts, unknown = reindex_columns(*trigram_matrix(np.arange(len(terms)), terms, len(terms)), vocabulary)
+        vectors = weighted_rows(term_counts, idf, unknown, np.log(1 + len(self.tokens)) + 1)
+        best = top_matches(vectors, weighted_rows(counts, idf).T.tocsr(), 1, SPELLING_SIMILARITY)
+        closest.loc[best['row'], 'closest_term'] = self.spellings.to_numpy(dtype=object)[best['column']]
+        closest.loc[best['row'], 'similarity'] = best['score'].to_numpy()
+        return closest
+
+    def diagnose(self, k=3):
+        """Match every zero-result query to the catalog, group similar ones and estimate synonym fixes.
+
+        Returns a dict of frames. `queries` has each failing query's searches,
+        closest product and score, and group. `groups` totals searches per
+        group. `synonyms` lists each query term the catalog does not contain,
+        with the searches of queries where it is the only unknown term: the
+        zero-result searches mapping it to a catalog term would fix, and the
+        closest catalog token when the term may be a misspelling of it.
+        """
+        started = time.perf_counter()
+        failing = self.zero_result_queries()
+        queries = failing['query'].astype(object)
+        searches = failing['searches'].to_numpy(dtype=np.int64)
+
+        matches = self.match(queries, k)
+        best = matches.groupby('query', sort=False).first()
+        table = failing.assign(
+            closest_product=best['product'].reindex(queries).to_numpy(dtype=object),
+            closest_product_id=best['product_id'].reindex(queries).to_numpy(dtype=object),
+            score=best['score'].reindex(queries).to_numpy(),
+            group=self.group_queries(queries, searches),
+        )
+        table['matched'] = table['score'] >= self.min_score
+
+        groups = (table.assign(matched_searches=np.where(table['matched'], table['searches'], 0))
+                  .groupby('group', sort=False)
+                  .agg(queries=('query', 'size'), searches=('searches', 'sum'),
+                       matched_searches=('matched_searches', 'sum'))
+                  .sort_values('searches', ascending=False, kind='stable').reset_index())
+
+        # Terms missing from the catalog, and the searches a single synonym would fix
+        pairs = self._vectors(queries)[1]
+        unknown = pairs[self.tokens.get_indexer(pairs['token']) < 0]
+        unknown = unknown.assign(searches=searches[unknown['row']])
+        only = unknown.groupby('row')['token'].transform('size') == 1
+        synonyms = (unknown.assign(fixable=np.where(only, unknown['searches'], 0))
+                    .groupby('token', sort=False)
+                    .agg(term=('word', 'first'), queries=('row', 'size'), searches=('searches', 'sum'),
+                         fixable_searches=('fixable', 'sum'))
+                    .sort_values(['fixable_searches', 'searches'], ascending=False, kind='stable')
+                    .reset_index())
+        synonyms = pd.concat([synonyms, self.closest_terms(synonyms['token'])], axis=1).drop(columns='token')
+
+        return {
+            'queries': table,
+            'groups': groups,
+            'synonyms': synonyms,
+            'zero_result_searches': int(searches.sum()),
+            'seconds': time.perf_counter() - started,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Match zero-result searches to the product catalog")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--query', action='append', default=None, help="Match a query instead (repeatable)")
+    args = parser.parse_args()
+
+    index = ProductSearchIndex(EcommerceDatabase(args.db)).fit()
+    print(f"Indexed {len(index.products):,} products ({len(index.tokens):,} tokens, {len(index.trigrams):,} trigrams) "
+          f"in {index.fit_seconds:.2f}s")
+    if args.query:
+        print(tabulate(index.match(args.query, 5), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
+    else:
+        diagnosis = index.diagnose()
+        table = diagnosis['queries']
+        print(f"{len(table):,} zero-result queries ({diagnosis['zero_result_searches']:,} searches), "
+              f"{int(table['matched'].sum()):,} with a catalog match, in {diagnosis['seconds']:.2f}s")
+        columns = ['query', 'searches', 'closest_product', 'score', 'group']
+        print(tabulate(table[columns].head(20), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
+        print(tabulate(diagnosis['groups'].head(10), headers='keys', tablefmt='pipe', showindex=False))
+        print(tabulate(diagnosis['synonyms'].head(10), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.3f'))
@@ -0,0 +1,233 @@
+import json
+import heapq
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from tabulate import tabulate
+from database import EcommerceDatabase
+from generate_data import EVENT_BUFFERS
+from event_ingest import column_converters, iso_datetime, to_utc
+
+# Inactivity after which a user's next event starts a new session
+SESSION_GAP = timedelta(minutes=30)
+
+# A session converted when it submitted its order or reached the confirmation page
+CONVERSION_STEP = 'submit_order'
+CONFIRMATION_PAGE = 'confirmation'
+
+# Session and user columns taken from the events themselves (their most common value)
+SESSION_ATTRIBUTES = ['device_type', 'browser']
+USER_ATTRIBUTES = ['device_type', 'browser', 'country', 'referrer']
+
+
+def event_time(value):
+    """A record's timestamp as a naive UTC datetime, or None if missing or invalid."""
+    try:
+        return to_utc(iso_datetime(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def event_key(record):
+    """Sort key of a clickstream record: user, then time in UTC (records missing either sort first)."""
+    user_id, moment = record.get('user_id'), event_time(record.get('timestamp'))
+    return (user_id is not None, user_id if user_id is not None else '',
+            moment is not None, moment if moment is not None else datetime.min)
+
+
+def merge_sorted(*streams):
+    """Merge clickstreams that are each sorted by user and time into one sorted stream, lazily."""
+    return heapq.merge(*streams, key=event_key)
+
+
+def read_ndjson(path):
+    """Clickstream records from a newline-delimited JSON file, one at a time."""
+    with open(path, encoding='utf-8') as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def most_common(records, column):
+    """The most frequent non-empty value of a column among records, or None."""
+    counts = Counter(record.get(column) for record in records if record.get(column) is not None)
+    return counts.most_common(1)[0][0] if counts else None
+
+
+class Sessionizer:
+    """Splits a raw clickstream into sessions and writes them through the bulk ingest path.
+
+    Records are flat event rows without a session: the columns of an event
+    table plus a "table" key naming it (the format `HttpSink` posts), with
+    device, browser, country and referrer carried on the events. They must
+    arrive sorted by user and time; several sorted exports can be combined
+    with `merge_sorted`. A user's session ends at the next user or at a gap
+    of more than `gap` between events, so one pass sees each session whole
+    and only the open session's events are held in memory.
+
+    Every value is converted to its column's declared type the way the
+    ingest endpoint converts it, so ids take the database's id type (binary
+    ids arrive as hex text) and timestamps, zoned or not, are compared and
+    stored as naive UTC. A record with a value that does not fit is
+    rejected and counted.
+
+    Each session gets a new id, its start time (first event), end time (last
+    event plus its time spent, if any), most common device and browser, and
+    a conversion status: 'completed' when it submitted its order or reached
+    the confirmation page, else 'abandoned'. The last page view of a session
+    is its exit page unless the record says otherwise. A user is added with
+    their first session's attributes unless they already exist.
+    """
+
+    def __init__(self, db=None, gap=SESSION_GAP, batch_size=20000):
+        """Initialize a sessionizer writing to an `EcommerceDatabase` in batches of `batch_size` rows."""
+        self.db = db if db else EcommerceDatabase()
+        self.gap = gap if isinstance(gap, timedelta) else timedelta(seconds=gap)
+        self.batch_size = batch_size
+        self.columns, self.keys, self.schemas = {}, {}, {}
+        conn = self.db.connect()
+        try:
+            for table in ['users'] + [table for _, table in EVENT_BUFFERS]:
+                info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                self.columns[table] = [row[1] for row in info]
+                self.keys[table] = next(row[1] for row in info if row[5])
+                self.schemas[table] = column_converters(info)
+        finally:
+            self.db.close()
+        self.stats = {}
+
+    def sessionize(self, events):
+        """Yield (user row or None, session row, [(table, event row), ...]) for each session as it closes.
+
+        Records without a user or a valid timestamp are skipped, and records
+        with other invalid values rejected; records out of order raise
+        ValueError.
+        """
+        session, previous, last_moment = [], None, None
+        for record in events:
+            self.stats['events'] = self.stats.get('events', 0) + 1
+            table = record.get('table')
+            if table not in self.columns or table in ('users', 'sessions'):
+                raise ValueError(f"Unknown clickstream table {table!r}")
+            key = event_key(record)
+            if not (key[0] and key[2]):
+                self.stats['skipped'] = self.stats.get('skipped', 0) + 1
+                continue
+            if previous is not None and key < previous:
+                raise ValueError(f"Clickstream is not sorted by user and time at user {record['user_id']!r}, "
+                                 f"{record['timestamp']}")
+            try:
+                row = self._convert(record, table)
+            except (TypeError, ValueError):
+                self.stats['rejected'] = self.stats.get('rejected', 0) + 1
+                continue
+            moment = key[3]
+            new_user = previous is None or key[1] != previous[1]
+            if session and (new_user or moment - last_moment > self.gap):
+                yield self._close(session, first_of_user)
+                session = []
+            if not session:
+                first_of_user = new_user
+            session.append((row, moment))
+            previous, last_moment = key, moment
+        if session:
+            yield self._close(session, first_of_user)
+
+    def _convert(self, record, table):
+        """A record's values for its table's columns (and the user attributes), converted to their stored types."""
+        row = {'table': table}
+        for column, convert in self.schemas[table]:
+            value = record.get(column)
+            row[column] = convert(value) if value is not None and value != '' else None
+        for column, convert in self.schemas['users']:
+            if column in USER_ATTRIBUTES and column not in row:
+                value = record.get(column)
+                row[column] = convert(value) if value is not None and value != '' else None
+        return row
+
+    def _close(self, session, first_of_user):
+        """User (for a user's first session), session and event rows for one complete session."""
+        records = [record for record, _ in session]
+        session_id = self.db.new_id()
+        user_id = records[0]['user_id']
+        start = session[0][1]
+        end = max(moment + timedelta(seconds=record.get('time_spent_seconds') or 0) for record, moment in session)
+        converted = any(
+            (record['table'] == 'checkout_events' and record.get('step') == CONVERSION_STEP
+             and record.get('status') == 'completed')
+            or (record['table'] == 'page_views' and record.get('page_type') == CONFIRMATION_PAGE)
+            for record in records
+        )
+        attributes = {column: most_common(records, column) for column in USER_ATTRIBUTES}
+        session_row = (session_id, user_id, start.isoformat(), end.isoformat(),
+                       *(attributes[column] for column in SESSION_ATTRIBUTES),
+                       'completed' if converted else 'abandoned')
+
+        user_row = None
+        if first_of_user:
+            user_row = (user_id, start.isoformat(), *(attributes[column] for column in USER_ATTRIBUTES))
+
+        exit_view = max((number for number, record in enumerate(records) if record['table'] == 'page_views'),
+                        default=None)
+        rows = []
+        for number, record in enumerate(records):
+            table = record['table']
+            row = dict(record, session_id=session_id)
+            if row.get(self.keys[table]) is None:
+                row[self.keys[table]] = self.db.new_id()
+            if table == 'page_views' and row.get('exit_page') is None:
+                row['exit_page'] = int(number == exit_view)
+            rows.append((table, tuple(row.get(column) for column in self.columns[table])))
+
+        self.stats['sessions'] = self.stats.get('sessions', 0) + 1
+        self.stats['converted'] = self.stats.get('converted', 0) + int(converted)
+        self.stats['longest_session'] = max(self.stats.get('longest_session', 0), len(records))
+        return user_row, session_row, rows
+
+    def ingest(self, events):
+        """Sessionize a sorted clickstream into the database; returns run statistics."""
+        started = time.perf_counter()
+        self.stats = {'events': 0, 'skipped': 0, 'rejected': 0, 'sessions': 0, 'converted': 0, 'users': 0,
+                      'longest_session': 0}
+        buffers = {table: [] for table in self.columns}
+        pending = 0
+        for user_row, session_row, rows in self.sessionize(events):
+            if user_row:
+                buffers['users'].append(user_row)
+            buffers['sessions'].append(session_row)
+            for table, row in rows:
+                buffers[table].append(row)
+            pending += 1 + len(rows)
+            if pending >= self.batch_size:
+                self._flush(buffers)
+                pending = 0
+        self._flush(buffers)
+        self.stats['seconds'] = time.perf_counter() - started
+        return dict(self.stats)
+
+    def _flush(self, buffers):
+        """Write buffered rows, users and sessions first so events never precede their session."""
+        if buffers['users']:
+            self.stats['users'] += self.db.insert_records('users', buffers['users'], self.columns['users'],
+                                                          ignore_duplicates=True)
+        for table, rows in buffers.items():
+            if rows and table != 'users':
+                self.db.insert_records(table, rows, self.columns[table])
+        for rows in buffers.values():
+            rows.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Sessionize raw clickstream exports sorted by user and time")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--input', action='append', required=True,
+                        help="NDJSON clickstream sorted by user and time (repeatable; inputs are merged)")
+    parser.add_argument('--gap-minutes', type=float, default=SESSION_GAP.total_seconds() / 60,
+                        help="Inactivity that ends a session")
+    args = parser.parse_args()
+
+    sessionizer = Sessionizer(EcommerceDatabase(args.db), gap=timedelta(minutes=args.gap_minutes))
+    stats = sessionizer.ingest(merge_sorted(*(read_ndjson(path) for path in args.input)))
+    print(tabulate([[name, f"{value:,.2f}" if isinstance(value, float) else f"{value:,}"]
+                    for name, value in stats.items()], headers=['Statistic', 'Value'], tablefmt='pipe'))
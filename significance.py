@@ -0,0 +1,227 @@
+import time
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from tabulate import tabulate
+
+# User attributes whose combinations are compared
+SEGMENT_DIMENSIONS = ['device_type', 'browser', 'referrer', 'country']
+
+# Cells with fewer sessions than this are not tested
+MIN_TRIALS = 30
+
+# False discovery rate the comparisons are controlled at
+FDR_LEVEL = 0.05
+
+TEST_METHODS = ('z', 'bayes')
+
+# Cap on the empirical-Bayes prior's weight, in pseudo-sessions
+MAX_PRIOR_STRENGTH = 1e6
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (q-values); NaN p-values stay NaN and are not counted."""
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if not len(tested):
+        return q_values
+    order = tested[np.argsort(p_values[tested], kind='stable')]
+    ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    # Each q-value is the smallest adjusted p-value at its rank or above
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+def bayesian_fdr(error_probabilities):
+    """Bayesian FDR of calling each comparison and every more certain one: the running mean of sorted error probabilities."""
+    error_probabilities = np.asarray(error_probabilities, dtype=float)
+    q_values = np.full(len(error_probabilities), np.nan)
+    tested = np.flatnonzero(~np.isnan(error_probabilities))
+    if not len(tested):
+        return q_values
+    order = tested[np.argsort(error_probabilities[tested], kind='stable')]
+    q_values[order] = np.cumsum(error_probabilities[order]) / np.arange(1, len(order) + 1)
+    return q_values
+
+
+def two_proportion_test(successes, trials, other_successes, other_trials):
+    """Pooled two-proportion z statistics and two-sided p-values, elementwise (NaN where a side is empty)."""
+    successes, trials = np.asarray(successes, dtype=float), np.asarray(trials, dtype=float)
+    other_successes, other_trials = np.asarray(other_successes, dtype=float), np.asarray(other_trials, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (successes + other_successes) / (trials + other_trials)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / trials + 1 / other_trials))
+        z = (successes / trials - other_successes / other_trials) / se
+    z[(se == 0) & (trials > 0) & (other_trials > 0)] = 0.0
+    return z, 2 * ndtr(-np.abs(z))
+
+
+def beta_binomial_comparison(successes, trials, other_successes, other_trials, prior_mean=0.5, prior_strength=2.0):
+    """Posterior probability that each rate beats the other's, elementwise.
+
+    Each rate gets a Beta(prior_mean * prior_strength, (1 - prior_mean) *
+    prior_strength) prior (arrays allowed, so each cell can have its own);
+    the other side gets a uniform one. Uses a normal approximation to the
+    difference of the two Beta posteriors, which is close for the cell
+    sizes that get tested.
+    """
+    def posterior(x, n, a0, b0):
+        a, b = np.asarray(x, dtype=float) + a0, np.asarray(n, dtype=float) - x + b0
+        return a / (a + b), a * b / ((a + b) ** 2 * (a + b + 1))
+
+    prior_mean, prior_strength = np.asarray(prior_mean, dtype=float), np.asarray(prior_strength, dtype=float)
+    mean, variance = posterior(successes, trials, prior_mean * prior_strength, (1 - prior_mean) * prior_strength)
+    other_mean, other_variance = posterior(other_successes, other_trials, 1.0, 1.0)
+    return ndtr((mean - other_mean) / np.sqrt(variance + other_variance))
+
+
+def beta_prior(successes, trials, groups):
+    """Empirical-Bayes Beta prior (mean, strength) per group, by the method of moments over the group's cells.
+
+    The spread of the cells' rates beyond binomial noise sets how strongly
+    they are shrunk towards the group's rate. When a group's cells differ
+    by no more than chance the prior is as strong as MAX_PRIOR_STRENGTH, so
+    no cell is credited with a difference; this is what makes the Bayesian
+    FDR account for testing many cells at once.
+    """
+    successes, trials = np.asarray(successes, dtype=float), np.asarray(trials, dtype=float)
+    groups = np.asarray(groups, dtype=np.int64)
+    group_trials = np.bincount(groups, weights=trials)
+    cells = np.bincount(groups)
+    mean = np.bincount(groups, weights=successes) / group_trials
+    rates = successes / trials
+    # Trial-weighted squared deviations, less what binomial noise alone would give, per unit of between-cell variance
+    spread = np.bincount(groups, weights=trials * (rates - mean[groups]) ** 2)
+    noise = (cells - 1) * mean * (1 - mean)
+    scale = group_trials - np.bincount(groups, weights=trials * trials) / group_trials
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (spread - noise) / scale
+        strength = mean * (1 - mean) / between - 1
+    strength = np.where((between > 0) & (cells > 1), np.clip(strength, 0, MAX_PRIOR_STRENGTH), MAX_PRIOR_STRENGTH)
+    return mean, strength
+
+
+def cell_counts(frame, dimensions, successes, trials):
+    """Successes and trials for every cell of every combination of dimensions, in one frame.
+
+    Each combination (device type alone, device type x referrer, ..., all
+    four) partitions the rows, so a cell's complement is the rest of its
+    combination. Cells are counted with integer codes and bincount, with no
+    per-row Python work.
+    """
+    codes, labels = {}, {}
+    for dimension in dimensions:
+        codes[dimension], labels[dimension] = pd.factorize(frame[dimension].astype(object).fillna('unknown'))
+    success_values = frame[successes].fillna(0).to_numpy(dtype=float)
+    trial_values = frame[trials].fillna(0).to_numpy(dtype=float)
+
+    pieces = []
+    for size in range(1, len(dimensions) + 1):
+        for combination in combinations(dimensions, size):
+            # Mixed-radix cell code over the combination's dimensions
+            cell = np.zeros(len(frame), dtype=np.int64)
+            space = 1
+            for dimension in combination:
+                cell = cell * len(labels[dimension]) + codes[dimension]
+                space *= len(labels[dimension])
+            if space <= len(frame):
+                # Small code space: count densely and keep the cells that occur, with no sort
+                rows = np.bincount(cell, minlength=space)
+                present = np.flatnonzero(rows)
+                piece = pd.DataFrame({
+                    'dimensions': ' x '.join(combination),
+                    'successes': np.bincount(cell, weights=success_values, minlength=space)[present],
+                    'trials': np.bincount(cell, weights=trial_values, minlength=space)[present],
+                })
+            else:
+                present, inverse = np.unique(cell, return_inverse=True)
+                piece = pd.DataFrame({
+                    'dimensions': ' x '.join(combination),
+                    'successes': np.bincount(inverse, weights=success_values, minlength=len(present)),
+                    'trials': np.bincount(inverse, weights=trial_values, minlength=len(present)),
+                })
+            # Decode each dimension's value from the mixed-radix code, last dimension first
+            remainder = present
+            for dimension in reversed(combination):
+                piece[dimension] = np.asarray(labels[dimension], dtype=object)[remainder % len(labels[dimension])]
+                remainder = remainder // len(labels[dimension])
+            piece['cell'] = piece[combination[0]].map(f"{combination[0]}={{}}".format)
+            for dimension in combination[1:]:
+                piece['cell'] += piece[dimension].map(f", {dimension}={{}}".format)
+            pieces.append(piece)
+    # Dimensions outside a cell's combination are None
+    cells = pd.concat(pieces, ignore_index=True).astype({dimension: object for dimension in dimensions})
+    return cells[['dimensions', 'cell'] + list(dimensions) + ['successes', 'trials']]
+
+
+def compare_cells(frame, dimensions=SEGMENT_DIMENSIONS, successes='completed_purchases', trials='session_count',
+                  method='z', fdr=FDR_LEVEL, min_trials=MIN_TRIALS):
+    """Test every segment cell's conversion rate against the rest of its population, with FDR control.
+
+    With `method='z'` each cell gets a pooled two-proportion test and
+    Benjamini-Hochberg q-values; with `method='bayes'` a beta-binomial
+    posterior probability of converting better than the rest, under an
+    empirical-Bayes prior per combination, and Bayesian FDR q-values from
+    the probability of having the direction wrong. Cells with fewer than
+    `min_trials` trials, or whose complement is empty, are not tested.
+    `significant` marks cells with q-value <= `fdr`.
+    """
+    if method not in TEST_METHODS:
+        raise ValueError(f"method must be one of {TEST_METHODS}, got {method!r}")
+    cells = cell_counts(frame, dimensions, successes, trials)
+    total_successes = frame[successes].fillna(0).sum()
+    total_trials = frame[trials].fillna(0).sum()
+    other_successes = total_successes - cells['successes'].to_numpy()
+    other_trials = total_trials - cells['trials'].to_numpy()
+    tested = (cells['trials'].to_numpy() >= min_trials) & (other_trials > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cells['rate'] = cells['successes'] / cells['trials']
+        cells['other_rate'] = other_successes / other_trials
+    cells['lift'] = cells['rate'] - cells['other_rate']
+
+    if method == 'z':
+        z, p_values = two_proportion_test(cells['successes'], cells['trials'], other_successes, other_trials)
+        cells['z'] = np.where(tested, z, np.nan)
+        cells['p_value'] = np.where(tested, p_values, np.nan)
+        cells['q_value'] = benjamini_hochberg(cells['p_value'])
+    else:
+        # One prior per combination, fitted to that combination's tested cells
+        groups = pd.factorize(cells['dimensions'])[0][tested]
+        prior_mean, prior_strength = beta_prior(cells['successes'].to_numpy()[tested], cells['trials'].to_numpy()[tested],
+                                                groups)
+        better = np.full(len(cells), np.nan)
+        better[tested] = beta_binomial_comparison(cells['successes'].to_numpy()[tested], cells['trials'].to_numpy()[tested],
+                                                  other_successes[tested], other_trials[tested],
+                                                  prior_mean[groups], prior_strength[groups])
+        cells['prob_better'] = better
+        cells['q_value'] = bayesian_fdr(np.minimum(better, 1 - better))
+    cells['significant'] = cells['q_value'] <= fdr
+    cells['successes'] = cells['successes'].astype(np.int64)
+    cells['trials'] = cells['trials'].astype(np.int64)
+    return cells
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Test segment conversion rates for significant differences")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--method', choices=TEST_METHODS, default='z')
+    parser.add_argument('--fdr', type=float, default=FDR_LEVEL)
+    args = parser.parse_args()
+
+    user_data = SharedFrameEngine(EcommerceDatabase(args.db)).get_user_segment_features()
+    started = time.perf_counter()
+    cells = compare_cells(user_data, method=args.method, fdr=args.fdr)
+    elapsed = time.perf_counter() - started
+    tested = cells['q_value'].notna()
+    print(f"{len(cells):,} cells, {int(tested.sum()):,} tested, {int(cells['significant'].sum()):,} significant "
+          f"at FDR {args.fdr:.0%}, in {elapsed*1000:.0f} ms")
+    significant = cells[cells['significant']].sort_values('q_value')
+    columns = ['cell', 'trials', 'rate', 'other_rate', 'lift', 'q_value']
+    print(tabulate(significant[columns].head(20), headers='keys', tablefmt='pipe', showindex=False, floatfmt='.4f'))
@@ -0,0 +1,316 @@
+import pickle
+import numpy as np
+import pandas as pd
+
+# Bump when a sketch's fields change, so old serialized sketches are rejected
+SKETCH_VERSION = 1
+
+
+def hash64(values):
+    """Stable 64-bit hashes of ids, query strings or numbers (identical in every process)."""
+    values = pd.Series(values)
+    if values.dtype.kind in 'iub':
+        return pd.util.hash_array(values.to_numpy(dtype=np.int64), categorize=False)
+    return pd.util.hash_array(values.to_numpy(dtype=object), categorize=False)
+
+
+def leading_zeros(values):
+    """Number of leading zero bits of each (non-zero) uint64."""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    # frexp is exact for 32-bit integers: v = m * 2**e with 0.5 <= m < 1, so floor(log2 v) = e - 1
+    high_bits = np.frexp(high)[1]
+    low_bits = np.frexp(low)[1]
+    return np.where(high > 0, 32 - high_bits, 64 - low_bits)
+
+
+class HyperLogLog:
+    """Distinct count estimate in 2**precision one-byte registers (about 1.04 / sqrt(2**precision) error).
+
+    Sketches with the same precision merge by taking the register-wise
+    maximum, so counts can be kept per time bucket or shard and combined.
+    """
+
+    def __init__(self, precision=14):
+        """Initialize an empty sketch; 14 bits is 16 KB for about 0.8% error."""
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        """Add an array of values (duplicates and nulls are ignored)."""
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return self
+        hashes = hash64(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # A guard bit below the remaining hash bits caps the rank at 64 - precision + 1
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        np.maximum.at(self.registers, index, (leading_zeros(rest) + 1).astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        """Fold another sketch with the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Heavy hitters: approximate counts of the `capacity` most frequent items.
+
+    Every tracked count is an upper bound, over by at most its `error`, and
+    any untracked item occurred at most `bound` times. Updates are applied
+    a batch at a time as a merge of two summaries, so a batch costs one
+    vectorized union rather than a loop per row, and sketches kept per time
+    bucket or shard merge the same way.
+    """
+
+    def __init__(self, capacity=1000):
+        """Initialize an empty summary that tracks up to `capacity` items."""
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=float)
+        self.errors = pd.Series(dtype=float)
+        self.bound = 0.0
+        self.total = 0.0
+
+    def add(self, values, weights=None):
+        """Count an array of items (optionally weighted); nulls are ignored."""
+        batch = pd.Series(1.0 if weights is None else weights, index=pd.Index(values, dtype=object), dtype=float)
+        batch = batch[batch.index.notna()]
+        if batch.empty:
+            return self
+        counts = batch.groupby(level=0, sort=False).sum()
+        update = SpaceSaving(self.capacity)
+        update.counts = counts
+        update.errors = pd.Series(0.0, index=counts.index)
+        update.total = float(counts.sum())
+        update._truncate()
+        return self.merge(update)
+
+    def merge(self, other):
+        """Fold another summary into this one, keeping the `capacity` largest counts."""
+        items = self.counts.index.union(other.counts.index, sort=False)
+        self.counts = (self.counts.reindex(items, fill_value=self.bound)
+                       + other.counts.reindex(items, fill_value=other.bound))
+        self.errors = (self.errors.reindex(items, fill_value=self.bound)
+                       + other.errors.reindex(items, fill_value=other.bound))
+        self.bound += other.bound
+        self.total += other.total
+        self._truncate()
+        return self
+
+    def _truncate(self):
+        """Drop all but the `capacity` largest counts, raising the bound for untracked items."""
+        if len(self.counts) <= self.capacity:
+            return
+        keep = self.counts.nlargest(self.capacity, keep='first').index
+        dropped = self.counts.drop(keep)
+        self.bound = max(self.bound, float(dropped.max()))
+        self.counts = self.counts[keep]
+        self.errors = self.errors[keep]
+
+    def top(self, k=20):
+        """The k most frequent items: item, estimated count and maximum overcount."""
+        counts = self.counts.sort_values(ascending=False, kind='stable').head(k)
+        return pd.DataFrame({
+            'item': counts.index.to_numpy(dtype=object),
+            'count': counts.to_numpy(),
+            'error': self.errors.reindex(counts.index).to_numpy(),
+        })
+
+
+class TDigest:
+    """Quantile sketch: values compressed into centroids, dense at the tails.
+
+    Centroids are bounded by the arcsine scale function, so extreme
+    quantiles (p99, p999) stay accurate. Values are buffered and compressed
+    in vectorized batches. Digests merge by pooling their centroids, so
+    they can be kept per time bucket or shard and combined.
+    """
+
+    def __init__(self, compression=100, buffer_size=50000):
+        """Initialize an empty digest; higher compression keeps more centroids."""
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0.0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values, weights=None):
+        """Add an array of values (optionally weighted); NaNs are ignored."""
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        keep = ~np.isnan(values)
+        values, weights = values[keep], weights[keep]
+        if not len(values):
+            return self
+        self.buffer.append((values, weights))
+        self.buffered += len(values)
+        self.count += float(weights.sum())
+        self.sum += float((values * weights).sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if self.buffered >= self.buffer_size:
+            self.compress()
+        return self
+
+    def merge(self, other):
+        """Fold another digest into this one."""
+        other.compress()
+        if other.count:
+            self.buffer.append((other.means, other.weights))
+            self.buffered += len(other.means)
+            self.count += other.count
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.compress()
+        return self
+
+    def compress(self):
+        """Merge buffered values into the centroids."""
+        if not self.buffer:
+            return self
+        means = np.concatenate([self.means] + [values for values, _ in self.buffer])
+        weights = np.concatenate([self.weights] + [weights for _, weights in self.buffer])
+        self.buffer = []
+        self.buffered = 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        midpoints = (np.cumsum(weights) - weights / 2) / total
+        # Each unit of the arcsine scale k(q) = compression / (2 pi) * asin(2q - 1) becomes one centroid
+        scale = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * midpoints - 1, -1, 1)))
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(scale)) + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+        return self
+
+    def quantile(self, q):
+        """Estimated value at quantile q (a number or an array of numbers in [0, 1])."""
+        self.compress()
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0], centers, [self.count]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q, dtype=float) * self.count, positions, values)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+
+SKETCH_TYPES = {cls.__name__: cls for cls in (HyperLogLog, SpaceSaving, TDigest)}
+
+
+def dump_sketch(sketch):
+    """Serialize a sketch to bytes."""
+    if isinstance(sketch, TDigest):
+        sketch.compress()
+    return pickle.dumps((type(sketch).__name__, SKETCH_VERSION, vars(sketch)), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_sketch(data):
+    """Rebuild a sketch serialized by `dump_sketch`."""
+    name, version, fields = pickle.loads(data)
+    if name not in SKETCH_TYPES or version != SKETCH_VERSION:
+        raise ValueError(f"Unsupported sketch {name!r} (version {version})")
+    sketch = SKETCH_TYPES[name].__new__(SKETCH_TYPES[name])
+    vars(sketch).update(fields)
+    return sketch
+
+
+def merge_sketches(sketches):
+    """Merge a list of sketches of one type (e.g. per time bucket or shard) into a new sketch."""
+    sketches = list(sketches)
+    merged = load_sketch(dump_sketch(sketches[0]))
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
+
+
+def self_check(seed=7):
+    """Check each sketch's accuracy, mergeability and serialization on synthetic data.
+
+    Returns rows of (check, measured, limit, passed).
+    """
+    rng = np.random.default_rng(seed)
+    checks = []
+
+    def check(name, measured, limit):
+        checks.append((name, measured, limit, measured <= limit))
+
+    # HyperLogLog: 1M distinct text ids (2M values), split across two shards
+    ids = np.array([f"session-{number}" for number in rng.permutation(1000000)], dtype=object)
+    stream = np.concatenate([ids, ids[rng.integers(0, len(ids), 1000000)]])
+    shards = [HyperLogLog().add(part) for part in np.array_split(stream, 2)]
+    merged = merge_sketches(shards)
+    check('HyperLogLog relative error (1M distinct)', abs(merged.count() - 1000000) / 1000000, 0.02)
+    check('HyperLogLog merge == single sketch',
+          float(merged.count() != HyperLogLog().add(stream).count()), 0)
+    small = HyperLogLog().add(ids[:1000])
+    check('HyperLogLog relative error (1k distinct)', abs(small.count() - 1000) / 1000, 0.02)
+    integers = HyperLogLog().add(np.arange(200000, dtype=np.int64) * 7919)
+    check('HyperLogLog relative error (200k integers)', abs(integers.count() - 200000) / 200000, 0.02)
+
+    # Space-Saving: Zipf-distributed queries fed in batches across two shards
+    queries = rng.zipf(1.2, 2000000) % 50000
+    exact = pd.Series(queries).value_counts()
+    shards = [SpaceSaving(capacity=500) for _ in range(2)]
+    for number, batch in enumerate(np.array_split(queries, 40)):
+        shards[number % 2].add(batch)
+    merged = merge_sketches(shards)
+    top = merged.top(20)
+    check('SpaceSaving top-20 recall', 1 - len(set(top['item']) & set(exact.index[:20])) / 20, 0)
+    true_counts = exact.reindex(top['item']).fillna(0).to_numpy()
+    check('SpaceSaving overcount within reported error',
+          float(np.any(top['count'].to_numpy() - true_counts > top['error'].to_numpy() + 1e-9)), 0)
+    check('SpaceSaving max relative error (top 20)',
+          float(np.max((top['count'].to_numpy() - true_counts) / true_counts)), 0.05)
+
+    # t-digest: heavy-tailed durations across four shards
+    values = rng.lognormal(4, 1.2, 1000000)
+    shards = [TDigest().add(part) for part in np.array_split(values, 4)]
+    merged = load_sketch(dump_sketch(merge_sketches(shards)))
+    quantiles = np.array([0.01, 0.1, 0.5, 0.9, 0.99, 0.999])
+    estimates = merged.quantile(quantiles)
+    ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+    check('TDigest max rank error (p1..p99.9)', float(np.max(np.abs(ranks - quantiles))), 0.005)
+    check('TDigest centroids', float(len(merged.means)), 200)
+    check('TDigest mean error', abs(merged.mean - values.mean()) / values.mean(), 1e-9)
+
+    # Serialization round trip
+    restored = load_sketch(dump_sketch(small))
+    check('Serialized HyperLogLog round trip', float(restored.count() != small.count()), 0)
+    return checks
+
+
+if __name__ == "__main__":
+    import sys
+    from tabulate import tabulate
+
+    checks = self_check()
+    rows = [[name, f"{measured:.4g}", f"{limit:g}", 'ok' if passed else 'FAIL'] for name, measured, limit, passed in checks]
+    print(tabulate(rows, headers=['Check', 'Measured', 'Limit', 'Result'], tablefmt='pipe'))
+    sys.exit(0 if all(passed for *_, passed in checks) else 1)
@@ -0,0 +1,398 @@
+import json
+import math
+import time
+import heapq
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta
+import numpy as np
+from tabulate import tabulate
+from database import EcommerceDatabase
+from generate_data import EcommerceDataGenerator, EVENT_BUFFERS
+from event_ingest import EventIngestor
+
+# Column holding the event time for each replayed table
+TIMESTAMP_COLUMNS = {
+    'sessions': 'start_time',
+}
+
+
+def diurnal_factor(moment, amplitude=0.6, peak_hour=20):
+    """Relative traffic level for a time of day; averages 1.0 over 24 hours."""
+    hour = moment.hour + moment.minute / 60.0
+    return 1.0 + amplitude * math.cos(2 * math.pi * (hour - peak_hour) / 24.0)
+
+
+class DatabaseSink:
+    """Writes replayed events straight into the database in batched transactions."""
+
+    def __init__(self, db, batch_size=1000, flush_interval=0.1):
+        """Initialize the sink; buffers are flushed by size or age, whichever comes first."""
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffers = {table: [] for _, table in EVENT_BUFFERS}
+        self.pending = 0
+        self.last_flush = time.perf_counter()
+        self.batches_written = 0
+
+    def send(self, table, row):
+        """Buffer one event row."""
+        self.buffers[table].append(row)
+        self.pending += 1
+        if self.pending >= self.batch_size or time.perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows, sessions first so events never precede their session."""
+        for _, table in EVENT_BUFFERS:
+            rows = self.buffers[table]
+            if rows:
+                self.db.insert_records(table, rows)
+                self.buffers[table] = []
+        if self.pending:
+            self.batches_written += 1
+        self.pending = 0
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        """Flush anything still buffered."""
+        self.flush()
+
+    def stats(self):
+        """Sink-specific counters for the run summary."""
+        return {'batches_written': self.batches_written}
+
+
+class HttpSink:
+    """Posts replayed events as NDJSON batches to an ingest endpoint.
+
+    Each line is the row's columns plus a "table" key. Binary ids are sent
+    as hex strings. 429/503 responses are treated as backpressure: the sink
+    waits for Retry-After and resends the batch.
+    """
+
+    def __init__(self, url='http://127.0.0.1:5002/events', batch_size=500, flush_interval=0.1, timeout=10):
+        """Initialize the sink for an ingest endpoint URL."""
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.lines = []
+        self.last_flush = time.perf_counter()
+        self.batches_written = 0
+        self.backpressure_waits = 0
+        self.failed_batches = 0
+
+    def send(self, table, row):
+        """Buffer one event row."""
+        record = dict(row)
+        record['table'] = table
+        self.lines.append(json.dumps(record, default=lambda o: o.hex() if isinstance(o, bytes) else str(o)))
+        if len(self.lines) >= self.batch_size or time.perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """POST the buffered lines, retrying while the endpoint signals backpressure."""
+        if not self.lines:
+            return
+        body = ('\n'.join(self.lines) + '\n').encode('utf-8')
+        self.lines = []
+        self.last_flush = time.perf_counter()
+
+        for _ in range(20):
+            request = urllib.request.Request(
+                self.url, data=body, method='POST',
+                headers={'Content-Type': 'application/x-ndjson'}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    self.batches_written += 1
+                    return
+            except urllib.error.HTTPError as e:
+                if e.code not in (429, 503):
+                    break
+                self.backpressure_waits += 1
+                time.sleep(float(e.headers.get('Retry-After', 0.1) or 0.1))
+            except urllib.error.URLError:
+                break
+        self.failed_batches += 1
+
+    def close(self):
+        """Flush anything still buffered."""
+        self.flush()
+
+    def stats(self):
+        """Sink-specific counters for the run summary."""
+        return {
+            'batches_written': self.batches_written,
+            'backpressure_waits': self.backpressure_waits,
+            'failed_batches': self.failed_batches
+        }
+
+
+class IngestorSink:
+    """Feeds NDJSON batches to an in-process `EventIngestor`, the path behind the /events endpoint.
+
+    Batches are encoded and refused exactly as `HttpSink` sees them, so a
+    run measures validation and group commit without HTTP overhead.
+    """
+
+    def __init__(self, ingestor, batch_size=500):
+        """Initialize the sink for an ingestor."""
+        self.ingestor = ingestor
+        self.batch_size = batch_size
+        self.lines = []
+        self.batches_written = 0
+        self.backpressure_waits = 0
+
+    def send(self, table, row):
+        """Buffer one event row."""
+        record = dict(row)
+        record['table'] = table
+        self.lines.append(json.dumps(record, default=lambda o: o.hex() if isinstance(o, bytes) else str(o)))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Submit the buffered lines, waiting out backpressure."""
+        if not self.lines:
+            return
+        body = ('\n'.join(self.lines) + '\n').encode('utf-8')
+        self.lines = []
+        refusal = self.ingestor.backpressure()
+        while refusal:
+            self.backpressure_waits += 1
+            time.sleep(refusal[1])
+            refusal = self.ingestor.backpressure()
+        self.ingestor.submit(body)
+        self.batches_written += 1
+
+    def close(self):
+        """Submit anything still buffered and wait for it to be committed."""
+        self.flush()
+        self.ingestor.close()
+
+    def stats(self):
+        """Sink-specific counters for the run summary."""
+        ingest = self.ingestor.stats()
+        return {
+            'batches_written': self.batches_written,
+            'backpressure_waits': self.backpressure_waits,
+            'group_commits': ingest['commits'],
+            'largest_commit': ingest['largest_commit']
+        }
+
+
+class TrafficSimulator:
+    def __init__(self, db=None, sink=None, rate=5000, duration=60, time_scale=60.0, diurnal=True,
+                 diurnal_amplitude=0.6, start_time=None, seed=None, probe_interval=0.5,
+                 num_users=500, num_products=100):
+        """Initialize the simulator.
+
+        `rate` is the average events/second to emit (modulated by the diurnal
+        curve when `diurnal` is on), `duration` is the wall-clock run length
+        in seconds and `time_scale` is how many simulated seconds pass per
+        wall-clock second, so a simulated day can be replayed in minutes.
+        """
+        self.db = db if db else EcommerceDatabase()
+        self.sink = sink if sink else DatabaseSink(self.db)
+        self.rate = rate
+        self.duration = duration
+        self.time_scale = time_scale
+        self.diurnal = diurnal
+        self.diurnal_amplitude = diurnal_amplitude
+        self.start_time = start_time or datetime.now().replace(microsecond=0)
+        self.probe_interval = probe_interval
+
+        # Journeys come from the same model as the demo data generator
+        self.generator = EcommerceDataGenerator(
+            num_users=num_users, num_products=num_products, db=self.db, seed=seed,
+            product_popularity='zipf', user_activity='zipf', show_progress=False
+        )
+        self.rng = self.generator.rng
+
+        self.events_per_session = 12.0  # refined as sessions are generated
+        self.sessions_generated = 0
+        self.events_generated = 0
+        self.pending = []  # heap of (event_time, sequence, table, row)
+        self.sequence = 0
+
+        self.session_emit_times = []
+        self.lags = []
+        self.probe_stop = threading.Event()
+
+    def prepare_catalog(self):
+        """Reuse the users and products in the database, generating them if it is empty."""
+        num_users, num_products = self.generator.load_existing_catalog()
+        if num_users == 0:
+            self.generator.generate_users()
+        if num_products == 0:
+            self.generator.generate_products()
+        if num_users == 0 or num_products == 0:
+            self.generator.load_existing_catalog()
+
+    def session_rate(self, moment):
+        """Simulated sessions per simulated second at a given moment."""
+        events_per_wall_second = self.rate * (diurnal_factor(moment, self.diurnal_amplitude) if self.diurnal else 1.0)
+        return events_per_wall_second / self.time_scale / self.events_per_session
+
+    def spawn_session(self, start_time):
+        """Generate one journey and queue its events by timestamp."""
+        self.generator.generate_session(start_time=start_time)
+        new_events = 0
+        for attribute, table in EVENT_BUFFERS:
+            rows = getattr(self.generator, attribute)
+            column = TIMESTAMP_COLUMNS.get(table, 'timestamp')
+            for row in rows:
+                self.sequence += 1
+                heapq.heappush(self.pending, (datetime.fromisoformat(row[column]), self.sequence, table, row))
+            new_events += len(rows)
+            setattr(self.generator, attribute, [])
+
+        self.sessions_generated += 1
+        self.events_generated += new_events
+        self.events_per_session = self.events_generated / self.sessions_generated
+
+    def kpi_session_count(self):
+        """Total sessions as reported by the conversion KPI query."""
+        return int(self.db.get_conversion_rates()['overall']['total'].iloc[0])
+
+    def probe_lag(self, baseline):
+        """Poll the KPIs and record how long each emitted session took to become visible."""
+        visible_before = 0
+        while not self.probe_stop.wait(self.probe_interval):
+            observed_at = time.perf_counter()
+            visible = self.kpi_session_count() - baseline
+            emitted = len(self.session_emit_times)
+            visible = min(visible, emitted)
+            for index in range(visible_before, visible):
+                self.lags.append(observed_at - self.session_emit_times[index])
+            visible_before = max(visible_before, visible)
+
+    def run(self):
+        """Replay traffic for the configured duration and return run statistics."""
+        self.prepare_catalog()
+        baseline = self.kpi_session_count()
+
+        probe = threading.Thread(target=self.probe_lag, args=(baseline,), daemon=True)
+        probe.start()
+
+        virtual_start = self.start_time
+        virtual_end = virtual_start + timedelta(seconds=self.duration * self.time_scale)
+        next_arrival = virtual_start
+        emitted = 0
+        max_behind = 0.0
+        wall_start = time.perf_counter()
+
+        while True:
+            # Make sure every session starting before the earliest queued
+            # event has been generated, so events leave in timestamp order
+            while next_arrival < virtual_end and (not self.pending or next_arrival <= self.pending[0][0]):
+                self.spawn_session(next_arrival)
+                gap = self.rng.expovariate(self.session_rate(next_arrival))
+                next_arrival += timedelta(seconds=gap)
+
+            if not self.pending or self.pending[0][0] >= virtual_end:
+                break
+
+            event_time, _, table, row = heapq.heappop(self.pending)
+            due = wall_start + (event_time - virtual_start).total_seconds() / self.time_scale
+            delay = due - time.perf_counter()
+            if delay > 0.002:
+                time.sleep(delay)
+            else:
+                max_behind = max(max_behind, -delay)
+
+            self.sink.send(table, row)
+            if table == 'sessions':
+                self.session_emit_times.append(time.perf_counter())
+            emitted += 1
+
+        self.sink.close()
+        wall_seconds = time.perf_counter() - wall_start
+
+        # Give the last writes a chance to show up in the KPIs
+        deadline = time.perf_counter() + max(5 * self.probe_interval, 2.0)
+        while len(self.lags) < len(self.session_emit_times) and time.perf_counter() < deadline:
+            time.sleep(self.probe_interval / 2)
+        self.probe_stop.set()
+        probe.join()
+
+        stats = {
+            'target_rate': self.rate,
+            'events_emitted': emitted,
+            'sessions_emitted': len(self.session_emit_times),
+            'wall_seconds': round(wall_seconds, 2),
+            'achieved_rate': round(emitted / wall_seconds, 1) if wall_seconds > 0 else 0.0,
+            'max_behind_schedule_seconds': round(max_behind, 3),
+            'sessions_visible': len(self.lags),
+            'lag_probe_interval': self.probe_interval,
+        }
+        if self.lags:
+            lags = np.array(self.lags)
+            stats.update({
+                'lag_p50_seconds': round(float(np.percentile(lags, 50)), 3),
+                'lag_p90_seconds': round(float(np.percentile(lags, 90)), 3),
+                'lag_p99_seconds': round(float(np.percentile(lags, 99)), 3),
+                'lag_max_seconds': round(float(lags.max()), 3),
+            })
+        stats.update(self.sink.stats())
+        return stats
+
+
+def print_stats(stats):
+    """Print run statistics as a table."""
+    print(tabulate([[key, value] for key, value in stats.items()], headers=['Metric', 'Value'], tablefmt='pipe'))
+
+
+def find_ingest_ceiling(rates=(1000, 2000, 5000, 10000, 20000, 40000), duration=10, max_p99_lag=2.0,
+                        sink_factory=None, **kwargs):
+    """Step through target rates until ingest falls behind; returns the last sustainable rate.
+
+    A rate is sustainable when the simulator achieves at least 95% of it
+    and the p99 end-to-end lag stays under `max_p99_lag` seconds.
+    `sink_factory` creates a fresh sink per step (default: database sink).
+    """
+    sustainable = None
+    for rate in rates:
+        sink = sink_factory() if sink_factory else None
+        stats = TrafficSimulator(sink=sink, rate=rate, duration=duration, **kwargs).run()
+        ok = stats['achieved_rate'] >= 0.95 * rate and stats.get('lag_p99_seconds', float('inf')) <= max_p99_lag
+        print(f"{rate:>8,} events/s target -> {stats['achieved_rate']:>10,.0f} achieved, "
+              f"p99 lag {stats.get('lag_p99_seconds', 'n/a')}s {'OK' if ok else 'SATURATED'}")
+        if not ok:
+            break
+        sustainable = rate
+    print(f"Ingest ceiling: {sustainable:,} events/s" if sustainable else "Ingest ceiling below the lowest tested rate")
+    return sustainable
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay simulated shopper traffic into the ingest path")
+    parser.add_argument('--rate', type=float, default=5000, help="Average events per second")
+    parser.add_argument('--duration', type=float, default=60, help="Wall-clock seconds to run")
+    parser.add_argument('--time-scale', type=float, default=60.0, help="Simulated seconds per wall-clock second")
+    parser.add_argument('--no-diurnal', action='store_true', help="Disable the time-of-day traffic curve")
+    parser.add_argument('--sink', choices=['database', 'http', 'ingestor'], default='database',
+                        help="Write directly, post to --url, or go through the endpoint's in-process ingestor")
+    parser.add_argument('--url', default='http://127.0.0.1:5002/events', help="Ingest endpoint for the http sink")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--find-ceiling', action='store_true', help="Step up the rate until ingest saturates")
+    args = parser.parse_args()
+
+    db = EcommerceDatabase(args.db)
+    sinks = {
+        'database': lambda: DatabaseSink(db),
+        'http': lambda: HttpSink(args.url),
+        'ingestor': lambda: IngestorSink(EventIngestor(db)),
+    }
+    make_sink = sinks[args.sink]
+    common = {'db': db, 'time_scale': args.time_scale, 'diurnal': not args.no_diurnal, 'seed': args.seed}
+    if args.find_ceiling:
+        find_ingest_ceiling(duration=args.duration, sink_factory=make_sink, **common)
+    else:
+        print_stats(TrafficSimulator(sink=make_sink(), rate=args.rate, duration=args.duration, **common).run())
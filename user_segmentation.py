@@ -0,0 +1,151 @@
+import os
+import pickle
+import numpy as np
+from datetime import datetime
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from tabulate import tabulate
+
+# Per-user features the segment model is fitted on
+SEGMENT_FEATURES = ['session_count', 'avg_time_spent', 'page_view_count', 'click_count',
+                    'cart_event_count', 'search_count', 'conversion_rate']
+
+# Candidate numbers of segments tried when choosing k
+K_RANGE = range(2, 9)
+
+# Silhouette scores cost O(n^2), so k is chosen on a bounded random sample
+SELECTION_SAMPLE_SIZE = 5000
+
+
+def segment_model_path(db_path):
+    """Default location of the segment model fitted on a database."""
+    return f"{db_path}.segment-model"
+
+
+def choose_k(X_scaled, k_range=K_RANGE, sample_size=SELECTION_SAMPLE_SIZE, random_state=42):
+    """Pick the number of segments with the best silhouette score on a sample.
+
+    Returns (k, {k: silhouette score}).
+    """
+    rng = np.random.default_rng(random_state)
+    if len(X_scaled) > sample_size:
+        X_scaled = X_scaled[rng.choice(len(X_scaled), sample_size, replace=False)]
+
+    scores = {}
+    for k in k_range:
+        if k >= len(X_scaled):
+            break
+        labels = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3).fit_predict(X_scaled)
+        if len(np.unique(labels)) < 2:
+            continue
+        scores[k] = float(silhouette_score(X_scaled, labels))
+
+    if not scores:
+        return 1, scores
+    return max(scores, key=scores.get), scores
+
+
+class UserSegmentModel:
+    """A fitted scaler + MiniBatchKMeans pair that assigns users to segments.
+
+    Once fitted (and saved), new users are assigned with `assign`, which is a
+    scale and a nearest-centroid lookup: constant time per user, no refit.
+    """
+
+    def __init__(self, n_clusters=None, random_state=42, batch_size=4096):
+        """Initialize an unfitted model; `n_clusters=None` chooses k automatically."""
+        self.n_clusters = n_clusters
+        self.random_state = random_state
+        self.batch_size = batch_size
+        self.features = list(SEGMENT_FEATURES)
+        self.scaler = None
+        self.kmeans = None
+        self.k_scores = {}
+        self.fitted_rows = 0
+        self.fitted_at = None
+
+    def _matrix(self, user_data):
+        """Feature matrix (missing values as 0) from a frame of per-user features."""
+        return user_data[self.features].fillna(0).to_numpy(dtype=float)
+
+    def fit(self, user_data):
+        """Fit on a frame of per-user features and return the model."""
+        X = self._matrix(user_data)
+        self.scaler = StandardScaler().fit(X)
+        X_scaled = self.scaler.transform(X)
+
+        if self.n_clusters is None:
+            k, self.k_scores = choose_k(X_scaled, random_state=self.random_state)
+        else:
+            k = min(self.n_clusters, len(X))
+        self.kmeans = MiniBatchKMeans(n_clusters=k, random_state=self.random_state,
+                                      batch_size=self.batch_size, n_init=3)
+        self.kmeans.fit(X_scaled)
+        self.fitted_rows = len(X)
+        self.fitted_at = datetime.now().isoformat()
+        return self
+
+    def partial_fit(self, user_data):
+        """Update the centroids with a batch of new users (the scaler is kept as fitted)."""
+        self.kmeans.partial_fit(self.scaler.transform(self._matrix(user_data)))
+        self.fitted_rows += len(user_data)
+        return self
+
+    @property
+    def is_fitted(self):
+        return self.kmeans is not None
+
+    def assign(self, user_data):
+        """Segment label for each row of a frame of per-user features."""
+        return self.kmeans.predict(self.scaler.transform(self._matrix(user_data)))
+
+    def assign_user(self, **features):
+        """Segment label for a single user given its feature values."""
+        row = np.array([[features.get(name) or 0 for name in self.features]], dtype=float)
+        return int(self.kmeans.predict(self.scaler.transform(row))[0])
+
+    def save(self, path):
+        """Persist the fitted model atomically."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved model, or None if there is none usable at `path`."""
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            return None
+        if not isinstance(model, cls) or model.features != SEGMENT_FEATURES:
+            return None
+        return model
+
+
+def fit_segment_model(user_data, n_clusters=None):
+    """Fit a new segment model (runs in a worker process when one is available)."""
+    return UserSegmentModel(n_clusters=n_clusters).fit(user_data)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import EcommerceDatabase
+    from analysis_engine import SharedFrameEngine
+
+    parser = argparse.ArgumentParser(description="Fit the user segment model")
+    parser.add_argument('--db', default='ecommerce_data.db')
+    parser.add_argument('--model', default=None, help="Model file (default: <db>.segment-model)")
+    parser.add_argument('--k', type=int, default=None, help="Number of segments (default: chosen automatically)")
+    args = parser.parse_args()
+
+    user_data = SharedFrameEngine(EcommerceDatabase(args.db)).get_user_segment_features()
+    model = fit_segment_model(user_data, n_clusters=args.k)
+    model.save(args.model or segment_model_path(args.db))
+
+    rows = [[k, f"{score:.3f}"] for k, score in model.k_scores.items()]
+    if rows:
+        print(tabulate(rows, headers=['k', 'Silhouette'], tablefmt='pipe'))
+    print(f"Fitted {model.kmeans.n_clusters} segments on {model.fitted_rows:,} users")